@@ -0,0 +1 @@
+"""Benchmarks for the sensor server. Run modules with ``python -m benchmarks.<name>``."""
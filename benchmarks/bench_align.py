@@ -0,0 +1,64 @@
+"""
+Heart-rate / IMU alignment on the pure-Python and NumPy analysis backends.
+
+Times ``analysis.alignment_summary`` (time in zones by elapsed time, HR gaps,
+intensity per zone, per-strike HR deltas) over synthetic sessions of each
+``--durations`` seconds at 100 Hz IMU and 1 Hz heart rate, and checks that
+the backends agree. The time per IMU sample should stay flat as sessions get
+longer::
+
+    python -m benchmarks.bench_align --durations 600 3600
+"""
+import argparse
+import sys
+
+from server import analysis
+from server.ingest import columns_from_payload
+
+from .bench_orientation import _agree, _best_of
+from .generate import synthetic_session
+
+DEFAULT_DURATIONS = (600, 3600)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--durations", type=float, nargs="+", default=list(DEFAULT_DURATIONS))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    backends = ["python"]
+    if analysis.analysis_numpy is not None:
+        backends.append("numpy")
+    else:
+        print("NumPy not installed; only the python backend is measured.")
+
+    previous = analysis.get_backend()
+    print(f"{'seconds':>8}{'samples':>10}" + "".join(f"{b + ' ms':>12}{'ns/sample':>11}" for b in backends) + f"{'speedup':>10}")
+    try:
+        for duration in args.durations:
+            session = columns_from_payload(synthetic_session(duration, seed=int(duration)))
+            imu, hr = session.imu, session.heart_rate
+            strikes = analysis.analysis_results([], imu["t"], imu["ax"], imu["ay"], imu["az"])["strike_times"]
+            runs = {}
+            for backend in backends:
+                analysis.set_backend(backend)
+                runs[backend] = _best_of(
+                    lambda: analysis.alignment_summary(hr["t"], hr["bpm"], imu["t"], imu["ax"], imu["ay"], imu["az"], strikes),
+                    args.repeat,
+                )
+            outs = [runs[b][1] for b in backends]
+            if not all(_agree(outs[0], out) for out in outs[1:]):
+                raise AssertionError(f"backends disagree at {duration:g} s")
+            n = len(imu["t"])
+            times = [runs[b][0] for b in backends]
+            speedup = f"{times[0] / times[-1]:>9.1f}x" if len(times) > 1 else ""
+            print(f"{duration:>8g}{n:>10}" + "".join(f"{t * 1e3:>12.1f}{t * 1e9 / n:>11.0f}" for t in times) + speedup)
+            sys.stdout.flush()
+    finally:
+        analysis.set_backend(previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
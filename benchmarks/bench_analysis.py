@@ -0,0 +1,77 @@
+"""
+Microbenchmark of the pure-Python and NumPy analysis backends.
+
+Runs the column functions used by the ingest path over synthetic sessions and
+prints the best-of-N time per backend::
+
+    python -m benchmarks.bench_analysis --sizes 10000 360000
+"""
+import argparse
+import json
+import sys
+import time
+
+from server import analysis
+from server.ingest import parse_payload
+
+from .common import synthetic_body
+
+DEFAULT_SIZES = (1_000, 36_000, 360_000)
+
+
+def _cases(session):
+    imu = session.imu
+    bpm = [v for v in session.heart_rate["bpm"] if v == v]
+    return {
+        "intensity": lambda: analysis.movement_intensity_from_columns(imu["ax"], imu["ay"], imu["az"]),
+        "strikes": lambda: analysis.strikes_from_columns(imu["t"], imu["ax"], imu["ay"], imu["az"]),
+        "hr_zones": lambda: analysis.calculate_hr_zones(bpm),
+    }
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    backends = ["python"]
+    if analysis.analysis_numpy is not None:
+        backends.append("numpy")
+    else:
+        print("NumPy not installed; only the python backend is measured.")
+
+    previous = analysis.get_backend()
+    print(f"{'samples':>10}  {'case':<10}" + "".join(f"{b + ' ms':>12}" for b in backends) + f"{'speedup':>10}")
+    try:
+        for size in args.sizes:
+            # heart_rate_hz scales with size so the zone histogram is not trivial.
+            ok, session = parse_payload(synthetic_body(size, heart_rate_hz=50))
+            results = {}
+            for backend in backends:
+                analysis.set_backend(backend)
+                for name, fn in _cases(session).items():
+                    results.setdefault(name, {})[backend] = (_best_of(fn, args.repeat), fn())
+            for name, per_backend in results.items():
+                outputs = {json.dumps(out, sort_keys=True) for _, out in per_backend.values()}
+                if len(outputs) != 1:
+                    raise AssertionError(f"backends disagree on {name} at {size} samples")
+                times = [per_backend[b][0] for b in backends]
+                speedup = f"{times[0] / times[-1]:>9.1f}x" if len(times) > 1 else ""
+                print(f"{size:>10}  {name:<10}" + "".join(f"{t * 1e3:>12.2f}" for t in times) + speedup)
+    finally:
+        analysis.set_backend(previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Sessions/sec of a backlog sync: one POST /end per session vs POST /sessions/batch.
+
+``--sessions`` distinct sessions (benchmarks.generate, ``--duration`` seconds
+each) go through the Flask test client with the ingest queue off, so every
+case includes processing. "batch" sends them as one NDJSON body, "retry"
+sends that body again (every session is a duplicate). Each case starts from
+an empty scratch directory under data/, because /tmp may be a tmpfs where
+fsync costs nothing::
+
+    python -m benchmarks.bench_batch --sessions 50 --duration 60 --levels fsync group
+"""
+from pathlib import Path
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+from .common import REPO_ROOT, quiet_stdout
+from .generate import synthetic_session
+
+
+def _run(case: str, data_dir: Path, bodies: list, level: str) -> dict:
+    from server import create_app
+
+    app = create_app({"DATA_DIR": data_dir, "INGEST_WORKERS": 0, "DURABILITY": level, "RECOVER_PENDING": False})
+    client = app.test_client()
+    ndjson = b"\n".join(bodies)
+    if case == "retry":
+        client.post("/sessions/batch", data=ndjson, content_type="application/x-ndjson")
+    start = time.perf_counter()
+    if case == "individual":
+        statuses = [client.post("/end", data=body, content_type="application/json").status_code for body in bodies]
+        ok = statuses.count(200)
+    else:
+        counts = client.post("/sessions/batch", data=ndjson, content_type="application/x-ndjson").get_json()["counts"]
+        ok = counts.get("duplicate" if case == "retry" else "created", 0)
+    elapsed = time.perf_counter() - start
+    return {"sessions_s": len(bodies) / elapsed, "seconds": elapsed, "ok": ok}
+
+
+def main(argv=None) -> int:
+    from server import durable
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of 100 Hz data per session")
+    parser.add_argument("--levels", nargs="+", choices=durable.LEVELS, default=["fsync", "group"])
+    parser.add_argument("--dir", type=Path, default=REPO_ROOT / "data", help="where to create the scratch directory")
+    args = parser.parse_args(argv)
+
+    bodies = [json.dumps(synthetic_session(args.duration, seed=i), separators=(",", ":")).encode() for i in range(args.sessions)]
+    args.dir.mkdir(parents=True, exist_ok=True)
+    print(f"{args.sessions} sessions of {args.duration:g} s ({sum(map(len, bodies)) / 1e6:.1f} MB), in {args.dir}")
+    print(f"{'level':<8}{'case':<12}{'sessions/s':>12}{'seconds':>10}{'ok':>6}")
+    previous = durable.get_level()
+    try:
+        for level in args.levels:
+            for case in ("individual", "batch", "retry"):
+                data_dir = Path(tempfile.mkdtemp(prefix="bench_batch_", dir=args.dir))
+                try:
+                    with quiet_stdout():
+                        r = _run(case, data_dir, bodies, level)
+                finally:
+                    shutil.rmtree(data_dir, ignore_errors=True)
+                print(f"{level:<8}{case:<12}{r['sessions_s']:>12.1f}{r['seconds']:>10.2f}{r['ok']:>6}")
+                sys.stdout.flush()
+    finally:
+        durable.set_level(previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
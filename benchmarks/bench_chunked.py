@@ -0,0 +1,101 @@
+"""
+Server-side peak memory of one /end upload vs the same session sent in chunks.
+
+Each case runs in a fresh interpreter through the Flask test client. "peak MB"
+is the largest tracemalloc peak of a single request (the request body is built
+before tracing starts); "RSS MB" is the interpreter's max RSS::
+
+    python -m benchmarks.bench_chunked --sizes 100000 1000000 --chunk 5000
+"""
+import argparse
+import gc
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .common import REPO_ROOT, quiet_stdout, synthetic_body, synthetic_payload
+
+DEFAULT_SIZES = (100_000, 1_000_000)
+
+
+def _chunk_bodies(size: int, chunk: int):
+    imu_hz = 100
+    for i, start in enumerate(range(0, size, chunk)):
+        part = synthetic_payload(min(chunk, size - start), imu_hz=imu_hz, seed=i)
+        offset = int(start * 1000 / imu_hz)
+        lines = [json.dumps({**s, "t": s["t"] + offset}) for s in part["imu"]]
+        lines += [json.dumps({**s, "t": s["t"] + offset}) for s in part["heart_rates"]]
+        yield "\n".join(lines)
+
+
+def _traced(fn):
+    # The test client keeps each request body in a reference cycle; collect it
+    # so earlier requests do not count towards this one's peak.
+    gc.collect()
+    tracemalloc.reset_peak()
+    resp = fn()
+    if resp.status_code >= 300:
+        raise RuntimeError(resp.get_data(as_text=True))
+    return tracemalloc.get_traced_memory()[1]
+
+
+def _worker(mode: str, size: int, chunk: int) -> dict:
+    from server import create_app
+
+    data_dir = tempfile.mkdtemp(prefix="bench_chunked_")
+    try:
+        client = create_app({"DATA_DIR": data_dir, "INGEST_WORKERS": 0}).test_client()
+        peak = 0
+        start = time.perf_counter()
+        tracemalloc.start()
+        with quiet_stdout():
+            if mode == "single":
+                body = synthetic_body(size)
+                peak = _traced(lambda: client.post("/end", data=body, content_type="application/json"))
+                del body
+            else:
+                urls = client.post("/session/start", json={"imu_hz": 100, "heart_rate_hz": 1}).get_json()
+                for body in _chunk_bodies(size, chunk):
+                    peak = max(peak, _traced(lambda: client.post(
+                        urls["chunk_url"], data=body, content_type="application/x-ndjson")))
+                peak = max(peak, _traced(lambda: client.post(urls["end_url"])))
+        tracemalloc.stop()
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"peak_mb": peak / 1e6, "rss_mb": rss_kb / 1e3, "seconds": elapsed}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--chunk", type=int, default=5_000, help="IMU samples per chunk")
+    parser.add_argument("--worker", nargs=3, metavar=("MODE", "SIZE", "CHUNK"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        mode, size, chunk = args.worker
+        print(json.dumps(_worker(mode, int(size), int(chunk))))
+        return 0
+
+    print(f"{'samples':>9}  {'mode':<8}{'peak MB':>9}{'RSS MB':>9}{'total s':>9}")
+    for size in args.sizes:
+        for mode in ("single", "chunked"):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_chunked", "--worker", mode, str(size), str(args.chunk)],
+                cwd=REPO_ROOT, check=True, capture_output=True, text=True,
+            ).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            print(f"{size:>9}  {mode:<8}{r['peak_mb']:>9.1f}{r['rss_mb']:>9.1f}{r['seconds']:>9.2f}")
+            sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
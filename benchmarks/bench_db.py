@@ -0,0 +1,185 @@
+"""
+Concurrent sessions.db access: N writer threads inserting sessions while M
+reader threads run the dashboard query.
+
+Compares the old access pattern (a fresh ``sqlite3.connect`` per call on a
+rollback-journal database) with the pooled WAL layer in ``server.db`` and
+reports p50/p99 latency per operation::
+
+    python -m benchmarks.bench_db --writers 4 --readers 4 --inserts 200
+"""
+from pathlib import Path
+import argparse
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from server import db
+from server.storage import insert_session
+
+INDEX_QUERY = "SELECT id, created_at, duration, heart_mean, heart_max, imu_csv, heart_csv, raw_filename FROM sessions ORDER BY id DESC"
+INSERT_SQL = "INSERT INTO sessions (created_at, raw_filename, duration, heart_mean, heart_max, status) VALUES (?,?,?,?,?,?)"
+
+SAMPLE_INFO = {
+    "processed": {"imu": "bench_imu.csv", "heart_rate": "bench_heart_rate.csv"},
+    "stats": {"duration": 60.0, "imu_hz_measured": 100.0, "heart_mean": 112.3, "heart_max": 158},
+}
+
+
+def _legacy_insert(data_dir: Path, name: str) -> None:
+    conn = sqlite3.connect(str(data_dir / "sessions.db"))
+    conn.execute(INSERT_SQL, (int(time.time()), name, 60.0, 112.3, 158, "done"))
+    conn.commit()
+    conn.close()
+
+
+def _legacy_read(data_dir: Path) -> None:
+    conn = sqlite3.connect(str(data_dir / "sessions.db"))
+    conn.row_factory = sqlite3.Row
+    conn.execute(INDEX_QUERY).fetchall()
+    conn.close()
+
+
+def _pooled_insert(data_dir: Path, name: str) -> None:
+    if insert_session(data_dir, name, SAMPLE_INFO) is None:
+        raise sqlite3.OperationalError("insert failed")
+
+
+def _pooled_read(data_dir: Path) -> None:
+    with db.connection(data_dir / "sessions.db") as conn:
+        conn.execute(INDEX_QUERY).fetchall()
+
+
+MODES = {
+    "legacy": (_legacy_insert, _legacy_read),
+    "pooled-wal": (_pooled_insert, _pooled_read),
+}
+
+
+def _prepare(mode: str) -> Path:
+    data_dir = Path(tempfile.mkdtemp(prefix=f"bench_db_{mode}_"))
+    if mode == "legacy":
+        # The schema as init_db used to create it, without WAL.
+        conn = sqlite3.connect(str(data_dir / "sessions.db"))
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+    db.init_db(data_dir)
+    if mode == "legacy":
+        db.close_all()
+        conn = sqlite3.connect(str(data_dir / "sessions.db"))
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+    return data_dir
+
+
+def _percentiles(samples):
+    if not samples:
+        return float("nan"), float("nan")
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(round(0.99 * (len(ordered) - 1))))]
+    return statistics.median(ordered) * 1e3, p99 * 1e3
+
+
+def run(mode: str, writers: int, readers: int, inserts: int) -> dict:
+    insert, read = MODES[mode]
+    data_dir = _prepare(mode)
+    write_lat, read_lat, errors = [], [], []
+    lock = threading.Lock()
+    writers_done = threading.Event()
+
+    def writer(idx: int) -> None:
+        local = []
+        for i in range(inserts):
+            start = time.perf_counter()
+            try:
+                insert(data_dir, f"w{idx}_{i}.json")
+                local.append(time.perf_counter() - start)
+            except sqlite3.OperationalError as exc:
+                with lock:
+                    errors.append(str(exc))
+        with lock:
+            write_lat.extend(local)
+
+    def reader() -> None:
+        local = []
+        while not writers_done.is_set():
+            start = time.perf_counter()
+            try:
+                read(data_dir)
+                local.append(time.perf_counter() - start)
+            except sqlite3.OperationalError as exc:
+                with lock:
+                    errors.append(str(exc))
+        with lock:
+            read_lat.extend(local)
+
+    read_threads = [threading.Thread(target=reader) for _ in range(readers)]
+    write_threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    wall = time.perf_counter()
+    for t in read_threads + write_threads:
+        t.start()
+    for t in write_threads:
+        t.join()
+    writers_done.set()
+    for t in read_threads:
+        t.join()
+    wall = time.perf_counter() - wall
+
+    db.close_all()
+    shutil.rmtree(data_dir, ignore_errors=True)
+    w50, w99 = _percentiles(write_lat)
+    r50, r99 = _percentiles(read_lat)
+    return {
+        "mode": mode, "writes": len(write_lat), "reads": len(read_lat), "errors": len(errors),
+        "write_p50_ms": w50, "write_p99_ms": w99, "read_p50_ms": r50, "read_p99_ms": r99,
+        "writes_per_s": len(write_lat) / wall,
+    }
+
+
+def bulk_insert(rows: int) -> dict:
+    """Per-row commits vs ``db.execute_batched`` for a bulk load."""
+    results = {}
+    for label in ("per-row commit", "execute_batched"):
+        data_dir = _prepare("pooled-wal")
+        db_path = data_dir / "sessions.db"
+        values = [(int(time.time()), f"bulk_{i}.json", 60.0, 112.3, 158, "done") for i in range(rows)]
+        start = time.perf_counter()
+        if label == "per-row commit":
+            for v in values:
+                with db.transaction(db_path) as conn:
+                    conn.execute(INSERT_SQL, v)
+        else:
+            db.execute_batched(db_path, INSERT_SQL, values)
+        results[label] = rows / (time.perf_counter() - start)
+        db.close_all()
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--inserts", type=int, default=200, help="inserts per writer")
+    parser.add_argument("--bulk-rows", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    print(f"{args.writers} writers x {args.inserts} inserts, {args.readers} readers")
+    print(f"{'mode':<12}{'writes':>8}{'reads':>8}{'errors':>8}{'w p50 ms':>10}{'w p99 ms':>10}{'r p50 ms':>10}{'r p99 ms':>10}{'writes/s':>10}")
+    for mode in MODES:
+        r = run(mode, args.writers, args.readers, args.inserts)
+        print(f"{r['mode']:<12}{r['writes']:>8}{r['reads']:>8}{r['errors']:>8}{r['write_p50_ms']:>10.2f}{r['write_p99_ms']:>10.2f}"
+              f"{r['read_p50_ms']:>10.2f}{r['read_p99_ms']:>10.2f}{r['writes_per_s']:>10.0f}")
+
+    print(f"\nbulk insert of {args.bulk_rows} rows (rows/s)")
+    for label, rate in bulk_insert(args.bulk_rows).items():
+        print(f"  {label:<16}{rate:>10.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Load test with many devices: ``--devices`` clients, each uploading its own sessions concurrently.
+
+Starts ``python -m server.serve`` on a scratch data directory with
+``--ingest-workers`` background workers. Every simulated device sends
+``--sessions`` /end bodies tagged with its ``device_id`` over a keep-alive
+connection. The test reports the upload rate and latency, how long the queue
+takes to finish every session (sessions of one device are processed in order,
+devices in parallel), and the latency of per-device listing and trend queries::
+
+    python -m benchmarks.bench_devices --devices 20 --sessions 5 --ingest-workers 4
+"""
+from pathlib import Path
+import argparse
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .bench_load import _free_port, _percentile, _wait_ready
+from .common import REPO_ROOT
+from .generate import synthetic_session
+
+
+def _device(i: int) -> str:
+    return f"athlete-{i:02d}"
+
+
+def _uploader(host: str, port: int, bodies: list, latencies: list, ids: list, errors: list) -> None:
+    conn = http.client.HTTPConnection(host, port, timeout=120)
+    for body in bodies:
+        start = time.perf_counter()
+        conn.request("POST", "/end", body=body, headers={"Content-Type": "application/json"})
+        resp = conn.getresponse()
+        data = resp.read()
+        latencies.append(time.perf_counter() - start)
+        if resp.status >= 400:
+            errors.append(resp.status)
+        else:
+            ids.append(json.loads(data)["session_id"])
+    conn.close()
+
+
+def _get(conn: http.client.HTTPConnection, path: str) -> dict:
+    conn.request("GET", path)
+    return json.loads(conn.getresponse().read())
+
+
+def _wait_done(host: str, port: int, ids: list, timeout: float) -> int:
+    """Poll until every session is done or failed; returns the number still unfinished."""
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    deadline = time.monotonic() + timeout
+    left = list(ids)
+    while left and time.monotonic() < deadline:
+        left = [i for i in left if _get(conn, f"/session/{i}/status")["state"] not in ("done", "failed")]
+        if left:
+            time.sleep(0.05)
+    conn.close()
+    return len(left)
+
+
+def _query_ms(host: str, port: int, path: str, repeat: int = 20) -> float:
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _get(conn, path)
+        times.append(time.perf_counter() - start)
+    conn.close()
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=5, help="sessions per device")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of 100 Hz data per session")
+    parser.add_argument("--ingest-workers", type=int, default=4)
+    parser.add_argument("--server", default="auto", help="server.serve --server")
+    parser.add_argument("--threads", type=int, default=32, help="server.serve --threads")
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds to wait for the queue")
+    args = parser.parse_args(argv)
+
+    bodies = {}
+    for d in range(args.devices):
+        bodies[_device(d)] = [
+            json.dumps({**synthetic_session(args.duration, seed=d * 1000 + s), "device_id": _device(d)}).encode()
+            for s in range(args.sessions)
+        ]
+    host, port = "127.0.0.1", _free_port()
+    data_dir = Path(tempfile.mkdtemp(prefix="bench_devices_", dir=REPO_ROOT / "data"))
+    env = dict(os.environ, SENSOR_LOG_LEVEL="WARNING", SENSOR_INGEST_WORKERS=str(args.ingest_workers))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "server.serve", "--server", args.server, "--host", host, "--port", str(port),
+         "--threads", str(args.threads), "--data-dir", str(data_dir)],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(host, port)
+        latencies: list = []
+        ids: list = []
+        errors: list = []
+        threads = [threading.Thread(target=_uploader, args=(host, port, b, latencies, ids, errors)) for b in bodies.values()]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        uploaded = time.perf_counter() - start
+        unfinished = _wait_done(host, port, ids, args.timeout)
+        processed = time.perf_counter() - start
+        latencies.sort()
+
+        total = args.devices * args.sessions
+        print(f"{args.devices} devices x {args.sessions} sessions of {args.duration:g} s, {args.ingest_workers} ingest workers")
+        print(f"upload:    {total / uploaded:8.1f} sessions/s   p50 {_percentile(latencies, 0.5) * 1000:7.1f} ms   "
+              f"p99 {_percentile(latencies, 0.99) * 1000:7.1f} ms   errors {len(errors)}")
+        print(f"processed: {(total - unfinished) / processed:8.1f} sessions/s   all done after {processed:.2f} s   unfinished {unfinished}")
+        device = _device(0)
+        for label, path in (
+            ("listing, all devices", "/api/sessions?limit=50"),
+            ("listing, one device", f"/api/sessions?limit=50&device={device}"),
+            ("trends, all devices", "/api/trends"),
+            ("trends, one device", f"/api/trends?device={device}"),
+        ):
+            print(f"{label:<22}{_query_ms(host, port, path):7.2f} ms")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=120)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
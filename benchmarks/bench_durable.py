@@ -0,0 +1,101 @@
+"""
+Write throughput of each durability level (server/durable.py).
+
+``--threads`` concurrent writers each store ``--sessions`` sessions the way
+an upload does: the compressed raw body, then the processed files and chart
+pyramids. Each session is about 6 files, and each level starts from an empty
+directory. The directory defaults to a scratch dir under data/, because
+/tmp may be a tmpfs where fsync costs nothing::
+
+    python -m benchmarks.bench_durable --threads 1 4 --samples 6000
+"""
+from pathlib import Path
+import argparse
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from .common import REPO_ROOT, quiet_stdout, synthetic_body
+
+
+def _run(data_dir: Path, raw: str, threads: int, sessions: int) -> dict:
+    from server.ingest import parse_payload
+    from server.storage import _process_and_save, write_raw_payload
+
+    latencies: list = []
+    errors: list = []
+
+    def writer():
+        ok, session = parse_payload(raw)
+        for _ in range(sessions):
+            start = time.perf_counter()
+            ok, fname = write_raw_payload(data_dir, raw)
+            if ok:
+                ok, info = _process_and_save(data_dir, fname, "", session)
+            if not ok:
+                errors.append(fname)
+            latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=writer) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    written = sum(p.stat().st_size for sub in ("raw_data", "processed_data") for p in (data_dir / sub).iterdir())
+    files = sum(1 for sub in ("raw_data", "processed_data") for _ in (data_dir / sub).iterdir())
+    return {
+        "sessions_s": len(latencies) / elapsed,
+        "files_s": files / elapsed,
+        "mb_s": written / elapsed / 1e6,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000,
+        "errors": len(errors),
+    }
+
+
+def main(argv=None) -> int:
+    from server import durable
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--levels", nargs="+", choices=durable.LEVELS, default=list(durable.LEVELS))
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--sessions", type=int, default=20, help="sessions per thread")
+    parser.add_argument("--samples", type=int, default=6000, help="IMU samples per session")
+    parser.add_argument("--dir", type=Path, default=REPO_ROOT / "data", help="where to create the scratch directory")
+    args = parser.parse_args(argv)
+
+    raw = synthetic_body(args.samples, rotation=True)
+    args.dir.mkdir(parents=True, exist_ok=True)
+    print(f"{args.samples} IMU samples per session, {args.sessions} sessions per thread, in {args.dir}")
+    print(f"{'level':<8}{'threads':>8}{'sessions/s':>12}{'files/s':>9}{'MB/s':>8}{'p50 ms':>9}{'p99 ms':>9}{'files/fsync batch':>19}")
+    previous = durable.get_level()
+    try:
+        for threads in args.threads:
+            for level in args.levels:
+                durable.set_level(level)
+                group = durable._group
+                batches, files = group.batches, group.files
+                data_dir = Path(tempfile.mkdtemp(prefix="bench_durable_", dir=args.dir))
+                try:
+                    for sub in ("raw_data", "processed_data"):
+                        (data_dir / sub).mkdir()
+                    with quiet_stdout():
+                        r = _run(data_dir, raw, threads, args.sessions)
+                finally:
+                    shutil.rmtree(data_dir, ignore_errors=True)
+                per_batch = (group.files - files) / (group.batches - batches) if group.batches > batches else float("nan")
+                print(f"{level:<8}{threads:>8}{r['sessions_s']:>12.1f}{r['files_s']:>9.0f}{r['mb_s']:>8.1f}"
+                      f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}{per_batch:>19.1f}")
+                sys.stdout.flush()
+    finally:
+        durable.set_level(previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
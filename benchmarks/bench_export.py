@@ -0,0 +1,121 @@
+"""
+Throughput and peak memory of GET /api/export for many sessions.
+
+Stores ``--sessions`` synthetic sessions (benchmarks.generate, ``--duration``
+seconds each) in a scratch directory under data/. The first ``--subset`` of
+them come from one device. Each format is then exported twice, in a fresh
+interpreter through the Flask test client: once for that device only
+(``?device=``) and once for every session. The response is read chunk by
+chunk, like a client would. "MB/s" is archive bytes per second. "RSS MB" is
+the exporting interpreter's max RSS, which should not grow with the number
+of sessions; "idle" is an interpreter that only started the app::
+
+    python -m benchmarks.bench_export --sessions 1000 --subset 100
+"""
+from pathlib import Path
+import argparse
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .common import REPO_ROOT, quiet_stdout
+from .generate import synthetic_session
+
+SUBSET_DEVICE = "bench-subset"
+
+
+def _populate(data_dir: Path, sessions: int, subset: int, duration: float) -> None:
+    from server import create_app, durable
+
+    previous = durable.get_level()
+    durable.set_level("none")
+    try:
+        client = create_app({"DATA_DIR": data_dir, "INGEST_WORKERS": 0, "RECOVER_PENDING": False}).test_client()
+        with quiet_stdout():
+            for i in range(sessions):
+                payload = synthetic_session(duration, seed=i)
+                payload["device_id"] = SUBSET_DEVICE if i < subset else "bench-rest"
+                if client.post("/end", data=json.dumps(payload), content_type="application/json").status_code != 200:
+                    raise RuntimeError(f"upload {i} failed")
+    finally:
+        durable.set_level(previous)
+
+
+def _peak_rss_mb() -> float:
+    # VmHWM starts over at exec; ru_maxrss keeps the peak of the forked parent on Linux.
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1e3
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def _worker(data_dir: str, query: str) -> dict:
+    from server import create_app
+
+    client = create_app({"DATA_DIR": data_dir, "INGEST_WORKERS": 0, "RECOVER_PENDING": False}).test_client()
+    size = 0
+    start = time.perf_counter()
+    if query:
+        resp = client.get(f"/api/export?{query}", buffered=False)
+        if resp.status_code != 200:
+            return {"error": resp.get_data(as_text=True)}
+        for chunk in resp.response:
+            size += len(chunk)
+        resp.close()
+    elapsed = time.perf_counter() - start
+    return {"mb": size / 1e6, "seconds": elapsed, "rss_mb": _peak_rss_mb()}
+
+
+def _run_worker(data_dir: Path, query: str) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_export", "--worker", str(data_dir), query],
+        cwd=REPO_ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--subset", type=int, default=100, help="sessions of the device exported on its own")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of 100 Hz data per session")
+    parser.add_argument("--formats", nargs="+", default=["csv", "npz", "parquet"])
+    parser.add_argument("--dir", type=Path, default=REPO_ROOT / "data", help="where to create the scratch directory")
+    parser.add_argument("--worker", nargs=2, metavar=("DIR", "QUERY"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(_worker(*args.worker)))
+        return 0
+
+    args.dir.mkdir(parents=True, exist_ok=True)
+    data_dir = Path(tempfile.mkdtemp(prefix="bench_export_", dir=args.dir))
+    try:
+        start = time.perf_counter()
+        _populate(data_dir, args.sessions, args.subset, args.duration)
+        print(f"{args.sessions} sessions of {args.duration:g} s stored in {time.perf_counter() - start:.1f} s, in {data_dir}")
+        print(f"idle RSS MB {_run_worker(data_dir, '')['rss_mb']:.1f}")
+        print(f"{'format':<9}{'sessions':>9}{'MB':>9}{'MB/s':>9}{'seconds':>9}{'RSS MB':>9}")
+        for fmt in args.formats:
+            for count, query in ((args.subset, f"format={fmt}&device={SUBSET_DEVICE}"), (args.sessions, f"format={fmt}")):
+                r = _run_worker(data_dir, query)
+                if "error" in r:
+                    print(f"{fmt:<9}{count:>9}  skipped: {r['error']}")
+                    break
+                print(f"{fmt:<9}{count:>9}{r['mb']:>9.1f}{r['mb'] / r['seconds']:>9.1f}{r['seconds']:>9.2f}{r['rss_mb']:>9.1f}")
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Per-request CPU time and peak memory of the /end ingest path.
+
+Each (tree, size) pair runs in a fresh interpreter so peak RSS is not shared
+between cases. ``--baseline-ref`` benchmarks the same path at another git
+revision for a before/after comparison::
+
+    python -m benchmarks.bench_ingest --baseline-ref HEAD~1
+"""
+from pathlib import Path
+import argparse
+import gc
+import json
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .common import REPO_ROOT, extract_tree, quiet_stdout, run_worker, synthetic_body
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+
+
+def _handler():
+    """Mirror what ``receive_end`` does in whichever tree is on ``sys.path``."""
+    from server import storage
+
+    try:
+        from server.ingest import parse_payload
+    except ImportError:
+        parse_payload = None
+
+    def handle(data_dir: Path, raw: str):
+        if parse_payload is None:
+            json.loads(raw)
+            return storage.save_raw_json_payload(data_dir, raw)
+        ok, session = parse_payload(raw)
+        return storage.save_raw_json_payload(data_dir, raw, session)
+
+    return handle
+
+
+def _fresh_data_dir() -> Path:
+    from server.db import init_db
+
+    data_dir = Path(tempfile.mkdtemp(prefix="bench_ingest_"))
+    (data_dir / "raw_data").mkdir()
+    (data_dir / "processed_data").mkdir()
+    try:
+        init_db(data_dir)
+    except TypeError:
+        # Older trees only know the repo data dir; create the table by hand.
+        import sqlite3
+        conn = sqlite3.connect(str(data_dir / "sessions.db"))
+        conn.execute(
+            "CREATE TABLE sessions (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at INTEGER, raw_filename TEXT, imu_csv TEXT, heart_csv TEXT, duration REAL, imu_hz_measured REAL, imu_hz_sampling_rate_defined REAL, heart_rate_hz_measured REAL, heart_rate_hz_sampling_rate REAL, heart_mean REAL, heart_max INTEGER)"
+        )
+        conn.commit()
+        conn.close()
+    return data_dir
+
+
+def worker(samples: int) -> dict:
+    raw = synthetic_body(samples)
+    handle = _handler()
+    gc.collect()
+
+    data_dir = _fresh_data_dir()
+    try:
+        with quiet_stdout():
+            wall0, cpu0 = time.perf_counter(), time.process_time()
+            ok, _ = handle(data_dir, raw)
+            cpu = time.process_time() - cpu0
+            wall = time.perf_counter() - wall0
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    if not ok:
+        raise RuntimeError("ingest failed")
+    gc.collect()
+
+    data_dir = _fresh_data_dir()
+    try:
+        with quiet_stdout():
+            tracemalloc.start()
+            handle(data_dir, raw)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        "samples": samples,
+        "body_mb": len(raw) / 1e6,
+        "cpu_s": cpu,
+        "wall_s": wall,
+        "peak_alloc_mb": peak / 1e6,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--baseline-ref", help="git revision to compare against")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--tree", help=argparse.SUPPRESS)
+    parser.add_argument("--samples", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(worker(args.samples)))
+        return 0
+
+    trees = [("current", REPO_ROOT)]
+    if args.baseline_ref:
+        trees.insert(0, (args.baseline_ref, extract_tree(args.baseline_ref)))
+
+    print(f"{'tree':<12}{'samples':>10}{'body MB':>10}{'cpu s':>9}{'wall s':>9}{'peak alloc MB':>15}{'max RSS MB':>12}")
+    try:
+        for size in args.sizes:
+            for label, tree in trees:
+                r = run_worker("benchmarks.bench_ingest", tree, ["--samples", size])
+                print(f"{label:<12}{r['samples']:>10}{r['body_mb']:>10.1f}{r['cpu_s']:>9.3f}{r['wall_s']:>9.3f}"
+                      f"{r['peak_alloc_mb']:>15.1f}{r['max_rss_mb']:>12.1f}")
+                sys.stdout.flush()
+    finally:
+        for label, tree in trees:
+            if tree != REPO_ROOT:
+                shutil.rmtree(tree, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+/end round trip and response size per JSON backend, with and without the payload echo.
+
+Posts the same ``--samples`` IMU-sample body through the Flask test client
+(processing inside the request) for every installed backend of
+``server.jsoncodec``, once with the default summary response and once with
+``?echo=1`` (what every response used to carry), and reports the median
+round trip, the response bytes, and the bare decode/encode cost::
+
+    python -m benchmarks.bench_json --samples 100000 --repeat 5
+"""
+from pathlib import Path
+import argparse
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from server import create_app, jsoncodec
+
+from .common import quiet_stdout, synthetic_body
+
+
+def _median_s(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--samples", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    body = synthetic_body(args.samples).encode("utf-8")
+    data_dir = Path(tempfile.mkdtemp(prefix="bench_json_"))
+    previous = jsoncodec.get_backend()
+    try:
+        client = create_app({"DATA_DIR": data_dir, "INGEST_WORKERS": 0}).test_client()
+        print(f"{args.samples} IMU samples, body {len(body) / 1e6:.1f} MB")
+        print(f"{'backend':<8}{'decode ms':>11}{'encode ms':>11}{'response':>10}{'round trip ms':>15}{'resp bytes':>12}")
+        for backend in jsoncodec.available_backends():
+            jsoncodec.set_backend(backend)
+            payload = jsoncodec.loads(body)
+            decode = _median_s(lambda: jsoncodec.loads(body), args.repeat)
+            encode = _median_s(lambda: jsoncodec.dumps_bytes(payload), args.repeat)
+            for label, url in (("summary", "/end"), ("echo", "/end?echo=1")):
+                sizes = []
+
+                def post():
+                    resp = client.post(url, data=body, content_type="application/json")
+                    assert resp.status_code == 200, resp.data[:200]
+                    sizes.append(len(resp.data))
+
+                with quiet_stdout():
+                    rtt = _median_s(post, args.repeat)
+                first = f"{backend:<8}{decode * 1000:>11.1f}{encode * 1000:>11.1f}" if label == "summary" else " " * 30
+                print(f"{first}{label:>10}{rtt * 1000:>15.1f}{sizes[-1]:>12}")
+                sys.stdout.flush()
+    finally:
+        jsoncodec.set_backend(previous)
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
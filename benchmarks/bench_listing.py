@@ -0,0 +1,105 @@
+"""
+Session listing time as the sessions table grows.
+
+For each table size it times the old dashboard query (every row fetched and
+turned into a dict with a formatted timestamp) against a first page and a deep
+page of ``queries.list_sessions``::
+
+    python -m benchmarks.bench_listing --rows 1000 100000 1000000
+"""
+from pathlib import Path
+import argparse
+import datetime
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from server import db
+from server.queries import list_sessions
+
+DEFAULT_ROWS = (1_000, 10_000, 100_000, 1_000_000)
+OLD_QUERY = "SELECT id, created_at, duration, heart_mean, heart_max, imu_csv, heart_csv, raw_filename FROM sessions ORDER BY id DESC"
+
+
+def _populate(db_path: Path, rows: int) -> None:
+    rng = random.Random(0)
+    start = 1_700_000_000
+    values = (
+        (start + i * 60, f"session_{i}.json", f"session_{i}_imu.csv", f"session_{i}_heart_rate.csv",
+         rng.uniform(30, 3600), rng.uniform(70, 170), rng.randint(100, 200), "done")
+        for i in range(rows)
+    )
+    db.execute_batched(
+        db_path,
+        "INSERT INTO sessions (created_at, raw_filename, imu_csv, heart_csv, duration, heart_mean, heart_max, status) VALUES (?,?,?,?,?,?,?,?)",
+        values,
+        batch_size=50_000,
+    )
+
+
+def _old_index(db_path: Path) -> int:
+    with db.connection(db_path) as conn:
+        rows = conn.execute(OLD_QUERY).fetchall()
+    sessions = [
+        {**dict(r), "created_at": datetime.datetime.fromtimestamp(int(r["created_at"])).isoformat(sep=" ")}
+        for r in rows
+    ]
+    return len(sessions)
+
+
+def _timed(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e3
+
+
+def _deep_cursor(db_path: Path, sort: str) -> str:
+    """Cursor pointing ~90% of the way through the listing."""
+    with db.connection(db_path) as conn:
+        total = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        row = conn.execute(
+            f"SELECT id, {sort} FROM sessions ORDER BY {sort} DESC, id DESC LIMIT 1 OFFSET ?", (int(total * 0.9),)
+        ).fetchone()
+    return str(row["id"]) if sort == "id" else f"{row[sort]!r}:{row['id']}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=list(DEFAULT_ROWS))
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--skip-old-above", type=int, default=100_000,
+                        help="skip the unpaginated query for larger tables (it takes seconds)")
+    args = parser.parse_args(argv)
+
+    print(f"{'rows':>9}{'old index ms':>14}{'page 1 ms':>11}{'deep page ms':>14}{'heart_mean page ms':>20}{'filtered page ms':>18}")
+    for rows in args.rows:
+        data_dir = Path(tempfile.mkdtemp(prefix="bench_listing_"))
+        try:
+            db.init_db(data_dir)
+            db_path = data_dir / "sessions.db"
+            _populate(db_path, rows)
+
+            old = _timed(lambda: _old_index(db_path), repeat=1) if rows <= args.skip_old_above else float("nan")
+            first = _timed(lambda: list_sessions(db_path, limit=args.limit))
+            deep_id = _deep_cursor(db_path, "id")
+            deep = _timed(lambda: list_sessions(db_path, after=deep_id, limit=args.limit))
+            deep_hr = _deep_cursor(db_path, "heart_mean")
+            by_hr = _timed(lambda: list_sessions(db_path, after=deep_hr, limit=args.limit, sort="heart_mean"))
+            filtered = _timed(lambda: list_sessions(
+                db_path, limit=args.limit, sort="heart_mean", filters={"heart_mean_min": 150.0, "heart_mean_max": 160.0}
+            ))
+            print(f"{rows:>9}{old:>14.2f}{first:>11.3f}{deep:>14.3f}{by_hr:>20.3f}{filtered:>18.3f}")
+            sys.stdout.flush()
+        finally:
+            db.close_all()
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
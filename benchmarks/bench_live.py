@@ -0,0 +1,146 @@
+"""
+Live strike feedback: detector throughput and end-to-end event latency.
+
+Throughput feeds ``streaming.StrikeDetector`` batches of 1, 10 and 100 samples
+with each analysis backend. Latency replays a session in real time at 100 Hz
+and 1 kHz through ``POST /session/<id>/chunk`` (one chunk every ``--batch-ms``)
+while a subscriber thread waits on the live hub like the SSE endpoint does; it
+is measured from the start of the POST carrying a strike to the subscriber
+receiving its event. Capacity is samples divided by time spent inside POSTs::
+
+    python -m benchmarks.bench_live --rates 100 1000 --seconds 5
+"""
+import argparse
+import json
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from server import analysis, create_app, streaming
+
+from .common import quiet_stdout
+
+STRIKE_EVERY_MS = 500
+
+
+def _samples(rate_hz: int, seconds: float):
+    step = 1000.0 / rate_hz
+    per_strike = max(1, int(STRIKE_EVERY_MS / step))
+    for i in range(int(seconds * rate_hz)):
+        a = 3.0 if i % per_strike == 0 else 0.5
+        yield {"t": i * step, "ax": a, "ay": 0.1, "az": 0.9, "gx": 0.0, "gy": 0.0, "gz": 0.0}
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+def detector_throughput(batch: int, total: int = 200_000) -> float:
+    rows = [[s["t"], s["ax"], s["ay"], s["az"]] for s in _samples(1000, total / 1000)]
+    batches = [analysis._columns_from_rows(rows[i:i + batch]) for i in range(0, len(rows), batch)]
+    detector = streaming.StrikeDetector()
+    start = time.perf_counter()
+    for t, ax, ay, az in batches:
+        detector.update(t, ax, ay, az)
+    return len(rows) / (time.perf_counter() - start)
+
+
+def live_latency(rate_hz: int, seconds: float, batch_ms: float) -> dict:
+    data_dir = tempfile.mkdtemp(prefix="bench_live_")
+    app = create_app({"DATA_DIR": data_dir, "INGEST_WORKERS": 0})
+    client = app.test_client()
+    hub = app.extensions["live_hub"]
+    session_id = client.post("/session/start").get_json()["session_id"]
+    chunk_url = f"/session/{session_id}/chunk"
+
+    sent_at = {}
+    latencies = []
+    done = threading.Event()
+
+    def subscribe():
+        after = 0
+        while not done.is_set():
+            events, closed = hub.wait(session_id, after, timeout=0.5)
+            now = time.perf_counter()
+            for event in events:
+                after = event["id"]
+                if event["type"] == "strike" and event["t"] in sent_at:
+                    latencies.append((now - sent_at[event["t"]]) * 1e3)
+            if closed:
+                return
+
+    subscriber = threading.Thread(target=subscribe)
+    subscriber.start()
+
+    per_chunk = max(1, int(rate_hz * batch_ms / 1000))
+    samples = list(_samples(rate_hz, seconds))
+    request_ms = []
+    start = time.perf_counter()
+    try:
+        with quiet_stdout():
+            for n, i in enumerate(range(0, len(samples), per_chunk)):
+                # Pace chunks in real time, as a phone would send them.
+                delay = start + n * batch_ms / 1000 - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                chunk = samples[i:i + per_chunk]
+                body = "\n".join(json.dumps(s) for s in chunk)
+                t0 = time.perf_counter()
+                for s in chunk:
+                    sent_at[s["t"]] = t0
+                client.post(chunk_url, data=body, content_type="application/x-ndjson")
+                request_ms.append((time.perf_counter() - t0) * 1e3)
+            client.post(f"/session/{session_id}/end")
+    finally:
+        done.set()
+        subscriber.join()
+        app.extensions["ingest_queue"].shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        "chunks": len(request_ms),
+        "strikes": len(latencies),
+        "latency_p50_ms": statistics.median(latencies) if latencies else float("nan"),
+        "latency_p99_ms": _pct(latencies, 0.99),
+        "request_p50_ms": statistics.median(request_ms),
+        "request_p99_ms": _pct(request_ms, 0.99),
+        "samples_per_s": len(samples) / max(1e-9, sum(request_ms) / 1e3),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rates", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--batch-ms", type=float, default=10.0, help="time covered by one chunk")
+    args = parser.parse_args(argv)
+
+    backends = ["python"] + (["numpy"] if analysis.analysis_numpy is not None else [])
+    previous = analysis.get_backend()
+    print("StrikeDetector throughput (samples/s)")
+    print(f"{'batch':>7}" + "".join(f"{b:>14}" for b in backends))
+    for batch in (1, 10, 100):
+        row = []
+        for backend in backends:
+            analysis.set_backend(backend)
+            row.append(detector_throughput(batch))
+        print(f"{batch:>7}" + "".join(f"{r:>14,.0f}" for r in row))
+    analysis.set_backend(previous)
+
+    print(f"\nChunk -> live event ({args.batch_ms:g} ms chunks, backend {previous})")
+    print(f"{'rate Hz':>8}{'chunks':>8}{'strikes':>9}{'event p50 ms':>14}{'event p99 ms':>14}"
+          f"{'POST p50 ms':>13}{'POST p99 ms':>13}{'capacity samples/s':>20}")
+    for rate in args.rates:
+        r = live_latency(rate, args.seconds, args.batch_ms)
+        print(f"{rate:>8}{r['chunks']:>8}{r['strikes']:>9}{r['latency_p50_ms']:>14.2f}{r['latency_p99_ms']:>14.2f}"
+              f"{r['request_p50_ms']:>13.2f}{r['request_p99_ms']:>13.2f}{r['samples_per_s']:>20,.0f}")
+        sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
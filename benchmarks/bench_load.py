@@ -0,0 +1,150 @@
+"""
+Load test: requests/s and latency percentiles of ``/end`` and ``/`` under concurrent clients.
+
+Starts ``python -m server.serve`` on a scratch data directory (or targets
+``--url``), then for each ``--clients`` count runs that many keep-alive
+client threads against each endpoint for ``--duration`` seconds. ``/end``
+posts a ``--samples`` IMU-sample body. Finally it sends SIGTERM and reports
+how long the server took to drain and exit::
+
+    python -m benchmarks.bench_load --server werkzeug --clients 1 4 16
+    python -m benchmarks.bench_load --server gunicorn --workers 4 --threads 4
+"""
+from pathlib import Path
+from urllib.parse import urlsplit
+import argparse
+import http.client
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .common import REPO_ROOT, synthetic_body
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(host: str, port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request("GET", "/api/sessions?limit=1")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def _client(host: str, port: int, method: str, path: str, body, headers, stop_at: float, latencies: list, errors: list) -> None:
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    while time.monotonic() < stop_at:
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status >= 400:
+                errors.append(resp.status)
+        except (OSError, http.client.HTTPException) as exc:
+            errors.append(type(exc).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=60)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))] if sorted_values else float("nan")
+
+
+def measure(host: str, port: int, clients: int, duration: float, method: str, path: str, body=None, headers=None) -> dict:
+    latencies: list = []
+    errors: list = []
+    stop_at = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=_client, args=(host, port, method, path, body, headers or {}, stop_at, latencies, errors))
+        for _ in range(clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "errors": len(errors),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="load an already running server instead of starting one")
+    parser.add_argument("--server", default="auto", help="server.serve --server for the started server")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per endpoint and client count")
+    parser.add_argument("--samples", type=int, default=1000, help="IMU samples per /end body")
+    args = parser.parse_args(argv)
+
+    body = synthetic_body(args.samples).encode("utf-8")
+    endpoints = (
+        ("/end", "POST", "/end", body, {"Content-Type": "application/json"}),
+        ("/", "GET", "/", None, None),
+    )
+    proc = data_dir = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        host, port = "127.0.0.1", _free_port()
+        data_dir = Path(tempfile.mkdtemp(prefix="bench_load_"))
+        env = dict(os.environ, SENSOR_LOG_LEVEL="WARNING")
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "server.serve", "--server", args.server, "--host", host, "--port", str(port),
+             "--workers", str(args.workers), "--threads", str(args.threads), "--data-dir", str(data_dir)],
+            cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    try:
+        _wait_ready(host, port)
+        print(f"/end body {len(body) / 1e3:.0f} KB ({args.samples} IMU samples), {args.duration:.0f} s per run")
+        print(f"{'endpoint':<10}{'clients':>8}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for clients in args.clients:
+            for label, method, path, payload, headers in endpoints:
+                r = measure(host, port, clients, args.duration, method, path, payload, headers)
+                print(f"{label:<10}{clients:>8}{r['requests']:>10}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['errors']:>8}")
+                sys.stdout.flush()
+        if proc is not None:
+            start = time.perf_counter()
+            proc.send_signal(signal.SIGTERM)
+            code = proc.wait(timeout=120)
+            print(f"SIGTERM -> exit {code} in {time.perf_counter() - start:.2f} s (queued sessions drained)")
+    finally:
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+        if data_dir is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
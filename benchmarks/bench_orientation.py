@@ -0,0 +1,86 @@
+"""
+Quaternion stream processing on the pure-Python and NumPy analysis backends.
+
+Times normalizing the rotation_vectors columns for storage
+(``storage.prepare_rotation``) and the orientation analysis (angular
+velocity, swings, strike matching) over synthetic sessions with one rotation
+vector per IMU sample, and checks that the backends agree::
+
+    python -m benchmarks.bench_orientation --sizes 36000 360000
+"""
+import argparse
+import sys
+import time
+
+from server import analysis
+from server.ingest import parse_payload
+from server.storage import prepare_rotation
+
+from .common import synthetic_body
+
+DEFAULT_SIZES = (36_000, 360_000)
+
+
+def _best_of(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def _agree(a, b) -> bool:
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_agree(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_agree(x, y) for x, y in zip(a, b))
+    if isinstance(a, float):
+        return abs(a - b) <= 1e-9 * max(1.0, abs(a))
+    return a == b
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    backends = ["python"]
+    if analysis.analysis_numpy is not None:
+        backends.append("numpy")
+    else:
+        print("NumPy not installed; only the python backend is measured.")
+
+    previous = analysis.get_backend()
+    print(f"{'samples':>10}  {'case':<10}" + "".join(f"{b + ' ms':>12}" for b in backends) + f"{'speedup':>10}{'swings':>8}")
+    try:
+        for size in args.sizes:
+            ok, session = parse_payload(synthetic_body(size, rotation=True))
+            imu = session.imu
+            strikes = analysis.analysis_results([], imu["t"], imu["ax"], imu["ay"], imu["az"])["strike_times"]
+            results = {}
+            for backend in backends:
+                analysis.set_backend(backend)
+                prepare = _best_of(lambda: prepare_rotation(session.rotation, imu["t"][0], imu["t"][-1]), args.repeat)
+                rotation = prepare[1][0]
+                results.setdefault("prepare", {})[backend] = prepare
+                results.setdefault("analysis", {})[backend] = _best_of(
+                    lambda: analysis.orientation_summary(rotation, strikes), args.repeat
+                )
+            for name, per_backend in results.items():
+                outs = [per_backend[b][1] for b in backends]
+                if not all(_agree(outs[0], out) for out in outs[1:]):
+                    raise AssertionError(f"backends disagree on {name} at {size} samples")
+                times = [per_backend[b][0] for b in backends]
+                speedup = f"{times[0] / times[-1]:>9.1f}x" if len(times) > 1 else ""
+                swings = f"{outs[0]['swing_count']:>8}" if name == "analysis" else ""
+                print(f"{size:>10}  {name:<10}" + "".join(f"{t * 1e3:>12.1f}" for t in times) + speedup + swings)
+                sys.stdout.flush()
+    finally:
+        analysis.set_backend(previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Processed IMU storage: CSV vs the binary columnar (.kcol) format.
+
+Reports write time, size on disk, full load time (``storage.read_processed``)
+and the time to mmap a .kcol file and reduce one column::
+
+    python -m benchmarks.bench_processed --sizes 1000 100000 1000000
+"""
+from pathlib import Path
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+from server import columnar
+from server.ingest import parse_payload
+from server.storage import read_processed, write_processed
+
+from .common import synthetic_body
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+
+
+def _timed(fn, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _mmap_reduce(path: Path) -> float:
+    with columnar.ColumnFile(path) as cf:
+        try:
+            col = cf.numpy("ax")
+            total = float(col.sum())
+            del col
+        except ImportError:
+            view = cf.view("ax")
+            total = sum(view)
+            view.release()
+    return total
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'samples':>9}  {'format':<9}{'write ms':>10}{'size MB':>9}{'load ms':>10}{'mmap+sum ms':>13}")
+    for size in args.sizes:
+        ok, session = parse_payload(synthetic_body(size))
+        tmp = Path(tempfile.mkdtemp(prefix="bench_processed_"))
+        processed = tmp / "processed_data"
+        processed.mkdir()
+        try:
+            for fmt in ("csv", "columnar"):
+                write_s, (ok, name) = _timed(lambda: write_processed(processed, "s", "imu", session.imu, fmt), args.repeat)
+                if not ok:
+                    raise RuntimeError(name)
+                size_mb = (processed / name).stat().st_size / 1e6
+                load_s, _ = _timed(lambda: read_processed(tmp, name), args.repeat)
+                mmap_col = ""
+                if fmt == "columnar":
+                    mmap_s, _ = _timed(lambda: _mmap_reduce(processed / name), args.repeat)
+                    mmap_col = f"{mmap_s * 1e3:>13.2f}"
+                print(f"{size:>9}  {fmt:<9}{write_s * 1e3:>10.1f}{size_mb:>9.2f}{load_s * 1e3:>10.1f}{mmap_col}")
+                sys.stdout.flush()
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
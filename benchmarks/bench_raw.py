@@ -0,0 +1,68 @@
+"""
+Raw payload compression: ratio and write/read throughput per codec and level.
+
+Runs over the sample sessions in data/raw_data (or ``--dir``) plus one
+synthetic 100k-sample body. Throughput is in MB/s of uncompressed JSON::
+
+    python -m benchmarks.bench_raw
+"""
+from pathlib import Path
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+from server import rawstore
+
+from .common import REPO_ROOT, synthetic_body
+
+LEVELS = {"zstd": (1, 3, 9), "gzip": (1, 6, 9), "lzma": (0, 6), "none": (None,)}
+
+
+def _bench(texts, codec, level, repeat):
+    tmp = Path(tempfile.mkdtemp(prefix="bench_raw_"))
+    previous = rawstore.get_compression()
+    rawstore.set_compression(codec, level)
+    try:
+        size_in = sum(len(t.encode("utf-8")) for t in texts)
+        best_w = best_r = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            names = [rawstore.write_raw_text(tmp, f"s{i}.json", t)[1] for i, t in enumerate(texts)]
+            best_w = min(best_w, time.perf_counter() - start)
+            start = time.perf_counter()
+            for name in names:
+                rawstore.read_raw_text(tmp / name)
+            best_r = min(best_r, time.perf_counter() - start)
+        size_out = sum((tmp / n).stat().st_size for n in names)
+    finally:
+        rawstore.set_compression(*previous)
+        shutil.rmtree(tmp, ignore_errors=True)
+    return size_in / size_out, size_in / 1e6 / best_w, size_in / 1e6 / best_r
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dir", type=Path, default=REPO_ROOT / "data" / "raw_data")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    samples = [rawstore.read_raw_text(p) for p in rawstore.iter_raw_files(args.dir)]
+    sets = [(f"{len(samples)} sample files", samples)] if samples else []
+    sets.append(("synthetic 100k IMU", [synthetic_body(100_000)]))
+
+    for label, texts in sets:
+        size = sum(len(t) for t in texts) / 1e6
+        print(f"\n{label} ({size:.2f} MB)")
+        print(f"{'codec':<7}{'level':>6}{'ratio':>8}{'write MB/s':>12}{'read MB/s':>11}")
+        for codec in rawstore.available_codecs():
+            for level in LEVELS[codec]:
+                ratio, write, read = _bench(texts, codec, level, args.repeat)
+                print(f"{codec:<7}{'' if level is None else level:>6}{ratio:>8.2f}{write:>12.1f}{read:>11.1f}")
+                sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Bulk reprocessing throughput vs worker count.
+
+Builds a synthetic archive of ``--sessions`` raw files (gzip, as the server
+stores them) and times ``server.reprocess`` over it for each ``--jobs`` value,
+then once more with nothing to do to show the cost of the up-to-date check::
+
+    python -m benchmarks.bench_reprocess --sessions 2000 --samples 3000 --jobs 1 2 4 8
+"""
+from pathlib import Path
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from server import rawstore
+from server.db import init_db
+from server.reprocess import reprocess
+
+from .common import synthetic_body
+
+
+def _archive(sessions: int, samples: int) -> Path:
+    data_dir = Path(tempfile.mkdtemp(prefix="bench_reprocess_"))
+    raw_dir = data_dir / "raw_data"
+    raw_dir.mkdir()
+    (data_dir / "processed_data").mkdir()
+    init_db(data_dir)
+    previous = rawstore.get_compression()
+    rawstore.set_compression("gzip")
+    try:
+        for i in range(sessions):
+            rawstore.write_raw_text(raw_dir, f"session_bench_{i:06d}.json", synthetic_body(samples, seed=i))
+    finally:
+        rawstore.set_compression(*previous)
+    return data_dir
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--samples", type=int, default=3000, help="IMU samples per session")
+    parser.add_argument("--jobs", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}))
+    args = parser.parse_args(argv)
+
+    data_dir = _archive(args.sessions, args.samples)
+    try:
+        print(f"{args.sessions} sessions x {args.samples} IMU samples, {os.cpu_count()} CPU(s)")
+        print(f"{'jobs':>5}{'seconds':>10}{'sessions/s':>12}{'MB/s raw':>10}{'speedup':>9}")
+        base = None
+        for jobs in args.jobs:
+            r = reprocess(data_dir, jobs, force=True)
+            rate = r["processed"] / r["seconds"]
+            base = base or rate
+            print(f"{jobs:>5}{r['seconds']:>10.2f}{rate:>12.1f}{r['bytes'] / 1e6 / r['seconds']:>10.1f}{rate / base:>9.2f}")
+            sys.stdout.flush()
+        r = reprocess(data_dir, args.jobs[-1])
+        print(f"up-to-date rerun: {r['unchanged']} unchanged in {r['seconds']:.3f} s")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Cost of the rhythm and HRV analysis (server/rhythm.py) per backend.
+
+Times ``rhythm.rhythm_summary`` and ``rhythm.hrv_summary`` over synthetic
+sessions of each ``--durations`` seconds at 100 Hz IMU and 1 Hz heart rate,
+next to the whole ``analysis_results`` they are part of, and checks that
+the backends agree. Run it on the Pi to check that an hour-long upload stays
+within its CPU budget::
+
+    python -m benchmarks.bench_rhythm --durations 600 3600
+"""
+import argparse
+import sys
+
+from server import analysis, rhythm
+from server.ingest import columns_from_payload
+
+from .bench_orientation import _agree, _best_of
+from .generate import synthetic_session
+
+DEFAULT_DURATIONS = (600, 3600)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--durations", type=float, nargs="+", default=list(DEFAULT_DURATIONS))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    backends = ["python"]
+    if analysis.analysis_numpy is not None:
+        backends.append("numpy")
+    else:
+        print("NumPy not installed; only the python backend is measured.")
+
+    previous = analysis.get_backend()
+    print(f"{'seconds':>8}  {'backend':<8}{'rhythm ms':>11}{'hrv ms':>9}{'analysis ms':>13}{'rhythm share':>14}{'cadence/min':>13}")
+    try:
+        for duration in args.durations:
+            session = columns_from_payload(synthetic_session(duration, seed=int(duration)))
+            imu, hr = session.imu, session.heart_rate
+            columns = (imu["t"], imu["ax"], imu["ay"], imu["az"])
+            strikes = analysis.analysis_results([], *columns)["strike_times"]
+            outs = []
+            for backend in backends:
+                analysis.set_backend(backend)
+                r_time, summary = _best_of(lambda: rhythm.rhythm_summary(*columns, strikes), args.repeat)
+                h_time, hrv = _best_of(lambda: rhythm.hrv_summary(hr["t"], hr["bpm"]), args.repeat)
+                a_time, _ = _best_of(lambda: analysis.analysis_results(hr["bpm"], *columns, session.rotation, hr["t"]), 1)
+                outs.append([summary, hrv])
+                print(f"{duration:>8g}  {backend:<8}{r_time * 1e3:>11.1f}{h_time * 1e3:>9.1f}{a_time * 1e3:>13.1f}"
+                      f"{r_time / a_time:>14.0%}{summary['cadence_spm'] or 0.0:>13.1f}")
+                sys.stdout.flush()
+            if not all(_agree(outs[0], out) for out in outs[1:]):
+                raise AssertionError(f"backends disagree at {duration:g} s")
+    finally:
+        analysis.set_backend(previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
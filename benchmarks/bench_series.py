@@ -0,0 +1,62 @@
+"""
+Chart series: pyramid build time, and query latency and response size vs session length.
+
+For each session length the IMU pyramid is built from synthetic columns, then
+``series.query`` is timed for the whole session and for a 10 s zoom window::
+
+    python -m benchmarks.bench_series --sizes 10000 100000 1000000 --points 1000
+"""
+from pathlib import Path
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+from server import analysis, series
+from server.ingest import parse_payload
+from server.storage import write_processed
+
+from .common import synthetic_body
+
+
+def _best(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--points", type=int, default=series.DEFAULT_POINTS)
+    args = parser.parse_args(argv)
+
+    print(f"backend {analysis.get_backend()}, points={args.points}")
+    print(f"{'samples':>9}{'build s':>9}{'lod MB':>8}{'full ms':>9}{'full KB':>9}{'bucket':>8}{'zoom ms':>9}{'zoom KB':>9}{'bucket':>8}")
+    for size in args.sizes:
+        tmp = Path(tempfile.mkdtemp(prefix="bench_series_"))
+        try:
+            (tmp / "processed_data").mkdir()
+            _, session = parse_payload(synthetic_body(size))
+            _, name = write_processed(tmp / "processed_data", "s", "imu", session.imu, "columnar")
+            build, _ = _best(lambda: series.write_lod(tmp / "processed_data", name, "imu", session.imu), repeat=1)
+            lod_mb = (tmp / "processed_data" / series.lod_filename(name)).stat().st_size / 1e6
+            mid = session.imu["t"][size // 2]
+            row = [size, build, lod_mb]
+            for t_from, t_to in ((None, None), (mid, mid + 10_000)):
+                seconds, out = _best(lambda: series.query(tmp, name, "accel", t_from, t_to, args.points))
+                row += [seconds * 1e3, len(json.dumps(out)) / 1e3, out["bucket"]]
+            print("{:>9}{:>9.2f}{:>8.2f}{:>9.2f}{:>9.1f}{:>8}{:>9.2f}{:>9.1f}{:>8}".format(*row))
+            sys.stdout.flush()
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Trend queries from the rollup tables vs aggregating the stored analysis results.
+
+Fills a sessions.db with ``--sessions`` finished sessions spread over
+``--days`` days (rows and analysis results only, no files), then times the
+incremental rollup update per session, a full rebuild, ``/api/trends``-style
+queries for each bucket, and the same daily totals computed by scanning
+session_analysis with json_extract::
+
+    python -m benchmarks.bench_trends --sessions 100000 --days 730
+"""
+from pathlib import Path
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from server import analysis, rollups
+from server.db import connection, init_db, transaction
+from server.results import dumps, save_results
+
+SCAN_SQL = (
+    "SELECT date(s.created_at, 'unixepoch', 'localtime') AS day, COUNT(*), "
+    "SUM(json_extract(a.results, '$.strikes.strike_count')), "
+    "AVG(json_extract(a.results, '$.intensity.avg_intensity')) "
+    "FROM sessions s JOIN session_analysis a ON a.session_id = s.id GROUP BY day ORDER BY day"
+)
+
+
+def _results(rng: random.Random) -> dict:
+    strikes = rng.randint(0, 300)
+    forces = [2.0 + rng.random() * 3 for _ in range(strikes)]
+    return {
+        "version": analysis.analysis_version(),
+        "zones": {name: rng.randint(0, 900) for name in analysis.hr_zone_labels()},
+        "intensity": {"avg_intensity": 1.0 + rng.random(), "max_intensity": 6.0},
+        "strikes": {"strike_count": strikes, "avg_strike_force": sum(forces) / strikes if strikes else 0.0,
+                    "max_strike_force": max(forces, default=0.0)},
+        "strike_times": [i * 500.0 for i in range(strikes)],
+        "strike_forces": forces,
+    }
+
+
+def _fill(data_dir: Path, sessions: int, days: int) -> float:
+    """Insert the sessions, maintaining the rollups per session; returns the seconds spent on rollups."""
+    rng = random.Random(0)
+    now = int(time.time())
+    spent = 0.0
+    with transaction(data_dir / "sessions.db") as conn:
+        for i in range(sessions):
+            created = now - rng.randrange(days * 86400)
+            cur = conn.execute(
+                "INSERT INTO sessions (created_at, raw_filename, duration, status) VALUES (?, ?, ?, 'done')",
+                (created, f"session_bench_{i}.json", 600.0 + rng.random() * 1800),
+            )
+            results = _results(rng)
+            save_results(conn, cur.lastrowid, dumps(results), results["version"])
+            start = time.perf_counter()
+            rollups.record_session(conn, cur.lastrowid, results)
+            spent += time.perf_counter() - start
+    return spent
+
+
+def _best_ms(fn, repeat: int = 20) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args(argv)
+
+    data_dir = Path(tempfile.mkdtemp(prefix="bench_trends_"))
+    try:
+        init_db(data_dir)
+        db_path = data_dir / "sessions.db"
+        spent = _fill(data_dir, args.sessions, args.days)
+        print(f"{args.sessions} sessions over {args.days} days")
+        print(f"incremental rollup update: {spent / args.sessions * 1e6:.0f} us/session")
+        stats = rollups.rebuild(data_dir)
+        print(f"rebuild: {stats['sessions']} sessions -> {stats['days']} days in {stats['seconds']:.2f} s")
+        for bucket in rollups.BUCKETS:
+            rows = rollups.trends(db_path, bucket)
+            print(f"trends bucket={bucket:<5} {len(rows):>5} rows {_best_ms(lambda: rollups.trends(db_path, bucket)):>8.2f} ms")
+
+        def scan():
+            with connection(db_path) as conn:
+                return conn.execute(SCAN_SQL).fetchall()
+        print(f"scan of session_analysis (day)  {_best_ms(scan, 3):>8.2f} ms")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
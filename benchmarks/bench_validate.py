@@ -0,0 +1,75 @@
+"""
+Ingest validation throughput on clean and dirty payloads.
+
+Times ``ingest.columns_from_payload`` on an already decoded payload of
+``--samples`` IMU samples (plus heart rates) for each ``--dirty`` fraction of
+malformed samples (missing fields, nulls, strings, bools, NaN, non-objects).
+``--baseline-ref`` runs the same inputs through the ingest code at another git
+revision in its own interpreter::
+
+    python -m benchmarks.bench_validate --baseline-ref <rev> --dirty 0 0.1 0.5
+"""
+import argparse
+import json
+import shutil
+import sys
+import time
+
+from .common import REPO_ROOT, extract_tree, run_worker, synthetic_payload
+from .generate import damage
+
+
+def dirty_payload(samples: int, dirty: float, seed: int = 0) -> dict:
+    """synthetic_payload with a ``dirty`` fraction of its samples damaged."""
+    return damage(synthetic_payload(samples, seed=seed), dirty, seed)
+
+
+def worker(samples: int, dirty: float, repeat: int) -> dict:
+    from server.ingest import columns_from_payload
+
+    payload = dirty_payload(samples, dirty)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        session = columns_from_payload(payload)
+        best = min(best, time.perf_counter() - start)
+    kept = len(session.imu["t"])
+    return {"seconds": best, "kept": kept, "samples": samples + len(payload["heart_rates"])}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--samples", type=int, default=200_000)
+    parser.add_argument("--dirty", type=float, nargs="+", default=[0.0, 0.1, 0.5])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline-ref", help="git revision to compare against")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--tree", help=argparse.SUPPRESS)
+    parser.add_argument("--dirty-one", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(worker(args.samples, args.dirty_one, args.repeat)))
+        return 0
+
+    trees = [("current", REPO_ROOT)]
+    if args.baseline_ref:
+        trees.insert(0, (args.baseline_ref, extract_tree(args.baseline_ref)))
+    print(f"{args.samples} IMU samples")
+    print(f"{'tree':<12}{'dirty':>7}{'ms':>9}{'Msamples/s':>12}{'IMU kept':>10}")
+    try:
+        for dirty in args.dirty:
+            for label, tree in trees:
+                r = run_worker("benchmarks.bench_validate", tree,
+                               ["--samples", args.samples, "--dirty-one", dirty, "--repeat", args.repeat])
+                print(f"{label:<12}{dirty:>7.2f}{r['seconds'] * 1000:>9.1f}{r['samples'] / r['seconds'] / 1e6:>12.2f}{r['kept']:>10}")
+                sys.stdout.flush()
+    finally:
+        for label, tree in trees:
+            if tree != REPO_ROOT:
+                shutil.rmtree(tree, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Shared helpers for the benchmark scripts."""
+from pathlib import Path
+import contextlib
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tarfile
+import tempfile
+import io
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def synthetic_payload(imu_samples: int, imu_hz: int = 100, heart_rate_hz: int = 1, seed: int = 0, rotation: bool = False) -> dict:
+    """Deterministic /end payload with ``imu_samples`` IMU rows and periodic strikes.
+
+    With ``rotation`` it also carries one rotation vector per IMU row, swinging
+    through 90 degrees in the 300 ms before each strike.
+    """
+    rng = random.Random(seed)
+    step_ms = 1000.0 / imu_hz
+    imu = []
+    for i in range(imu_samples):
+        strike = 3.0 if i % (imu_hz * 2) == 0 else 0.0
+        imu.append({
+            "t": int(i * step_ms),
+            "ax": 0.1 + rng.random() * 0.5 + strike,
+            "ay": 0.1 + rng.random() * 0.5 + strike,
+            "az": 0.8 + rng.random() * 0.5 + strike,
+            "gx": rng.random() * 0.1,
+            "gy": rng.random() * 0.1,
+            "gz": rng.random() * 0.1,
+        })
+    duration = imu_samples / float(imu_hz)
+    heart_rates = [
+        {"t": int(i * 1000 / heart_rate_hz), "bpm": 80 + (i % 40) * 2}
+        for i in range(max(1, int(duration * heart_rate_hz)))
+    ]
+    payload = {
+        "heart_rates": heart_rates,
+        "imu": imu,
+        "duration": duration,
+        "heart_rate_hz": heart_rate_hz,
+        "imu_hz": imu_hz,
+    }
+    if rotation:
+        period, swing = imu_hz * 2, max(1, int(0.3 * imu_hz))
+        vectors = []
+        for i in range(imu_samples):
+            # Angle about y: rests at 0, ramps to 90 degrees up to the strike sample, then snaps back.
+            phase = i % period
+            angle = math.pi / 2 * (1 - (period - phase) / swing) if phase > period - swing else 0.0
+            angle += rng.random() * 0.001
+            vectors.append({"t": int(i * step_ms), "x": 0.0, "y": math.sin(angle / 2), "z": 0.0, "w": math.cos(angle / 2)})
+        payload["rotation_vectors"] = vectors
+    return payload
+
+
+def synthetic_body(imu_samples: int, **kwargs) -> str:
+    return json.dumps(synthetic_payload(imu_samples, **kwargs))
+
+
+def extract_tree(ref: str) -> Path:
+    """Extract ``server/`` and ``benchmarks/`` at git ``ref`` into a temp dir and return it."""
+    dest = Path(tempfile.mkdtemp(prefix="bench_tree_"))
+    archive = subprocess.run(
+        ["git", "archive", ref, "server"], cwd=REPO_ROOT, check=True, capture_output=True
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(dest)
+    (dest / "data").mkdir()
+    return dest
+
+
+def run_worker(module: str, tree: Path, args: list) -> dict:
+    """Run ``module --worker`` in a fresh interpreter importing ``server`` from ``tree``."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([str(tree), str(REPO_ROOT)])
+    out = subprocess.run(
+        [sys.executable, "-m", module, "--worker", "--tree", str(tree)] + [str(a) for a in args],
+        cwd=str(tree), env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+@contextlib.contextmanager
+def quiet_stdout():
+    """Silence stdout and the server's INFO logging (the per-session analysis report)."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        logging.disable(logging.INFO)
+        try:
+            yield
+        finally:
+            logging.disable(logging.NOTSET)
@@ -0,0 +1,155 @@
+"""
+Deterministic synthetic sessions for the benchmarks.
+
+``synthetic_session`` builds an /end payload like the watch app sends:
+IMU samples at ``imu_hz`` with a strike (a 3-5 G spike after a fast 90 degree
+swing) on average ``strikes_per_min`` times a minute, heart rates climbing
+from rest into the cardio zones, rotation vectors, optional timestamp jitter
+and a ``dirty`` fraction of malformed samples. The same arguments always give
+the same payload, so results and baselines from different runs compare::
+
+    python -m benchmarks.generate --duration 1800 --imu-hz 100 --dirty 0.01 -o practice.json
+"""
+from pathlib import Path
+from typing import Dict, List, Sequence
+import argparse
+import json
+import math
+import random
+import sys
+
+JUNK = (None, "abc", "", True, [], {}, float("nan"))
+
+# Named sessions used by benchmarks.suite; keys are synthetic_session arguments.
+SCENARIOS: Dict[str, dict] = {
+    "short": {"duration_s": 60, "imu_hz": 100, "strikes_per_min": 30},
+    "practice": {"duration_s": 1800, "imu_hz": 100, "strikes_per_min": 20, "jitter_ms": 2.0, "dirty": 0.01},
+    "dirty": {"duration_s": 300, "imu_hz": 100, "strikes_per_min": 30, "jitter_ms": 2.0, "dirty": 0.2},
+    "fast": {"duration_s": 300, "imu_hz": 400, "heart_rate_hz": 4, "strikes_per_min": 40},
+}
+
+SWING_MS = 300  # 90 degrees before the strike: 300 dps
+RETURN_MS = 700  # back to rest after it: about 130 dps, below analysis.SWING_MIN_DPS
+
+
+def strike_times(duration_s: float, strikes_per_min: float, rng: random.Random) -> List[float]:
+    """Strike times in ms: evenly spread at the requested rate, each moved by up to a quarter period."""
+    if strikes_per_min <= 0:
+        return []
+    period = 60_000.0 / strikes_per_min
+    times = []
+    t = period / 2
+    while t < duration_s * 1000.0 - RETURN_MS:
+        times.append(max(SWING_MS, t + rng.uniform(-0.25, 0.25) * period))
+        t += period
+    return times
+
+
+def _swing_angle(t: float, strikes: Sequence[float], start: int) -> float:
+    """Rotation about y in radians at ``t``: ramps up over SWING_MS to each strike, then back over RETURN_MS."""
+    for s in strikes[start:start + 2]:
+        if s - SWING_MS <= t <= s:
+            return math.pi / 2 * (t - (s - SWING_MS)) / SWING_MS
+        if s < t <= s + RETURN_MS:
+            return math.pi / 2 * (1 - (t - s) / RETURN_MS)
+    return 0.0
+
+
+def damage(payload: dict, dirty: float, seed: int = 0, keys: Sequence[str] = ("imu", "heart_rates")) -> dict:
+    """Replace, strip a field from, or corrupt a field of a ``dirty`` fraction of the samples under ``keys``."""
+    rng = random.Random(seed)
+    for key in keys:
+        items = payload.get(key) or []
+        for i in rng.sample(range(len(items)), int(len(items) * dirty)):
+            roll = rng.random()
+            if roll < 0.1:
+                items[i] = rng.choice(JUNK)
+            elif roll < 0.4:
+                items[i].pop(rng.choice(list(items[i])))
+            else:
+                items[i][rng.choice(list(items[i]))] = rng.choice(JUNK)
+    return payload
+
+
+def synthetic_session(duration_s: float = 60.0, imu_hz: float = 100.0, heart_rate_hz: float = 1.0,
+                      strikes_per_min: float = 30.0, rotation: bool = True, jitter_ms: float = 0.0,
+                      dirty: float = 0.0, seed: int = 0) -> dict:
+    """A decoded /end payload; see the module docstring."""
+    rng = random.Random(seed)
+    strikes = strike_times(duration_s, strikes_per_min, rng)
+    step_ms = 1000.0 / imu_hz
+    jitter_ms = min(jitter_ms, step_ms * 0.45)  # keeps timestamps increasing
+    n = int(duration_s * imu_hz)
+
+    imu, vectors = [], []
+    swing = peak_at = 0  # first strike whose swing, resp. spike, is not over yet
+    for i in range(n):
+        t = i * step_ms + (rng.uniform(-jitter_ms, jitter_ms) if jitter_ms else 0.0)
+        while swing < len(strikes) and strikes[swing] + RETURN_MS < t:
+            swing += 1
+        while peak_at < len(strikes) and strikes[peak_at] + 1.5 * step_ms <= t:
+            peak_at += 1
+        ax, ay, az = rng.gauss(0.0, 0.08), rng.gauss(0.0, 0.08), 1.0 + rng.gauss(0.0, 0.08)
+        angle = _swing_angle(t, strikes, swing)
+        if peak_at < len(strikes) and abs(t - strikes[peak_at]) < 1.5 * step_ms:
+            peak = rng.uniform(3.0, 5.0) * (1 - abs(t - strikes[peak_at]) / (3 * step_ms))
+            ax, ay, az = ax + peak * 0.6, ay + peak * 0.3, az + peak * 0.74
+        gyro = 5.2 if 0.0 < angle < math.pi / 2 else 0.0  # rad/s while swinging
+        imu.append({
+            "t": round(t, 3), "ax": round(ax, 4), "ay": round(ay, 4), "az": round(az, 4),
+            "gx": round(rng.gauss(0.0, 0.02), 4), "gy": round(gyro + rng.gauss(0.0, 0.02), 4), "gz": round(rng.gauss(0.0, 0.02), 4),
+        })
+        if rotation:
+            angle += rng.gauss(0.0, 0.0002 * step_ms)  # sensor noise, about 20 dps whatever the rate
+            vectors.append({"t": round(t, 3), "x": 0.0, "y": round(math.sin(angle / 2), 6), "z": 0.0, "w": round(math.cos(angle / 2), 6)})
+
+    heart_rates = []
+    for i in range(max(1, int(duration_s * heart_rate_hz))):
+        progress = i / (duration_s * heart_rate_hz)
+        # Warm-up ramp to ~160 over the first 40% of the session, then waves between cardio and peak.
+        bpm = 75 + 85 * min(1.0, progress / 0.4) + 10 * math.sin(i / (heart_rate_hz * 30.0)) * (progress > 0.4)
+        heart_rates.append({"t": int(i * 1000 / heart_rate_hz), "bpm": int(bpm + rng.gauss(0.0, 2.0))})
+
+    payload = {
+        "heart_rates": heart_rates,
+        "imu": imu,
+        "duration": float(duration_s),
+        "heart_rate_hz": heart_rate_hz,
+        "imu_hz": imu_hz,
+    }
+    if rotation:
+        payload["rotation_vectors"] = vectors
+    if dirty:
+        damage(payload, dirty, seed, ("imu", "heart_rates", "rotation_vectors"))
+    return payload
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), help="start from a named scenario")
+    parser.add_argument("--duration", type=float, help="seconds")
+    parser.add_argument("--imu-hz", type=float)
+    parser.add_argument("--heart-rate-hz", type=float)
+    parser.add_argument("--strikes-per-min", type=float)
+    parser.add_argument("--jitter-ms", type=float)
+    parser.add_argument("--dirty", type=float, help="fraction of malformed samples")
+    parser.add_argument("--no-rotation", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--out", type=Path, help="default: stdout")
+    args = parser.parse_args(argv)
+
+    params = dict(SCENARIOS[args.scenario]) if args.scenario else {}
+    for key, value in (("duration_s", args.duration), ("imu_hz", args.imu_hz), ("heart_rate_hz", args.heart_rate_hz),
+                       ("strikes_per_min", args.strikes_per_min), ("jitter_ms", args.jitter_ms), ("dirty", args.dirty)):
+        if value is not None:
+            params[key] = value
+    body = json.dumps(synthetic_session(rotation=not args.no_rotation, seed=args.seed, **params), separators=(",", ":"))
+    if args.out:
+        args.out.write_text(body, encoding="utf-8")
+    else:
+        sys.stdout.write(body)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
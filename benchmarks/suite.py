@@ -0,0 +1,297 @@
+"""
+Benchmark suite: the ingest path stage by stage on synthetic sessions, with results kept as JSON.
+
+Each case times one entry point, in process, on every scenario of
+``benchmarks.generate``:
+
+- ``parse``: ``ingest.parse_payload`` on the body
+- ``end_request``: ``POST /end`` through the Flask test client, processing in the request
+- ``process_and_save``: ``storage._process_and_save`` (processed files and chart pyramids)
+- ``analyze_session``: ``analysis.analyze_session`` on the decoded payload
+- ``detect_kendo_strikes``: ``analysis.detect_kendo_strikes`` on IMU rows
+- ``db_insert``: ``storage.insert_session`` of one finished session
+
+Every (case, scenario) runs in a fresh interpreter so its peak RSS is its
+own. Results (median/min/max latency, throughput, peak RSS, the environment)
+are written to ``--out``. With ``--baseline`` the run is compared against an
+earlier results file. Regressions beyond ``--threshold`` are flagged, and the
+exit status is then 1::
+
+    python -m benchmarks.suite --save-baseline          # on the reference commit
+    python -m benchmarks.suite --baseline               # after the change
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+import argparse
+import datetime
+import gc
+import hashlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .common import REPO_ROOT, quiet_stdout, run_worker
+from .generate import SCENARIOS
+
+RESULTS_DIR = REPO_ROOT / "benchmarks" / "results"
+DEFAULT_OUT = RESULTS_DIR / "latest.json"
+DEFAULT_BASELINE = RESULTS_DIR / "baseline.json"
+QUICK_SCENARIOS = ("short", "dirty")
+# Only differences above this many MB count as RSS regressions; smaller ones are allocator noise.
+RSS_NOISE_MB = 5.0
+
+
+def _setup_parse(body: bytes, data_dir: Path) -> Tuple[Callable[[], Any], int]:
+    from server.ingest import parse_payload
+
+    return lambda: parse_payload(body), 1
+
+
+def _setup_end_request(body: bytes, data_dir: Path) -> Tuple[Callable[[], Any], int]:
+    from server import create_app
+
+    client = create_app({"DATA_DIR": data_dir, "INGEST_WORKERS": 0, "RECOVER_PENDING": False}).test_client()
+
+    def run():
+        with client.post("/end", data=body, content_type="application/json") as resp:
+            if resp.status_code != 200:
+                raise RuntimeError(f"/end answered {resp.status_code}")
+    return run, 1
+
+
+def _setup_process_and_save(body: bytes, data_dir: Path) -> Tuple[Callable[[], Any], int]:
+    from server.ingest import parse_payload
+    from server.storage import _process_and_save
+
+    ok, session = parse_payload(body)
+    calls = iter(range(1 << 30))
+
+    def run():
+        ok, info = _process_and_save(data_dir, f"session_bench{next(calls)}.json", "", session)
+        if not ok:
+            raise RuntimeError(info["error"])
+    return run, 1
+
+
+def _setup_analyze_session(body: bytes, data_dir: Path) -> Tuple[Callable[[], Any], int]:
+    from server import analysis
+
+    payload = json.loads(body)
+    return lambda: analysis.analyze_session(payload), 1
+
+
+def _setup_detect_kendo_strikes(body: bytes, data_dir: Path) -> Tuple[Callable[[], Any], int]:
+    from server import analysis
+    from server.ingest import IMU_FIELDS
+
+    rows = [[sample.get(k) for k in IMU_FIELDS] for sample in json.loads(body)["imu"] if isinstance(sample, dict)]
+    return lambda: analysis.detect_kendo_strikes(rows), 1
+
+
+def _setup_db_insert(body: bytes, data_dir: Path) -> Tuple[Callable[[], Any], int]:
+    from server.ingest import parse_payload
+    from server.storage import insert_session, process_raw_payload, write_raw_payload
+
+    ok, session = parse_payload(body)
+    ok, fname = write_raw_payload(data_dir, body)
+    ok, info = process_raw_payload(data_dir, fname, session)
+    batch = 20  # one insert is well under a millisecond; time them in groups
+
+    def run():
+        for _ in range(batch):
+            if insert_session(data_dir, fname, info) is None:
+                raise RuntimeError("insert failed")
+    return run, batch
+
+
+# name -> (setup returning (call, operations per call), unit of throughput)
+CASES: Dict[str, Tuple[Callable[[bytes, Path], Tuple[Callable[[], Any], int]], str]] = {
+    "parse": (_setup_parse, "samples"),
+    "end_request": (_setup_end_request, "samples"),
+    "process_and_save": (_setup_process_and_save, "samples"),
+    "analyze_session": (_setup_analyze_session, "samples"),
+    "detect_kendo_strikes": (_setup_detect_kendo_strikes, "samples"),
+    "db_insert": (_setup_db_insert, "rows"),
+}
+
+
+def worker(case: str, body_path: Path, samples: int, repeat: int) -> dict:
+    from server.db import close_all, init_db
+
+    body = body_path.read_bytes()
+    data_dir = Path(tempfile.mkdtemp(prefix="bench_suite_"))
+    try:
+        for sub in ("raw_data", "processed_data"):
+            (data_dir / sub).mkdir()
+        init_db(data_dir)
+        setup, unit = CASES[case]
+        with quiet_stdout():
+            call, ops = setup(body, data_dir)
+            input_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+            call()  # warm-up: imports, caches, the NumPy engine
+            times = []
+            for _ in range(repeat):
+                gc.collect()
+                start = time.perf_counter()
+                call()
+                times.append(time.perf_counter() - start)
+        close_all()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    times.sort()
+    median = times[len(times) // 2] if len(times) % 2 else (times[len(times) // 2 - 1] + times[len(times) // 2]) / 2
+    units = samples if unit == "samples" else ops
+    return {
+        "repeat": repeat,
+        "median_ms": median * 1000,
+        "min_ms": times[0] * 1000,
+        "max_ms": times[-1] * 1000,
+        "per_op_ms": median * 1000 / ops,
+        "throughput": units / median,
+        "unit": f"{unit}/s",
+        "input_rss_mb": input_rss,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+
+def environment() -> Dict[str, Any]:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git("rev-parse", "--short", "HEAD"),
+        "git_dirty": bool(git("status", "--porcelain", "--untracked-files=no", "server", "benchmarks")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": numpy_version,
+        "analysis_backend": os.environ.get("SENSOR_ANALYSIS_BACKEND"),
+    }
+
+
+# Environment keys that make timings incomparable when they differ.
+_COMPARABLE_ENV = ("python", "machine", "cpus", "numpy", "analysis_backend")
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float, rss_threshold: float) -> Dict[str, List[str]]:
+    """Per result key, the regressions against ``baseline`` as readable notes.
+
+    Keys missing from the baseline, or measured there on a different input, are skipped.
+    """
+    notes: Dict[str, List[str]] = {}
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if base is None or base.get("input_sha256") != cur.get("input_sha256"):
+            continue
+        found = []
+        if cur["median_ms"] > base["median_ms"] * (1 + threshold):
+            found.append(f"time +{cur['median_ms'] / base['median_ms'] * 100 - 100:.0f}%")
+        if cur["peak_rss_mb"] > base["peak_rss_mb"] * (1 + rss_threshold) and cur["peak_rss_mb"] - base["peak_rss_mb"] > RSS_NOISE_MB:
+            found.append(f"peak RSS +{cur['peak_rss_mb'] - base['peak_rss_mb']:.0f} MB")
+        if found:
+            notes[key] = found
+    return notes
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--case", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--scenario", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--quick", action="store_true", help=f"only the {' and '.join(QUICK_SCENARIOS)} scenarios, 3 repeats")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", type=Path, default=DEFAULT_OUT, help=f"results file (default {DEFAULT_OUT.relative_to(REPO_ROOT)})")
+    parser.add_argument("--baseline", type=Path, nargs="?", const=DEFAULT_BASELINE,
+                        help=f"results file to compare against (default {DEFAULT_BASELINE.relative_to(REPO_ROOT)})")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results as the default baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="median time increase flagged as a regression")
+    parser.add_argument("--rss-threshold", type=float, default=0.10, help="peak RSS increase flagged as a regression")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--tree", help=argparse.SUPPRESS)
+    parser.add_argument("--body", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--samples", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(worker(args.case[0], args.body, args.samples, args.repeat)))
+        return 0
+
+    scenarios = [s for s in args.scenario if s in QUICK_SCENARIOS] if args.quick else args.scenario
+    repeat = 3 if args.quick else args.repeat
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        env = environment()
+        differs = [k for k in _COMPARABLE_ENV if baseline["environment"].get(k) != env.get(k)]
+        if differs:
+            print(f"warning: baseline was recorded with a different {', '.join(differs)}; timings may not compare")
+
+    run = {"environment": environment(), "threshold": args.threshold, "results": {}}
+    bodies = Path(tempfile.mkdtemp(prefix="bench_bodies_"))
+    print(f"{'case':<22}{'scenario':<10}{'median ms':>11}{'throughput':>16}{'peak MB':>9}  vs baseline")
+    try:
+        for scenario in scenarios:
+            # Generated by another process: a child's peak RSS starts from its parent's, so this one stays small.
+            body_path = bodies / f"{scenario}.json"
+            subprocess.run([sys.executable, "-m", "benchmarks.generate", "--scenario", scenario, "-o", str(body_path)],
+                           cwd=REPO_ROOT, check=True)
+            digest = hashlib.sha256()
+            with open(body_path, "rb") as fh:
+                for block in iter(lambda: fh.read(1 << 20), b""):
+                    digest.update(block)
+            params = SCENARIOS[scenario]
+            samples = int(params["duration_s"] * params["imu_hz"])
+            for case in args.case:
+                key = f"{case}/{scenario}"
+                r = run_worker("benchmarks.suite", REPO_ROOT, [
+                    "--case", case, "--body", body_path, "--samples", samples, "--repeat", repeat,
+                ])
+                r.update(case=case, scenario=scenario, samples=samples, body_mb=body_path.stat().st_size / 1e6,
+                         input_sha256=digest.hexdigest())
+                run["results"][key] = r
+                versus = ""
+                if baseline is not None:
+                    base = baseline["results"].get(key)
+                    notes = compare({key: r}, baseline["results"], args.threshold, args.rss_threshold).get(key)
+                    if base is not None and base.get("input_sha256") != r["input_sha256"]:
+                        versus = "different input, not compared"
+                    elif base is not None:
+                        versus = f"{r['median_ms'] / base['median_ms'] * 100 - 100:+.0f}% time"
+                    if notes:
+                        versus += "  REGRESSION: " + ", ".join(notes)
+                print(f"{case:<22}{scenario:<10}{r['median_ms']:>11.1f}{r['throughput']:>10.3g} {r['unit']:<5}{r['peak_rss_mb']:>9.0f}  {versus}")
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(bodies, ignore_errors=True)
+
+    targets = [args.out] + ([DEFAULT_BASELINE] if args.save_baseline else [])
+    for target in targets:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(json.dumps(run, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"wrote {target}")
+
+    if baseline is not None:
+        regressions = compare(run["results"], baseline["results"], args.threshold, args.rss_threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
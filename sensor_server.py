@@ -1,5 +1,7 @@
-from server import app
+import sys
+
+from server.serve import main
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    sys.exit(main())
@@ -1,24 +1,88 @@
 from flask import Flask
+from pathlib import Path
+from typing import Any, Dict, Optional
 import logging
-from . import views
+import os
+from . import logconfig, views
 
+DEFAULT_DATA_DIR = Path(__file__).resolve().parent.parent / "data"
 
-def _configure_logger() -> None:
-    log = logging.getLogger("sensor_server")
-    if not log.handlers:
-        log.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
-        log.addHandler(handler)
 
+def _default_config() -> Dict[str, Any]:
+    return {
+        "DATA_DIR": Path(os.environ.get("SENSOR_DATA_DIR") or DEFAULT_DATA_DIR),
+        # 0 processes uploads inside the request, like before the queue existed.
+        "INGEST_WORKERS": int(os.environ.get("SENSOR_INGEST_WORKERS", "2")),
+        "INGEST_EXECUTOR": os.environ.get("SENSOR_INGEST_EXECUTOR", "thread"),
+        # "columnar" (.kcol) or "csv" for data/processed_data.
+        "PROCESSED_FORMAT": os.environ.get("SENSOR_PROCESSED_FORMAT", "columnar"),
+        # Raw payload compression: "auto" (zstd if installed, else gzip), zstd, gzip, lzma or none.
+        "RAW_COMPRESSION": os.environ.get("SENSOR_RAW_COMPRESSION", "auto"),
+        "RAW_COMPRESSION_LEVEL": int(os.environ["SENSOR_RAW_COMPRESSION_LEVEL"]) if os.environ.get("SENSOR_RAW_COMPRESSION_LEVEL") else None,
+        # Serialized analysis results kept in memory by /api/session/<id>/analysis.
+        "ANALYSIS_CACHE_SIZE": int(os.environ.get("SENSOR_ANALYSIS_CACHE_SIZE", "256")),
+        # Re-queue sessions left unfinished by the previous run. Under several
+        # server processes only one may do it (server/serve.py sees to that).
+        "RECOVER_PENDING": os.environ.get("SENSOR_RECOVER_PENDING", "1") != "0",
+        # File durability: "none", "atomic", "fsync" or "group" (server/durable.py).
+        "DURABILITY": os.environ.get("SENSOR_DURABILITY", "fsync"),
+        # Reconcile files and sessions.db at startup, in the process that re-queues sessions (server/fsck.py).
+        "CONSISTENCY_CHECK": os.environ.get("SENSOR_CONSISTENCY_CHECK", "1") != "0",
+        # Sessions accepted by one POST /sessions/batch (server/batch.py).
+        "BATCH_MAX_SESSIONS": int(os.environ.get("SENSOR_BATCH_MAX_SESSIONS", "200")),
+        # Per-request profiles in data/profiles: "off", "header" (X-Profile: 1) or "all" (server/profiling.py).
+        "PROFILE": os.environ.get("SENSOR_PROFILE", "off"),
+    }
 
-def create_app() -> Flask:
-    _configure_logger()
+
+def create_app(config: Optional[Dict[str, Any]] = None) -> Flask:
+    logconfig.configure()
     app = Flask(__name__)
+    app.json = views.CodecJSONProvider(app)
+    app.config.update(_default_config())
+    if config:
+        app.config.update(config)
+    app.config["DATA_DIR"] = Path(app.config["DATA_DIR"])
+
+    from . import durable, fsck, metrics, profiling, rawstore
     from .db import init_db
-    init_db()
+    from .lifecycle import InflightTracker
+    from .live import LiveHub
+    from .results import ResultsCache
+    from .storage import make_data_dir
+    from .worker import IngestQueue, recover_pending
+    rawstore.set_compression(app.config["RAW_COMPRESSION"], app.config["RAW_COMPRESSION_LEVEL"])
+    durable.set_level(app.config["DURABILITY"])
+    data_dir = make_data_dir(str(app.config["DATA_DIR"]))
+    init_db(data_dir)
+    queue = IngestQueue(
+        data_dir, app.config["INGEST_WORKERS"], app.config["INGEST_EXECUTOR"], app.config["PROCESSED_FORMAT"]
+    )
+    app.extensions["ingest_queue"] = queue
+    app.extensions["live_hub"] = LiveHub()
+    app.extensions["analysis_cache"] = ResultsCache(app.config["ANALYSIS_CACHE_SIZE"])
+    if app.config["RECOVER_PENDING"]:
+        if app.config["CONSISTENCY_CHECK"]:
+            fsck.check(data_dir)
+        recovered = recover_pending(data_dir, queue)
+        if recovered:
+            logging.getLogger("sensor_server").info("Re-queued %d unfinished session(s)", recovered)
+    metrics.init_app(app)
+    profiling.init_app(app)
     views.register_routes(app)
+    app.wsgi_app = app.extensions["inflight"] = InflightTracker(app.wsgi_app)
     return app
 
 
-app = create_app()
+_app = None
+
+
+def __getattr__(name: str):
+    # ``from server import app`` builds the default app on first use, so importing
+    # submodules (analysis, storage, ...) has no side effects on the data dir.
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
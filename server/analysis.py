@@ -1,58 +1,222 @@
+from array import array
+from bisect import bisect_right
+import hashlib
+import json
 import math
 import logging
+import os
+
+from .ingest import NAN, columns_from_payload, finite_values
+
+try:
+    from . import analysis_numpy
+except ImportError:
+    analysis_numpy = None
+
+from . import rhythm
 
 LOG = logging.getLogger("sensor_server.analysis")
 
+# Analysis parameters. Stored results are keyed by analysis_version(), which
+# changes whenever one of these does.
+HR_ZONE_BOUNDS = (100, 130, 150)
+HR_ZONE_NAMES = ("Resting/Warm Up", "Fat Burn", "Cardio", "Peak")
+STRIKE_THRESHOLD = 2.0
+STRIKE_MIN_DIST_MS = 200
+# A swing is a run of rotation samples turning at least SWING_MIN_DPS for at
+# least SWING_MIN_DURATION_MS; a strike starting within the swing or up to
+# SWING_STRIKE_WINDOW_MS after it is counted as the swing's hit.
+SWING_MIN_DPS = 180.0
+SWING_MIN_DURATION_MS = 100
+SWING_STRIKE_WINDOW_MS = 150
+# Heart-rate readings further apart than HR_GAP_MS are a gap: no heart rate is
+# assumed between them. A strike's HR delta is the heart rate
+# STRIKE_HR_WINDOW_MS after the strike minus the heart rate at the strike.
+HR_GAP_MS = 5000
+STRIKE_HR_WINDOW_MS = 10000
+# Bump when the analysis code changes its output for the same parameters.
+ANALYSIS_CODE_VERSION = 4
+
+# Vectorized engine used by the column functions; None means the pure-Python loops.
+_engine = None
+
+# Below this many samples (live batches) the array setup costs more than the loop.
+ENGINE_MIN_BATCH = 64
+
+def set_backend(name):
+    """
+    Selects the analysis backend: "numpy" or "python". Returns the active name.
+    """
+    global _engine
+    if name == "numpy":
+        if analysis_numpy is None:
+            raise ValueError("NumPy backend requested but NumPy is not installed")
+        _engine = analysis_numpy
+    elif name == "python":
+        _engine = None
+    else:
+        raise ValueError(f"Unknown analysis backend: {name!r}")
+    return name
+
+def get_backend():
+    return "numpy" if _engine is not None else "python"
+
+set_backend(os.environ.get("SENSOR_ANALYSIS_BACKEND") or ("numpy" if analysis_numpy else "python"))
+
+def analysis_params():
+    """
+    The parameters the analysis results depend on.
+    """
+    return {
+        "code": ANALYSIS_CODE_VERSION,
+        "hr_zone_bounds": list(HR_ZONE_BOUNDS),
+        "strike_threshold": STRIKE_THRESHOLD,
+        "strike_min_dist_ms": STRIKE_MIN_DIST_MS,
+        "swing_min_dps": SWING_MIN_DPS,
+        "swing_min_duration_ms": SWING_MIN_DURATION_MS,
+        "swing_strike_window_ms": SWING_STRIKE_WINDOW_MS,
+        "hr_gap_ms": HR_GAP_MS,
+        "strike_hr_window_ms": STRIKE_HR_WINDOW_MS,
+        "rhythm": rhythm.rhythm_params(),
+    }
+
+def analysis_version():
+    """
+    Short fingerprint of analysis_params(); stored results with another version are stale.
+    """
+    blob = json.dumps(analysis_params(), sort_keys=True).encode("utf-8")
+    return hashlib.sha1(blob).hexdigest()[:12]
+
+def hr_zone_labels():
+    """
+    Zone names with their bpm ranges, e.g. "Fat Burn (100-130)".
+    """
+    bounds = HR_ZONE_BOUNDS
+    labels = [f"{HR_ZONE_NAMES[0]} (<{bounds[0]})"]
+    labels += [f"{name} ({lo}-{hi})" for name, lo, hi in zip(HR_ZONE_NAMES[1:], bounds, bounds[1:])]
+    labels.append(f"{HR_ZONE_NAMES[len(bounds)]} (>{bounds[-1]})")
+    return labels
+
 def calculate_hr_zones(hr_values):
     """
     Calculates time spent in different HR zones.
-    Zones:
+    Zones (with the default HR_ZONE_BOUNDS):
     - Resting/Warm Up: < 100 bpm
     - Fat Burn: 100 - 130 bpm
     - Cardio: 130 - 150 bpm
     - Peak: > 150 bpm
     """
-    zones = {
-        "Resting/Warm Up (<100)": 0,
-        "Fat Burn (100-130)": 0,
-        "Cardio (130-150)": 0,
-        "Peak (>150)": 0
-    }
-    
+    labels = hr_zone_labels()
+
     if not hr_values:
-        return zones
+        return dict.fromkeys(labels, 0)
+
+    if _engine is not None:
+        return dict(zip(labels, _engine.hr_zone_counts(hr_values, HR_ZONE_BOUNDS)))
 
+    counts = [0] * len(labels)
     for bpm in hr_values:
-        if bpm < 100:
-            zones["Resting/Warm Up (<100)"] += 1
-        elif bpm < 130:
-            zones["Fat Burn (100-130)"] += 1
-        elif bpm < 150:
-            zones["Cardio (130-150)"] += 1
-        else:
-            zones["Peak (>150)"] += 1
-            
-    return zones
+        # NaN compares false with every bound and lands in the last zone.
+        counts[bisect_right(HR_ZONE_BOUNDS, bpm)] += 1
+    return dict(zip(labels, counts))
 
-def calculate_movement_intensity(imu_rows):
+def _magnitudes(ax, ay, az):
+    sqrt = math.sqrt
+    return (sqrt(x*x + y*y + z*z) for x, y, z in zip(ax, ay, az))
+
+def _columns_from_rows(imu_rows):
     """
-    Calculates statistics on movement intensity using accelerometer vector magnitude.
+    Transposes [t, ax, ay, az, ...] rows into t/ax/ay/az columns.
+    Rows with unparsable acceleration are dropped; an unparsable t becomes NaN.
     """
-    if not imu_rows:
-        return {"avg_intensity": 0.0, "max_intensity": 0.0}
-
-    intensities = []
+    t_col, ax_col, ay_col, az_col = array("d"), array("d"), array("d"), array("d")
     for row in imu_rows:
-        # row format: [t, ax, ay, az, gx, gy, gz]
-        # We use ax, ay, az which are at indices 1, 2, 3
         try:
             ax = float(row[1])
             ay = float(row[2])
             az = float(row[3])
-            magnitude = math.sqrt(ax*ax + ay*ay + az*az)
-            intensities.append(magnitude)
-        except (ValueError, IndexError):
+        except (TypeError, ValueError, IndexError):
             continue
+        try:
+            t = float(row[0])
+        except (TypeError, ValueError):
+            t = NAN
+        t_col.append(t)
+        ax_col.append(ax)
+        ay_col.append(ay)
+        az_col.append(az)
+    return t_col, ax_col, ay_col, az_col
+
+def heart_rate_stats(bpm_values):
+    """
+    Mean, max and count of the finite values of a bpm column.
+    """
+    values = finite_values(bpm_values)
+    if not values:
+        return {"mean": None, "max": None, "count": 0}
+    return {"mean": sum(values) / float(len(values)), "max": max(values), "count": len(values)}
+
+def finite_magnitudes(ax, ay, az):
+    """
+    Accelerometer magnitudes of the samples with no NaN axis, as a list.
+    """
+    if _engine is not None:
+        mags = _engine.magnitudes(ax, ay, az)
+        return mags[mags == mags].tolist()
+    return [m for m in _magnitudes(ax, ay, az) if m == m]
+
+def magnitude_column(ax, ay, az):
+    """
+    Accelerometer magnitude of every sample as an array('d'); NaN where an axis is NaN.
+    """
+    if _engine is not None:
+        return array("d", _engine.magnitudes(ax, ay, az).tobytes())
+    return array("d", _magnitudes(ax, ay, az))
+
+def merge_buckets(mins, maxs, sums, counts, factor):
+    """
+    Merges consecutive groups of ``factor`` buckets (the last group may be
+    shorter) into one: min of mins and max of maxs ignoring NaN, summed sums
+    and counts. Returns four array('d') columns.
+    """
+    if _engine is not None and len(mins) >= ENGINE_MIN_BATCH:
+        return tuple(array("d", col.tobytes()) for col in _engine.merge_buckets(mins, maxs, sums, counts, factor))
+    out_min, out_max, out_sum, out_count = array("d"), array("d"), array("d"), array("d")
+    for i in range(0, len(mins), factor):
+        lo = [v for v in mins[i:i + factor] if v == v]
+        hi = [v for v in maxs[i:i + factor] if v == v]
+        out_min.append(min(lo) if lo else NAN)
+        out_max.append(max(hi) if hi else NAN)
+        out_sum.append(sum(sums[i:i + factor]))
+        out_count.append(sum(counts[i:i + factor]))
+    return out_min, out_max, out_sum, out_count
+
+def bucket_values(values, factor):
+    """
+    min, max, sum and finite count of consecutive groups of ``factor`` values,
+    as merge_buckets returns them.
+    """
+    if _engine is not None and len(values) >= ENGINE_MIN_BATCH:
+        return tuple(array("d", col.tobytes()) for col in _engine.bucket_values(values, factor))
+    sums = [v if v == v else 0.0 for v in values]
+    counts = [1.0 if v == v else 0.0 for v in values]
+    return merge_buckets(values, values, sums, counts, factor)
+
+def calculate_movement_intensity(imu_rows):
+    """
+    Calculates statistics on movement intensity using accelerometer vector magnitude.
+    """
+    _, ax, ay, az = _columns_from_rows(imu_rows)
+    return movement_intensity_from_columns(ax, ay, az)
+
+def movement_intensity_from_columns(ax, ay, az):
+    """
+    Column variant of calculate_movement_intensity. Samples with a NaN axis are skipped.
+    """
+    if _engine is not None:
+        return _engine.movement_intensity(ax, ay, az)
+
+    intensities = [m for m in _magnitudes(ax, ay, az) if m == m]
 
     if not intensities:
         return {"avg_intensity": 0.0, "max_intensity": 0.0}
@@ -64,8 +228,61 @@ def calculate_movement_intensity(imu_rows):
 
 def analyze_session(payload):
     """
-    Orchestrates the analysis. Extracts data from the payload, calls calculation functions,
-    and prints a formatted report to the console.
+    Orchestrates the analysis of a decoded payload dict. Prefer analyze_columns
+    when the payload has already been ingested.
+    """
+    analyze_columns(columns_from_payload(payload))
+
+def analyze_columns(session):
+    """
+    Runs the calculation functions over an ingested SessionColumns, prints a
+    formatted report to the console and returns the analysis_results dict.
+    """
+    hr = session.heart_rate
+    results = analysis_results(hr["bpm"], session.imu["t"], session.imu["ax"], session.imu["ay"], session.imu["az"], session.rotation, hr["t"])
+    print_report(results["heart_rate"], results["zones"], results["intensity"], results["strikes"], results["orientation"], results["alignment"])
+    return results
+
+def analysis_results(bpm, t_col, ax, ay, az, rotation=None, hr_t=None):
+    """
+    The full analysis of a session's columns as a JSON-serialisable dict:
+    heart rate stats and zones, movement intensity, the strike summary, the
+    strike list (``strike_times`` in ms, ``strike_forces`` in G), the
+    orientation summary of the ``rotation`` columns (t, x, y, z, w) with its
+    swings matched to the strikes, and, when the heart-rate timestamps
+    ``hr_t`` are given, the alignment of heart rate with the IMU stream.
+    ``rhythm`` (swing cadence and consistency) and ``hrv`` come from
+    server/rhythm.py. Sections without data are None.
+    """
+    # A 0 bpm reading means the sensor had no lock; leave it out of the report.
+    hr_values = [v for v in finite_values(bpm) if v]
+
+    intensity_stats = kendo_stats = None
+    forces, times = [], []
+    if len(ax):
+        intensity_stats = movement_intensity_from_columns(ax, ay, az)
+        scan_strikes(t_col, ax, ay, az, STRIKE_THRESHOLD, STRIKE_MIN_DIST_MS, forces, -STRIKE_MIN_DIST_MS, times)
+        kendo_stats = strike_summary(forces)
+
+    return {
+        "version": analysis_version(),
+        "params": analysis_params(),
+        "heart_rate": heart_rate_stats(hr_values) if hr_values else None,
+        "zones": calculate_hr_zones(hr_values) if hr_values else None,
+        "intensity": intensity_stats,
+        "strikes": kendo_stats,
+        "strike_times": [float(t) for t in times],
+        "strike_forces": [float(f) for f in forces],
+        "orientation": orientation_summary(rotation, times) if rotation and len(rotation["t"]) else None,
+        "alignment": alignment_summary(hr_t, bpm, t_col, ax, ay, az, times) if hr_values and hr_t is not None else None,
+        "rhythm": rhythm.rhythm_summary(t_col, ax, ay, az, times) if len(ax) else None,
+        "hrv": rhythm.hrv_summary(hr_t, bpm) if hr_values and hr_t is not None else None,
+    }
+
+def print_report(hr_stats, zones, intensity_stats, kendo_stats, orientation=None, alignment=None):
+    """
+    Logs the session report (INFO on sensor_server.analysis), with its headline
+    numbers as structured fields. A None section means the session had no data for it.
     """
     report_lines = []
     report_lines.append("\n" + "="*40)
@@ -73,70 +290,60 @@ def analyze_session(payload):
     report_lines.append("="*40)
 
     # 1. Heart Rate Analysis
-    hr_list = payload.get("heart_rates") or []
-    hr_values = []
-    for item in hr_list:
-        val = None
-        if isinstance(item, dict):
-            val = item.get("bpm") or item.get("value")
-        else:
-            val = item
-        
-        if val is not None:
-            try:
-                hr_values.append(float(val))
-            except ValueError:
-                # Skip invalid heart rate values that cannot be converted to float
-                pass
-
     report_lines.append(f"\n[Heart Rate Analysis]")
-    if hr_values:
-        avg_hr = sum(hr_values) / len(hr_values)
-        max_hr = max(hr_values)
-        report_lines.append(f"Average HR: {avg_hr:.1f} bpm")
-        report_lines.append(f"Max HR:     {max_hr:.1f} bpm")
+    if hr_stats:
+        report_lines.append(f"Average HR: {hr_stats['mean']:.1f} bpm")
+        report_lines.append(f"Max HR:     {hr_stats['max']:.1f} bpm")
         
-        zones = calculate_hr_zones(hr_values)
         report_lines.append("Time in Zones (samples):")
         for zone, count in zones.items():
             report_lines.append(f"  - {zone}: {count}")
+        if alignment:
+            report_lines.append("Time in Zones (elapsed):")
+            for zone, seconds in alignment["zone_seconds"].items():
+                report_lines.append(f"  - {zone}: {int(seconds // 60)}:{int(seconds % 60):02d}")
+            report_lines.append(f"HR Gaps:    {len(alignment['hr_gaps'])} ({alignment['hr_gap_s']:.0f} s)")
+            if alignment["avg_strike_hr_delta"] is not None:
+                report_lines.append(f"Avg HR change {STRIKE_HR_WINDOW_MS / 1000:g} s after a strike: {alignment['avg_strike_hr_delta']:+.1f} bpm")
     else:
         report_lines.append("No Heart Rate data available.")
 
     # 2. IMU & Kendo Analysis
-    imu_list = payload.get("imu") or []
-    imu_rows = []
-    for item in imu_list:
-        if isinstance(item, dict):
-            imu_rows.append([
-                item.get("t"),
-                item.get("ax"),
-                item.get("ay"),
-                item.get("az"),
-                item.get("gx"),
-                item.get("gy"),
-                item.get("gz"),
-            ])
-    
     report_lines.append(f"\n[Movement & Kendo Analysis]")
-    if imu_rows:
-        intensity_stats = calculate_movement_intensity(imu_rows)
+    if intensity_stats:
         report_lines.append(f"Average Intensity: {intensity_stats['avg_intensity']:.2f} G")
         report_lines.append(f"Max Intensity:     {intensity_stats['max_intensity']:.2f} G")
 
         # Kendo Stats
-        kendo_stats = detect_kendo_strikes(imu_rows)
         report_lines.append(f"Kendo Strikes:     {kendo_stats['strike_count']}")
         report_lines.append(f"Max Strike Force:  {kendo_stats['max_strike_force']:.2f} G")
         report_lines.append(f"Avg Strike Force:  {kendo_stats['avg_strike_force']:.2f} G")
     else:
         report_lines.append("No IMU data available.")
 
+    # 3. Orientation (only shown for sessions that sent rotation vectors)
+    if orientation:
+        report_lines.append(f"\n[Orientation & Swings]")
+        if orientation["max_angular_velocity"] is not None:
+            report_lines.append(f"Max Angular Velocity: {orientation['max_angular_velocity']:.0f} deg/s")
+        report_lines.append(f"Swings:               {orientation['swing_count']} ({orientation['swings_with_strike']} with a strike)")
+        if orientation["swing_count"]:
+            report_lines.append(f"Avg Swing Arc:        {orientation['avg_swing_arc']:.1f} deg")
+
     report_lines.append("\n" + "="*40 + "\n")
-    
-    print("\n".join(report_lines))
 
-def detect_kendo_strikes(imu_rows, threshold=2.0, min_dist_ms=200):
+    fields = {
+        "event": "session_report",
+        "heart_mean": hr_stats["mean"] if hr_stats else None,
+        "heart_max": hr_stats["max"] if hr_stats else None,
+        "avg_intensity": intensity_stats["avg_intensity"] if intensity_stats else None,
+        "strike_count": kendo_stats["strike_count"] if kendo_stats else None,
+        "max_strike_force": kendo_stats["max_strike_force"] if kendo_stats else None,
+        "swing_count": orientation["swing_count"] if orientation else None,
+    }
+    LOG.info("\n".join(report_lines), extra={"fields": fields})
+
+def detect_kendo_strikes(imu_rows, threshold=STRIKE_THRESHOLD, min_dist_ms=STRIKE_MIN_DIST_MS):
     """
     Detects sword strikes based on accelerometer peaks.
     
@@ -152,28 +359,18 @@ def detect_kendo_strikes(imu_rows, threshold=2.0, min_dist_ms=200):
             "avg_strike_force": float
         }
     """
+    t, ax, ay, az = _columns_from_rows(imu_rows)
+    return strikes_from_columns(t, ax, ay, az, threshold, min_dist_ms)
+
+def strikes_from_columns(t_col, ax, ay, az, threshold=STRIKE_THRESHOLD, min_dist_ms=STRIKE_MIN_DIST_MS):
+    """
+    Column variant of detect_kendo_strikes. Samples with a NaN timestamp or axis are skipped.
+    """
     strikes = []
-    last_strike_time = -min_dist_ms
-    
-    for row in imu_rows:
-        try:
-            t = float(row[0])
-            ax = float(row[1])
-            ay = float(row[2])
-            az = float(row[3])
-            magnitude = math.sqrt(ax*ax + ay*ay + az*az)
-            
-            if magnitude > threshold:
-                if (t - last_strike_time) > min_dist_ms:
-                    strikes.append(magnitude)
-                    last_strike_time = t
-                else:
-                    # If within window, check if this peak is higher (update the strike)
-                    if strikes and magnitude > strikes[-1]:
-                        strikes[-1] = magnitude
-        except (ValueError, IndexError):
-            continue
-            
+    scan_strikes(t_col, ax, ay, az, threshold, min_dist_ms, strikes, -min_dist_ms)
+    return strike_summary(strikes)
+
+def strike_summary(strikes):
     count = len(strikes)
     max_force = max(strikes) if strikes else 0.0
     avg_force = sum(strikes) / count if strikes else 0.0
@@ -184,3 +381,279 @@ def detect_kendo_strikes(imu_rows, threshold=2.0, min_dist_ms=200):
         "avg_strike_force": avg_force
     }
 
+def scan_strikes(t_col, ax, ay, az, threshold, min_dist_ms, strikes, last_strike_time, times=None):
+    """
+    Runs the debounced strike detection over one batch of samples, continuing
+    from an earlier batch: new peaks are appended to ``strikes`` (and their
+    start timestamps to ``times`` when given) and the last entry is raised if
+    the batch opens inside its debounce window. Returns the updated
+    last_strike_time.
+    """
+    if _engine is not None and len(t_col) >= ENGINE_MIN_BATCH:
+        last = _engine.strike_scan(t_col, ax, ay, az, threshold, min_dist_ms, strikes, last_strike_time, times)
+        if last is not None:
+            return last
+    return _strike_scan_py(t_col, ax, ay, az, threshold, min_dist_ms, strikes, last_strike_time, times)
+
+def _strike_scan_py(t_col, ax, ay, az, threshold, min_dist_ms, strikes, last_strike_time, times=None):
+    for t, magnitude in zip(t_col, _magnitudes(ax, ay, az)):
+        if t != t or magnitude != magnitude:
+            continue
+        if magnitude > threshold:
+            if (t - last_strike_time) > min_dist_ms:
+                strikes.append(magnitude)
+                if times is not None:
+                    times.append(t)
+                last_strike_time = t
+            else:
+                # If within window, check if this peak is higher (update the strike)
+                if strikes and magnitude > strikes[-1]:
+                    strikes[-1] = magnitude
+    return last_strike_time
+
+def normalize_quaternions(x, y, z, w):
+    """
+    Unit quaternions from the rotation_vectors columns, as four array('d')
+    columns. Zero-length (or NaN) quaternions become NaN.
+    """
+    if _engine is not None and len(x) >= ENGINE_MIN_BATCH:
+        return tuple(array("d", col.tobytes()) for col in _engine.normalize_quaternions(x, y, z, w))
+    out = (array("d"), array("d"), array("d"), array("d"))
+    put_x, put_y, put_z, put_w = (col.append for col in out)
+    sqrt = math.sqrt
+    for qx, qy, qz, qw in zip(x, y, z, w):
+        norm = sqrt(qx*qx + qy*qy + qz*qz + qw*qw)
+        if not norm > 0:
+            norm = NAN
+        put_x(qx / norm)
+        put_y(qy / norm)
+        put_z(qz / norm)
+        put_w(qw / norm)
+    return out
+
+def euler_angles(x, y, z, w):
+    """
+    Roll, pitch and yaw in degrees (ZYX order) of unit quaternions, as three array('d') columns.
+    """
+    if _engine is not None and len(x) >= ENGINE_MIN_BATCH:
+        return tuple(array("d", col.tobytes()) for col in _engine.euler_angles(x, y, z, w))
+    roll, pitch, yaw = array("d"), array("d"), array("d")
+    atan2, degrees = math.atan2, math.degrees
+    for qx, qy, qz, qw in zip(x, y, z, w):
+        roll.append(degrees(atan2(2.0 * (qw*qx + qy*qz), 1.0 - 2.0 * (qx*qx + qy*qy))))
+        pitch.append(_pitch(qx, qy, qz, qw))
+        yaw.append(degrees(atan2(2.0 * (qw*qz + qx*qy), 1.0 - 2.0 * (qy*qy + qz*qz))))
+    return roll, pitch, yaw
+
+def _pitch(qx, qy, qz, qw):
+    sin_pitch = 2.0 * (qw*qy - qz*qx)
+    if sin_pitch != sin_pitch:
+        return NAN
+    return math.degrees(math.asin(min(1.0, max(-1.0, sin_pitch))))
+
+def angular_velocity(t_col, x, y, z, w):
+    """
+    Rotation speed in degrees per second from the previous sample to each
+    sample, as an array('d'). The first sample, and any whose interval is
+    not positive, get NaN. The angle is that of the relative rotation, so q
+    and -q count as the same orientation.
+    """
+    if _engine is not None and len(t_col) >= ENGINE_MIN_BATCH:
+        return array("d", _engine.angular_velocity(t_col, x, y, z, w).tobytes())
+    out = array("d")
+    if not len(t_col):
+        return out
+    out.append(NAN)
+    atan2, sqrt, degrees = math.atan2, math.sqrt, math.degrees
+    samples = zip(t_col, x, y, z, w)
+    t1, x1, y1, z1, w1 = next(samples)
+    for t2, x2, y2, z2, w2 in samples:
+        dt = t2 - t1
+        if dt > 0:
+            # Vector part and |scalar part| of conj(q1) * q2.
+            rx = w1*x2 - w2*x1 - (y1*z2 - z1*y2)
+            ry = w1*y2 - w2*y1 - (z1*x2 - x1*z2)
+            rz = w1*z2 - w2*z1 - (x1*y2 - y1*x2)
+            rw = abs(w1*w2 + x1*x2 + y1*y2 + z1*z2)
+            out.append(degrees(2.0 * atan2(sqrt(rx*rx + ry*ry + rz*rz), rw)) * 1000.0 / dt)
+        else:
+            out.append(NAN)
+        t1, x1, y1, z1, w1 = t2, x2, y2, z2, w2
+    return out
+
+def _swing_runs(speeds, threshold):
+    """
+    (start, stop) index ranges of the runs of consecutive speeds >= threshold.
+    """
+    if _engine is not None and len(speeds) >= ENGINE_MIN_BATCH:
+        return _engine.threshold_runs(speeds, threshold)
+    runs, start = [], None
+    for i, speed in enumerate(speeds):
+        if speed >= threshold:
+            if start is None:
+                start = i
+        elif start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(speeds)))
+    return runs
+
+def detect_swings(t_col, x, y, z, w, speeds=None, min_dps=SWING_MIN_DPS, min_duration_ms=SWING_MIN_DURATION_MS):
+    """
+    Swings in unit-quaternion columns: runs of samples turning at least
+    ``min_dps`` that last at least ``min_duration_ms``. Each swing has its
+    ``start``/``end`` times (ms), ``arc`` (degrees turned), ``peak_velocity``
+    (deg/s) and ``pitch_delta`` (degrees, end minus start).
+    """
+    if speeds is None:
+        speeds = angular_velocity(t_col, x, y, z, w)
+    swings = []
+    for start, stop in _swing_runs(speeds, min_dps):
+        # A sample's speed covers the interval from the previous sample.
+        first, last = start - 1, stop - 1
+        duration = t_col[last] - t_col[first]
+        if not duration >= min_duration_ms:
+            continue
+        arc = sum(speeds[i] * (t_col[i] - t_col[i - 1]) for i in range(start, stop)) / 1000.0
+        swings.append({
+            "start": float(t_col[first]),
+            "end": float(t_col[last]),
+            "arc": arc,
+            "peak_velocity": max(speeds[start:stop]),
+            "pitch_delta": _pitch(x[last], y[last], z[last], w[last]) - _pitch(x[first], y[first], z[first], w[first]),
+        })
+    return swings
+
+def match_swings_to_strikes(swings, strike_times, window_ms=SWING_STRIKE_WINDOW_MS):
+    """
+    Sets each swing's ``strike`` to the index of the first strike starting
+    between the swing's start and ``window_ms`` after its end (None if there
+    is none). Both lists must be in time order.
+    """
+    k = 0
+    for swing in swings:
+        while k < len(strike_times) and strike_times[k] < swing["start"]:
+            k += 1
+        swing["strike"] = k if k < len(strike_times) and strike_times[k] <= swing["end"] + window_ms else None
+    return swings
+
+def orientation_summary(rotation, strike_times=None):
+    """
+    Orientation section of analysis_results for ``rotation`` columns (t, x,
+    y, z, w; quaternions need not be normalized): angular velocity stats,
+    the swings and how many of them line up with ``strike_times``.
+    """
+    x, y, z, w = normalize_quaternions(rotation["x"], rotation["y"], rotation["z"], rotation["w"])
+    t_col = rotation["t"]
+    speeds = angular_velocity(t_col, x, y, z, w)
+    finite = finite_values(speeds)
+    swings = match_swings_to_strikes(detect_swings(t_col, x, y, z, w, speeds), strike_times or [])
+    arcs = [s["arc"] for s in swings]
+    matched = [s["strike"] for s in swings if s["strike"] is not None]
+    return {
+        "samples": len(t_col),
+        "max_angular_velocity": max(finite) if finite else None,
+        "avg_angular_velocity": sum(finite) / len(finite) if finite else None,
+        "swing_count": len(swings),
+        "swings_with_strike": len(matched),
+        "strikes_with_swing": len(set(matched)),
+        "avg_swing_arc": sum(arcs) / len(arcs) if arcs else 0.0,
+        "max_swing_arc": max(arcs) if arcs else 0.0,
+        "swings": swings,
+    }
+
+def hr_timeline(t_col, bpm):
+    """
+    The heart-rate readings with a finite timestamp and a non-zero finite bpm,
+    in time order (stable for equal timestamps), as (t, bpm) array('d') columns.
+    """
+    if _engine is not None and len(t_col) >= ENGINE_MIN_BATCH:
+        return tuple(array("d", col.tobytes()) for col in _engine.hr_timeline(t_col, bpm))
+    readings = sorted(((t, b) for t, b in zip(t_col, bpm) if t == t and b == b and b), key=lambda r: r[0])
+    return array("d", (t for t, _ in readings)), array("d", (b for _, b in readings))
+
+def interpolate_hr(hr_t, hr_bpm, query_t, gap_ms=HR_GAP_MS):
+    """
+    Heart rate at each of ``query_t`` (any order) from an hr_timeline, as an
+    array('d'): linear between the two readings around it, NaN before the
+    first reading, after the last one and inside a gap (readings more than
+    ``gap_ms`` apart).
+    """
+    if _engine is not None and len(query_t) >= ENGINE_MIN_BATCH:
+        return array("d", _engine.interpolate_hr(hr_t, hr_bpm, query_t, gap_ms).tobytes())
+    out = array("d")
+    n = len(hr_t)
+    for q in query_t:
+        i = bisect_right(hr_t, q)
+        if i == n:
+            out.append(hr_bpm[-1] if n and q == hr_t[-1] else NAN)
+        elif i == 0 or hr_t[i] - hr_t[i - 1] > gap_ms:
+            out.append(NAN)
+        else:
+            t0, b0 = hr_t[i - 1], hr_bpm[i - 1]
+            out.append(b0 + (hr_bpm[i] - b0) * (q - t0) / (hr_t[i] - t0))
+    return out
+
+def hr_zone_seconds(hr_t, hr_bpm, gap_ms=HR_GAP_MS):
+    """
+    Elapsed seconds per HR zone from an hr_timeline: each reading holds until
+    the next one. Intervals longer than ``gap_ms`` are gaps and count for no
+    zone. Returns (seconds per zone label, gaps as {"start", "end"} in ms).
+    """
+    labels = hr_zone_labels()
+    if _engine is not None and len(hr_t) >= ENGINE_MIN_BATCH:
+        ms, starts, ends = _engine.hr_zone_ms(hr_t, hr_bpm, HR_ZONE_BOUNDS, gap_ms)
+        gaps = [{"start": s, "end": e} for s, e in zip(starts, ends)]
+    else:
+        ms, gaps = [0.0] * len(labels), []
+        for i in range(1, len(hr_t)):
+            dt = hr_t[i] - hr_t[i - 1]
+            if dt <= gap_ms:
+                ms[bisect_right(HR_ZONE_BOUNDS, hr_bpm[i - 1])] += dt
+            else:
+                gaps.append({"start": hr_t[i - 1], "end": hr_t[i]})
+    return dict(zip(labels, (v / 1000.0 for v in ms))), gaps
+
+def intensity_by_zone(hr_at_imu, ax, ay, az):
+    """
+    Mean accelerometer magnitude (G) per HR zone, given the heart rate at
+    every IMU sample (interpolate_hr). Samples without a heart rate or with a
+    NaN axis are skipped; zones without samples get None.
+    """
+    if _engine is not None and len(ax) >= ENGINE_MIN_BATCH:
+        sums, counts = _engine.zone_sums(_engine.magnitudes(ax, ay, az), hr_at_imu, HR_ZONE_BOUNDS)
+    else:
+        sums, counts = [0.0] * (len(HR_ZONE_BOUNDS) + 1), [0] * (len(HR_ZONE_BOUNDS) + 1)
+        for bpm, magnitude in zip(hr_at_imu, _magnitudes(ax, ay, az)):
+            if bpm == bpm and magnitude == magnitude:
+                zone = bisect_right(HR_ZONE_BOUNDS, bpm)
+                sums[zone] += magnitude
+                counts[zone] += 1
+    return dict(zip(hr_zone_labels(), (s / c if c else None for s, c in zip(sums, counts))))
+
+def alignment_summary(hr_t, bpm, t_col, ax, ay, az, strike_times):
+    """
+    Alignment section of analysis_results: heart rate and IMU on one
+    timeline. Time in zones weighted by elapsed time, the gaps in the
+    heart-rate stream, mean movement intensity per zone, and per strike the
+    heart rate at the strike (``strike_bpm``) and its change
+    STRIKE_HR_WINDOW_MS later (``strike_hr_delta``), None where either falls
+    outside the heart-rate coverage.
+    """
+    hr_t, hr_bpm = hr_timeline(hr_t, bpm)
+    zone_seconds, gaps = hr_zone_seconds(hr_t, hr_bpm)
+    at_strike = interpolate_hr(hr_t, hr_bpm, strike_times)
+    later = interpolate_hr(hr_t, hr_bpm, [t + STRIKE_HR_WINDOW_MS for t in strike_times])
+    deltas = [b - a for a, b in zip(at_strike, later)]
+    finite = finite_values(deltas)
+    return {
+        "hr_covered_s": sum(zone_seconds.values()),
+        "hr_gap_s": sum(g["end"] - g["start"] for g in gaps) / 1000.0,
+        "hr_gaps": gaps,
+        "zone_seconds": zone_seconds,
+        "intensity_by_zone": intensity_by_zone(interpolate_hr(hr_t, hr_bpm, t_col), ax, ay, az) if len(ax) else None,
+        "strike_bpm": [b if b == b else None for b in at_strike],
+        "strike_hr_delta": [d if d == d else None for d in deltas],
+        "avg_strike_hr_delta": sum(finite) / len(finite) if finite else None,
+    }
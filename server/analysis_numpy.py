@@ -0,0 +1,246 @@
+"""
+NumPy engine for server.analysis and server.rhythm.
+
+Each function mirrors a pure-Python column function in analysis.py (or
+rhythm.py) and returns exactly the same values: magnitudes use the same
+operation order, and sums go through the builtin ``sum`` or an in-order
+``bincount`` so results do not depend on NumPy's pairwise summation. The
+quaternion functions and the rhythm spectra use NumPy's trigonometry, FFT
+and means, which can differ from ``math`` in the last bits, so their results
+agree to rounding. Importing this module raises ImportError when NumPy is
+missing.
+"""
+from array import array
+
+import numpy as np
+
+
+def as_float_array(col) -> np.ndarray:
+    if isinstance(col, array) and col.typecode == "d":
+        return np.frombuffer(col, dtype=np.float64) if len(col) else np.empty(0)
+    return np.asarray(col, dtype=np.float64)
+
+
+def magnitudes(ax, ay, az) -> np.ndarray:
+    x, y, z = as_float_array(ax), as_float_array(ay), as_float_array(az)
+    return np.sqrt(x*x + y*y + z*z)
+
+
+def movement_intensity(ax, ay, az):
+    mags = magnitudes(ax, ay, az)
+    mags = mags[~np.isnan(mags)]
+    if not mags.size:
+        return {"avg_intensity": 0.0, "max_intensity": 0.0}
+    return {
+        "avg_intensity": sum(mags.tolist()) / mags.size,
+        "max_intensity": float(mags.max()),
+    }
+
+
+def hr_zone_counts(hr_values, bounds) -> list:
+    """Sample counts per zone; NaN lands in the last zone like the Python loop."""
+    values = as_float_array(hr_values)
+    if not values.size:
+        return [0] * (len(bounds) + 1)
+    idx = np.digitize(values, bounds)
+    return np.bincount(idx, minlength=len(bounds) + 1).tolist()
+
+
+def merge_buckets(mins, maxs, sums, counts, factor):
+    """Group-of-``factor`` reduction; sums are accumulated left to right like ``sum``."""
+    n = len(mins)
+    groups = -(-n // factor)
+    pad = groups * factor - n
+
+    def grid(col, fill):
+        a = as_float_array(col)
+        if pad:
+            a = np.concatenate([a, np.full(pad, fill)])
+        return a.reshape(groups, factor)
+
+    lo = np.fmin.reduce(grid(mins, np.nan), axis=1)
+    hi = np.fmax.reduce(grid(maxs, np.nan), axis=1)
+    s, c = grid(sums, 0.0), grid(counts, 0.0)
+    total, count = np.zeros(groups), np.zeros(groups)
+    for j in range(factor):
+        total += s[:, j]
+        count += c[:, j]
+    return lo, hi, total, count
+
+
+def bucket_values(values, factor):
+    v = as_float_array(values)
+    finite = v == v
+    return merge_buckets(v, v, np.where(finite, v, 0.0), finite.astype(np.float64), factor)
+
+
+def strike_scan(t_col, ax, ay, az, threshold, min_dist_ms, strikes, last, times=None):
+    """
+    Debounced strike detection over one batch, continuing from ``strikes`` and
+    ``last`` (the previous start time). Appends the new peaks (and their start
+    times to ``times`` when given) and returns the new ``last``, or None without touching ``strikes`` when timestamps are not
+    sorted (the caller then falls back to the sequential loop).
+
+    A strike starts at the first above-threshold sample more than min_dist_ms
+    after the previous start; its force is the max over the above-threshold
+    samples up to the next start.
+    """
+    t = as_float_array(t_col)
+    mags = magnitudes(ax, ay, az)
+    above = np.flatnonzero((mags > threshold) & ~np.isnan(t))
+    if not above.size:
+        return last
+    ts = t[above]
+    peaks = mags[above]
+    if ts.size > 1 and np.any(ts[1:] < ts[:-1]):
+        return None
+
+    n = ts.size
+    starts = []
+    pos = 0
+    while pos < n:
+        # The start condition (t - last) > min_dist_ms is monotonic in t, so
+        # searchsorted gives a candidate that is nudged onto the exact boundary.
+        j = max(pos, int(np.searchsorted(ts, last + min_dist_ms, side="right")))
+        while j > pos and (ts[j - 1] - last) > min_dist_ms:
+            j -= 1
+        while j < n and not (ts[j] - last) > min_dist_ms:
+            j += 1
+        if j >= n:
+            break
+        starts.append(j)
+        last = float(ts[j])
+        pos = j + 1
+
+    # Samples before the first new start still belong to the previous strike.
+    lead = starts[0] if starts else n
+    if strikes and lead:
+        strikes[-1] = max(strikes[-1], float(peaks[:lead].max()))
+    if starts:
+        strikes.extend(np.maximum.reduceat(peaks, starts).tolist())
+        if times is not None:
+            times.extend(ts[starts].tolist())
+    return last
+
+
+def normalize_quaternions(x, y, z, w):
+    qx, qy, qz, qw = (as_float_array(c) for c in (x, y, z, w))
+    norm = np.sqrt(qx*qx + qy*qy + qz*qz + qw*qw)
+    norm[~(norm > 0)] = np.nan
+    return qx / norm, qy / norm, qz / norm, qw / norm
+
+
+def euler_angles(x, y, z, w):
+    """Roll, pitch, yaw in degrees. Trigonometry may differ from ``math`` in the last bit."""
+    qx, qy, qz, qw = (as_float_array(c) for c in (x, y, z, w))
+    roll = np.degrees(np.arctan2(2.0 * (qw*qx + qy*qz), 1.0 - 2.0 * (qx*qx + qy*qy)))
+    pitch = np.degrees(np.arcsin(np.clip(2.0 * (qw*qy - qz*qx), -1.0, 1.0)))
+    yaw = np.degrees(np.arctan2(2.0 * (qw*qz + qx*qy), 1.0 - 2.0 * (qy*qy + qz*qz)))
+    return roll, pitch, yaw
+
+
+def angular_velocity(t_col, x, y, z, w):
+    """Degrees per second from the previous sample (NaN first and where dt <= 0)."""
+    t, qx, qy, qz, qw = (as_float_array(c) for c in (t_col, x, y, z, w))
+    out = np.full(t.size, np.nan)
+    if t.size < 2:
+        return out
+    x1, y1, z1, w1 = qx[:-1], qy[:-1], qz[:-1], qw[:-1]
+    x2, y2, z2, w2 = qx[1:], qy[1:], qz[1:], qw[1:]
+    rx = w1*x2 - w2*x1 - (y1*z2 - z1*y2)
+    ry = w1*y2 - w2*y1 - (z1*x2 - x1*z2)
+    rz = w1*z2 - w2*z1 - (x1*y2 - y1*x2)
+    rw = np.abs(w1*w2 + x1*x2 + y1*y2 + z1*z2)
+    dt = t[1:] - t[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.degrees(2.0 * np.arctan2(np.sqrt(rx*rx + ry*ry + rz*rz), rw)) * 1000.0 / dt
+    out[1:] = np.where(dt > 0, speed, np.nan)
+    return out
+
+
+def threshold_runs(values, threshold) -> list:
+    """(start, stop) index ranges of consecutive values >= threshold."""
+    v = as_float_array(values)
+    with np.errstate(invalid="ignore"):
+        above = np.concatenate(([0], (v >= threshold).astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(above))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def hr_timeline(t_col, bpm):
+    t, b = as_float_array(t_col), as_float_array(bpm)
+    keep = (t == t) & (b == b) & (b != 0)
+    t, b = t[keep], b[keep]
+    order = np.argsort(t, kind="stable")
+    return t[order], b[order]
+
+
+def interpolate_hr(hr_t, hr_bpm, query_t, gap_ms) -> np.ndarray:
+    """Same interpolation formula as the loop; one searchsorted over the sorted readings."""
+    t, b, q = as_float_array(hr_t), as_float_array(hr_bpm), as_float_array(query_t)
+    out = np.full(q.size, np.nan)
+    if not t.size:
+        return out
+    i = np.searchsorted(t, q, side="right")
+    inner = (i > 0) & (i < t.size)
+    j = i[inner]
+    t0, t1, b0 = t[j - 1], t[j], b[j - 1]
+    values = b0 + (b[j] - b0) * (q[inner] - t0) / (t1 - t0)
+    out[inner] = np.where(t1 - t0 <= gap_ms, values, np.nan)
+    out[q == t[-1]] = b[-1]
+    return out
+
+
+def hr_zone_ms(hr_t, hr_bpm, bounds, gap_ms):
+    """Milliseconds per zone (bincount adds the weights in order, like the loop) and the gap start/end lists."""
+    t, b = as_float_array(hr_t), as_float_array(hr_bpm)
+    dt = np.diff(t)
+    held = dt <= gap_ms
+    zones = np.digitize(b[:-1][held], bounds)
+    ms = np.bincount(zones, weights=dt[held], minlength=len(bounds) + 1)
+    return ms.tolist(), t[:-1][~held].tolist(), t[1:][~held].tolist()
+
+
+def zone_sums(values, hr, bounds):
+    """Sums and counts of ``values`` per HR zone, skipping NaN in either column."""
+    v, h = as_float_array(values), as_float_array(hr)
+    keep = (v == v) & (h == h)
+    zones = np.digitize(h[keep], bounds)
+    sums = np.bincount(zones, weights=v[keep], minlength=len(bounds) + 1)
+    counts = np.bincount(zones, minlength=len(bounds) + 1)
+    return sums.tolist(), counts.tolist()
+
+
+def grid_means(t_col, values, step):
+    """(t0, means) of ``values`` per ``step``-ms bin from the first finite time; bincount sums in order like the loop."""
+    t, v = as_float_array(t_col), as_float_array(values)
+    finite = t[t == t]
+    if not finite.size:
+        return None, []
+    t0 = float(finite.min())
+    size = int((float(finite.max()) - t0) // step) + 1
+    keep = (t == t) & (v == v)
+    idx = ((t[keep] - t0) // step).astype(np.intp)
+    sums = np.bincount(idx, weights=v[keep], minlength=size)
+    counts = np.bincount(idx, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return t0, np.where(counts > 0, sums / counts, np.nan).tolist()
+
+
+def band_powers(grid, window, hop, lo, hi):
+    """
+    Power in bins lo..hi of every Hann-windowed, mean-removed window and the
+    window stds, like rhythm.band_powers. The windows are a strided view of
+    the grid; the only copies are the centered frames and their spectra.
+    """
+    g = as_float_array(grid)
+    if g.size < window:
+        return [], []
+    frames = np.lib.stride_tricks.sliding_window_view(g, window)[::hop]
+    centered = frames - frames.mean(axis=1, keepdims=True)
+    stds = np.sqrt((centered * centered).mean(axis=1))
+    centered *= 0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(window) / window)
+    spectrum = np.fft.rfft(centered, axis=1)[:, lo:hi + 1]
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    rows = [row if std == std else None for row, std in zip(power.tolist(), stds.tolist())]
+    return rows, stds.tolist()
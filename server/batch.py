@@ -0,0 +1,180 @@
+"""
+Batch uploads for syncing sessions recorded while the watch was offline.
+
+``POST /sessions/batch`` takes a JSON array of /end bodies, or NDJSON with
+one /end body per line (read line by line from the socket). A session is
+identified by the SHA-256 of its bytes: the line as sent for NDJSON, the
+compact re-encoding of the array element for JSON. The hash is stored in
+``sessions.content_sha256`` under a unique index. A session already stored
+(by an earlier batch, or by an /end with the same body) is answered with
+``duplicate`` and nothing is written, so a client can resend a whole batch
+after a timeout.
+
+The raw and processed files of all sessions are written first, as one group
+commit under SENSOR_DURABILITY=group, and then all rows go in with one
+transaction. With the ingest queue enabled, only the raw files and
+``queued`` rows are written in the request, like /end.
+"""
+from pathlib import Path
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+
+from . import durable, jsoncodec, series
+from .db import connection, transaction
+from .ingest import columns_from_payload, parse_payload
+from .metrics import timed
+from .storage import content_hash, insert_row, process_raw_payload, write_raw_payload
+
+LOG = logging.getLogger("sensor_server.batch")
+
+# Sessions accepted per request; the rest of a longer batch is answered with an error.
+MAX_SESSIONS = 200
+
+
+class BatchError(ValueError):
+    """A batch that cannot be taken at all; ``status`` is the HTTP code."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def ndjson_items(lines: Iterable[bytes]) -> Iterator[Tuple[bytes, Callable[[], Tuple[bool, Any]]]]:
+    """``(raw bytes, parse)`` per non-blank NDJSON line; ``parse()`` returns what parse_payload does."""
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield line, partial(parse_payload, line)
+
+
+def json_items(raw: bytes, max_sessions: int = MAX_SESSIONS) -> Iterator[Tuple[Optional[bytes], Callable[[], Tuple[bool, Any]]]]:
+    """``(re-encoded bytes, parse)`` per element of a JSON array body. Raises BatchError for anything else."""
+    try:
+        payloads = jsoncodec.loads(raw)
+    except Exception as exc:
+        raise BatchError(f"Invalid JSON: {exc}")
+    if not isinstance(payloads, list):
+        raise BatchError("Invalid JSON: a batch must be an array of sessions")
+    if len(payloads) > max_sessions:
+        raise BatchError(f"Too many sessions: {len(payloads)} > {max_sessions}", 413)
+    return _decoded_items(payloads)
+
+
+def _columns(payload: Dict[str, Any]) -> Tuple[bool, Any]:
+    try:
+        return True, columns_from_payload(payload, keep_payload=False)
+    except ValueError as exc:
+        return False, f"Invalid payload: {exc}"
+
+
+def _decoded_items(payloads: list) -> Iterator[Tuple[Optional[bytes], Callable[[], Tuple[bool, Any]]]]:
+    for i, payload in enumerate(payloads):
+        payloads[i] = None  # the columns replace it
+        if not isinstance(payload, dict):
+            yield None, lambda: (False, "Invalid JSON: session must be an object")
+            continue
+        yield jsoncodec.dumps_bytes(payload), partial(_columns, payload)
+
+
+def _remove_files(directory: Path, raw_filename: str, info: Dict[str, Any]) -> None:
+    paths = [directory / "raw_data" / raw_filename]
+    processed = info.get("processed") or {}
+    for name in (processed.get(stream) for stream in ("imu", "heart_rate", "rotation")):
+        if name:
+            paths += [directory / "processed_data" / name, directory / "processed_data" / series.lod_filename(name)]
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+def save_batch(directory: Path, items: Iterable[Tuple[Optional[bytes], Callable[[], Tuple[bool, Any]]]], queue, max_sessions: int = MAX_SESSIONS) -> List[Dict[str, Any]]:
+    """Store every new session of ``items`` and return one result dict per item.
+
+    ``status`` is ``created`` (processed and stored), ``queued`` (left to
+    ``queue``), ``duplicate``, ``invalid`` or ``failed``. Raises BatchError
+    when the files or the rows could not be committed; nothing is kept then.
+    """
+    db_path = directory / "sessions.db"
+    results: List[Dict[str, Any]] = []
+    pending = []  # (result, raw filename, info, row status, session for the queue)
+    first: Dict[str, Dict[str, Any]] = {}  # content hash -> result of its first copy in this batch
+    copies = []  # (result, result of the first copy)
+    try:
+        with connection(db_path) as conn, durable.batch():
+            for index, (raw, parse) in enumerate(items):
+                result: Dict[str, Any] = {"index": index}
+                results.append(result)
+                if index >= max_sessions:
+                    result.update(status="invalid", error=f"Over the limit of {max_sessions} sessions per batch")
+                    continue
+                # Duplicates are answered before parsing, which makes a retried batch cheap.
+                digest = content_hash(raw) if raw is not None else None
+                if digest in first:
+                    result["status"] = "duplicate"
+                    copies.append((result, first[digest]))
+                    continue
+                row = conn.execute("SELECT id FROM sessions WHERE content_sha256 = ?", (digest,)).fetchone() if digest else None
+                if row is not None:
+                    result.update(status="duplicate", session_id=row["id"])
+                    continue
+                ok, session = parse()
+                if not ok:
+                    result.update(status="invalid", error=session)
+                    continue
+                first[digest] = result
+
+                timings: Dict[str, float] = {}
+                with timed("raw_write", timings):
+                    ok, fname = write_raw_payload(directory, raw, session.device_id)
+                if not ok:
+                    result.update(status="failed", error=fname)
+                    continue
+                result["raw"] = fname
+                info = {"timings": timings, "content_sha256": digest}
+                if queue.is_async:
+                    result["status"] = "queued"
+                    pending.append((result, fname, info, "queued", session))
+                    continue
+                ok, processed = process_raw_payload(directory, fname, session, queue.processed_format)
+                if ok:
+                    processed["timings"] = {**timings, **processed["timings"]}
+                    result["status"] = "created"
+                    pending.append((result, fname, {**processed, "content_sha256": digest}, "done", None))
+                else:
+                    # Recorded without the hash, so that sending the session again retries it.
+                    result.update(status="failed", error=processed.get("error"))
+                    pending.append((result, fname, {"timings": timings}, "failed", None))
+    except OSError as exc:
+        for _, fname, info, _, _ in pending:
+            _remove_files(directory, fname, info)
+        raise BatchError(f"Failed to commit files: {exc}", 500)
+
+    raced = []
+    try:
+        with timed("db"), transaction(db_path) as conn:
+            for result, fname, info, status, _ in pending:
+                session_id = insert_row(conn, fname, info, status, skip_duplicate=True)
+                if session_id is None:
+                    # Stored by a concurrent request since the check above.
+                    row = conn.execute("SELECT id FROM sessions WHERE content_sha256 = ?", (info["content_sha256"],)).fetchone()
+                    result.update(status="duplicate", session_id=row["id"] if row else None)
+                    del result["raw"]
+                    raced.append((fname, info))
+                    continue
+                result["session_id"] = session_id
+                if status == "failed":
+                    conn.execute("UPDATE sessions SET error = ? WHERE id = ?", (result["error"], session_id))
+    except Exception as exc:
+        LOG.exception("Failed to insert batch rows into %s", db_path)
+        for _, fname, info, _, _ in pending:
+            _remove_files(directory, fname, info)
+        raise BatchError(f"Failed to record sessions: {exc}", 500)
+
+    for fname, info in raced:
+        _remove_files(directory, fname, info)
+    for result, original in copies:
+        result["session_id"] = original.get("session_id")
+    for result, fname, _, status, session in pending:
+        if status == "queued" and result["status"] == "queued":
+            queue.submit(result["session_id"], fname, session)
+    return results
@@ -0,0 +1,475 @@
+"""
+Chunked uploads for long sessions.
+
+``POST /session/start`` opens an upload, ``POST /session/<id>/chunk`` appends
+samples (a JSON object shaped like an /end body, or NDJSON) and
+``POST /session/<id>/end`` finishes it. Every chunk is appended to per-column
+spool files in ``data/spool/<id>/`` and to the session's raw NDJSON log in
+raw_data, and folded into running aggregates kept in ``state.json`` next to
+the spool. Finishing stitches the spool into the processed files block by
+block, so no request ever holds more than one chunk in memory.
+
+A chunk is all-or-nothing: the state file records how many rows and raw bytes
+were committed, and anything past that (a failed or interrupted chunk) is
+truncated away before the next one is applied. An optional ``seq`` number per
+chunk makes client retries idempotent.
+"""
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import fcntl
+import json
+import logging
+import os
+import shutil
+
+from . import columnar, durable, rawstore, series
+from .analysis import orientation_summary, print_report
+from .metrics import timed
+from .ingest import (
+    HR_FIELDS,
+    IMU_FIELDS,
+    ROTATION_FIELDS,
+    STREAM_FIELDS,
+    SessionColumns,
+    device_id,
+    ndjson_batches,
+    normalize_meta,
+    optional_float,
+    parse_payload,
+)
+from .storage import (
+    DEFAULT_PROCESSED_FORMAT,
+    PROCESSED_FORMATS,
+    STREAM_DTYPES,
+    _write_csv_rows,
+    _csv_column,
+    insert_session,
+    prepare_rotation,
+    raw_filename_for,
+    session_stats_from_parts,
+    update_session,
+    write_processed,
+)
+from .streaming import ColumnSpan, HeartRateAggregator, IntensityAggregator, StrikeDetector
+
+LOG = logging.getLogger("sensor_server.chunked")
+
+SPOOL_DIR = "spool"
+STATE_FILE = "state.json"
+LOCK_FILE = "lock"
+RECEIVING = "receiving"
+SPOOL_STREAMS = {"imu": IMU_FIELDS, "heart_rate": HR_FIELDS, "rotation": ROTATION_FIELDS}
+# Streams stitched from the spool block by block; rotation is normalized in memory when the upload finishes.
+COPIED_STREAMS = ("imu", "heart_rate")
+
+
+class UploadError(ValueError):
+    """A chunked-upload request that cannot be applied; ``status`` is the HTTP code."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def _spool_dir(directory: Path, session_id: int) -> Path:
+    return directory / SPOOL_DIR / str(session_id)
+
+
+def _spool_file(spool: Path, stream: str, name: str) -> Path:
+    return spool / f"{stream}_{name}.f8"
+
+
+def _new_state(raw_filename: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "raw": raw_filename,
+        "raw_bytes": 0,
+        "next_seq": 0,
+        "meta": normalize_meta(meta),
+        "imu": ColumnSpan().state(),
+        "heart_rate": ColumnSpan().state(),
+        "rotation": ColumnSpan().state(),
+        "hr": HeartRateAggregator().state(),
+        "hr_report": HeartRateAggregator(skip_zero=True).state(),
+        "intensity": IntensityAggregator().state(),
+        "strikes": StrikeDetector().state(),
+        "dropped": {stream: 0 for stream in STREAM_FIELDS},
+    }
+
+
+def _write_state(spool: Path, state: Dict[str, Any]) -> None:
+    tmp = spool / (STATE_FILE + ".tmp")
+    with tmp.open("w", encoding="utf-8") as fh:
+        json.dump(state, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, spool / STATE_FILE)
+
+
+@contextmanager
+def _locked_upload(directory: Path, session_id: int) -> Iterator[Tuple[Path, Dict[str, Any]]]:
+    """Hold the upload's lock and yield ``(spool dir, committed state)``."""
+    spool = _spool_dir(directory, session_id)
+    if not (spool / STATE_FILE).exists():
+        raise UploadError(f"No open upload for session {session_id}", 404)
+    with (spool / LOCK_FILE).open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not (spool / STATE_FILE).exists():
+                # Finished by a concurrent /end while we waited for the lock.
+                raise UploadError(f"No open upload for session {session_id}", 404)
+            with (spool / STATE_FILE).open(encoding="utf-8") as fh:
+                yield spool, json.load(fh)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class _Upload:
+    """An open upload while one request applies chunks to it."""
+
+    def __init__(self, directory: Path, spool: Path, state: Dict[str, Any]):
+        self.directory = directory
+        self.spool = spool
+        self.state = state
+        self.meta = dict(state["meta"])
+        # Uploads opened before rotation was spooled have no span for it yet.
+        self.spans = {s: ColumnSpan.from_state(state.get(s, ColumnSpan().state())) for s in SPOOL_STREAMS}
+        self.hr = HeartRateAggregator.from_state(state["hr"])
+        self.hr_report = HeartRateAggregator.from_state(state["hr_report"])
+        self.intensity = IntensityAggregator.from_state(state["intensity"])
+        self.strikes = StrikeDetector.from_state(state["strikes"])
+        # Uploads opened before validation existed have no counters yet.
+        self.dropped = {stream: 0 for stream in STREAM_FIELDS}
+        self.dropped.update(state.get("dropped", {}))
+        self.raw_path = directory / "raw_data" / state["raw"]
+        self.events: List[Dict[str, Any]] = []
+        self._rollback()
+        self._files = {
+            (stream, name): _spool_file(spool, stream, name).open("ab")
+            for stream, fields in SPOOL_STREAMS.items() for name in fields
+        }
+        self._raw = self.raw_path.open("ab")
+
+    def _rollback(self) -> None:
+        """Cut the spool and raw log back to what the state file committed."""
+        for stream, fields in SPOOL_STREAMS.items():
+            size = self.state.get(stream, {}).get("count", 0) * 8
+            for name in fields:
+                path = _spool_file(self.spool, stream, name)
+                if path.exists() and path.stat().st_size != size:
+                    os.truncate(path, size)
+        if self.raw_path.exists() and self.raw_path.stat().st_size != self.state["raw_bytes"]:
+            os.truncate(self.raw_path, self.state["raw_bytes"])
+
+    def append(self, batch: SessionColumns, raw_lines: List[str]) -> None:
+        for stream in SPOOL_STREAMS:
+            cols = batch.stream(stream)
+            for name, col in cols.items():
+                col.tofile(self._files[(stream, name)])
+            self.spans[stream].update(cols["t"])
+        for line in raw_lines:
+            self._raw.write(line.encode("utf-8") + b"\n")
+        self.meta.update((k, v) for k, v in batch.meta.items() if v is not None)
+        for stream, count in batch.dropped.items():
+            self.dropped[stream] += count
+
+        imu = batch.imu
+        self.intensity.update(imu["ax"], imu["ay"], imu["az"])
+        self.events.extend(self.strikes.update(imu["t"], imu["ax"], imu["ay"], imu["az"]))
+        self.hr.update(batch.heart_rate["bpm"])
+        self.hr_report.update(batch.heart_rate["bpm"])
+
+    def commit(self, seq_advance: int = 1) -> Dict[str, Any]:
+        self.close(sync=True)
+        state = dict(self.state)
+        state.update({
+            "raw_bytes": self.raw_path.stat().st_size,
+            "next_seq": self.state["next_seq"] + seq_advance,
+            "meta": self.meta,
+            "imu": self.spans["imu"].state(),
+            "heart_rate": self.spans["heart_rate"].state(),
+            "rotation": self.spans["rotation"].state(),
+            "hr": self.hr.state(),
+            "hr_report": self.hr_report.state(),
+            "intensity": self.intensity.state(),
+            "strikes": self.strikes.state(),
+            "dropped": self.dropped,
+        })
+        _write_state(self.spool, state)
+        self.state = state
+        return state
+
+    def close(self, sync: bool = False) -> None:
+        for fh in list(self._files.values()) + [self._raw]:
+            if fh.closed:
+                continue
+            if sync:
+                fh.flush()
+                os.fsync(fh.fileno())
+            fh.close()
+
+
+READ_BLOCK_BYTES = 1 << 16
+
+
+def stream_lines(stream, block_size: int = READ_BLOCK_BYTES) -> Iterator[bytes]:
+    """Split a binary stream into lines, reading it in fixed-size blocks.
+
+    Much cheaper than ``readline`` on a WSGI input stream, and memory stays at
+    one block plus the longest line.
+    """
+    tail = b""
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        lines = (tail + block).split(b"\n")
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
+def _body_batches(body: Any) -> Iterator[Tuple[SessionColumns, List[str]]]:
+    """Batches from a chunk body: a JSON object string or an iterable of NDJSON lines."""
+    if isinstance(body, str):
+        ok, session = parse_payload(body)
+        if not ok:
+            raise UploadError(session)
+        session.meta = {k: v for k, v in session.meta.items() if v is not None}
+        # JSON only allows raw newlines as whitespace, so the body fits on one log line.
+        yield session, [body.replace("\r", " ").replace("\n", " ").strip()]
+        return
+    try:
+        yield from ndjson_batches(body)
+    except ValueError as exc:
+        raise UploadError(str(exc))
+
+
+def start_upload(directory: Path, meta: Optional[Dict[str, Any]] = None) -> int:
+    """Open a chunked upload and return its session id (status ``receiving``)."""
+    meta = meta or {}
+    try:
+        device = device_id(meta.get("device_id"))
+    except ValueError as exc:
+        raise UploadError(str(exc))
+    raw_filename = raw_filename_for(directory, device, ext=".ndjson")
+    (directory / "raw_data" / raw_filename).touch()
+    session_id = insert_session(directory, raw_filename, status=RECEIVING)
+    if session_id is None:
+        raise UploadError("Failed to record session", 500)
+    spool = _spool_dir(directory, session_id)
+    spool.mkdir(parents=True, exist_ok=True)
+    _write_state(spool, _new_state(raw_filename, meta))
+    return session_id
+
+
+def _apply(upload: _Upload, body: Any) -> None:
+    try:
+        for batch, raw_lines in _body_batches(body):
+            upload.append(batch, raw_lines)
+    except Exception:
+        upload.close()
+        upload._rollback()
+        raise
+
+
+def append_chunk(directory: Path, session_id: int, body: Any, seq: Optional[int] = None) -> Dict[str, Any]:
+    """Append one chunk. ``body`` is a JSON object string or an iterable of NDJSON lines.
+
+    With ``seq``, a chunk number already applied is acknowledged without being
+    appended again and a gap is rejected with 409.
+    """
+    with _locked_upload(directory, session_id) as (spool, state):
+        expected = state["next_seq"]
+        if seq is not None and seq < expected:
+            return _progress(session_id, state, duplicate=True)
+        if seq is not None and seq > expected:
+            raise UploadError(f"Expected chunk seq {expected}, got {seq}", 409)
+        upload = _Upload(directory, spool, state)
+        _apply(upload, body)
+        state = upload.commit()
+        return _progress(session_id, state, events=upload.events + [_stats_event(state)])
+
+
+def _progress(session_id: int, state: Dict[str, Any], duplicate: bool = False, events: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Chunk response; ``events`` are the live events the chunk produced."""
+    return {
+        "session_id": session_id,
+        "next_seq": state["next_seq"],
+        "imu_samples": state["imu"]["count"],
+        "heart_rate_samples": state["heart_rate"]["count"],
+        "rotation_samples": state.get("rotation", {}).get("count", 0),
+        "strike_count": StrikeDetector.from_state(state["strikes"]).strike_count,
+        "dropped": state.get("dropped", {}),
+        "duplicate": duplicate,
+        "events": events or [],
+    }
+
+
+def _stats_event(state: Dict[str, Any]) -> Dict[str, Any]:
+    hr = HeartRateAggregator.from_state(state["hr_report"])
+    return {
+        "type": "stats",
+        "imu_samples": state["imu"]["count"],
+        "strike_count": StrikeDetector.from_state(state["strikes"]).strike_count,
+        "heart_rate": {**hr.stats(), "last": hr.last, "zones": hr.zone_counts()},
+        "intensity": IntensityAggregator.from_state(state["intensity"]).stats(),
+    }
+
+
+def _spool_csv_rows(spool: Path, stream: str, rows: int) -> Iterator[list]:
+    fields = SPOOL_STREAMS[stream]
+    handles = [_spool_file(spool, stream, name).open("rb") for name in fields]
+    try:
+        for _ in range(0, rows, columnar.COPY_BLOCK_ROWS):
+            cols = []
+            for fh in handles:
+                col = array("d")
+                col.frombytes(fh.read(columnar.COPY_BLOCK_ROWS * 8))
+                cols.append(_csv_column(col))
+            yield from zip(*cols)
+    finally:
+        for fh in handles:
+            fh.close()
+
+
+def _write_processed_from_spool(directory: Path, spool: Path, base: str, stream: str, rows: int, processed_format: str) -> Tuple[bool, str]:
+    if processed_format not in PROCESSED_FORMATS:
+        return False, f"Unknown processed format: {processed_format}"
+    name = f"{base}_{stream}{PROCESSED_FORMATS[processed_format]}"
+    target = directory / "processed_data" / name
+    if rawstore.device_of(name):
+        target.parent.mkdir(exist_ok=True)
+    if processed_format == "csv":
+        ok, err = _write_csv_rows(target, list(SPOOL_STREAMS[stream]), _spool_csv_rows(spool, stream, rows))
+    else:
+        sources = {field: _spool_file(spool, stream, field) for field in SPOOL_STREAMS[stream]}
+        ok, err = columnar.write_columns_from_files(target, sources, STREAM_DTYPES[stream])
+    return (True, name) if ok else (False, err)
+
+
+def _read_spool(spool: Path, stream: str) -> Dict[str, array]:
+    cols = {}
+    for name in SPOOL_STREAMS[stream]:
+        cols[name] = array("d")
+        with _spool_file(spool, stream, name).open("rb") as fh:
+            cols[name].frombytes(fh.read())
+    return cols
+
+
+def _write_lod_from_spool(directory: Path, spool: Path, stream: str, rows: int, processed_name: str) -> Tuple[bool, str]:
+    builder = series.LodBuilder(stream)
+    fields = SPOOL_STREAMS[stream]
+    handles = [_spool_file(spool, stream, name).open("rb") for name in fields]
+    try:
+        for _ in range(0, rows, columnar.COPY_BLOCK_ROWS):
+            cols = {}
+            for name, fh in zip(fields, handles):
+                cols[name] = array("d")
+                cols[name].frombytes(fh.read(columnar.COPY_BLOCK_ROWS * 8))
+            builder.add(cols)
+    finally:
+        for fh in handles:
+            fh.close()
+    return builder.write(directory / "processed_data" / series.lod_filename(processed_name))
+
+
+def finish_upload(directory: Path, session_id: int, body: Any = None, processed_format: str = DEFAULT_PROCESSED_FORMAT) -> Dict[str, Any]:
+    """Apply an optional last chunk, write the processed files and complete the sessions row.
+
+    Returns the same info dict as a single-request upload (without ``payload``).
+    """
+    with _locked_upload(directory, session_id) as (spool, state):
+        upload = _Upload(directory, spool, state)
+        if body is not None:
+            _apply(upload, body)
+        state = upload.commit(seq_advance=0)
+
+        base = rawstore.raw_stem(state["raw"])
+        # The processed files are committed together (server/durable.py).
+        with durable.batch():
+            processed = {"format": processed_format}
+            timings: Dict[str, float] = {}
+            for stream in COPIED_STREAMS:
+                with timed("processed_write", timings):
+                    ok, name = _write_processed_from_spool(
+                        directory, spool, base, stream, state[stream]["count"], processed_format
+                    )
+                if not ok:
+                    error = f"Failed to write {stream} {processed_format} file: {name}"
+                    update_session(directory, session_id, "failed", error=error)
+                    raise UploadError(error, 500)
+                processed[stream] = name
+
+            orientation = None
+            if upload.spans["rotation"].count:
+                # At most a few MB per hour of samples, so the stream is normalized in memory.
+                imu_span = upload.spans["imu"]
+                rotation, removed = prepare_rotation(
+                    _read_spool(spool, "rotation"), imu_span.first_t, imu_span.last_t, optional_float(upload.meta.get("duration"))
+                )
+                upload.dropped["rotation"] += removed
+                if len(rotation["t"]):
+                    ok, name = write_processed(directory / "processed_data", base, "rotation", rotation, processed_format)
+                    if not ok:
+                        error = f"Failed to write rotation {processed_format} file: {name}"
+                        update_session(directory, session_id, "failed", error=error)
+                        raise UploadError(error, 500)
+                    processed["rotation"] = name
+                    # Strike times are not kept by the running detector; /api/session/<id>/analysis correlates them with swings.
+                    orientation = orientation_summary(rotation)
+
+            for stream in COPIED_STREAMS:
+                with timed("processed_write", timings):
+                    ok, err = _write_lod_from_spool(directory, spool, stream, state[stream]["count"], processed[stream])
+                if not ok:
+                    LOG.warning("Failed to write %s: %s", series.lod_filename(processed[stream]), err)
+
+        imu_span = upload.spans["imu"]
+        info = {
+            "raw": state["raw"],
+            "processed": processed,
+            "sampling": {
+                "imu_hz_measured": imu_span.rate_hz(upload.meta.get("imu_hz")),
+                "heart_rate_hz_measured": upload.spans["heart_rate"].rate_hz(upload.meta.get("heart_rate_hz")),
+            },
+            "stats": session_stats_from_parts(
+                upload.meta, imu_span.count, imu_span.first_t, imu_span.last_t, upload.hr.stats(), upload.dropped, orientation
+            ),
+            "payload": None,
+            "timings": timings,
+        }
+        has_hr = upload.hr_report.count > 0
+        # The running aggregates, shaped like analysis_results, feed the daily rollups.
+        info["summary"] = {
+            "zones": upload.hr_report.zone_counts() if has_hr else None,
+            "intensity": upload.intensity.stats() if imu_span.count else None,
+            "strikes": upload.strikes.stats() if imu_span.count else None,
+        }
+        try:
+            print_report(
+                upload.hr_report.stats() if has_hr else None,
+                info["summary"]["zones"],
+                info["summary"]["intensity"],
+                info["summary"]["strikes"],
+                orientation,
+            )
+        except Exception as e:
+            LOG.error(f"Failed to run session analysis: {e}")
+
+        # The log is complete: archive it compressed like single-request uploads.
+        raw_log = directory / "raw_data" / state["raw"]
+        codec, level = rawstore.get_compression()
+        if codec != "none":
+            with timed("raw_write", timings):
+                info["raw"] = rawstore.relative_name(directory / "raw_data", rawstore.compress_file(raw_log, codec, level))
+        update_session(directory, session_id, "done", info)
+        if info["raw"] != state["raw"]:
+            raw_log.unlink()
+        # Removing the state file closes the upload; the lock file goes with the directory.
+        (spool / STATE_FILE).unlink()
+    shutil.rmtree(spool, ignore_errors=True)
+    return info
+
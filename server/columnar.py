@@ -0,0 +1,246 @@
+"""
+Compact binary column files (``.kcol``) for processed session data.
+
+Layout::
+
+    b"KCOL" + version (uint16) + reserved (uint16)   8 bytes
+    header length (uint32, little-endian)            4 bytes
+    header (UTF-8 JSON)                               padded to an 8-byte boundary
+    column blocks                                     each 8-byte aligned
+
+The JSON header records the row count, the byte order and, per column, its
+name, dtype (``f8``, ``f4`` or ``i4``) and offset relative to the first block,
+plus a free-form ``meta`` dict. Blocks are raw fixed-width values, so readers
+can ``mmap`` the file and view a column without copying or parsing it.
+"""
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+import json
+import mmap
+import struct
+import sys
+
+from . import durable
+
+MAGIC = b"KCOL"
+VERSION = 1
+EXTENSION = ".kcol"
+
+# dtype -> array typecode. "i" is 4 bytes on every platform we run on.
+TYPECODES = {"f8": "d", "f4": "f", "i4": "i"}
+
+_PREAMBLE = struct.Struct("<4sHHI")
+_ALIGN = 8
+
+
+def _aligned(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _as_typed(values, typecode: str) -> array:
+    if isinstance(values, array) and values.typecode == typecode:
+        return values
+    try:
+        import numpy as np
+        return array(typecode, np.asarray(values).astype(typecode).tobytes())
+    except ImportError:
+        return array(typecode, values)
+
+
+class ColumnFileError(ValueError):
+    """The file is not a readable .kcol file."""
+
+
+def write_columns(
+    target: Path,
+    columns: Mapping[str, Iterable[float]],
+    dtypes: Mapping[str, str],
+    meta: Optional[Dict[str, Any]] = None,
+) -> Tuple[bool, str]:
+    """Write ``columns`` (equal length) to ``target`` using ``dtypes`` per column.
+
+    Returns ``(True, filename)`` or ``(False, error)`` like the other storage writers.
+    """
+    try:
+        blocks = []
+        specs = []
+        offset = 0
+        rows = None
+        for name, values in columns.items():
+            dtype = dtypes.get(name, "f8")
+            typed = _as_typed(values, TYPECODES[dtype])
+            if rows is None:
+                rows = len(typed)
+            elif len(typed) != rows:
+                raise ValueError(f"column {name!r} has {len(typed)} rows, expected {rows}")
+            if sys.byteorder != "little":
+                typed = array(typed.typecode, typed)
+                typed.byteswap()
+            nbytes = len(typed) * typed.itemsize
+            specs.append({"name": name, "dtype": dtype, "offset": offset, "nbytes": nbytes})
+            blocks.append((typed, _aligned(nbytes) - nbytes))
+            offset += _aligned(nbytes)
+
+        header = json.dumps(
+            {"rows": rows or 0, "byteorder": "little", "columns": specs, "meta": meta or {}},
+            separators=(",", ":"),
+        ).encode("utf-8")
+        header_pad = _aligned(_PREAMBLE.size + len(header)) - _PREAMBLE.size - len(header)
+
+        with durable.atomic_write(target) as fh:
+            fh.write(_PREAMBLE.pack(MAGIC, VERSION, 0, len(header)))
+            fh.write(header)
+            fh.write(b"\0" * header_pad)
+            for typed, pad in blocks:
+                typed.tofile(fh)
+                fh.write(b"\0" * pad)
+        return True, str(target.name)
+    except Exception as exc:
+        return False, str(exc)
+
+
+COPY_BLOCK_ROWS = 1 << 16
+
+
+def write_columns_from_files(
+    target: Path,
+    sources: Mapping[str, Path],
+    dtypes: Mapping[str, str],
+    meta: Optional[Dict[str, Any]] = None,
+) -> Tuple[bool, str]:
+    """Like write_columns, but each column is read from a file of native float64 values.
+
+    The sources are converted and copied block by block, so memory stays at
+    ``COPY_BLOCK_ROWS`` values however long the columns are.
+    """
+    try:
+        specs = []
+        offset = 0
+        rows = None
+        for name, path in sources.items():
+            dtype = dtypes.get(name, "f8")
+            n = Path(path).stat().st_size // 8
+            if rows is None:
+                rows = n
+            elif n != rows:
+                raise ValueError(f"column {name!r} has {n} rows, expected {rows}")
+            nbytes = n * array(TYPECODES[dtype]).itemsize
+            specs.append({"name": name, "dtype": dtype, "offset": offset, "nbytes": nbytes})
+            offset += _aligned(nbytes)
+
+        header = json.dumps(
+            {"rows": rows or 0, "byteorder": "little", "columns": specs, "meta": meta or {}},
+            separators=(",", ":"),
+        ).encode("utf-8")
+        header_pad = _aligned(_PREAMBLE.size + len(header)) - _PREAMBLE.size - len(header)
+
+        with durable.atomic_write(target) as fh:
+            fh.write(_PREAMBLE.pack(MAGIC, VERSION, 0, len(header)))
+            fh.write(header)
+            fh.write(b"\0" * header_pad)
+            for spec, path in zip(specs, sources.values()):
+                typecode = TYPECODES[spec["dtype"]]
+                with Path(path).open("rb") as src:
+                    for _ in range(0, rows, COPY_BLOCK_ROWS):
+                        block = array("d")
+                        block.frombytes(src.read(COPY_BLOCK_ROWS * 8))
+                        typed = _as_typed(block, typecode)
+                        if sys.byteorder != "little":
+                            typed = array(typed.typecode, typed)
+                            typed.byteswap()
+                        typed.tofile(fh)
+                fh.write(b"\0" * (_aligned(spec["nbytes"]) - spec["nbytes"]))
+        return True, str(target.name)
+    except Exception as exc:
+        return False, str(exc)
+
+
+class ColumnFile:
+    """Memory-mapped reader for a .kcol file.
+
+    ``view(name)`` is a zero-copy memoryview over the mapping and ``numpy(name)``
+    a zero-copy ndarray; both must be dropped before ``close()``. ``read(name)``
+    returns an independent ``array`` copy.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._fh = self.path.open("rb")
+        try:
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._fh.close()
+            raise ColumnFileError(f"{self.path.name}: empty file")
+        try:
+            magic, version, _, header_len = _PREAMBLE.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ColumnFileError(f"{self.path.name}: not a version {VERSION} .kcol file")
+            end = _PREAMBLE.size + header_len
+            header = json.loads(bytes(self._mm[_PREAMBLE.size:end]))
+        except (struct.error, ValueError) as exc:
+            self.close()
+            raise ColumnFileError(f"{self.path.name}: {exc}")
+        self._data_start = _aligned(end)
+        self.rows: int = header["rows"]
+        self.meta: Dict[str, Any] = header.get("meta", {})
+        self._swap = header.get("byteorder", "little") != sys.byteorder
+        self._specs = {spec["name"]: spec for spec in header["columns"]}
+        if self._data_start + sum(_aligned(s["nbytes"]) for s in self._specs.values()) > len(self._mm):
+            self.close()
+            raise ColumnFileError(f"{self.path.name}: truncated")
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(self._specs)
+
+    def dtype(self, name: str) -> str:
+        return self._specs[name]["dtype"]
+
+    def _span(self, name: str) -> Tuple[int, int]:
+        spec = self._specs[name]
+        start = self._data_start + spec["offset"]
+        return start, start + spec["nbytes"]
+
+    def view(self, name: str) -> memoryview:
+        if self._swap:
+            raise ColumnFileError("byte order differs from this machine; use read()")
+        start, end = self._span(name)
+        return memoryview(self._mm)[start:end].cast(TYPECODES[self.dtype(name)])
+
+    def read(self, name: str, start_row: int = 0, stop_row: Optional[int] = None) -> array:
+        """Copy rows ``[start_row, stop_row)`` of a column into an ``array``."""
+        typecode = TYPECODES[self.dtype(name)]
+        out = array(typecode)
+        begin, end = self._span(name)
+        stop_row = self.rows if stop_row is None else min(stop_row, self.rows)
+        start_row = max(0, min(start_row, stop_row))
+        out.frombytes(self._mm[begin + start_row * out.itemsize:begin + stop_row * out.itemsize])
+        if self._swap:
+            out.byteswap()
+        return out
+
+    def numpy(self, name: str):
+        import numpy as np
+        start, _ = self._span(name)
+        dtype = np.dtype(self.dtype(name)).newbyteorder("<")
+        return np.frombuffer(self._mm, dtype=dtype, count=self.rows, offset=start)
+
+    def close(self) -> None:
+        mm = getattr(self, "_mm", None)
+        if mm is not None:
+            mm.close()
+            self._mm = None
+        self._fh.close()
+
+    def __enter__(self) -> "ColumnFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def read_columns(path: Path) -> Dict[str, array]:
+    """Load every column of a .kcol file into ``array`` copies."""
+    with ColumnFile(path) as cf:
+        return {name: cf.read(name) for name in cf.names}
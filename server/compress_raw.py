@@ -0,0 +1,40 @@
+"""
+One-shot migration: compress the uncompressed raw files in data/raw_data in
+place and repoint their sessions rows::
+
+    python -m server.compress_raw [--data-dir data] [--codec gzip] [--level 6]
+
+Only files of finished sessions are compressed. Files of uploads still
+receiving data, queued or processing, and files without a sessions row,
+are skipped and left for a later run.
+"""
+from pathlib import Path
+import argparse
+import os
+import sys
+
+from . import DEFAULT_DATA_DIR, rawstore
+from .db import init_db
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compress the uncompressed raw files in data/raw_data in place.")
+    parser.add_argument("--data-dir", type=Path, default=None, help="data directory (default: SENSOR_DATA_DIR or data/)")
+    parser.add_argument("--codec", choices=sorted(c for c in rawstore.SUFFIXES if c != "none"), default=None,
+                        help="default: SENSOR_RAW_COMPRESSION, else zstd if installed, else gzip")
+    parser.add_argument("--level", type=int, default=None, help="default: the codec's default level")
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir or Path(os.environ.get("SENSOR_DATA_DIR") or DEFAULT_DATA_DIR)
+    init_db(data_dir)
+    stats = rawstore.migrate(data_dir, args.codec, args.level)
+    ratio = stats["bytes_in"] / stats["bytes_out"] if stats["bytes_out"] else float("nan")
+    mb_s = stats["bytes_in"] / 1e6 / stats["seconds"] if stats["seconds"] else float("nan")
+    print(f"Compressed {stats['files']} file(s), skipped {stats['skipped']} unfinished or unrecorded: "
+          f"{stats['bytes_in'] / 1e6:.2f} MB -> {stats['bytes_out'] / 1e6:.2f} MB "
+          f"(ratio {ratio:.1f}x, {mb_s:.1f} MB/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,246 @@
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Sequence
+import fcntl
+import os
+import queue
 import sqlite3
+import threading
 
+# Per-connection tuning. WAL lets dashboard readers run while an upload commits;
+# synchronous=NORMAL is durable across application crashes in WAL mode and only
+# risks the last transactions on power loss.
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", "-8000"),  # KiB, i.e. 8 MB of page cache
+    ("temp_store", "MEMORY"),
+    ("busy_timeout", "5000"),
+)
 
-def init_db() -> None:
-    repo_root = Path(__file__).resolve().parent.parent
-    data_dir = repo_root / "data"
+# Statements kept compiled per connection (sqlite3's LRU statement cache).
+STATEMENT_CACHE_SIZE = 256
+
+# Idle connections kept per database; extra connections opened under load are closed on return.
+POOL_SIZE = 8
+
+BATCH_SIZE = 500
+
+_pools: Dict[str, "queue.LifoQueue[sqlite3.Connection]"] = {}
+_pools_pid = os.getpid()
+_pools_lock = threading.Lock()
+
+
+def _open_connection(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        db_path, timeout=5.0, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False
+    )
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def _pool_for(db_path: str) -> "queue.LifoQueue[sqlite3.Connection]":
+    global _pools, _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Forked worker: never touch the parent's handles.
+            _pools, _pools_pid = {}, os.getpid()
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = queue.LifoQueue()
+        return pool
+
+
+@contextmanager
+def connection(db_path: Path) -> Iterator[sqlite3.Connection]:
+    """Borrow a pooled connection to ``db_path`` for the duration of the block.
+
+    Connections keep their compiled statements between borrows, so repeated
+    queries skip re-preparing. A transaction left open by the caller is rolled
+    back before the connection goes back to the pool.
+    """
+    key = str(db_path)
+    pool = _pool_for(key)
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection(key)
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        if pool.qsize() < POOL_SIZE:
+            pool.put(conn)
+        else:
+            conn.close()
+
+
+@contextmanager
+def transaction(db_path: Path) -> Iterator[sqlite3.Connection]:
+    """Borrow a connection inside a transaction; commit on success, roll back on error."""
+    with connection(db_path) as conn:
+        with conn:
+            yield conn
+
+
+def execute_batched(db_path: Path, sql: str, rows: Iterable[Sequence], batch_size: int = BATCH_SIZE) -> int:
+    """Run ``sql`` for every row, committing once per ``batch_size`` rows. Returns the row count."""
+    total = 0
+    with connection(db_path) as conn:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                with conn:
+                    conn.executemany(sql, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            with conn:
+                conn.executemany(sql, batch)
+            total += len(batch)
+    return total
+
+
+def close_all() -> None:
+    """Close every idle pooled connection (e.g. on shutdown or in tests)."""
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def init_db(data_dir: Optional[Path] = None) -> None:
+    """Create sessions.db or bring its schema up to date.
+
+    Safe to run from several server processes starting together: they take
+    turns on ``sessions.db.lock``, so each migration runs once.
+    """
+    if data_dir is None:
+        repo_root = Path(__file__).resolve().parent.parent
+        data_dir = repo_root / "data"
     data_dir.mkdir(parents=True, exist_ok=True)
-    db_path = data_dir / "sessions.db"
-    conn = sqlite3.connect(str(db_path))
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at INTEGER,
-            raw_filename TEXT,
-            imu_csv TEXT,
-            heart_csv TEXT,
-            duration REAL,
-            imu_hz_measured REAL,
-            imu_hz_sampling_rate_defined REAL,
-            heart_rate_hz_measured REAL,
-            heart_rate_hz_sampling_rate REAL,
-            heart_mean REAL,
-            heart_max INTEGER
+    with (data_dir / "sessions.db.lock").open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            _create_schema(data_dir / "sessions.db")
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _create_schema(db_path: Path) -> None:
+    with transaction(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at INTEGER,
+                raw_filename TEXT,
+                imu_csv TEXT,
+                heart_csv TEXT,
+                duration REAL,
+                imu_hz_measured REAL,
+                imu_hz_sampling_rate_defined REAL,
+                heart_rate_hz_measured REAL,
+                heart_rate_hz_sampling_rate REAL,
+                heart_mean REAL,
+                heart_max INTEGER
+            )
+            """
         )
-        """
-    )
-    conn.commit()
-    conn.close()
+        _add_missing_columns(cur, "sessions", SESSION_MIGRATIONS)
+        for name, columns in SESSION_INDEXES:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON sessions ({columns})")
+        cur.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_content_sha256 ON sessions (content_sha256) WHERE content_sha256 IS NOT NULL"
+        )
+        # Analysis results (server/results.py), one row per session; version is
+        # the analysis.analysis_version() they were computed with.
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS session_analysis (
+                session_id INTEGER PRIMARY KEY,
+                version TEXT NOT NULL,
+                created_at INTEGER,
+                results TEXT NOT NULL
+            )
+            """
+        )
+        # Per-day rollups (server/rollups.py): each finished session's
+        # contribution, and the per-day sums of those contributions.
+        rollup_sums = ", ".join(f"{name} REAL NOT NULL DEFAULT 0" for name in ROLLUP_SUM_COLUMNS)
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS rollup_sessions (session_id INTEGER PRIMARY KEY, day TEXT NOT NULL, {rollup_sums})"
+        )
+        _add_missing_columns(cur, "rollup_sessions", (("device_id", "TEXT"),))
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_rollup_sessions_day ON rollup_sessions (day)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_rollup_sessions_device_day ON rollup_sessions (device_id, day)")
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS rollup_days (day TEXT PRIMARY KEY, sessions INTEGER NOT NULL, {rollup_sums})"
+        )
+        # The same sums per device, for trends of one device.
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS rollup_device_days (device_id TEXT NOT NULL, day TEXT NOT NULL, "
+            f"sessions INTEGER NOT NULL, {rollup_sums}, PRIMARY KEY (device_id, day))"
+        )
+
+
+# Columns added after the original sessions schema, applied in order on startup.
+SESSION_MIGRATIONS = (
+    ("status", "TEXT"),  # queued | processing | done | failed; NULL rows predate the queue
+    ("error", "TEXT"),
+    ("processed_format", "TEXT"),  # csv | columnar; NULL rows predate the setting and are csv
+    ("processing_version", "INTEGER"),  # storage.PROCESSING_VERSION that wrote the processed data
+    # Fingerprint of the raw file, recorded by server/reprocess.py to skip unchanged sessions.
+    ("raw_sha256", "TEXT"),  # of the uncompressed content, so recompressing keeps it
+    ("raw_size", "INTEGER"),
+    ("raw_mtime_ns", "INTEGER"),
+    # Samples dropped by ingest validation, per stream (NULL for rows from before validation).
+    ("imu_dropped", "INTEGER"),
+    ("heart_rate_dropped", "INTEGER"),
+    ("rotation_dropped", "INTEGER"),
+    # Processed rotation_vectors stream (NULL when the session sent none) and its summary.
+    ("rotation_file", "TEXT"),
+    ("rotation_samples", "INTEGER"),
+    ("max_angular_velocity", "REAL"),  # deg/s
+    ("timings", "TEXT"),  # JSON: ms per ingest stage (server/metrics.py)
+    # SHA-256 of the uploaded body; unique, so batch uploads skip sessions already stored (server/batch.py).
+    ("content_sha256", "TEXT"),
+    # Device/athlete the session came from; also the directory of its files (NULL: shared top level).
+    ("device_id", "TEXT"),
+)
+
+
+# Additive per-session totals kept by the rollup tables; zone<i>_s are seconds in HR zone i.
+ROLLUP_SUM_COLUMNS = (
+    "duration", "strikes", "strike_force_sum", "intensity_sum", "intensity_sessions",
+    "zone0_s", "zone1_s", "zone2_s", "zone3_s",
+)
+
+
+# (column, id) indexes back keyset pagination and range filters in queries.py.
+SESSION_INDEXES = (
+    ("idx_sessions_created_at", "created_at, id"),
+    ("idx_sessions_heart_mean", "heart_mean, id"),
+    ("idx_sessions_duration", "duration, id"),
+    # The same per device, for listings filtered by device_id.
+    ("idx_sessions_device", "device_id, id"),
+    ("idx_sessions_device_created_at", "device_id, created_at, id"),
+    ("idx_sessions_device_heart_mean", "device_id, heart_mean, id"),
+    ("idx_sessions_device_duration", "device_id, duration, id"),
+)
+
+
+def _add_missing_columns(cur: sqlite3.Cursor, table: str, columns) -> None:
+    existing = {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns:
+        if name not in existing:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
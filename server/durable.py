@@ -0,0 +1,240 @@
+"""
+Crash-safe file writes for raw_data and processed_data.
+
+``atomic_write(target)`` yields a file object opened on a hidden temp file
+next to ``target``. When the block ends without an error, the temp file
+replaces ``target``; after an error it is deleted. Readers therefore see
+either the old file or the complete new one, never a truncated one. How
+much survives a power cut depends on the level (SENSOR_DURABILITY):
+
+- ``none``: write ``target`` in place, like before this module existed.
+- ``atomic``: temp file and rename, without fsync. Safe against a crashing
+  process; after a power cut the newest files may be missing or empty.
+- ``fsync`` (default): fsync the temp file, rename it, then fsync the
+  directory. When the call returns, the file is on disk under its final name.
+- ``group``: the same guarantee, but fsyncs are batched. When other files
+  are being written, the first writer waits GROUP_WINDOW_S for them. One
+  thread then fsyncs every waiting file, renames them and fsyncs each
+  directory once. Inside ``batch()``, a thread's writes are collected and
+  committed together when the block ends; storage uses this for the
+  processed files of one session.
+
+Files are durable before their sessions row is written, so the row never
+names a file that is not fully on disk. Leftover ``*.tmp`` files are removed
+by the startup check (server/fsck.py).
+"""
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterator, List, Optional, Tuple
+import os
+import threading
+import time
+
+LEVELS = ("none", "atomic", "fsync", "group")
+TMP_SUFFIX = ".tmp"
+# How long the first writer of a group waits for others to join it.
+GROUP_WINDOW_S = 0.002
+
+
+def resolve_level(level: Optional[str]) -> str:
+    level = level or "fsync"
+    if level not in LEVELS:
+        raise ValueError(f"Unknown durability level: {level!r}")
+    return level
+
+
+_level = resolve_level(os.environ.get("SENSOR_DURABILITY"))
+
+
+def set_level(level: Optional[str]) -> str:
+    """Select the durability level for new files; returns the resolved level."""
+    global _level
+    _level = resolve_level(level)
+    return _level
+
+
+def get_level() -> str:
+    return _level
+
+
+def temp_path(target: Path) -> Path:
+    """Hidden, per-thread temp name next to ``target``."""
+    return target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}")
+
+
+def fsync_path(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GroupCommitter:
+    """Leader/follower group commit of (temp, target) renames.
+
+    The first caller becomes the leader. If other files are still being
+    written it waits ``window`` seconds for them, then commits every pending
+    file: one fsync per file, the renames, then one fsync per directory. It
+    repeats until nothing is pending. Other callers only wait for their own
+    files.
+    """
+
+    def __init__(self, window: float = GROUP_WINDOW_S):
+        self.window = window
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[Path, Path, dict]] = []
+        self._leading = False
+        self.batches = 0
+        self.files = 0
+
+    def commit(self, pairs: List[Tuple[Path, Path]]) -> None:
+        """Durably rename each temp file to its target; raises OSError if any of them failed."""
+        entries = [(tmp, target, {"done": False, "error": None}) for tmp, target in pairs]
+        with self._cond:
+            self._pending.extend(entries)
+            lead = not self._leading
+            if lead:
+                self._leading = True
+            else:
+                while not all(e["done"] for _, _, e in entries):
+                    self._cond.wait()
+        if lead:
+            if _writing.value:
+                time.sleep(self.window)
+            while True:
+                with self._cond:
+                    batch, self._pending = self._pending, []
+                    if not batch:
+                        self._leading = False
+                        break
+                self._flush(batch)
+                with self._cond:
+                    for _, _, entry in batch:
+                        entry["done"] = True
+                    self.batches += 1
+                    self.files += len(batch)
+                    self._cond.notify_all()
+        errors = [e["error"] for _, _, e in entries if e["error"] is not None]
+        if errors:
+            raise errors[0]
+
+    @staticmethod
+    def _flush(batch: List[Tuple[Path, Path, dict]]) -> None:
+        renamed = []
+        for tmp, target, entry in batch:
+            try:
+                fsync_path(tmp)
+                os.replace(tmp, target)
+                renamed.append((target, entry))
+            except OSError as exc:
+                entry["error"] = exc
+        for directory in {target.parent for target, _ in renamed}:
+            try:
+                fsync_path(directory)
+            except OSError as exc:
+                for target, entry in renamed:
+                    if target.parent == directory:
+                        entry["error"] = exc
+
+
+class _Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, n: int) -> None:
+        with self._lock:
+            self.value += n
+
+
+_group = GroupCommitter()
+_batch = threading.local()
+# Temp files being written right now; a group leader only waits when there are some.
+_writing = _Counter()
+
+
+def _commit(tmp: Path, target: Path) -> None:
+    """Move a finished temp file into place according to the current level."""
+    if _level == "atomic":
+        os.replace(tmp, target)
+    elif _level == "fsync":
+        fsync_path(tmp)
+        os.replace(tmp, target)
+        fsync_path(target.parent)
+    else:
+        pending = getattr(_batch, "pairs", None)
+        if pending is not None:
+            pending.append((tmp, target))
+        else:
+            _group.commit([(tmp, target)])
+
+
+@contextmanager
+def batch() -> Iterator[None]:
+    """Commit the ``group``-level writes of this thread together when the block ends.
+
+    Until then the files exist only under their temp names. Other levels commit each file at once.
+    """
+    if _level != "group" or getattr(_batch, "pairs", None) is not None:
+        yield
+        return
+    _batch.pairs = []
+    try:
+        yield
+    except BaseException:
+        for tmp, _ in _batch.pairs:
+            _unlink(tmp)
+        raise
+    else:
+        if _batch.pairs:
+            _group.commit(_batch.pairs)
+    finally:
+        del _batch.pairs
+
+
+def _unlink(path: Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+@contextmanager
+def atomic_write(target: Path, mode: str = "wb", **open_kwargs) -> Iterator[IO]:
+    """Open ``target`` for writing so that it only appears once complete (see the module docstring)."""
+    target = Path(target)
+    if _level == "none":
+        with target.open(mode, **open_kwargs) as fh:
+            yield fh
+        return
+    tmp = temp_path(target)
+    with replacing(target, tmp):
+        with tmp.open(mode, **open_kwargs) as fh:
+            yield fh
+
+
+@contextmanager
+def replacing(target: Path, tmp: Optional[Path] = None) -> Iterator[Path]:
+    """Yield the temp path to write ``target`` through, for writers that open files themselves.
+
+    With level ``none`` that is ``target`` itself.
+    """
+    target = Path(target)
+    if _level == "none":
+        yield target
+        return
+    tmp = tmp or temp_path(target)
+    _writing.add(1)
+    try:
+        yield tmp
+    except BaseException:
+        _unlink(tmp)
+        raise
+    finally:
+        _writing.add(-1)
+    try:
+        _commit(tmp, target)
+    except BaseException:
+        _unlink(tmp)
+        raise
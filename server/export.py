@@ -0,0 +1,256 @@
+"""
+Streaming zip export of finished sessions for offline analysis (GET /api/export).
+
+The archive starts with ``sessions.csv``, the sessions.db row of every
+selected session. Then, per session, it has ``<id>/analysis.json`` (the
+analysis results) and one file per processed stream: ``<id>/imu``,
+``heart_rate`` and ``rotation``, as ``.csv``, ``.npz`` (one float array per
+column) or ``.parquet``.
+
+Files are converted from whatever processed format is stored while the
+archive is written. ZipFile writes to an unseekable sink, and the response
+generator hands on the sink's bytes after every chunk. Sessions are read from
+the DB in pages of PAGE_SIZE, and streams in slices of CHUNK_ROWS rows. So
+memory stays flat however many sessions are selected. ``npz`` needs NumPy and
+``parquet`` needs pyarrow; without them these formats answer 501.
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+import csv
+import datetime
+import io
+import logging
+import time
+import zipfile
+
+from .db import connection
+from .results import session_results_json
+from .storage import iter_processed_chunks, iter_processed_csv, processed_layout
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+LOG = logging.getLogger("sensor_server.export")
+
+FORMATS = ("csv", "npz", "parquet")
+PAGE_SIZE = 100
+CHUNK_ROWS = 65536
+# Deflate level of the csv and npz entries; parquet files are compressed already and stored as is.
+COMPRESSLEVEL = 1
+STREAM_COLUMNS = (("imu", "imu_csv"), ("heart_rate", "heart_csv"), ("rotation", "rotation_file"))
+
+
+class ExportError(ValueError):
+    """Invalid export parameters; ``status`` is the HTTP code."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class _Sink:
+    """Write-only, unseekable file object that keeps what ZipFile wrote until it is drained."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _day_start(value: Optional[str], name: str, next_day: bool = False) -> Optional[int]:
+    """Unix time of the local midnight starting a day given like /api/trends takes it (or the day after)."""
+    if value is None or value == "":
+        return None
+    try:
+        day = datetime.date.fromtimestamp(int(value)) if value.isdigit() else datetime.date.fromisoformat(value)
+    except (ValueError, OverflowError, OSError):
+        raise ExportError(f"{name} must be YYYY-MM-DD or a unix timestamp")
+    if next_day:
+        day += datetime.timedelta(days=1)
+    return int(datetime.datetime.combine(day, datetime.time()).timestamp())
+
+
+def parse_export_args(args) -> Dict[str, Any]:
+    """Validated export parameters from request args; raises ExportError."""
+    fmt = args.get("format", "csv")
+    if fmt not in FORMATS:
+        raise ExportError(f"format must be one of {', '.join(FORMATS)}")
+    if fmt == "npz" and np is None:
+        raise ExportError("npz export needs NumPy, which is not installed", 501)
+    if fmt == "parquet" and pa is None:
+        raise ExportError("parquet export needs pyarrow, which is not installed", 501)
+    return {
+        "fmt": fmt,
+        "created_from": _day_start(args.get("from"), "from"),
+        "created_before": _day_start(args.get("to"), "to", next_day=True),
+        "device_id": args.get("device") or None,
+    }
+
+
+def _pages(db_path: Path, created_from: Optional[int], created_before: Optional[int], device_id: Optional[str]) -> Iterator[list]:
+    """Finished sessions in id order, PAGE_SIZE rows at a time, each page read with a short-lived borrow."""
+    where, params = ["COALESCE(status, 'done') = 'done'"], []
+    if created_from is not None:
+        where.append("created_at >= ?")
+        params.append(created_from)
+    if created_before is not None:
+        where.append("created_at < ?")
+        params.append(created_before)
+    if device_id is not None:
+        where.append("device_id = ?")
+        params.append(device_id)
+    sql = f"SELECT * FROM sessions WHERE {' AND '.join(where)} AND id > ? ORDER BY id LIMIT {PAGE_SIZE}"
+    last = 0
+    while True:
+        with connection(db_path) as conn:
+            rows = conn.execute(sql, params + [last]).fetchall()
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]["id"]
+
+
+def _entry(zf: zipfile.ZipFile, name: str, compress: bool = True):
+    if compress:
+        return zf.open(name, "w")
+    info = zipfile.ZipInfo(name, time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    return zf.open(info, "w")
+
+
+def _write_csv(fh, directory: Path, filename: str) -> Iterator[None]:
+    for text in iter_processed_csv(directory, filename, CHUNK_ROWS):
+        fh.write(text.encode("utf-8"))
+        yield
+
+
+def _write_npz(fh, directory: Path, filename: str) -> Iterator[None]:
+    # An .npz is a zip of .npy files; each column is streamed into its own entry.
+    typecodes, rows = processed_layout(directory, filename)
+    with zipfile.ZipFile(fh, "w", zipfile.ZIP_STORED) as npz:
+        for name, typecode in typecodes.items():
+            with npz.open(f"{name}.npy", "w") as out:
+                dtype = np.dtype(typecode)
+                np.lib.format.write_array_header_1_0(
+                    out, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (rows,)}
+                )
+                for chunk in iter_processed_chunks(directory, filename, [name], CHUNK_ROWS):
+                    out.write(chunk[name].tobytes())
+                    yield
+
+
+_ARROW_TYPES = {"d": "float64", "f": "float32", "i": "int32"}
+
+
+class _Counted:
+    """Forwards writes to a zip entry and counts them, for writers that ask for their position."""
+
+    def __init__(self, fh):
+        self._fh = fh
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._fh.write(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def _write_parquet(fh, directory: Path, filename: str) -> Iterator[None]:
+    typecodes, _ = processed_layout(directory, filename)
+    schema = pa.schema([(name, getattr(pa, _ARROW_TYPES[code])()) for name, code in typecodes.items()])
+    # One row group per chunk; the writer only appends, so the unseekable entry is fine.
+    with pq.ParquetWriter(pa.PythonFile(_Counted(fh), mode="w"), schema) as writer:
+        for chunk in iter_processed_chunks(directory, filename, None, CHUNK_ROWS):
+            arrays = [
+                pa.Array.from_buffers(field.type, len(chunk[field.name]), [None, pa.py_buffer(chunk[field.name])])
+                for field in schema
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield
+
+
+_WRITERS = {"csv": _write_csv, "npz": _write_npz, "parquet": _write_parquet}
+
+
+def _session_entries(zf: zipfile.ZipFile, sink: _Sink, directory: Path, row, fmt: str) -> Iterator[bytes]:
+    session_id = row["id"]
+    try:
+        analysis = session_results_json(directory, session_id)
+    except Exception as exc:
+        LOG.warning("Exporting session %s without analysis: %s", session_id, exc)
+    else:
+        with _entry(zf, f"{session_id}/analysis.json") as fh:
+            fh.write(analysis.encode("utf-8"))
+        yield sink.drain()
+    for stream, column in STREAM_COLUMNS:
+        filename = row[column]
+        if not filename or not (directory / "processed_data" / filename).exists():
+            continue
+        with _entry(zf, f"{session_id}/{stream}.{fmt}", compress=fmt != "parquet") as fh:
+            for _ in _WRITERS[fmt](fh, directory, filename):
+                yield sink.drain()
+        yield sink.drain()
+
+
+def export_zip(directory: Path, fmt: str = "csv", created_from: Optional[int] = None, created_before: Optional[int] = None,
+               device_id: Optional[str] = None) -> Iterator[bytes]:
+    """Yield a zip archive of the finished sessions created in ``[created_from, created_before)`` (see the module docstring)."""
+    directory = Path(directory)
+    db_path = directory / "sessions.db"
+    sink = _Sink()
+    exported = 0
+    with connection(db_path) as conn:
+        columns = [d[0] for d in conn.execute("SELECT * FROM sessions LIMIT 0").description]
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, compresslevel=COMPRESSLEVEL) as zf:
+        # Two passes over the rows keep sessions.csv first without holding it in memory.
+        with _entry(zf, "sessions.csv") as fh:
+            text = io.TextIOWrapper(fh, encoding="utf-8", newline="", write_through=True)
+            writer = csv.writer(text)
+            writer.writerow(columns)
+            for rows in _pages(db_path, created_from, created_before, device_id):
+                writer.writerows(tuple(row) for row in rows)
+                yield sink.drain()
+            text.detach()
+        for rows in _pages(db_path, created_from, created_before, device_id):
+            for row in rows:
+                yield from _session_entries(zf, sink, directory, row, fmt)
+                exported += 1
+    LOG.info("Exported %d sessions as %s", exported, fmt)
+    yield sink.drain()
+
+
+def export_filename(params: Dict[str, Any]) -> str:
+    return f"sessions_{datetime.date.today().isoformat()}_{params['fmt']}.zip"
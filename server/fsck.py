@@ -0,0 +1,149 @@
+"""
+Startup consistency check of data/raw_data, data/processed_data and sessions.db::
+
+    python -m server.fsck [--data-dir data] [--dry-run] [--prune-orphans]
+
+After a crash or power cut it repairs what the previous run left behind:
+
+- temp files of interrupted writes (``*.tmp``, server/durable.py) are deleted;
+- a finished session whose processed file is missing, empty or truncated is
+  set back to ``queued``, so recover_pending rebuilds it from the raw file;
+  without a raw file it is marked ``failed``;
+- a queued session whose raw file is missing is marked ``failed``;
+- damaged chart pyramids are deleted (they are rebuilt on request);
+- processed files no sessions row refers to are counted and kept; only
+  ``--prune-orphans`` deletes them (sample data and files of an upload whose
+  row is not written yet look the same). Raw files without a row are kept;
+  recover_pending queues them.
+
+``create_app`` runs the check before re-queueing unfinished sessions, in the
+one process that does that (RECOVER_PENDING). server.serve runs it in the
+parent instead, before any worker starts. Set SENSOR_CONSISTENCY_CHECK=0 to
+skip it. Run it by hand only while the server is stopped. Raw files are not decompressed, so a truncated raw file is only
+found when its session is processed.
+"""
+from pathlib import Path
+from typing import Dict, Optional
+import argparse
+import logging
+import os
+import sys
+
+from . import DEFAULT_DATA_DIR, series
+from .columnar import ColumnFile, ColumnFileError
+from .db import connection, init_db, transaction
+from .durable import TMP_SUFFIX
+from .rawstore import relative_name
+
+LOG = logging.getLogger("sensor_server.fsck")
+
+PROCESSED_EXTENSIONS = (".kcol", ".csv")
+FILE_COLUMNS = ("imu_csv", "heart_csv", "rotation_file")
+
+
+def processed_file_error(path: Path) -> Optional[str]:
+    """Why ``path`` is not a complete processed file, or None if it looks intact."""
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        return "missing"
+    if size == 0:
+        return "empty"
+    if path.suffix == ".kcol":
+        try:
+            ColumnFile(path).close()
+        except (ColumnFileError, OSError) as exc:
+            return str(exc)
+        return None
+    with path.open("rb") as fh:
+        fh.seek(-1, 2)
+        if fh.read(1) != b"\n":
+            return "truncated"
+    return None
+
+
+def check(data_dir: Path, repair: bool = True, prune_orphans: bool = False) -> Dict[str, int]:
+    """Reconcile the data directory with sessions.db; returns counts of what was found (and fixed unless ``repair`` is False).
+
+    Unreferenced processed files are only deleted with ``prune_orphans``.
+    """
+    raw_dir = data_dir / "raw_data"
+    processed_dir = data_dir / "processed_data"
+    counts = {"temp_files": 0, "requeued": 0, "failed": 0, "bad_pyramids": 0, "orphans": 0}
+
+    def remove(path: Path) -> None:
+        if repair:
+            path.unlink(missing_ok=True)
+
+    for directory in (raw_dir, processed_dir):
+        # Top level and the device directories.
+        for path in (*directory.glob("*" + TMP_SUFFIX), *directory.glob("*/*" + TMP_SUFFIX)):
+            counts["temp_files"] += 1
+            remove(path)
+
+    requeue, failed = [], []
+    referenced = set()
+    with connection(data_dir / "sessions.db") as conn:
+        rows = conn.execute(
+            f"SELECT id, raw_filename, status, {', '.join(FILE_COLUMNS)} FROM sessions"
+        ).fetchall()
+    for row in rows:
+        names = [row[c] for c in FILE_COLUMNS if row[c]]
+        referenced.update(names)
+        referenced.update(series.lod_filename(name) for name in names)
+        raw_present = bool(row["raw_filename"]) and (raw_dir / row["raw_filename"]).is_file()
+        if row["status"] in ("queued", "processing"):
+            if not raw_present:
+                failed.append((row["id"], "Raw file missing after restart"))
+            continue
+        if row["status"] not in ("done", None):
+            continue
+        damaged = {name: err for name in names if (err := processed_file_error(processed_dir / name))}
+        if not damaged:
+            for name in names:
+                lod = processed_dir / series.lod_filename(name)
+                if lod.exists() and processed_file_error(lod):
+                    counts["bad_pyramids"] += 1
+                    remove(lod)
+            continue
+        LOG.warning("Session %s has damaged processed files: %s", row["id"], damaged)
+        if raw_present:
+            requeue.append(row["id"])
+        else:
+            failed.append((row["id"], f"Processed files damaged and raw file missing: {', '.join(damaged)}"))
+
+    for path in (*processed_dir.iterdir(), *processed_dir.glob("*/*")):
+        if path.suffix in PROCESSED_EXTENSIONS and path.is_file() and relative_name(processed_dir, path) not in referenced:
+            counts["orphans"] += 1
+            if prune_orphans:
+                remove(path)
+
+    counts["requeued"], counts["failed"] = len(requeue), len(failed)
+    if repair and (requeue or failed):
+        with transaction(data_dir / "sessions.db") as conn:
+            conn.executemany("UPDATE sessions SET status = 'queued', processing_version = NULL WHERE id = ?", [(i,) for i in requeue])
+            conn.executemany("UPDATE sessions SET status = 'failed', error = ? WHERE id = ?", [(e, i) for i, e in failed])
+    if any(counts.values()):
+        LOG.warning("Consistency check%s: %s", "" if repair else " (dry run)", counts, extra={"fields": {"event": "fsck", **counts}})
+    return counts
+
+
+def main(argv=None) -> int:
+    from . import logconfig
+
+    parser = argparse.ArgumentParser(description="Reconcile raw files, processed files and sessions.db after a crash.")
+    parser.add_argument("--data-dir", type=Path, default=None, help="data directory (default: SENSOR_DATA_DIR or data/)")
+    parser.add_argument("--dry-run", action="store_true", help="report without changing anything")
+    parser.add_argument("--prune-orphans", action="store_true",
+                        help="delete processed files no session refers to (stop the server first)")
+    args = parser.parse_args(argv)
+    logconfig.configure()
+    data_dir = args.data_dir or Path(os.environ.get("SENSOR_DATA_DIR") or DEFAULT_DATA_DIR)
+    init_db(data_dir)
+    counts = check(data_dir, repair=not args.dry_run, prune_orphans=args.prune_orphans)
+    print(", ".join(f"{k}: {v}" for k, v in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
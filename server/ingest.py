@@ -0,0 +1,314 @@
+"""
+Single-pass ingest of /end payloads.
+
+The request body is decoded once and every sample list is walked exactly once
+into compact ``array('d')`` columns by a validator generated from the list's
+``SampleSchema``: malformed samples are dropped and counted there, so nothing
+downstream has to re-check them. CSV writing, sampling-rate measurement,
+heart-rate stats and the analysis functions all read from these columns instead
+of walking the decoded JSON again. Chunked uploads send NDJSON, which is
+turned into the same columns in bounded batches by ``ndjson_batches``.
+"""
+from array import array
+from dataclasses import dataclass, field
+from operator import itemgetter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import math
+import re
+
+from . import jsoncodec
+
+IMU_FIELDS = ("t", "ax", "ay", "az", "gx", "gy", "gz")
+HR_FIELDS = ("t", "bpm")
+ROTATION_FIELDS = ("t", "x", "y", "z", "w")
+META_FIELDS = ("duration", "imu_hz", "heart_rate_hz")
+NDJSON_BATCH_SAMPLES = 4096
+NAN = float("nan")
+# A device/athlete id names a subdirectory of raw_data and processed_data.
+DEVICE_ID_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+
+
+@dataclass(frozen=True)
+class SampleSchema:
+    """The fields of one sample list in a payload.
+
+    A sample is dropped unless it is an object whose ``required`` fields are
+    finite numbers (bools and numeric strings do not count). Other fields
+    become NaN when missing or invalid. ``aliases`` maps a field to the key
+    read when the field is missing or null; ``bare`` is the field a bare
+    number in the list stands for.
+    """
+
+    fields: Tuple[str, ...]
+    required: Tuple[str, ...]
+    aliases: Tuple[Tuple[str, str], ...] = ()
+    bare: Optional[str] = None
+
+
+# payload key -> (stream name, schema). Old phone builds send heart rates as
+# {"value": ...} or as bare bpm numbers; both are still accepted.
+PAYLOAD_STREAMS = {
+    "imu": ("imu", SampleSchema(IMU_FIELDS, IMU_FIELDS)),
+    "heart_rates": ("heart_rate", SampleSchema(HR_FIELDS, ("bpm",), aliases=(("bpm", "value"),), bare="bpm")),
+    "rotation_vectors": ("rotation", SampleSchema(ROTATION_FIELDS, ("x", "y", "z", "w"))),
+}
+STREAM_FIELDS = {stream: schema.fields for stream, schema in PAYLOAD_STREAMS.values()}
+
+
+@dataclass
+class SessionColumns:
+    """Typed columns for one session, one array per schema field.
+
+    Samples that failed validation are left out and counted in ``dropped``
+    (per stream); NaN only marks an optional field that was missing.
+    """
+
+    imu: Dict[str, array] = field(default_factory=lambda: {k: array("d") for k in IMU_FIELDS})
+    heart_rate: Dict[str, array] = field(default_factory=lambda: {k: array("d") for k in HR_FIELDS})
+    rotation: Dict[str, array] = field(default_factory=lambda: {k: array("d") for k in ROTATION_FIELDS})
+    meta: Dict[str, Any] = field(default_factory=dict)
+    dropped: Dict[str, int] = field(default_factory=lambda: {stream: 0 for stream in STREAM_FIELDS})
+    payload: Optional[Dict[str, Any]] = None
+    device_id: Optional[str] = None
+
+    @property
+    def imu_count(self) -> int:
+        return len(self.imu["t"])
+
+    @property
+    def heart_rate_count(self) -> int:
+        return len(self.heart_rate["t"])
+
+    @property
+    def rotation_count(self) -> int:
+        return len(self.rotation["t"])
+
+    def stream(self, name: str) -> Dict[str, array]:
+        return getattr(self, name)
+
+
+def number(value) -> Optional[float]:
+    """``value`` as a finite float if it is a JSON number, else None."""
+    if type(value) is float or type(value) is int:
+        try:
+            value = float(value)
+        except OverflowError:
+            return None
+        return value if value - value == 0.0 else None
+    return None
+
+
+def compile_validator(schema: SampleSchema):
+    """Generate ``validate(items, cols) -> dropped count`` specialised for ``schema``.
+
+    The common case, an object holding every field as a finite number, costs
+    one itemgetter call, one float sum (finite only if every value is) and the
+    appends. Anything else falls through to a field-by-field check with
+    ``number``, which decides between keeping, NaN-filling and dropping.
+    """
+    aliases = dict(schema.aliases)
+    names = [f"v{i}" for i in range(len(schema.fields))]
+    puts = [f"put{i}({v})" for i, v in enumerate(names)]
+    src = ["def validate(items, cols):"]
+    src += [f"    put{i} = cols[{name!r}].append" for i, name in enumerate(schema.fields)]
+    src += ["    dropped = 0", "    for item in items:", "        try:",
+            f"            {', '.join(names)}, = fetch(item){',' if len(names) == 1 else ''}",
+            f"            total = 0.0 + {' + '.join(names)}",
+            "        except (TypeError, KeyError, OverflowError):", "            total = NAN",
+            f"        if total - total == 0.0 and {' and '.join(f'type({v}) is not bool' for v in names)}:"]
+    src += [f"            {put}" for put in puts] + ["            continue"]
+    src += ["        if type(item) is not dict:"]
+    if schema.bare:
+        src += ["            value = number(item)", "            if value is None:",
+                "                dropped += 1", "                continue"]
+        src += [f"            put{i}({'value' if name == schema.bare else 'NAN'})" for i, name in enumerate(schema.fields)]
+        src += ["            continue"]
+    else:
+        src += ["            dropped += 1", "            continue"]
+    src += ["        get = item.get"]
+    for v, name in zip(names, schema.fields):
+        src.append(f"        {v} = get({name!r})")
+        if name in aliases:
+            src += [f"        if {v} is None:", f"            {v} = get({aliases[name]!r})"]
+        src += [f"        if type({v}) is not float:", f"            {v} = number({v})",
+                f"        elif {v} - {v} != 0.0:", f"            {v} = None"]
+    required = [v for v, name in zip(names, schema.fields) if name in schema.required]
+    src += [f"        if {' or '.join(f'{v} is None' for v in required)}:",
+            "            dropped += 1", "            continue"]
+    for v, name in zip(names, schema.fields):
+        if name not in schema.required:
+            src += [f"        if {v} is None:", f"            {v} = NAN"]
+    src += [f"        {put}" for put in puts] + ["    return dropped"]
+    namespace = {"fetch": itemgetter(*schema.fields), "number": number, "NAN": NAN}
+    exec("\n".join(src), namespace)
+    return namespace["validate"]
+
+
+_VALIDATORS = {stream: compile_validator(schema) for stream, schema in PAYLOAD_STREAMS.values()}
+
+
+def validate_samples(session: SessionColumns, stream: str, items: list) -> None:
+    """Append the valid samples of ``items`` to ``session``'s ``stream`` columns and count the rest."""
+    session.dropped[stream] += _VALIDATORS[stream](items, session.stream(stream))
+
+
+def normalize_meta(payload: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """META_FIELDS of ``payload`` as finite floats, None when missing or invalid."""
+    return {k: number(payload.get(k)) for k in META_FIELDS}
+
+
+def device_id(value: Any) -> Optional[str]:
+    """The payload's ``device_id`` (None when absent). Raises ValueError unless it matches DEVICE_ID_RE."""
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str) or not DEVICE_ID_RE.fullmatch(value):
+        raise ValueError("device_id must be 1-64 letters, digits, '_', '.' or '-', starting with a letter or digit")
+    return value
+
+
+def _sample_lists(payload: Dict[str, Any]) -> Iterator[Tuple[str, list]]:
+    for key, (stream, _) in PAYLOAD_STREAMS.items():
+        items = payload.get(key)
+        if items is None:
+            continue
+        if type(items) is not list:
+            raise ValueError(f"{key} must be a list")
+        yield stream, items
+
+
+def columns_from_payload(payload: Dict[str, Any], keep_payload: bool = True) -> SessionColumns:
+    """Validate ``payload`` into columns in one pass. Raises ValueError when a sample list is not a list."""
+    session = SessionColumns(payload=payload if keep_payload else None, device_id=device_id(payload.get("device_id")))
+    for stream, items in _sample_lists(payload):
+        validate_samples(session, stream, items)
+    session.meta = normalize_meta(payload)
+    return session
+
+
+def parse_payload(raw: Union[bytes, str], keep_payload: bool = False) -> Tuple[bool, Any]:
+    """Decode ``raw`` (UTF-8 bytes or text) once and build its columns.
+
+    The decoded dict is only kept on ``SessionColumns.payload`` when
+    ``keep_payload`` is set (for echoing it back); otherwise it is freed as
+    soon as the columns exist. Returns ``(True, SessionColumns)`` or
+    ``(False, error message)``.
+    """
+    try:
+        payload = jsoncodec.loads(raw)
+    except Exception as exc:
+        return False, f"Invalid JSON: {exc}"
+    if not isinstance(payload, dict):
+        return False, "Invalid JSON: payload must be an object"
+    try:
+        return True, columns_from_payload(payload, keep_payload)
+    except ValueError as exc:
+        return False, f"Invalid payload: {exc}"
+
+
+def _ndjson_objects(lines: Iterable) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    for lineno, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = jsoncodec.loads(line)
+        except Exception as exc:
+            raise ValueError(f"Invalid JSON on line {lineno}: {exc}")
+        if not isinstance(obj, dict):
+            raise ValueError(f"Invalid JSON on line {lineno}: expected an object")
+        yield line, obj
+
+
+def ndjson_batches(lines: Iterable, batch_size: int = NDJSON_BATCH_SAMPLES) -> Iterator[Tuple[SessionColumns, List[str]]]:
+    """Group NDJSON lines into ``(SessionColumns, raw lines)`` batches of about ``batch_size`` samples.
+
+    A line is either a payload fragment with sample lists (as in an /end
+    body), a single heart-rate sample (has ``bpm`` or ``value``), a single IMU
+    sample (has ``ax``), a single rotation vector (has ``w``) or a metadata
+    object (``duration``, ``imu_hz``, ``heart_rate_hz``). A batch's ``meta``
+    only holds the valid keys that appeared in it. Raises ValueError on a line
+    that is not a JSON object or a fragment whose sample lists are not lists.
+    """
+    session, samples, raw = SessionColumns(), 0, []
+    for line, obj in _ndjson_objects(lines):
+        if any(key in obj for key in PAYLOAD_STREAMS):
+            for stream, items in _sample_lists(obj):
+                validate_samples(session, stream, items)
+                samples += len(items)
+        elif "bpm" in obj or "value" in obj:
+            validate_samples(session, "heart_rate", [obj])
+            samples += 1
+        elif "ax" in obj:
+            validate_samples(session, "imu", [obj])
+            samples += 1
+        elif "w" in obj:
+            validate_samples(session, "rotation", [obj])
+            samples += 1
+        meta = normalize_meta(obj)
+        session.meta.update((k, meta[k]) for k in META_FIELDS if k in obj and meta[k] is not None)
+        raw.append(line)
+        if samples >= batch_size:
+            yield session, raw
+            session, samples, raw = SessionColumns(), 0, []
+    if raw:
+        yield session, raw
+
+
+def parse_ndjson(raw_text: str) -> Tuple[bool, Any]:
+    """NDJSON counterpart of parse_payload (used for chunked-upload raw logs)."""
+    session = SessionColumns(meta={k: None for k in META_FIELDS})
+    try:
+        for batch, _ in ndjson_batches(raw_text.splitlines()):
+            for stream in STREAM_FIELDS:
+                cols = session.stream(stream)
+                for k, col in batch.stream(stream).items():
+                    cols[k].extend(col)
+                session.dropped[stream] += batch.dropped[stream]
+            session.meta.update(batch.meta)
+    except ValueError as exc:
+        return False, str(exc)
+    return True, session
+
+
+def optional_float(value) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def measured_rate_hz(t_col: array, fallback=None) -> Optional[float]:
+    """Average sampling rate from the first/last timestamp (ms) of a column.
+
+    Falls back to the device-reported rate when the timestamps are unusable.
+    """
+    n = len(t_col)
+    if n < 2:
+        return None
+    return rate_from_span(n, t_col[0], t_col[-1], fallback)
+
+
+def rate_from_span(n: int, first_t: float, last_t: float, fallback=None) -> Optional[float]:
+    """measured_rate_hz for a column known only by its length and end timestamps."""
+    if n < 2:
+        return None
+    if math.isnan(first_t) or math.isnan(last_t):
+        return optional_float(fallback)
+    interval = (last_t - first_t) / float(n - 1)
+    return 1000.0 / interval if interval > 0 else None
+
+
+def evenly_spaced(n: int, first_t: float, last_t: float) -> array:
+    """``n`` timestamps spread evenly from ``first_t`` to ``last_t`` (ms)."""
+    if n < 2:
+        return array("d", [first_t] * n)
+    step = (last_t - first_t) / (n - 1)
+    return array("d", (first_t + i * step for i in range(n)))
+
+
+def finite_values(col) -> list:
+    return [v for v in col if v == v]
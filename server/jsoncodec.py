@@ -0,0 +1,88 @@
+"""
+JSON encoding and decoding through the fastest library installed.
+
+orjson is preferred, then ujson, then the standard library; set
+SENSOR_JSON_BACKEND (``orjson``, ``ujson`` or ``json``) to force one. Request
+bodies are decoded straight from bytes. A document the fast library rejects
+is retried with the standard library, so inputs ``json`` accepts (NaN and
+Infinity literals, integers beyond 64 bits) keep loading the same way;
+valid bodies are still parsed only once.
+
+Encoding is compact. orjson writes NaN as ``null`` where ``json`` would
+write the non-standard ``NaN``.
+"""
+from typing import Any, Callable, Optional, Union
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # optional speed-up
+    ujson = None
+
+_backend = "json"
+
+
+def available_backends():
+    return tuple(name for name, mod in (("orjson", orjson), ("ujson", ujson), ("json", json)) if mod is not None)
+
+
+def set_backend(name: str) -> str:
+    """Selects the JSON library: "orjson", "ujson" or "json". Returns the active name."""
+    global _backend
+    if name not in ("orjson", "ujson", "json"):
+        raise ValueError(f"Unknown JSON backend: {name!r}")
+    if name not in available_backends():
+        raise ValueError(f"JSON backend {name!r} requested but it is not installed")
+    _backend = name
+    return name
+
+
+def get_backend() -> str:
+    return _backend
+
+
+set_backend(os.environ.get("SENSOR_JSON_BACKEND") or available_backends()[0])
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Decode a JSON document given as UTF-8 bytes or text. Raises ValueError when invalid."""
+    if _backend == "orjson":
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    elif _backend == "ujson":
+        try:
+            return ujson.loads(data)
+        except (ValueError, OverflowError):
+            pass
+    return json.loads(data)
+
+
+def dumps_bytes(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """Compact UTF-8 encoding of ``obj``; ``default`` converts types JSON has no form for."""
+    if _backend == "orjson":
+        try:
+            return orjson.dumps(obj, default=default, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+        except TypeError:
+            pass  # e.g. non-string keys, which json converts
+    elif _backend == "ujson":
+        try:
+            return ujson.dumps(obj, sort_keys=sort_keys, default=default, ensure_ascii=False,
+                               escape_forward_slashes=False).encode("utf-8")
+        except (TypeError, ValueError, OverflowError):
+            pass  # NaN and other values ujson refuses
+    return json.dumps(obj, sort_keys=sort_keys, default=default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """Compact encoding of ``obj`` as text."""
+    if _backend == "json":
+        return json.dumps(obj, sort_keys=sort_keys, default=default, ensure_ascii=False, separators=(",", ":"))
+    return dumps_bytes(obj, sort_keys, default).decode("utf-8")
@@ -0,0 +1,107 @@
+"""
+Graceful shutdown of a server process.
+
+``create_app`` wraps the WSGI app in an InflightTracker. On shutdown,
+``shutdown_app`` does three things in order:
+
+- it stops taking requests: new ones get ``503`` with ``Retry-After``, and
+  live streams end so clients reconnect;
+- it waits for the requests in progress, such as an ``/end`` upload still
+  being written;
+- it lets the ingest queue finish the sessions already accepted and closes
+  the pooled DB connections.
+
+A chunked upload that is interrupted between chunks keeps its spool on disk
+and can continue after the restart.
+"""
+from typing import Any, Callable, Iterable
+import logging
+import threading
+import time
+
+from werkzeug.wsgi import ClosingIterator
+
+from .db import close_all
+
+LOG = logging.getLogger("sensor_server.lifecycle")
+
+RETRY_AFTER_S = 5
+_UNAVAILABLE = b'{"status":"error","message":"Server is shutting down"}'
+
+
+class InflightTracker:
+    """WSGI middleware counting the requests in progress.
+
+    A request counts until its response is closed, so streamed responses
+    are included. Once ``start_draining`` is called, new requests are
+    refused with 503.
+    """
+
+    def __init__(self, wsgi_app: Callable):
+        self.wsgi_app = wsgi_app
+        self.active = 0
+        self.draining = False
+        self._cond = threading.Condition()
+
+    def __call__(self, environ: dict, start_response: Callable) -> Iterable[bytes]:
+        with self._cond:
+            refuse = self.draining
+            if not refuse:
+                self.active += 1
+        if refuse:
+            start_response("503 Service Unavailable", [
+                ("Content-Type", "application/json"),
+                ("Content-Length", str(len(_UNAVAILABLE))),
+                ("Retry-After", str(RETRY_AFTER_S)),
+                ("Connection", "close"),
+            ])
+            return [_UNAVAILABLE]
+        try:
+            return ClosingIterator(self.wsgi_app(environ, start_response), self._finished)
+        except BaseException:
+            self._finished()
+            raise
+
+    def _finished(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def start_draining(self) -> None:
+        with self._cond:
+            self.draining = True
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Block until no request is in progress; False if ``timeout`` s passed first."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+
+def drain_requests(app: Any, timeout: float) -> bool:
+    """Refuse new requests, end live streams and wait up to ``timeout`` s for the rest."""
+    tracker = app.extensions["inflight"]
+    tracker.start_draining()
+    app.extensions["live_hub"].close()
+    idle = tracker.wait_idle(timeout)
+    if not idle:
+        LOG.warning("Shutting down with %d request(s) still in progress", tracker.active)
+    return idle
+
+
+def shutdown_app(app: Any, timeout: float) -> bool:
+    """Drain requests, finish the sessions already queued and close the DB pool.
+
+    Returns False when requests were still running after ``timeout`` s.
+    """
+    start = time.monotonic()
+    idle = drain_requests(app, timeout)
+    app.extensions["ingest_queue"].shutdown(wait=True)
+    close_all()
+    LOG.info("Stopped in %.2f s", time.monotonic() - start, extra={"fields": {"event": "shutdown", "drained": idle}})
+    return idle
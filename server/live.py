@@ -0,0 +1,94 @@
+"""
+In-process fan-out of live session events (strikes, running stats) to SSE and
+long-poll clients.
+
+Each session has a channel with a bounded backlog of numbered events, so a
+client that reconnects with its last seen number picks up where it left off.
+Channels are opened by uploads only (``open`` and ``publish``); waiting on a
+session without one returns at once, so clients cannot create channels.
+Publishing wakes waiting clients through a condition variable; nothing is
+polled. Channels live in the memory of one server process, so live clients must
+reach the same process that receives the chunks.
+"""
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Tuple
+import threading
+import time
+
+BACKLOG = 1024
+MAX_CHANNELS = 256
+
+
+class _Channel:
+    def __init__(self):
+        self.events = deque(maxlen=BACKLOG)
+        self.next_id = 1
+        self.closed = False
+
+
+class LiveHub:
+    """Per-session event channels. Thread-safe."""
+
+    def __init__(self, max_channels: int = MAX_CHANNELS):
+        self.max_channels = max_channels
+        self._cond = threading.Condition()
+        self._channels: "OrderedDict[int, _Channel]" = OrderedDict()
+        self._closed = False
+
+    def _channel(self, session_id: int) -> _Channel:
+        channel = self._channels.get(session_id)
+        if channel is None:
+            channel = self._channels[session_id] = _Channel()
+            # Forget the oldest sessions once there are too many; clients of
+            # an evicted session simply see no further events.
+            while len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        return channel
+
+    def open(self, session_id: int) -> None:
+        """Create the channel of a chunked upload that has just started."""
+        with self._cond:
+            self._channel(session_id)
+
+    def publish(self, session_id: int, events: List[Dict[str, Any]], close: bool = False) -> None:
+        """Append ``events`` (numbered in order as ``id``) and wake the session's clients."""
+        if not events and not close:
+            return
+        with self._cond:
+            channel = self._channel(session_id)
+            for event in events:
+                channel.events.append({**event, "id": channel.next_id})
+                channel.next_id += 1
+            channel.closed = channel.closed or close
+            self._cond.notify_all()
+
+    def wait(self, session_id: int, after: int = 0, timeout: float = 15.0) -> Tuple[List[Dict[str, Any]], bool]:
+        """Events with ``id > after``, blocking up to ``timeout`` s for the first one.
+
+        Returns ``(events, closed)``; ``closed`` means the session has ended
+        and no more events will follow the returned ones. A session without a
+        channel in this process (never opened, evicted, or from before a
+        restart) gives ``([], True)``.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                channel = self._channels.get(session_id)
+                if channel is None:
+                    return [], True
+                if channel.next_id - 1 > after or channel.closed or self._closed:
+                    return [e for e in channel.events if e["id"] > after], channel.closed
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], False
+                self._cond.wait(remaining)
+
+    @property
+    def shutting_down(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        """Shutdown: wake every waiting client and make further waits return at once."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
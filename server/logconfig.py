@@ -0,0 +1,51 @@
+"""
+Logging setup for the ``sensor_server`` loggers.
+
+SENSOR_LOG_FORMAT picks the output: ``text`` (default) writes
+``time level logger message`` lines, ``json`` one JSON object per line for
+journald or a log shipper. Records can carry structured fields with
+``extra={"fields": {...}}``; the JSON format writes them as top-level keys.
+SENSOR_LOG_LEVEL sets the level (default INFO).
+"""
+from typing import Optional
+import datetime
+import logging
+import os
+
+from . import jsoncodec
+
+LOG_FORMATS = ("text", "json")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ``ts``, ``level``, ``logger``, ``msg``, the record's fields and any traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return jsoncodec.dumps(entry, default=str)
+
+
+def configure(fmt: Optional[str] = None, level: Optional[str] = None) -> None:
+    """Attach a stderr handler to the ``sensor_server`` logger (once per process)."""
+    fmt = fmt or os.environ.get("SENSOR_LOG_FORMAT") or "text"
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format: {fmt!r}")
+    log = logging.getLogger("sensor_server")
+    log.setLevel((level or os.environ.get("SENSOR_LOG_LEVEL") or "INFO").upper())
+    if log.handlers:
+        return
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    log.addHandler(handler)
@@ -0,0 +1,146 @@
+"""
+Timing instrumentation for the ingest pipeline, served as Prometheus text at ``/metrics``.
+
+``timed(stage, timings)`` measures one step of the pipeline. It adds the
+duration to the ``sensor_ingest_stage_seconds`` histogram and, when given a
+dict, records it there in milliseconds. That dict becomes the session's
+``timings`` column. The stages are:
+
+- ``parse``: decoding and validating the body
+- ``raw_write``: the compressed raw file
+- ``processed_write``: processed files and chart pyramids
+- ``analysis``: the analysis and session stats
+- ``db``: the sessions row and results
+- ``response``: encoding the reply
+- ``chunk``: applying one chunked-upload chunk
+
+Every request's latency also goes into ``sensor_http_request_seconds``,
+labelled by Flask endpoint.
+
+Metrics live in the memory of one process. With several gunicorn workers,
+each worker reports its own numbers. Sessions processed by the ``process``
+ingest executor only reach their row's ``timings``.
+"""
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import math
+import threading
+import time
+
+from flask import g, request
+
+# Seconds; upper bounds of the histogram buckets (+Inf is implied).
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format. Thread-safe."""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((k, list(v[0]), v[1]) for k, v in self._series.items())
+        for label_values, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == math.inf else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, label_values)} {total!r}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, label_values)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter with labels. Thread-safe."""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], int] = {}
+
+    def inc(self, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in snapshot)
+        return lines
+
+
+STAGE_SECONDS = Histogram("sensor_ingest_stage_seconds", "Time spent in each ingest pipeline stage.", ("stage",))
+REQUEST_SECONDS = Histogram("sensor_http_request_seconds", "HTTP request latency until the response is returned.", ("endpoint", "method"))
+REQUESTS = Counter("sensor_http_requests_total", "HTTP requests by endpoint and status code.", ("endpoint", "status"))
+METRICS = (STAGE_SECONDS, REQUEST_SECONDS, REQUESTS)
+
+
+@contextmanager
+def timed(stage: str, timings: Optional[Dict[str, float]] = None) -> Iterator[None]:
+    """Time the block as ``stage``: observed in STAGE_SECONDS and added to ``timings`` (ms)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000.0, 3)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app) -> None:
+    """Time every request of ``app`` into REQUEST_SECONDS and count it in REQUESTS."""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, request.method)
+            REQUESTS.inc(endpoint, str(response.status_code))
+        return response
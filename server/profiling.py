@@ -0,0 +1,108 @@
+"""
+Opt-in profiling of single requests.
+
+The PROFILE setting (env SENSOR_PROFILE) chooses which requests are profiled:
+
+- ``off`` (default): none.
+- ``header``: requests sent with an ``X-Profile`` header. ``X-Profile: 1``
+  uses cProfile; ``X-Profile: pyinstrument`` uses pyinstrument if it is
+  installed (``pip install pyinstrument``).
+- ``all``: every request, with cProfile. Only for short debugging runs.
+
+Each profile is written to ``<data dir>/profiles`` as
+``<time>_<endpoint>.prof`` (pstats; ``python -m pstats`` or snakeviz read it)
+or ``.html`` (pyinstrument). The response names the file in an
+``X-Profile-File`` header.
+
+Profiling covers the view function only, not a streamed body. It slows the
+request down several times.
+"""
+from pathlib import Path
+from typing import Optional
+import cProfile
+import datetime
+import logging
+
+from flask import current_app, g, request
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+LOG = logging.getLogger("sensor_server.profiling")
+
+PROFILE_MODES = ("off", "header", "all")
+
+
+def _profiler_kind() -> Optional[str]:
+    mode = current_app.config["PROFILE"]
+    if mode == "all":
+        return "cprofile"
+    if mode != "header":
+        return None
+    value = request.headers.get("X-Profile", "").strip().lower()
+    if not value or value in ("0", "false", "no"):
+        return None
+    if value == "pyinstrument":
+        if pyinstrument is not None:
+            return "pyinstrument"
+        LOG.warning("X-Profile: pyinstrument requested but it is not installed; using cProfile")
+    return "cprofile"
+
+
+def _profile_path(suffix: str) -> Path:
+    out_dir = Path(current_app.config["DATA_DIR"]) / "profiles"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    endpoint = (request.endpoint or "unmatched").replace(".", "_")
+    return out_dir / f"{stamp}_{endpoint}{suffix}"
+
+
+def init_app(app) -> None:
+    """Register the profiling hooks on ``app`` unless PROFILE is ``off``."""
+    mode = app.config.get("PROFILE") or "off"
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown PROFILE mode: {mode!r}")
+    app.config["PROFILE"] = mode
+    if mode == "off":
+        return
+
+    @app.before_request
+    def _start_profile():
+        kind = _profiler_kind()
+        if kind == "pyinstrument":
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        elif kind == "cprofile":
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is active in this thread (e.g. a nested request).
+                return
+        else:
+            return
+        g.profiler = (kind, profiler)
+
+    @app.after_request
+    def _write_profile(response):
+        entry = g.pop("profiler", None)
+        if entry is None:
+            return response
+        kind, profiler = entry
+        try:
+            if kind == "pyinstrument":
+                profiler.stop()
+                path = _profile_path(".html")
+                path.write_text(profiler.output_html(), encoding="utf-8")
+            else:
+                profiler.disable()
+                path = _profile_path(".prof")
+                profiler.dump_stats(str(path))
+        except OSError as exc:
+            LOG.warning("Failed to write profile: %s", exc)
+            return response
+        response.headers["X-Profile-File"] = path.name
+        LOG.info("Wrote profile %s", path.name, extra={"fields": {"event": "profile", "file": path.name, "endpoint": request.endpoint}})
+        return response
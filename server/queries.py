@@ -0,0 +1,122 @@
+"""
+Read-side queries behind the dashboard and JSON API.
+
+Listings use keyset (cursor) pagination: each page is an index range scan that
+starts right after the last row of the previous page, so the cost of a page
+does not grow with the table size or with how deep the client has scrolled.
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .db import connection
+
+LIST_COLUMNS = ("id", "created_at", "device_id", "duration", "heart_mean", "heart_max", "imu_csv", "heart_csv", "raw_filename", "status")
+
+# Sortable columns; each has an index on (column, id) and one on (device_id, column, id) created by init_db.
+SORT_COLUMNS = ("id", "created_at", "heart_mean", "duration")
+
+# Query-string name -> (column, operator) for range filters.
+FILTERS = {
+    "from": ("created_at", ">="),
+    "to": ("created_at", "<="),
+    "heart_mean_min": ("heart_mean", ">="),
+    "heart_mean_max": ("heart_mean", "<="),
+    "duration_min": ("duration", ">="),
+    "duration_max": ("duration", "<="),
+}
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class QueryError(ValueError):
+    """Invalid listing parameters (reported to clients as 400)."""
+
+
+def _encode_cursor(sort: str, row) -> str:
+    if sort == "id":
+        return str(row["id"])
+    return f"{row[sort]!r}:{row['id']}"
+
+
+def _decode_cursor(sort: str, cursor: str) -> Tuple[Any, int]:
+    try:
+        if sort == "id":
+            return None, int(cursor)
+        value, _, row_id = cursor.rpartition(":")
+        return float(value), int(row_id)
+    except ValueError:
+        raise QueryError(f"Invalid cursor: {cursor!r}")
+
+
+def list_sessions(
+    db_path: Path,
+    after: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    sort: str = "id",
+    order: str = "desc",
+    filters: Optional[Dict[str, Any]] = None,
+    device_id: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Return one page of sessions and the cursor for the next page (None on the last page).
+
+    Sorting by a stats column skips sessions where that column is NULL.
+    ``device_id`` limits the page to one device's sessions.
+    """
+    if sort not in SORT_COLUMNS:
+        raise QueryError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    if order not in ("asc", "desc"):
+        raise QueryError("order must be asc or desc")
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    where, params = [], []
+    if device_id:
+        where.append("device_id = ?")
+        params.append(device_id)
+    for name, value in (filters or {}).items():
+        if name not in FILTERS:
+            raise QueryError(f"Unknown filter: {name}")
+        column, op = FILTERS[name]
+        where.append(f"{column} {op} ?")
+        params.append(value)
+
+    cmp = "<" if order == "desc" else ">"
+    if sort != "id":
+        where.append(f"{sort} IS NOT NULL")
+    if after:
+        value, row_id = _decode_cursor(sort, after)
+        if sort == "id":
+            where.append(f"id {cmp} ?")
+            params.append(row_id)
+        else:
+            where.append(f"({sort}, id) {cmp} (?, ?)")
+            params.extend((value, row_id))
+
+    direction = order.upper()
+    order_by = f"id {direction}" if sort == "id" else f"{sort} {direction}, id {direction}"
+    sql = f"SELECT {', '.join(LIST_COLUMNS)} FROM sessions"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {order_by} LIMIT ?"
+    params.append(limit + 1)
+
+    with connection(db_path) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    next_cursor = _encode_cursor(sort, rows[limit - 1]) if len(rows) > limit else None
+    return [dict(r) for r in rows[:limit]], next_cursor
+
+
+def parse_listing_args(args) -> Dict[str, Any]:
+    """Turn request query args into ``list_sessions`` keyword arguments."""
+    try:
+        kwargs: Dict[str, Any] = {
+            "after": args.get("after") or None,
+            "limit": int(args.get("limit", DEFAULT_PAGE_SIZE)),
+            "sort": args.get("sort", "id"),
+            "order": args.get("order", "desc"),
+            "device_id": args.get("device") or None,
+        }
+        kwargs["filters"] = {name: float(args[name]) for name in FILTERS if args.get(name) not in (None, "")}
+    except ValueError as exc:
+        raise QueryError(f"Invalid query parameter: {exc}")
+    return kwargs
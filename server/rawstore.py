@@ -0,0 +1,279 @@
+"""
+Compressed storage for raw upload bodies in data/raw_data.
+
+New raw files are written through a streaming compressor: zstd when the
+``zstandard`` package is installed, otherwise gzip from the standard library
+(lzma is also available). The codec is part of the filename
+(``session_<ts>.json.zst``, ``.json.gz``, ``.json.xz``) so readers never need
+to be told how a file was written; ``open_raw``/``read_raw_text`` handle every
+variant, including plain ``.json`` files from before compression existed.
+
+``migrate`` compresses existing uncompressed files in place and points their
+sessions rows at the new names; ``python -m server.compress_raw`` runs it.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple, Union
+import gzip
+import io
+import logging
+import lzma
+import os
+import shutil
+import time
+
+from . import durable
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+LOG = logging.getLogger("sensor_server.rawstore")
+
+# codec -> filename suffix appended after .json / .ndjson
+SUFFIXES = {"zstd": ".zst", "gzip": ".gz", "lzma": ".xz", "none": ""}
+# gzip 1 keeps most of the ratio of level 6 at ~3x the speed on our payloads;
+# the raw write sits on the /end request path.
+DEFAULT_LEVELS = {"zstd": 3, "gzip": 1, "lzma": 6, "none": None}
+RAW_EXTENSIONS = (".json", ".ndjson")
+ENCODE_CHUNK_CHARS = 1 << 20
+COPY_BLOCK_BYTES = 1 << 20
+
+
+def available_codecs() -> Tuple[str, ...]:
+    return tuple(c for c in SUFFIXES if c != "zstd" or zstandard is not None)
+
+
+def resolve_codec(name: Optional[str]) -> str:
+    """Map a configured codec name ("auto" or empty picks zstd, else gzip) to an available codec."""
+    if not name or name == "auto":
+        return "zstd" if zstandard is not None else "gzip"
+    if name not in SUFFIXES:
+        raise ValueError(f"Unknown raw compression codec: {name!r}")
+    if name == "zstd" and zstandard is None:
+        raise ValueError("zstd raw compression requested but the zstandard package is not installed")
+    return name
+
+
+_codec = resolve_codec(os.environ.get("SENSOR_RAW_COMPRESSION"))
+_level: Optional[int] = None
+
+
+def set_compression(codec: Optional[str], level: Optional[int] = None) -> str:
+    """Select the codec (and level, None for the codec default) used for new raw files."""
+    global _codec, _level
+    _codec = resolve_codec(codec)
+    _level = level
+    return _codec
+
+
+def get_compression() -> Tuple[str, int]:
+    return _codec, _level if _level is not None else DEFAULT_LEVELS[_codec]
+
+
+def codec_of(filename: str) -> str:
+    for codec, suffix in SUFFIXES.items():
+        if suffix and filename.endswith(suffix):
+            return codec
+    return "none"
+
+
+def raw_stem(filename: str) -> str:
+    """``session_<ts>`` (``<device>/session_<ts>`` in a device directory) for any raw filename, compressed or not."""
+    name = filename[:len(filename) - len(SUFFIXES[codec_of(filename)])]
+    for ext in RAW_EXTENSIONS:
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return str(Path(name).with_suffix(""))
+
+
+def device_of(filename: str) -> Optional[str]:
+    """Device id of a raw or processed filename: its directory, None for the shared top level."""
+    return filename.rpartition("/")[0] or None
+
+
+def relative_name(root: Path, path: Path) -> str:
+    """``path`` as stored in sessions rows: relative to raw_data or processed_data."""
+    return path.relative_to(root).as_posix()
+
+
+def is_ndjson(filename: str) -> bool:
+    return filename[:len(filename) - len(SUFFIXES[codec_of(filename)])].endswith(".ndjson")
+
+
+def iter_raw_files(raw_dir: Path) -> Iterator[Path]:
+    """Raw payload files (any codec) in ``raw_dir`` and its device directories, sorted by file name."""
+    paths = []
+    for path in raw_dir.iterdir():
+        paths.extend(path.iterdir() if path.is_dir() else (path,))
+    for path in sorted(paths, key=lambda p: (p.name, str(p.parent))):
+        name = path.name[:len(path.name) - len(SUFFIXES[codec_of(path.name)])]
+        if path.is_file() and name.endswith(RAW_EXTENSIONS):
+            yield path
+
+
+class _ZstdWriter(io.RawIOBase):
+    """Closes the compressor and the file together, like gzip.open does."""
+
+    def __init__(self, fh: BinaryIO, level: int):
+        self._fh = fh
+        self._writer = zstandard.ZstdCompressor(level=level).stream_writer(fh, closefd=False)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        return self._writer.write(data)
+
+    def fileno(self) -> int:
+        return self._fh.fileno()
+
+    def close(self) -> None:
+        if not self.closed:
+            self._writer.close()
+            self._fh.close()
+        super().close()
+
+
+def _open_writer(path: Path, codec: str, level: Optional[int]) -> BinaryIO:
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == "gzip":
+        # mtime=0 keeps the output a pure function of the input.
+        return gzip.GzipFile(str(path), mode="wb", compresslevel=level, mtime=0)
+    if codec == "lzma":
+        return lzma.open(path, "wb", preset=level)
+    if codec == "zstd":
+        return _ZstdWriter(path.open("wb"), level)
+    return path.open("wb")
+
+
+@contextmanager
+def _target(path: Path, fsync: bool) -> Iterator[Path]:
+    """The path to write ``path`` through: durable.replacing() with ``fsync``, else ``path`` itself."""
+    if fsync:
+        with durable.replacing(path) as tmp:
+            yield tmp
+    else:
+        yield path
+
+
+def write_raw_text(raw_dir: Path, filename: str, text: Union[str, bytes], fsync: bool = False) -> Tuple[bool, str]:
+    """Write ``text`` (or UTF-8 bytes) as ``filename`` + codec suffix with the configured compression.
+
+    The text is encoded and compressed in slices, so neither the encoded bytes
+    nor the compressed output is ever held whole. With ``fsync`` the file is
+    written through server.durable at its configured level; without it, in
+    place (for bulk fixtures). Returns ``(True, stored filename)`` or
+    ``(False, error)``.
+    """
+    codec, level = get_compression()
+    name = filename + SUFFIXES[codec]
+    try:
+        with _target(raw_dir / name, fsync) as path:
+            with _open_writer(path, codec, level) as writer:
+                if isinstance(text, bytes):
+                    view = memoryview(text)
+                    for i in range(0, len(view), ENCODE_CHUNK_CHARS):
+                        writer.write(view[i:i + ENCODE_CHUNK_CHARS])
+                else:
+                    for i in range(0, len(text), ENCODE_CHUNK_CHARS):
+                        writer.write(text[i:i + ENCODE_CHUNK_CHARS].encode("utf-8"))
+        return True, name
+    except Exception as exc:
+        return False, str(exc)
+
+
+def open_raw(path: Path) -> BinaryIO:
+    """Binary reader that decompresses according to the filename."""
+    codec = codec_of(path.name)
+    if codec == "gzip":
+        return gzip.open(path, "rb")
+    if codec == "lzma":
+        return lzma.open(path, "rb")
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError(f"{path.name}: reading .zst files needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(path.open("rb"), read_across_frames=True, closefd=True)
+    return path.open("rb")
+
+
+def read_raw_text(path: Path) -> str:
+    with open_raw(path) as fh:
+        return fh.read().decode("utf-8")
+
+
+def compress_file(path: Path, codec: Optional[str] = None, level: Optional[int] = None, fsync: bool = True) -> Path:
+    """Write a compressed copy of an uncompressed raw file next to it and return its path.
+
+    The original is left in place; callers remove it once nothing refers to it.
+    The copy is written through server.durable (a temp file and rename
+    without ``fsync``).
+    """
+    if codec is None:
+        codec, level = get_compression()
+    target = path.with_name(path.name + SUFFIXES[codec])
+    with (durable.replacing(target) if fsync else _renamed(target)) as tmp:
+        with _open_writer(tmp, codec, level) as writer, path.open("rb") as src:
+            shutil.copyfileobj(src, writer, COPY_BLOCK_BYTES)
+    return target
+
+
+@contextmanager
+def _renamed(target: Path) -> Iterator[Path]:
+    tmp = durable.temp_path(target)
+    try:
+        yield tmp
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, target)
+
+
+def migrate(data_dir: Path, codec: Optional[str] = None, level: Optional[int] = None) -> dict:
+    """Compress every uncompressed raw file in ``data_dir`` and repoint its sessions row.
+
+    Each file is compressed to a temp name, renamed, its row updated and only
+    then the original removed, so an interrupted run leaves at most a stray
+    copy that the next run replaces. Only files of finished sessions (``done``,
+    ``failed`` or no status) are touched: a file that is still receiving data,
+    queued or being processed is in use under its name, and a file without a
+    row may be one that /end has written but not recorded yet.
+    """
+    from .db import connection, transaction
+
+    codec = resolve_codec(codec) if codec else get_compression()[0]
+    if codec == "none":
+        raise ValueError("migration needs a compressing codec")
+    db_path = data_dir / "sessions.db"
+    stats = {"files": 0, "skipped": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+    start = time.perf_counter()
+    raw_dir = data_dir / "raw_data"
+    finished = "COALESCE(status, 'done') IN ('done', 'failed')"
+    for path in iter_raw_files(raw_dir):
+        if codec_of(path.name) != "none":
+            continue
+        name = relative_name(raw_dir, path)
+        with connection(db_path) as conn:
+            row = conn.execute(f"SELECT id FROM sessions WHERE raw_filename = ? AND {finished}", (name,)).fetchone()
+        if row is None:
+            stats["skipped"] += 1
+            continue
+        target = compress_file(path, codec, level)
+        with transaction(db_path) as conn:
+            # The session may have been requeued meanwhile; then the original stays in use.
+            updated = conn.execute(
+                f"UPDATE sessions SET raw_filename = ? WHERE raw_filename = ? AND {finished}",
+                (relative_name(raw_dir, target), name),
+            ).rowcount
+        if not updated:
+            target.unlink(missing_ok=True)
+            stats["skipped"] += 1
+            continue
+        stats["files"] += 1
+        stats["bytes_in"] += path.stat().st_size
+        stats["bytes_out"] += target.stat().st_size
+        path.unlink()
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
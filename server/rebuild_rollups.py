@@ -0,0 +1,29 @@
+"""
+Rebuild the per-day trend rollups from sessions.db (server/rollups.py)::
+
+    python -m server.rebuild_rollups [--data-dir data]
+"""
+from pathlib import Path
+import argparse
+import os
+import sys
+
+from . import DEFAULT_DATA_DIR, rollups
+from .db import init_db
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild the per-day rollup tables from sessions.db.")
+    parser.add_argument("--data-dir", type=Path, default=None, help="data directory (default: SENSOR_DATA_DIR or data/)")
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir or Path(os.environ.get("SENSOR_DATA_DIR") or DEFAULT_DATA_DIR)
+    init_db(data_dir)
+    stats = rollups.rebuild(data_dir)
+    print(f"Rolled up {stats['sessions']} session(s) into {stats['days']} day(s) "
+          f"({stats['computed']} analysed on the way) in {stats['seconds']:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""
+Rebuild data/processed_data and the sessions rows from the raw files::
+
+    python -m server.reprocess [--data-dir data] [--jobs N] [--format columnar] [--force]
+
+Run it after changing the processing code or the stats schema (and bumping
+``storage.PROCESSING_VERSION``), with the server stopped. Raw files are parsed
+and processed in a process pool; only the parent writes to sessions.db,
+committing the results in batches.
+
+A session is skipped when its row was written by the current
+PROCESSING_VERSION in the requested format, its processed files exist and the
+raw file is unchanged: the same size and mtime as recorded, or failing that the
+same SHA-256 of its uncompressed content, so files recompressed by
+``server.compress_raw`` or copied to another disk are not reprocessed. Raw
+files without a row get one; failed sessions are retried on every run.
+Reprocessed sessions also get fresh analysis results (server/results.py).
+"""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import argparse
+import datetime
+import hashlib
+import logging
+import os
+import sys
+import time
+
+from . import DEFAULT_DATA_DIR, analysis, rawstore, rollups, series
+from .db import BATCH_SIZE, connection, init_db, transaction
+from .results import UPSERT_SQL as _ANALYSIS_SQL, dumps as dump_results
+from .storage import (
+    DEFAULT_PROCESSED_FORMAT,
+    PROCESSED_FORMATS,
+    PROCESSING_VERSION,
+    SESSION_STAT_COLUMNS,
+    _process_and_save,
+    _session_stats,
+    parse_raw_text,
+)
+
+LOG = logging.getLogger("sensor_server.reprocess")
+
+PROGRESS_INTERVAL_S = 2.0
+# Tasks handed to the pool ahead of the results, per worker.
+IN_FLIGHT_PER_WORKER = 4
+
+_DONE_SQL = (
+    "UPDATE sessions SET status = 'done', error = NULL, raw_filename = ?, imu_csv = ?, heart_csv = ?, rotation_file = ?, "
+    "processed_format = ?, " + ", ".join(c + " = ?" for c in SESSION_STAT_COLUMNS)
+    + ", processing_version = ?, raw_sha256 = ?, raw_size = ?, raw_mtime_ns = ? WHERE id = ?"
+)
+_FAILED_SQL = "UPDATE sessions SET status = 'failed', error = ?, raw_filename = ? WHERE id = ?"
+_FINGERPRINT_SQL = "UPDATE sessions SET raw_filename = ?, raw_sha256 = ?, raw_size = ?, raw_mtime_ns = ? WHERE id = ?"
+_INSERT_COLUMNS = ("created_at", "raw_filename", "device_id", "status", "error", "imu_csv", "heart_csv", "rotation_file", "processed_format") \
+    + SESSION_STAT_COLUMNS + ("processing_version", "raw_sha256", "raw_size", "raw_mtime_ns")
+_INSERT_SQL = f"INSERT INTO sessions ({', '.join(_INSERT_COLUMNS)}) VALUES ({','.join('?' * len(_INSERT_COLUMNS))})"
+# Results of a session inserted earlier in the same batch, found by its raw name.
+_NEW_ANALYSIS_SQL = (
+    "INSERT OR REPLACE INTO session_analysis (session_id, version, created_at, results) "
+    "SELECT id, ?, ?, ? FROM sessions WHERE raw_filename = ?"
+)
+
+
+def reprocess_one(data_dir: Path, raw_filename: str, processed_format: str, current: bool, known_sha256: Optional[str]) -> Dict[str, Any]:
+    """Pool task: hash one raw file and, unless it turns out up to date, process it.
+
+    ``current`` means the row was written by this PROCESSING_VERSION; it is
+    then kept when the content hash matches ``known_sha256`` (or when no hash
+    was recorded yet, as for rows written by the upload path).
+    """
+    path = Path(data_dir) / "raw_data" / raw_filename
+    result: Dict[str, Any] = {"raw": raw_filename, "bytes": 0}
+    try:
+        st = path.stat()
+        with rawstore.open_raw(path) as fh:
+            data = fh.read()
+        result.update(size=st.st_size, mtime_ns=st.st_mtime_ns, bytes=len(data),
+                      sha256=hashlib.sha256(data).hexdigest())
+        if current and known_sha256 in (None, result["sha256"]):
+            result["status"] = "unchanged"
+            return result
+        ok, session = parse_raw_text(raw_filename, data.decode("utf-8"))
+        del data
+        if not ok:
+            return {**result, "status": "failed", "error": session}
+        ok, info = _process_and_save(Path(data_dir), raw_filename, "", session, processed_format)
+        if not ok:
+            return {**result, "status": "failed", "error": info.get("error")}
+        result["processed"] = info["processed"]
+        imu = session.imu
+        hr = session.heart_rate
+        results = analysis.analysis_results(hr["bpm"], imu["t"], imu["ax"], imu["ay"], imu["az"], session.rotation, hr["t"])
+        result["stats"] = _session_stats(session, results["orientation"])
+        result["analysis"] = (results["version"], dump_results(results))
+        result["status"] = "done"
+        return result
+    except Exception as exc:
+        return {**result, "status": "failed", "error": f"{type(exc).__name__}: {exc}"}
+
+
+def _load_rows(db_path: Path) -> Dict[str, Dict[str, Any]]:
+    """Sessions rows keyed by raw stem (the part of the raw name without extensions)."""
+    with connection(db_path) as conn:
+        rows = conn.execute(
+            "SELECT id, raw_filename, status, imu_csv, heart_csv, rotation_file, processed_format, processing_version, "
+            "raw_sha256, raw_size, raw_mtime_ns FROM sessions WHERE raw_filename IS NOT NULL ORDER BY id"
+        ).fetchall()
+    # A stem with several rows keeps the newest one.
+    return {rawstore.raw_stem(row["raw_filename"]): dict(row) for row in rows}
+
+
+def _raw_files(raw_dir: Path, rows: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """One raw filename (relative to ``raw_dir``) per stem, preferring the name the row points at.
+
+    A stem can have two files when a compression was interrupted.
+    """
+    files: Dict[str, str] = {}
+    for path in rawstore.iter_raw_files(raw_dir):
+        name = rawstore.relative_name(raw_dir, path)
+        stem = rawstore.raw_stem(name)
+        row = rows.get(stem)
+        if stem not in files or (row is not None and row["raw_filename"] == name):
+            files[stem] = name
+    return files
+
+
+def _is_current(data_dir: Path, row: Dict[str, Any], processed_format: str) -> bool:
+    processed_dir = data_dir / "processed_data"
+    return (
+        row["status"] == "done"
+        and row["processing_version"] == PROCESSING_VERSION
+        and row["processed_format"] == processed_format
+        and bool(row["imu_csv"]) and (processed_dir / row["imu_csv"]).exists()
+        and bool(row["heart_csv"]) and (processed_dir / row["heart_csv"]).exists()
+        and (not row["rotation_file"] or (processed_dir / row["rotation_file"]).exists())
+    )
+
+
+def _plan(data_dir: Path, processed_format: str, force: bool) -> Tuple[List[tuple], int]:
+    """Pool tasks ``(raw_filename, current, known_sha256, row)`` and the count skipped by stat."""
+    rows = _load_rows(data_dir / "sessions.db")
+    tasks = []
+    skipped = 0
+    for stem, name in _raw_files(data_dir / "raw_data", rows).items():
+        row = rows.get(stem)
+        if row is None and rawstore.is_ndjson(name):
+            continue  # log of a chunked upload that never got its row
+        if row is not None and row["status"] in ("receiving", "queued", "processing"):
+            continue  # owned by the server
+        current = row is not None and not force and _is_current(data_dir, row, processed_format)
+        if current and row["raw_filename"] == name:
+            st = (data_dir / "raw_data" / name).stat()
+            if (row["raw_size"], row["raw_mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+                skipped += 1
+                continue
+        tasks.append((name, current, row["raw_sha256"] if current else None, row))
+    return tasks, skipped
+
+
+def _run(data_dir: Path, tasks: List[tuple], processed_format: str, jobs: int) -> Iterator[Tuple[tuple, Dict[str, Any]]]:
+    """Yield ``(task, result)`` as results come in; ``jobs`` <= 1 runs inline."""
+    if jobs <= 1:
+        for task in tasks:
+            yield task, reprocess_one(data_dir, task[0], processed_format, task[1], task[2])
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = {}
+        todo = iter(tasks)
+        while True:
+            # Keep a bounded window in flight so results stream back in step with submission.
+            for task in todo:
+                pending[executor.submit(reprocess_one, data_dir, task[0], processed_format, task[1], task[2])] = task
+                if len(pending) >= jobs * IN_FLIGHT_PER_WORKER:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+
+def _statements(row: Optional[Dict[str, Any]], result: Dict[str, Any]) -> List[Tuple[str, tuple]]:
+    status = result["status"]
+    raw = result["raw"]
+    now = int(datetime.datetime.now().timestamp())
+    fingerprint = (result.get("sha256"), result.get("size"), result.get("mtime_ns"))
+    if row is None:
+        processed = result.get("processed", {})
+        stats = result.get("stats", {})
+        statements = [(_INSERT_SQL, (
+            now, raw, rawstore.device_of(raw), status, result.get("error"),
+            processed.get("imu"), processed.get("heart_rate"), processed.get("rotation"), processed.get("format"),
+        ) + tuple(stats.get(c) for c in SESSION_STAT_COLUMNS) + (
+            (PROCESSING_VERSION,) + fingerprint if status == "done" else (None, None, None, None)
+        ))]
+        if status == "done":
+            version, results_json = result["analysis"]
+            statements.append((_NEW_ANALYSIS_SQL, (version, now, results_json, raw)))
+        return statements
+    if status == "unchanged":
+        return [(_FINGERPRINT_SQL, (raw,) + fingerprint + (row["id"],))]
+    if status == "failed":
+        return [(_FAILED_SQL, (result.get("error"), raw, row["id"]))]
+    processed = result["processed"]
+    version, results_json = result["analysis"]
+    return [
+        (_DONE_SQL, (raw, processed["imu"], processed["heart_rate"], processed.get("rotation"), processed["format"])
+         + tuple(result["stats"].get(c) for c in SESSION_STAT_COLUMNS) + (PROCESSING_VERSION,) + fingerprint + (row["id"],)),
+        (_ANALYSIS_SQL, (row["id"], version, now, results_json)),
+    ]
+
+
+def _flush(data_dir: Path, statements: List[Tuple[str, tuple]], stale: List[Path]) -> None:
+    # Grouped by statement in order of first use, so a new session's INSERT runs before its results.
+    by_sql: Dict[str, List[tuple]] = {}
+    for sql, params in statements:
+        by_sql.setdefault(sql, []).append(params)
+    with transaction(data_dir / "sessions.db") as conn:
+        for sql, params in by_sql.items():
+            conn.executemany(sql, params)
+    # Processed files replaced under another name (e.g. csv -> kcol) go once the rows no longer point at them.
+    for path in stale:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+    statements.clear()
+    stale.clear()
+
+
+def reprocess(data_dir: Path, jobs: Optional[int] = None, processed_format: str = DEFAULT_PROCESSED_FORMAT,
+              force: bool = False, progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Bring every finished session in ``data_dir`` up to date. Returns run counters.
+
+    ``jobs`` defaults to the CPU count. ``progress`` is called with the
+    counters at most every PROGRESS_INTERVAL_S seconds. ``checked`` counts the
+    files that were read (hashed, and processed unless unchanged).
+    """
+    if processed_format not in PROCESSED_FORMATS:
+        raise ValueError(f"Unknown processed format: {processed_format}")
+    data_dir = Path(data_dir)
+    jobs = jobs if jobs is not None else (os.cpu_count() or 1)
+    start = time.perf_counter()
+    tasks, skipped = _plan(data_dir, processed_format, force)
+    stats = {"sessions": len(tasks) + skipped, "done": skipped, "checked": 0, "processed": 0,
+             "unchanged": skipped, "failed": 0, "bytes": 0, "seconds": 0.0}
+
+    statements: List[Tuple[str, tuple]] = []
+    stale: List[Path] = []
+    last_report = start
+    for (_, _, _, row), result in _run(data_dir, tasks, processed_format, jobs):
+        stats["done"] += 1
+        stats["checked"] += 1
+        stats["bytes"] += result["bytes"]
+        stats[{"done": "processed"}.get(result["status"], result["status"])] += 1
+        if result["status"] == "failed":
+            LOG.warning("Failed to reprocess %s: %s", result["raw"], result.get("error"))
+        statements += _statements(row, result)
+        if row is not None and result["status"] == "done":
+            new = {name for name in result["processed"].values() if name}
+            for old in (row[k] for k in ("imu_csv", "heart_csv", "rotation_file")):
+                if old and old not in new:
+                    stale.append(data_dir / "processed_data" / old)
+                    if series.lod_filename(old) not in map(series.lod_filename, new):
+                        stale.append(data_dir / "processed_data" / series.lod_filename(old))
+        if len(statements) >= BATCH_SIZE:
+            _flush(data_dir, statements, stale)
+        now = time.perf_counter()
+        if progress is not None and now - last_report >= PROGRESS_INTERVAL_S:
+            last_report = now
+            progress({**stats, "seconds": now - start})
+    if statements:
+        _flush(data_dir, statements, stale)
+    if stats["processed"] or stats["failed"]:
+        # Rows were rewritten outside storage's per-session hooks: refresh the trends in one pass.
+        rollups.rebuild(data_dir)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def _print_progress(stats: Dict[str, Any]) -> None:
+    seconds = max(stats["seconds"], 1e-9)
+    print(f"{stats['done']}/{stats['sessions']} sessions: {stats['processed']} processed, "
+          f"{stats['unchanged']} unchanged, {stats['failed']} failed "
+          f"({stats['checked'] / seconds:.1f} sessions/s, {stats['bytes'] / 1e6 / seconds:.1f} MB/s raw)")
+    sys.stdout.flush()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild processed data and sessions rows from data/raw_data.")
+    parser.add_argument("--data-dir", type=Path, default=None, help="data directory (default: SENSOR_DATA_DIR or data/)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: CPU count; 1 runs inline)")
+    parser.add_argument("--format", choices=sorted(PROCESSED_FORMATS),
+                        default=os.environ.get("SENSOR_PROCESSED_FORMAT", DEFAULT_PROCESSED_FORMAT))
+    parser.add_argument("--force", action="store_true", help="reprocess sessions that are up to date")
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir or Path(os.environ.get("SENSOR_DATA_DIR") or DEFAULT_DATA_DIR)
+    init_db(data_dir)
+    stats = reprocess(data_dir, args.jobs, args.format, args.force, progress=_print_progress)
+    _print_progress(stats)
+    print(f"Finished in {stats['seconds']:.2f} s")
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Stored per-session analysis results and the in-memory cache in front of them.
+
+``analysis.analysis_results`` output is kept as JSON in the session_analysis
+table with the ``analysis_version()`` that produced it. Results stored under
+another version are stale: the next lookup recomputes them from the session's
+processed files and replaces the row, so changing a strike threshold or zone
+bound takes effect without a migration. Recomputed results read the processed
+files, whose float32 sensor columns (.kcol) can move forces in the 7th
+significant digit relative to results computed at upload time.
+"""
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+import datetime
+import logging
+import sqlite3
+import threading
+
+from . import analysis, jsoncodec, rollups
+from .db import connection, transaction
+
+LOG = logging.getLogger("sensor_server.results")
+
+RESULTS_CACHE_SIZE = 256
+
+UPSERT_SQL = (
+    "INSERT INTO session_analysis (session_id, version, created_at, results) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(session_id) DO UPDATE SET version = excluded.version, "
+    "created_at = excluded.created_at, results = excluded.results"
+)
+
+
+class ResultsError(Exception):
+    """A session's results cannot be served; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class ResultsCache:
+    """LRU of serialized results keyed by ``(session_id, analysis version)``. Thread-safe."""
+
+    def __init__(self, max_entries: int = RESULTS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[int, str], str]" = OrderedDict()
+
+    def get(self, key: Tuple[int, str]) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def put(self, key: Tuple[int, str], text: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def dumps(results: Dict[str, Any]) -> str:
+    return jsoncodec.dumps(results)
+
+
+def save_results(conn: sqlite3.Connection, session_id: int, results_json: str, version: str) -> None:
+    """Store serialized results inside the caller's transaction."""
+    conn.execute(UPSERT_SQL, (session_id, version, int(datetime.datetime.now().timestamp()), results_json))
+
+
+def compute_results(directory: Path, imu_file: Optional[str], heart_file: Optional[str], rotation_file: Optional[str] = None) -> Dict[str, Any]:
+    """Run the analysis over a session's processed files."""
+    from .storage import read_processed
+
+    imu = read_processed(directory, imu_file) if imu_file else {}
+    heart = read_processed(directory, heart_file) if heart_file else {}
+    rotation = read_processed(directory, rotation_file) if rotation_file else None
+    empty = []
+    return analysis.analysis_results(
+        heart.get("bpm", empty), imu.get("t", empty), imu.get("ax", empty), imu.get("ay", empty), imu.get("az", empty), rotation,
+        heart.get("t", empty),
+    )
+
+
+def session_results_json(directory: Path, session_id: int, cache: Optional[ResultsCache] = None) -> str:
+    """Serialized results of a finished session: from ``cache``, the DB, or computed and stored.
+
+    Raises ResultsError (404 unknown session, 409 not processed yet).
+    """
+    version = analysis.analysis_version()
+    key = (session_id, version)
+    if cache is not None:
+        text = cache.get(key)
+        if text is not None:
+            return text
+
+    db_path = Path(directory) / "sessions.db"
+    with connection(db_path) as conn:
+        row = conn.execute(
+            "SELECT s.status, s.imu_csv, s.heart_csv, s.rotation_file, a.version, a.results FROM sessions s "
+            "LEFT JOIN session_analysis a ON a.session_id = s.id WHERE s.id = ?",
+            (session_id,),
+        ).fetchone()
+    if row is None:
+        raise ResultsError("Session not found", 404)
+    # Rows written before the queue existed have no status and are complete.
+    if (row["status"] or "done") != "done":
+        raise ResultsError(f"Session is {row['status']}", 409)
+
+    if row["version"] == version:
+        text = row["results"]
+    else:
+        LOG.info("Computing analysis of session %s (version %s)", session_id, version)
+        results = compute_results(Path(directory), row["imu_csv"], row["heart_csv"], row["rotation_file"])
+        text = dumps(results)
+        with transaction(db_path) as conn:
+            save_results(conn, session_id, text, version)
+            # New parameters can move strike counts and zones: keep the trends in step.
+            rollups.record_session(conn, session_id, results)
+    if cache is not None:
+        cache.put(key, text)
+    return text
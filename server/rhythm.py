@@ -0,0 +1,198 @@
+"""
+Swing rhythm and heart-rate variability.
+
+The accelerometer magnitude is averaged onto a RHYTHM_RATE_HZ grid (the
+swing band is far below the IMU rate, so the FFTs stay short). The grid is cut
+into CADENCE_WINDOW-sample windows every CADENCE_HOP samples. Each complete,
+active window gets the power spectrum of its Hann-windowed, mean-removed
+samples in CADENCE_BAND_HZ. Its dominant frequency is the window's swing
+cadence. The mean of those spectra (Welch's method) gives the session cadence.
+Rhythm consistency is the spread of the window cadences and of the intervals
+between strikes.
+
+HRV comes from the bpm readings converted to intervals (60000 / bpm). The
+watch reports averaged heart rate rather than beat-to-beat intervals, so
+SDNN and RMSSD here track slow variability, and are comparable between
+sessions rather than with clinical values.
+
+With the NumPy backend, windows are strided views of the grid and one
+batched rfft computes every spectrum. The pure-Python loops only evaluate the
+band's frequency bins. Both agree to rounding.
+"""
+from typing import Any, Dict, List, Optional
+import math
+
+from . import analysis
+
+# Rhythm parameters; they are part of analysis_params().
+RHYTHM_RATE_HZ = 10.0
+CADENCE_WINDOW = 256  # grid samples per window (25.6 s)
+CADENCE_HOP = 128
+CADENCE_BAND_HZ = (0.2, 3.0)
+# Windows whose magnitude varies less than this (G, standard deviation) are idle.
+CADENCE_MIN_STD_G = 0.05
+# Strike intervals longer than this are pauses and do not count for the rhythm.
+STRIKE_BREAK_MS = 5000
+
+
+def rhythm_params() -> Dict[str, Any]:
+    return {
+        "rate_hz": RHYTHM_RATE_HZ,
+        "window": CADENCE_WINDOW,
+        "hop": CADENCE_HOP,
+        "band_hz": list(CADENCE_BAND_HZ),
+        "min_std_g": CADENCE_MIN_STD_G,
+        "strike_break_ms": STRIKE_BREAK_MS,
+    }
+
+
+def _engine():
+    return analysis.analysis_numpy if analysis.get_backend() == "numpy" else None
+
+
+def band_bins(rate_hz: float = RHYTHM_RATE_HZ, window: int = CADENCE_WINDOW, band=CADENCE_BAND_HZ):
+    """First and last FFT bin inside ``band``."""
+    step = rate_hz / window
+    return math.ceil(band[0] / step), min(window // 2, math.floor(band[1] / step))
+
+
+def magnitude_grid(t_col, ax, ay, az, rate_hz: float = RHYTHM_RATE_HZ):
+    """
+    Mean accelerometer magnitude per 1/rate_hz bin from the first finite
+    timestamp, as (start ms, list); NaN where a bin has no samples.
+    """
+    step = 1000.0 / rate_hz
+    engine = _engine()
+    if engine is not None and len(t_col) >= analysis.ENGINE_MIN_BATCH:
+        return engine.grid_means(t_col, engine.magnitudes(ax, ay, az), step)
+    finite_t = analysis.finite_values(t_col)
+    if not finite_t:
+        return None, []
+    t0 = min(finite_t)
+    size = int((max(finite_t) - t0) // step) + 1
+    sums, counts = [0.0] * size, [0] * size
+    for t, magnitude in zip(t_col, analysis.magnitude_column(ax, ay, az)):
+        if t == t and magnitude == magnitude:
+            i = int((t - t0) // step)
+            sums[i] += magnitude
+            counts[i] += 1
+    return t0, [s / c if c else analysis.NAN for s, c in zip(sums, counts)]
+
+
+def band_powers(grid: List[float], window: int = CADENCE_WINDOW, hop: int = CADENCE_HOP, bins=None):
+    """
+    (power rows, stds) of every window of ``grid``: the power in bins
+    ``bins[0]..bins[1]`` of the Hann-windowed, mean-removed window, and the
+    window's standard deviation. Windows containing NaN get None and NaN.
+    """
+    lo, hi = bins or band_bins(window=window)
+    engine = _engine()
+    if engine is not None:
+        return engine.band_powers(grid, window, hop, lo, hi)
+    if len(grid) < window:
+        return [], []
+    hann = [0.5 - 0.5 * math.cos(2.0 * math.pi * n / window) for n in range(window)]
+    tables = [
+        ([math.cos(2.0 * math.pi * k * n / window) for n in range(window)],
+         [math.sin(2.0 * math.pi * k * n / window) for n in range(window)])
+        for k in range(lo, hi + 1)
+    ]
+    rows, stds = [], []
+    for start in range(0, len(grid) - window + 1, hop):
+        frame = grid[start:start + window]
+        if any(v != v for v in frame):
+            rows.append(None)
+            stds.append(analysis.NAN)
+            continue
+        mean = sum(frame) / window
+        centered = [v - mean for v in frame]
+        stds.append(math.sqrt(sum(v * v for v in centered) / window))
+        x = [v * h for v, h in zip(centered, hann)]
+        row = []
+        for cos_k, sin_k in tables:
+            re = sum(v * c for v, c in zip(x, cos_k))
+            im = sum(v * s for v, s in zip(x, sin_k))
+            row.append(re * re + im * im)
+        rows.append(row)
+    return rows, stds
+
+
+def peak_frequency(powers: List[float], first_bin: int, rate_hz: float = RHYTHM_RATE_HZ, window: int = CADENCE_WINDOW) -> float:
+    """Frequency (Hz) of the highest bin, refined by a parabola through it and its neighbours."""
+    i = max(range(len(powers)), key=powers.__getitem__)
+    offset = 0.0
+    if 0 < i < len(powers) - 1:
+        a, b, c = powers[i - 1], powers[i], powers[i + 1]
+        curvature = a - 2.0 * b + c
+        if curvature < 0:
+            offset = 0.5 * (a - c) / curvature
+    return (first_bin + i + offset) * rate_hz / window
+
+
+def _cv(values: List[float]) -> Optional[float]:
+    if len(values) < 2:
+        return None
+    mean = sum(values) / len(values)
+    if not mean:
+        return None
+    return math.sqrt(sum((v - mean) ** 2 for v in values) / len(values)) / mean
+
+
+def rhythm_summary(t_col, ax, ay, az, strike_times) -> Dict[str, Any]:
+    """
+    Rhythm section of analysis_results. It has the session cadence
+    (``cadence_spm``, swings per minute) and the share of the band's power in
+    its peak bin. Per window it has the start time (ms) and the cadence, None
+    for idle or incomplete windows. ``cadence_cv`` is the coefficient of
+    variation of the window cadences. The strike rhythm is the mean and
+    coefficient of variation of the intervals between strikes, leaving out
+    pauses.
+    """
+    lo, hi = band_bins()
+    t0, grid = magnitude_grid(t_col, ax, ay, az)
+    rows, stds = band_powers(grid, bins=(lo, hi))
+    active = [row for row, std in zip(rows, stds) if std >= CADENCE_MIN_STD_G]
+    cadences = [peak_frequency(row, lo) * 60.0 if std >= CADENCE_MIN_STD_G else None for row, std in zip(rows, stds)]
+    found = [c for c in cadences if c is not None]
+
+    cadence = share = None
+    if active:
+        welch = [sum(column) / len(active) for column in zip(*active)]
+        total = sum(welch)
+        cadence = peak_frequency(welch, lo) * 60.0
+        share = max(welch) / total if total else None
+
+    intervals = [b - a for a, b in zip(strike_times, strike_times[1:]) if b - a <= STRIKE_BREAK_MS]
+    step = 1000.0 / RHYTHM_RATE_HZ
+    return {
+        "cadence_spm": cadence,
+        "cadence_peak_share": share,
+        "cadence_cv": _cv(found),
+        "window_s": CADENCE_WINDOW / RHYTHM_RATE_HZ,
+        "window_starts": [t0 + i * CADENCE_HOP * step for i in range(len(rows))],
+        "window_cadence_spm": cadences,
+        "active_windows": len(found),
+        "strike_interval_ms": sum(intervals) / len(intervals) if intervals else None,
+        "strike_interval_cv": _cv(intervals),
+    }
+
+
+def hrv_summary(hr_t, bpm) -> Optional[Dict[str, Any]]:
+    """
+    HRV section of analysis_results from the bpm readings (see the module
+    docstring): mean interval, SDNN and RMSSD in ms. Successive differences
+    across heart-rate gaps (analysis.HR_GAP_MS) are left out. None with fewer
+    than two readings.
+    """
+    t, b = analysis.hr_timeline(hr_t, bpm)
+    if len(t) < 2:
+        return None
+    rr = [60000.0 / v for v in b]
+    mean = sum(rr) / len(rr)
+    diffs = [rr[i] - rr[i - 1] for i in range(1, len(rr)) if t[i] - t[i - 1] <= analysis.HR_GAP_MS]
+    return {
+        "readings": len(rr),
+        "mean_rr_ms": mean,
+        "sdnn_ms": math.sqrt(sum((v - mean) ** 2 for v in rr) / len(rr)),
+        "rmssd_ms": math.sqrt(sum(d * d for d in diffs) / len(diffs)) if diffs else None,
+    }
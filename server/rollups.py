@@ -0,0 +1,223 @@
+"""
+Per-day rollups of finished sessions for cross-session trends.
+
+Each finished session contributes one row to ``rollup_sessions``: its device,
+local day and additive totals (duration, strikes, strike force, intensity,
+seconds per HR zone). ``rollup_days`` holds the per-day sums and
+``rollup_device_days`` the per-device, per-day sums. Whenever a session is
+recorded or re-analysed, its contribution row is replaced and the affected
+days are re-summed from their contributions, inside the caller's transaction.
+So repeated updates never double count, and a day costs only as many rows as
+it has sessions. Weeks and months are summed from days at query time.
+
+``rebuild`` (``python -m server.rebuild_rollups``) rebuilds the tables from
+sessions.db in one pass, computing analysis results that are missing or stale
+on the way.
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import datetime
+import logging
+import sqlite3
+import time
+
+from . import analysis, jsoncodec
+from .db import BATCH_SIZE, ROLLUP_SUM_COLUMNS as SUM_COLUMNS, connection, transaction
+
+LOG = logging.getLogger("sensor_server.rollups")
+
+ZONE_COLUMNS = SUM_COLUMNS[5:]
+
+# bucket -> SQL expression mapping a day (YYYY-MM-DD) to the first day of its bucket.
+BUCKETS = {
+    "day": "day",
+    "week": "date(day, 'weekday 0', '-6 days')",  # weeks start on Monday
+    "month": "strftime('%Y-%m-01', day)",
+}
+TREND_MAX_ROWS = 5000
+
+_SUMS = ", ".join(f"SUM({c})" for c in SUM_COLUMNS)
+_REFRESH_SQL = (
+    f"INSERT OR REPLACE INTO rollup_days (day, sessions, {', '.join(SUM_COLUMNS)}) "
+    f"SELECT day, COUNT(*), {_SUMS} FROM rollup_sessions WHERE day = ? GROUP BY day"
+)
+_REFRESH_DEVICE_SQL = (
+    f"INSERT OR REPLACE INTO rollup_device_days (device_id, day, sessions, {', '.join(SUM_COLUMNS)}) "
+    f"SELECT device_id, day, COUNT(*), {_SUMS} FROM rollup_sessions WHERE device_id = ? AND day = ? GROUP BY device_id, day"
+)
+_FACT_SQL = (
+    f"INSERT OR REPLACE INTO rollup_sessions (session_id, device_id, day, {', '.join(SUM_COLUMNS)}) "
+    f"VALUES ({','.join('?' * (len(SUM_COLUMNS) + 3))})"
+)
+
+
+class TrendsError(ValueError):
+    """Invalid trend parameters (reported to clients as 400)."""
+
+
+def day_of(created_at: int) -> str:
+    """Local calendar day of a unix timestamp, as rollups are keyed."""
+    return datetime.datetime.fromtimestamp(int(created_at)).date().isoformat()
+
+
+def session_fact(created_at: int, duration: Optional[float], summary: Optional[Dict[str, Any]]) -> tuple:
+    """``(day,) + SUM_COLUMNS`` of one session.
+
+    ``summary`` is analysis_results output (or the same keys from the chunked
+    upload's running aggregates); None counts only the session and its duration.
+    """
+    summary = summary or {}
+    duration = duration or 0.0
+    strikes = summary.get("strikes") or {}
+    intensity = summary.get("intensity")
+    alignment = summary.get("alignment")
+    if alignment:
+        zone_seconds = list(alignment["zone_seconds"].values())
+    else:
+        zones = list((summary.get("zones") or {}).values())
+        zone_total = sum(zones)
+        # Without heart-rate timestamps each sample stands for an equal share of the session.
+        zone_seconds = [n * duration / zone_total if zone_total else 0.0 for n in zones] or [0.0] * len(ZONE_COLUMNS)
+    count = strikes.get("strike_count") or 0
+    return (
+        day_of(created_at),
+        duration,
+        count,
+        (strikes.get("avg_strike_force") or 0.0) * count,
+        intensity["avg_intensity"] if intensity else 0.0,
+        1 if intensity else 0,
+    ) + tuple(zone_seconds)
+
+
+def _refresh_days(conn: sqlite3.Connection, days: Iterable[Tuple[Optional[str], str]]) -> None:
+    """Re-sum the given ``(device_id, day)`` pairs; every day of the overall table once."""
+    days = set(days)
+    for day in {day for _, day in days}:
+        conn.execute("DELETE FROM rollup_days WHERE day = ?", (day,))
+        conn.execute(_REFRESH_SQL, (day,))
+    for device_id, day in days:
+        if device_id is not None:
+            conn.execute("DELETE FROM rollup_device_days WHERE device_id = ? AND day = ?", (device_id, day))
+            conn.execute(_REFRESH_DEVICE_SQL, (device_id, day))
+
+
+def record_session(conn: sqlite3.Connection, session_id: int, summary: Optional[Dict[str, Any]]) -> None:
+    """Bring the rollups in line with one session's row, inside the caller's transaction.
+
+    Sessions that are not done are removed from the rollups.
+    """
+    row = conn.execute("SELECT created_at, duration, status, device_id FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    old = conn.execute("SELECT device_id, day FROM rollup_sessions WHERE session_id = ?", (session_id,)).fetchone()
+    days = [tuple(old)] if old else []
+    if row is not None and (row[2] or "done") == "done" and row[0] is not None:
+        fact = session_fact(row[0], row[1], summary)
+        conn.execute(_FACT_SQL, (session_id, row[3]) + fact)
+        days.append((row[3], fact[0]))
+    elif old:
+        conn.execute("DELETE FROM rollup_sessions WHERE session_id = ?", (session_id,))
+    _refresh_days(conn, days)
+
+
+def rebuild(data_dir: Path) -> Dict[str, Any]:
+    """Recompute both rollup tables from the sessions and their analysis results."""
+    from .results import session_results_json
+
+    data_dir = Path(data_dir)
+    db_path = data_dir / "sessions.db"
+    start = time.perf_counter()
+    version = analysis.analysis_version()
+    with connection(db_path) as conn:
+        rows = conn.execute(
+            "SELECT s.id, s.created_at, s.duration, s.device_id, a.version, "
+            "json_extract(a.results, '$.strikes') AS strikes, json_extract(a.results, '$.intensity') AS intensity, "
+            "json_extract(a.results, '$.zones') AS zones, json_extract(a.results, '$.alignment.zone_seconds') AS zone_seconds "
+            "FROM sessions s LEFT JOIN session_analysis a ON a.session_id = s.id "
+            "WHERE COALESCE(s.status, 'done') = 'done' AND s.created_at IS NOT NULL ORDER BY s.id"
+        ).fetchall()
+
+    facts: List[tuple] = []
+    computed = 0
+    for row in rows:
+        if row["version"] == version:
+            # Only the summary fields leave SQLite; strike lists stay in the row.
+            summary = {k: jsoncodec.loads(row[k]) if row[k] is not None else None for k in ("strikes", "intensity", "zones")}
+            if row["zone_seconds"] is not None:
+                summary["alignment"] = {"zone_seconds": jsoncodec.loads(row["zone_seconds"])}
+        else:
+            try:
+                summary = jsoncodec.loads(session_results_json(data_dir, row["id"]))
+                computed += 1
+            except Exception as exc:
+                LOG.warning("No analysis for session %s: %s", row["id"], exc)
+                summary = None
+        facts.append((row["id"], row["device_id"]) + session_fact(row["created_at"], row["duration"], summary))
+
+    with transaction(db_path) as conn:
+        conn.execute("DELETE FROM rollup_sessions")
+        conn.execute("DELETE FROM rollup_days")
+        conn.execute("DELETE FROM rollup_device_days")
+        for i in range(0, len(facts), BATCH_SIZE):
+            conn.executemany(_FACT_SQL, facts[i:i + BATCH_SIZE])
+        conn.execute(
+            f"INSERT INTO rollup_days (day, sessions, {', '.join(SUM_COLUMNS)}) "
+            f"SELECT day, COUNT(*), {_SUMS} FROM rollup_sessions GROUP BY day"
+        )
+        conn.execute(
+            f"INSERT INTO rollup_device_days (device_id, day, sessions, {', '.join(SUM_COLUMNS)}) "
+            f"SELECT device_id, day, COUNT(*), {_SUMS} FROM rollup_sessions WHERE device_id IS NOT NULL GROUP BY device_id, day"
+        )
+        days = conn.execute("SELECT COUNT(*) FROM rollup_days").fetchone()[0]
+    return {"sessions": len(facts), "days": days, "computed": computed, "seconds": time.perf_counter() - start}
+
+
+def _parse_day(value: Optional[str], name: str) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    if value.isdigit():
+        return day_of(int(value))
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise TrendsError(f"{name} must be YYYY-MM-DD or a unix timestamp")
+
+
+def trends(db_path: Path, bucket: str = "day", day_from: Optional[str] = None, day_to: Optional[str] = None,
+           device_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Per-bucket totals between two days (inclusive, YYYY-MM-DD or unix time), oldest first.
+
+    With ``device_id`` only that device's sessions count, read from its own rows of ``rollup_device_days``.
+    """
+    if bucket not in BUCKETS:
+        raise TrendsError(f"bucket must be one of {', '.join(BUCKETS)}")
+    day_from, day_to = _parse_day(day_from, "from"), _parse_day(day_to, "to")
+    where, params = [], []
+    table = "rollup_days"
+    if device_id:
+        table = "rollup_device_days"
+        where.append("device_id = ?")
+        params.append(device_id)
+    if day_from:
+        where.append("day >= ?")
+        params.append(day_from)
+    if day_to:
+        where.append("day <= ?")
+        params.append(day_to)
+    sql = (
+        f"SELECT {BUCKETS[bucket]} AS start, SUM(sessions) AS sessions, {_SUMS} FROM {table} "
+        f"{'WHERE ' + ' AND '.join(where) if where else ''} GROUP BY start ORDER BY start LIMIT {TREND_MAX_ROWS}"
+    )
+    labels = analysis.hr_zone_labels()
+    out = []
+    with connection(db_path) as conn:
+        for row in conn.execute(sql, params):
+            start, sessions, duration, strikes, force_sum, intensity_sum, intensity_sessions = row[:7]
+            out.append({
+                "start": start,
+                "sessions": sessions,
+                "duration_s": duration,
+                "strikes": strikes,
+                "avg_strike_force": force_sum / strikes if strikes else None,
+                "avg_intensity": intensity_sum / intensity_sessions if intensity_sessions else None,
+                "hr_zone_seconds": dict(zip(labels, row[7:])),
+            })
+    return out
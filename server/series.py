@@ -0,0 +1,240 @@
+"""
+Level-of-detail pyramids of a session's chart metrics and window queries on them.
+
+Each processed stream gets a companion ``<base>_<stream>_lod.kcol`` holding
+min/max/mean buckets of its metrics (``accel`` magnitude and the gyro axes for
+IMU, ``bpm`` for heart rate) over LOD_FACTOR, LOD_FACTOR**2, ... samples. All
+levels are stored one after another; the header meta records each level's
+bucket size and row range. The processed file itself serves as level 0.
+
+``query`` answers a time window with at most ``points`` buckets from the finest
+level that fits, reading only the window's rows through mmap, so the response
+and the work behind it are bounded by ``points`` however long the session is.
+Buckets follow the recorded sample order; lookups assume timestamps increase,
+as the devices send them.
+"""
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+import logging
+
+from . import analysis, columnar
+from .ingest import NAN
+
+LOG = logging.getLogger("sensor_server.series")
+
+LOD_FACTOR = 8
+# Levels are added until one has at most this many buckets.
+LOD_TOP_ROWS = 256
+LOD_SUFFIX = "_lod" + columnar.EXTENSION
+DEFAULT_POINTS = 1000
+MAX_POINTS = 5000
+
+STREAM_METRICS = {"imu": ("accel", "gx", "gy", "gz"), "heart_rate": ("bpm",)}
+METRIC_STREAMS = {metric: stream for stream, metrics in STREAM_METRICS.items() for metric in metrics}
+
+
+class SeriesError(ValueError):
+    """Invalid series parameters (reported to clients as 400)."""
+
+
+def lod_filename(processed_name: str) -> str:
+    """``session_x_imu.kcol`` (or ``.csv``) -> ``session_x_imu_lod.kcol``, in the same device directory."""
+    return str(Path(processed_name).with_suffix("")) + LOD_SUFFIX
+
+
+def _doubles(col) -> array:
+    return col if isinstance(col, array) and col.typecode == "d" else array("d", col)
+
+
+def _metric_values(metric: str, columns: Mapping[str, Any]):
+    if metric == "accel":
+        return analysis.magnitude_column(columns["ax"], columns["ay"], columns["az"])
+    return columns[metric]
+
+
+class LodBuilder:
+    """Builds the pyramid of one stream from column blocks fed in recorded order.
+
+    Memory is the first level (one bucket per LOD_FACTOR samples) plus the
+    block being added.
+    """
+
+    def __init__(self, stream: str):
+        self.stream = stream
+        self.metrics = STREAM_METRICS[stream]
+        self.samples = 0
+        self._carry: Dict[str, array] = {k: array("d") for k in ("t",) + self.metrics}
+        self._t = array("d")
+        self._n = array("d")
+        self._buckets = {m: (array("d"), array("d"), array("d"), array("d")) for m in self.metrics}
+
+    def add(self, columns: Mapping[str, Any]) -> None:
+        t = _doubles(columns["t"])
+        values = {m: _doubles(_metric_values(m, columns)) for m in self.metrics}
+        if any(v != v for v in t):
+            keep = [i for i, v in enumerate(t) if v == v]
+            t = array("d", (t[i] for i in keep))
+            values = {m: array("d", (col[i] for i in keep)) for m, col in values.items()}
+        self.samples += len(t)
+        carry = self._carry
+        if len(carry["t"]):
+            # Complete the bucket left open by the previous block.
+            need = LOD_FACTOR - len(carry["t"])
+            carry["t"].extend(t[:need])
+            for m in self.metrics:
+                carry[m].extend(values[m][:need])
+            if len(carry["t"]) < LOD_FACTOR:
+                return
+            self._bucket(carry, LOD_FACTOR)
+            t = t[need:]
+            values = {m: col[need:] for m, col in values.items()}
+            for col in carry.values():
+                del col[:]
+        full = len(t) // LOD_FACTOR * LOD_FACTOR
+        if full:
+            self._bucket({"t": t, **values}, full)
+        carry["t"].extend(t[full:])
+        for m in self.metrics:
+            carry[m].extend(values[m][full:])
+
+    def _bucket(self, columns: Mapping[str, Any], rows: int) -> None:
+        """Append the buckets of the first ``rows`` samples; only the last one may be partial."""
+        self._t.extend(columns["t"][:rows:LOD_FACTOR])
+        self._n.extend([float(LOD_FACTOR)] * (rows // LOD_FACTOR))
+        if rows % LOD_FACTOR:
+            self._n.append(float(rows % LOD_FACTOR))
+        for m in self.metrics:
+            col = columns[m]
+            if rows != len(col):
+                col = col[:rows]
+            for out, part in zip(self._buckets[m], analysis.bucket_values(col, LOD_FACTOR)):
+                out.extend(part)
+
+    def finish(self) -> Tuple[Dict[str, Iterable[float]], Dict[str, str], Dict[str, Any]]:
+        """Columns, dtypes and meta of the pyramid file."""
+        if len(self._carry["t"]):
+            self._bucket(self._carry, len(self._carry["t"]))
+        levels = [(LOD_FACTOR, self._t, self._n, self._buckets)]
+        while len(levels[-1][1]) > LOD_TOP_ROWS:
+            size, t, n, buckets = levels[-1]
+            n_sum = array("d", (sum(n[i:i + LOD_FACTOR]) for i in range(0, len(n), LOD_FACTOR)))
+            levels.append((size * LOD_FACTOR, t[::LOD_FACTOR], n_sum,
+                           {m: analysis.merge_buckets(*cols, LOD_FACTOR) for m, cols in buckets.items()}))
+
+        columns: Dict[str, array] = {"t": array("d"), "n": array("d")}
+        for m in self.metrics:
+            columns[f"{m}_min"], columns[f"{m}_max"], columns[f"{m}_mean"] = array("d"), array("d"), array("d")
+        specs = []
+        for size, t, n, buckets in levels:
+            specs.append({"size": size, "start": len(columns["t"]), "rows": len(t)})
+            columns["t"].extend(t)
+            columns["n"].extend(n)
+            for m, (mins, maxs, sums, counts) in buckets.items():
+                columns[f"{m}_min"].extend(mins)
+                columns[f"{m}_max"].extend(maxs)
+                columns[f"{m}_mean"].extend(s / c if c else NAN for s, c in zip(sums, counts))
+        dtypes = {name: "f4" for name in columns}
+        dtypes.update(t="f8", n="i4")
+        meta = {"stream": self.stream, "factor": LOD_FACTOR, "samples": self.samples, "levels": specs}
+        return columns, dtypes, meta
+
+    def write(self, target: Path) -> Tuple[bool, str]:
+        columns, dtypes, meta = self.finish()
+        return columnar.write_columns(target, columns, dtypes, meta)
+
+
+def write_lod(processed_dir: Path, processed_name: str, stream: str, columns: Mapping[str, Any]) -> Tuple[bool, str]:
+    """Build and write the pyramid of one processed stream from its in-memory columns."""
+    builder = LodBuilder(stream)
+    builder.add(columns)
+    return builder.write(processed_dir / lod_filename(processed_name))
+
+
+def _window(t, lo: int, hi: int, t_from: Optional[float], t_to: Optional[float]) -> Tuple[int, int]:
+    """Rows of ``t[lo:hi]`` covering [t_from, t_to], including the bucket that contains t_from."""
+    start = lo if t_from is None else max(lo, bisect_right(t, t_from, lo, hi) - 1)
+    stop = hi if t_to is None else bisect_right(t, t_to, lo, hi)
+    return start, max(start, stop)
+
+
+def _json_list(values) -> List[Optional[float]]:
+    return [v if v == v else None for v in values]
+
+
+def _raw_window(directory: Path, processed_name: str, metric: str, t_from, t_to, points: int) -> Optional[Dict[str, Any]]:
+    """Samples of the window from the processed file, or None if there are more than ``points``."""
+    names = ("t", "ax", "ay", "az") if metric == "accel" else ("t", metric)
+    if processed_name.endswith(columnar.EXTENSION):
+        with columnar.ColumnFile(directory / "processed_data" / processed_name) as cf:
+            t_view = cf.view("t")
+            try:
+                start, stop = _window(t_view, 0, cf.rows, t_from, t_to)
+            finally:
+                t_view.release()
+            if stop - start > points:
+                return None
+            cols = {name: cf.read(name, start, stop) for name in names}
+    else:
+        from .storage import read_processed
+        cols = read_processed(directory, processed_name)
+        start, stop = _window(cols["t"], 0, len(cols["t"]), t_from, t_to)
+        if stop - start > points:
+            return None
+        cols = {name: cols[name][start:stop] for name in names}
+    values = _json_list(_metric_values(metric, cols))
+    return {"bucket": 1, "t": list(cols["t"]), "min": values, "max": values, "mean": values}
+
+
+def query(directory: Path, processed_name: str, metric: str, t_from: Optional[float] = None,
+          t_to: Optional[float] = None, points: int = DEFAULT_POINTS) -> Dict[str, Any]:
+    """At most ``points`` min/max/mean buckets of ``metric`` over [t_from, t_to] (ms).
+
+    ``bucket`` in the result is the number of samples per bucket (1 for raw
+    samples). A missing pyramid (sessions from before pyramids existed) is
+    built from the processed file first.
+    """
+    if metric not in METRIC_STREAMS:
+        raise SeriesError(f"Unknown metric: {metric}")
+    if not 1 <= points <= MAX_POINTS:
+        raise SeriesError(f"points must be between 1 and {MAX_POINTS}")
+    directory = Path(directory)
+    lod_path = directory / "processed_data" / lod_filename(processed_name)
+    if not lod_path.exists():
+        from .storage import read_processed
+        ok, err = write_lod(directory / "processed_data", processed_name, METRIC_STREAMS[metric],
+                            read_processed(directory, processed_name))
+        if not ok:
+            raise OSError(f"Failed to build {lod_path.name}: {err}")
+
+    with columnar.ColumnFile(lod_path) as cf:
+        levels = cf.meta["levels"]
+        t_view = cf.view("t")
+        try:
+            windows = [_window(t_view, lv["start"], lv["start"] + lv["rows"], t_from, t_to) for lv in levels]
+        finally:
+            t_view.release()
+        # Raw samples when the finest level says they may fit.
+        if windows[0][1] - windows[0][0] <= max(1, points // LOD_FACTOR):
+            raw = _raw_window(directory, processed_name, metric, t_from, t_to, points)
+            if raw is not None:
+                return raw
+        chosen = next((i for i, (a, b) in enumerate(windows) if b - a <= points), len(levels) - 1)
+        start, stop = windows[chosen]
+        t = cf.read("t", start, stop)
+        n = cf.read("n", start, stop)
+        mins, maxs, means = (cf.read(f"{metric}_{k}", start, stop) for k in ("min", "max", "mean"))
+    size = levels[chosen]["size"]
+
+    if len(t) > points:
+        # Even the coarsest level is too fine for this few points: merge on the fly.
+        group = -(-len(t) // points)
+        counts = array("d", n)
+        sums = array("d", (m * c if m == m else 0.0 for m, c in zip(means, counts)))
+        counts = array("d", (c if m == m else 0.0 for m, c in zip(means, counts)))
+        mins, maxs, sums, counts = analysis.merge_buckets(mins, maxs, sums, counts, group)
+        means = [s / c if c else NAN for s, c in zip(sums, counts)]
+        t = t[::group]
+        size *= group
+    return {"bucket": size, "t": list(t), "min": _json_list(mins), "max": _json_list(maxs), "mean": _json_list(means)}
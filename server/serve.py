@@ -0,0 +1,187 @@
+"""
+Production serving::
+
+    python -m server.serve [--server auto|gunicorn|waitress|werkzeug] [--workers N] [--threads N]
+
+``auto`` picks the first installed server, in this order:
+
+- gunicorn (``pip install gunicorn``): a pre-forked pool of ``--workers``
+  processes, each running ``--threads`` threads.
+- waitress (``pip install waitress``): ``--threads`` threads in one process.
+- Werkzeug's threaded server, which ships with Flask: one process, one
+  thread per request.
+
+The parent creates or migrates sessions.db, and runs the startup consistency
+check (server/fsck.py), once before any worker starts. Only the first worker re-queues sessions left unfinished by the last run;
+a replacement worker started later does not. SIGTERM or SIGINT drains the
+server (server/lifecycle.py). It stops accepting requests, waits up to
+``--drain-timeout`` s for those in progress, then finishes the sessions
+already queued.
+
+Live events and the analysis cache are kept per process. With more than one
+worker, a client following ``/session/<id>/live`` may reach a different
+process than the one receiving the chunks. Use ``--workers 1`` (and
+threads) when live feedback matters.
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+import _thread
+import argparse
+import importlib.util
+import logging
+import os
+import signal
+import sys
+import threading
+
+from . import _default_config, create_app, fsck, logconfig
+from .db import close_all, init_db
+from .lifecycle import drain_requests, shutdown_app
+from .storage import make_data_dir
+
+LOG = logging.getLogger("sensor_server.serve")
+
+SERVERS = ("gunicorn", "waitress", "werkzeug")
+
+
+def available_servers():
+    return tuple(name for name in SERVERS if name == "werkzeug" or importlib.util.find_spec(name) is not None)
+
+
+def prepare(data_dir: Path, check: bool = False) -> Path:
+    """Create the data directory, bring sessions.db up to date and optionally run fsck, before any worker starts."""
+    data_dir = make_data_dir(str(data_dir))
+    init_db(data_dir)
+    if check:
+        fsck.check(data_dir)
+    close_all()  # workers fork from this process; they open their own connections
+    return data_dir
+
+
+def _serve_until_signal(app: Any, serve: Callable[[], None], stop: Callable[[], None], drain_timeout: float) -> None:
+    """Run ``serve()`` until SIGTERM/SIGINT, then drain requests, ``stop()`` the server and shut the app down."""
+    def on_signal(signum, frame):
+        LOG.info("Received %s, draining", signal.Signals(signum).name)
+        signal.signal(signum, signal.SIG_DFL)  # a second signal stops at once
+
+        def drain_then_stop():
+            drain_requests(app, drain_timeout)
+            stop()
+        threading.Thread(target=drain_then_stop, name="drain", daemon=True).start()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, on_signal)
+    try:
+        serve()
+    except KeyboardInterrupt:
+        pass  # raised by stop() for waitress
+    shutdown_app(app, drain_timeout)
+
+
+def _run_werkzeug(host: str, port: int, workers: int, threads: int, drain_timeout: float, config: Dict[str, Any]) -> None:
+    from werkzeug.serving import make_server
+
+    if workers > 1:
+        LOG.warning("The werkzeug server runs one process; install gunicorn for --workers %d", workers)
+    app = create_app(config)
+    server = make_server(host, port, app, threaded=True)
+    LOG.info("Serving on http://%s:%d (werkzeug, thread per request)", host, server.port)
+    _serve_until_signal(app, server.serve_forever, server.shutdown, drain_timeout)
+    server.server_close()
+
+
+def _run_waitress(host: str, port: int, workers: int, threads: int, drain_timeout: float, config: Dict[str, Any]) -> None:
+    from waitress import create_server
+
+    if workers > 1:
+        LOG.warning("waitress runs one process; install gunicorn for --workers %d", workers)
+    app = create_app(config)
+    server = create_server(app, host=host, port=port, threads=threads)
+    LOG.info("Serving on http://%s:%d (waitress, %d threads)", host, port, threads)
+    # waitress's loop ends on KeyboardInterrupt in the main thread.
+    _serve_until_signal(app, server.run, _thread.interrupt_main, drain_timeout)
+
+
+def _run_gunicorn(host: str, port: int, workers: int, threads: int, drain_timeout: float, config: Dict[str, Any]) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    first_worker = {"age": None}
+
+    def post_fork(server, worker):
+        # Ages count every worker the arbiter has started; 1 is the first of this run.
+        first_worker["age"] = worker.age
+
+    def worker_exit(server, worker):
+        # gunicorn has already drained the worker's connections (graceful_timeout).
+        app = getattr(worker, "wsgi", None)
+        if app is not None and hasattr(app, "extensions"):
+            shutdown_app(app, drain_timeout)
+
+    class Application(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "threads": threads,
+                "worker_class": "gthread",
+                "graceful_timeout": drain_timeout,
+                # Long uploads are slow on the Pi; only kill workers that hang far past that.
+                "timeout": max(120, int(drain_timeout) * 2),
+                "post_fork": post_fork,
+                "worker_exit": worker_exit,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            if first_worker["age"] == 1:
+                return create_app(config)
+            return create_app({**config, "RECOVER_PENDING": False})
+
+    LOG.info("Serving on http://%s:%d (gunicorn, %d workers x %d threads)", host, port, workers, threads)
+    Application().run()
+
+
+RUNNERS = {"gunicorn": _run_gunicorn, "waitress": _run_waitress, "werkzeug": _run_werkzeug}
+
+
+def run(server: str = "auto", host: str = "0.0.0.0", port: int = 5000, workers: int = 1, threads: int = 8,
+        drain_timeout: float = 30.0, config: Optional[Dict[str, Any]] = None) -> None:
+    """Serve the app until stopped by a signal. ``config`` overrides create_app's settings."""
+    if server == "auto":
+        server = available_servers()[0]
+    if server not in available_servers():
+        raise ValueError(f"Server {server!r} requested but it is not installed")
+    config = dict(config or {})
+    settings = {**_default_config(), **config}
+    check = settings["RECOVER_PENDING"] and settings["CONSISTENCY_CHECK"]
+    config["DATA_DIR"] = prepare(Path(settings["DATA_DIR"]), check)
+    # Checked above; in a worker it would race the workers already serving.
+    config["CONSISTENCY_CHECK"] = False
+    RUNNERS[server](host, port, workers, threads, drain_timeout, config)
+
+
+def main(argv=None) -> int:
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description="Serve the sensor server with a production WSGI server.")
+    parser.add_argument("--server", choices=("auto",) + SERVERS, default=env("SENSOR_SERVER", "auto"))
+    parser.add_argument("--host", default=env("SENSOR_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(env("SENSOR_PORT", "5000")))
+    parser.add_argument("--workers", type=int, default=int(env("SENSOR_WORKERS", "1")), help="processes (gunicorn only)")
+    parser.add_argument("--threads", type=int, default=int(env("SENSOR_THREADS", "8")), help="threads per process")
+    parser.add_argument("--drain-timeout", type=float, default=float(env("SENSOR_DRAIN_TIMEOUT", "30")),
+                        help="seconds to wait for requests in progress on shutdown")
+    parser.add_argument("--data-dir", type=Path, help="default: SENSOR_DATA_DIR or data/")
+    args = parser.parse_args(argv)
+
+    logconfig.configure()
+    try:
+        run(args.server, args.host, args.port, args.workers, args.threads, args.drain_timeout,
+            {"DATA_DIR": args.data_dir} if args.data_dir else None)
+    except ValueError as exc:
+        parser.error(str(exc))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
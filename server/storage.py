@@ -1,11 +1,30 @@
+from array import array
 from pathlib import Path
 import datetime
-from typing import Tuple, Dict, Any
-import json
+from typing import Tuple, Dict, Any, Iterator, Optional, Union
 import csv
-import sqlite3
+import hashlib
+import io
 import logging
 
+from . import columnar, durable, rawstore, rollups, series
+from .metrics import timed
+from .results import dumps as dump_results, save_results
+from .analysis import heart_rate_stats, normalize_quaternions, orientation_summary
+from .db import transaction
+from .ingest import (
+    HR_FIELDS,
+    IMU_FIELDS,
+    NAN,
+    ROTATION_FIELDS,
+    SessionColumns,
+    evenly_spaced,
+    measured_rate_hz,
+    optional_float,
+    parse_ndjson,
+    parse_payload,
+)
+
 LOG = logging.getLogger("sensor_server.storage")
 
 
@@ -23,232 +42,489 @@ def make_unique_filename(prefix: str = "session", ext: str = ".json") -> str:
     return f"{prefix}_{ts}{ext}"
 
 
-def _write_text(target: Path, text: str) -> Tuple[bool, str]:
-    try:
-        target.write_text(text, encoding="utf-8")
-        return True, str(target.name)
-    except Exception as exc:
-        return False, str(exc)
-
-
-def _write_csv_rows(target: Path, headers: list, rows: list) -> Tuple[bool, str]:
+def _write_csv_rows(target: Path, headers: list, rows) -> Tuple[bool, str]:
     try:
-        with target.open("w", newline="", encoding="utf-8") as fh:
+        with durable.atomic_write(target, "w", newline="", encoding="utf-8") as fh:
             writer = csv.writer(fh)
             writer.writerow(headers)
-            for r in rows:
-                writer.writerow(r)
+            writer.writerows(rows)
         return True, str(target.name)
     except Exception as exc:
         return False, str(exc)
 
 
-def _process_and_save(directory: Path, raw_filename: str, raw_text: str) -> Tuple[bool, Dict[str, Any]]:
-    try:
-        payload = json.loads(raw_text)
-    except Exception as exc:
-        return False, {"error": f"Invalid JSON: {exc}"}
+def _csv_column(col):
+    # NaN marks a missing value; write it as an empty cell like the old None rows.
+    if any(v != v for v in col):
+        return ["" if v != v else v for v in col]
+    return col
+
+
+def _column_rows(columns: Dict[str, Any], headers: tuple):
+    return zip(*(_csv_column(columns[h]) for h in headers))
+
+
+# Processed-data formats: name -> file extension. The sessions row records the
+# format; readers also recognise it from the extension.
+PROCESSED_FORMATS = {"csv": ".csv", "columnar": columnar.EXTENSION}
+DEFAULT_PROCESSED_FORMAT = "columnar"
+
+# Fixed-width column types for the columnar format: ms timestamps keep float64,
+# sensor values fit in float32.
+STREAM_DTYPES = {
+    "imu": {"t": "f8", "ax": "f4", "ay": "f4", "az": "f4", "gx": "f4", "gy": "f4", "gz": "f4"},
+    "heart_rate": {"t": "f8", "bpm": "f4"},
+    "rotation": {"t": "f8", "x": "f4", "y": "f4", "z": "f4", "w": "f4"},
+}
+STREAM_FIELDS = {"imu": IMU_FIELDS, "heart_rate": HR_FIELDS, "rotation": ROTATION_FIELDS}
+
+
+def write_processed(processed_dir: Path, base: str, stream: str, columns: Dict[str, Any], processed_format: str) -> Tuple[bool, str]:
+    """Write one stream ("imu", "heart_rate" or "rotation") of a session in ``processed_format``."""
+    if processed_format not in PROCESSED_FORMATS:
+        return False, f"Unknown processed format: {processed_format}"
+    fields = STREAM_FIELDS[stream]
+    name = f"{base}_{stream}{PROCESSED_FORMATS[processed_format]}"
+    target = processed_dir / name
+    if rawstore.device_of(name):
+        target.parent.mkdir(exist_ok=True)
+    if processed_format == "csv":
+        ok, err = _write_csv_rows(target, list(fields), _column_rows(columns, fields))
+    else:
+        ok, err = columnar.write_columns(target, {k: columns[k] for k in fields}, STREAM_DTYPES[stream])
+    # The name relative to processed_dir, i.e. with the device directory.
+    return (True, name) if ok else (False, err)
+
+
+def read_processed(directory: Path, filename: str) -> Dict[str, array]:
+    """Load a processed file of either format into columns (missing CSV cells become NaN)."""
+    path = directory / "processed_data" / filename
+    if filename.endswith(columnar.EXTENSION):
+        return columnar.read_columns(path)
+    with path.open(newline="", encoding="utf-8") as fh:
+        reader = csv.reader(fh)
+        headers = next(reader, [])
+        cols = [array("d") for _ in headers]
+        for row in reader:
+            for col, cell in zip(cols, row):
+                col.append(float(cell) if cell else NAN)
+    return dict(zip(headers, cols))
+
+
+def _csv_number(value: float, typecode: str) -> str:
+    if value != value:
+        return ""
+    if typecode == "f":
+        # 9 significant digits round-trip any float32.
+        return "%.9g" % value
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def iter_processed_csv(directory: Path, filename: str, chunk_rows: int = 8192) -> Iterator[str]:
+    """Yield a processed file as CSV text in chunks, converting columnar files on the fly."""
+    path = directory / "processed_data" / filename
+    if not filename.endswith(columnar.EXTENSION):
+        with path.open(newline="", encoding="utf-8") as fh:
+            while True:
+                block = fh.read(1 << 16)
+                if not block:
+                    return
+                yield block
+    with columnar.ColumnFile(path) as cf:
+        names = cf.names
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(names)
+        for start in range(0, cf.rows, chunk_rows):
+            cols = [cf.read(name, start, start + chunk_rows) for name in names]
+            writer.writerows(zip(*([_csv_number(v, col.typecode) for v in col] for col in cols)))
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if cf.rows == 0:
+            yield buf.getvalue()
+
+
+def processed_layout(directory: Path, filename: str) -> Tuple[Dict[str, str], int]:
+    """Column typecodes (by name, in file order) and row count of a processed file.
+
+    CSV files are all doubles; counting their rows takes one pass over the file.
+    """
+    path = directory / "processed_data" / filename
+    if filename.endswith(columnar.EXTENSION):
+        with columnar.ColumnFile(path) as cf:
+            return {name: columnar.TYPECODES[cf.dtype(name)] for name in cf.names}, cf.rows
+    with path.open(newline="", encoding="utf-8") as fh:
+        reader = csv.reader(fh)
+        headers = next(reader, [])
+        return dict.fromkeys(headers, "d"), sum(1 for _ in reader)
+
+
+def iter_processed_chunks(directory: Path, filename: str, names: Optional[list] = None, chunk_rows: int = 8192) -> Iterator[Dict[str, array]]:
+    """Yield the columns of a processed file (only ``names`` when given) in slices of ``chunk_rows`` rows."""
+    path = directory / "processed_data" / filename
+    if filename.endswith(columnar.EXTENSION):
+        with columnar.ColumnFile(path) as cf:
+            names = names or list(cf.names)
+            for start in range(0, cf.rows, chunk_rows):
+                yield {name: cf.read(name, start, start + chunk_rows) for name in names}
+        return
+    with path.open(newline="", encoding="utf-8") as fh:
+        reader = csv.reader(fh)
+        headers = next(reader, [])
+        names = names or headers
+        positions = [headers.index(name) for name in names]
+        cols = [array("d") for _ in names]
+        for row in reader:
+            for col, i in zip(cols, positions):
+                cell = row[i] if i < len(row) else ""
+                col.append(float(cell) if cell else NAN)
+            if len(cols[0]) >= chunk_rows:
+                yield dict(zip(names, cols))
+                cols = [array("d") for _ in names]
+        if cols and len(cols[0]):
+            yield dict(zip(names, cols))
+
+
+def prepare_rotation(rotation: Dict[str, array], imu_first_t: Optional[float] = None, imu_last_t: Optional[float] = None, duration: Optional[float] = None) -> Tuple[Dict[str, array], int]:
+    """Rotation columns as stored: unit quaternions, with zero-length ones removed.
+
+    Returns the columns and the number of samples removed. When no sample
+    carried a time, the samples are spread evenly over the IMU span (first to
+    last timestamp), or over ``duration`` seconds from 0.
+    """
+    x, y, z, w = normalize_quaternions(rotation["x"], rotation["y"], rotation["z"], rotation["w"])
+    t_col = rotation["t"]
+    n = len(t_col)
+    if n and not any(t == t for t in t_col):
+        if imu_first_t is not None and imu_last_t is not None and imu_last_t > imu_first_t:
+            t_col = evenly_spaced(n, imu_first_t, imu_last_t)
+        elif duration:
+            t_col = evenly_spaced(n, 0.0, duration * 1000.0)
+    cols = {"t": t_col, "x": x, "y": y, "z": z, "w": w}
+    keep = [i for i, v in enumerate(x) if v == v]
+    if len(keep) == n:
+        return cols, 0
+    return {k: array("d", (col[i] for i in keep)) for k, col in cols.items()}, n - len(keep)
+
+
+def _process_and_save(directory: Path, raw_filename: str, raw_text: str, session: Optional[SessionColumns] = None, processed_format: str = DEFAULT_PROCESSED_FORMAT) -> Tuple[bool, Dict[str, Any]]:
+    if session is None:
+        ok, session = parse_payload(raw_text)
+        if not ok:
+            return False, {"error": session}
 
     processed_dir = directory / "processed_data"
-    base = Path(raw_filename).stem
-
-    imu_list = payload.get("imu") or []
-    imu_headers = ["t", "ax", "ay", "az", "gx", "gy", "gz"]
-    imu_rows = []
-    for item in imu_list:
-        if isinstance(item, dict):
-            imu_rows.append([
-                item.get("t"),
-                item.get("ax"),
-                item.get("ay"),
-                item.get("az"),
-                item.get("gx"),
-                item.get("gy"),
-                item.get("gz"),
-            ])
-
-    imu_avg_hz = None
-    if len(imu_rows) > 1:
-        try:
-            first_t = float(imu_rows[0][0])
-            last_t = float(imu_rows[-1][0])
-            interval = (last_t - first_t) / float(len(imu_rows) - 1)
-            imu_avg_hz = 1000.0 / interval if interval > 0 else None
-        except Exception:
-            imu_hz_field = payload.get("imu_hz")
-            try:
-                imu_avg_hz = float(imu_hz_field) if imu_hz_field is not None else None
-            except Exception:
-                imu_avg_hz = None
-
-    imu_name = base + "_imu.csv"
-    imu_target = processed_dir / imu_name
-    ok, info = _write_csv_rows(imu_target, imu_headers, imu_rows)
-    if not ok:
-        return False, {"error": f"Failed to write imu csv: {info}"}
-
-    hr_list = payload.get("heart_rates") or []
-    hr_headers = ["t", "bpm"]
-    hr_rows = []
-    for hr in hr_list:
-        if isinstance(hr, dict):
-            bpm = hr.get("bpm")
-            if bpm is None:
-                bpm = hr.get("value")
-            hr_rows.append([hr.get("t"), bpm])
-
-    hr_name = base + "_heart_rate.csv"
-    hr_target = processed_dir / hr_name
-    ok, info = _write_csv_rows(hr_target, hr_headers, hr_rows)
-    if not ok:
-        return False, {"error": f"Failed to write heart rate csv: {info}"}
+    base = rawstore.raw_stem(raw_filename)
 
-    hr_avg_hz = None
-    if len(hr_rows) > 1:
-        try:
-            first_t = float(hr_rows[0][0])
-            last_t = float(hr_rows[-1][0])
-            interval = (last_t - first_t) / float(len(hr_rows) - 1)
-            hr_avg_hz = 1000.0 / interval if interval > 0 else None
-        except Exception:
-            hr_hz_field = payload.get("heart_rate_hz")
-            try:
-                hr_avg_hz = float(hr_hz_field) if hr_hz_field is not None else None
-            except Exception:
-                hr_avg_hz = None
+    imu_avg_hz = measured_rate_hz(session.imu["t"], session.meta.get("imu_hz"))
+
+    timings: Dict[str, float] = {}
+    try:
+        # One group commit for all files of the session (server/durable.py).
+        with timed("processed_write", timings), durable.batch():
+            ok, imu_name = write_processed(processed_dir, base, "imu", session.imu, processed_format)
+            if not ok:
+                return False, {"error": f"Failed to write imu {processed_format} file: {imu_name}"}
+
+            ok, hr_name = write_processed(processed_dir, base, "heart_rate", session.heart_rate, processed_format)
+            if not ok:
+                return False, {"error": f"Failed to write heart rate {processed_format} file: {hr_name}"}
+
+            rotation_name = None
+            if session.rotation_count:
+                imu_t = session.imu["t"]
+                span = (imu_t[0], imu_t[-1]) if len(imu_t) else (None, None)
+                session.rotation, removed = prepare_rotation(session.rotation, *span, optional_float(session.meta.get("duration")))
+                session.dropped["rotation"] += removed
+            if session.rotation_count:
+                ok, rotation_name = write_processed(processed_dir, base, "rotation", session.rotation, processed_format)
+                if not ok:
+                    return False, {"error": f"Failed to write rotation {processed_format} file: {rotation_name}"}
+
+            # Chart pyramids are a cache that /api/session/<id>/series can rebuild; a failure is not fatal.
+            for stream, name, columns in (("imu", imu_name, session.imu), ("heart_rate", hr_name, session.heart_rate)):
+                ok, err = series.write_lod(processed_dir, name, stream, columns)
+                if not ok:
+                    LOG.warning("Failed to write %s: %s", series.lod_filename(name), err)
+    except OSError as exc:
+        return False, {"error": f"Failed to commit processed files: {exc}"}
+
+    hr_avg_hz = measured_rate_hz(session.heart_rate["t"], session.meta.get("heart_rate_hz"))
 
     return True, {
         "raw": raw_filename,
-        "processed": {"imu": imu_name, "heart_rate": hr_name},
+        "processed": {"imu": imu_name, "heart_rate": hr_name, "rotation": rotation_name, "format": processed_format},
         "sampling": {"imu_hz_measured": imu_avg_hz, "heart_rate_hz_measured": hr_avg_hz},
-        "payload": payload,
+        "payload": session.payload,
+        "timings": timings,
     }
 
 
-def save_raw_json_payload(directory: Path, raw_text: str) -> Tuple[bool, Any]:
-    raw_dir = directory / "raw_data"
-    fname = make_unique_filename()
-    target = raw_dir / fname
+# Bump when processed files or sessions-row stats change meaning, so that
+# ``python -m server.reprocess`` rebuilds rows written by older code.
+PROCESSING_VERSION = 3
+
+SESSION_STAT_COLUMNS = (
+    "duration",
+    "imu_hz_measured",
+    "imu_hz_sampling_rate_defined",
+    "heart_rate_hz_measured",
+    "heart_rate_hz_sampling_rate",
+    "heart_mean",
+    "heart_max",
+    # Samples dropped by ingest validation (ingest.PAYLOAD_STREAMS).
+    "imu_dropped",
+    "heart_rate_dropped",
+    "rotation_dropped",
+    # Orientation summary (analysis.orientation_summary) of the rotation stream.
+    "rotation_samples",
+    "max_angular_velocity",
+)
+
+
+def _session_stats(session: SessionColumns, orientation: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Sessions-row stats; ``orientation`` is the analysis section when it was already computed."""
+    imu_t = session.imu["t"]
+    first_t, last_t = (imu_t[0], imu_t[-1]) if len(imu_t) else (None, None)
+    if orientation is None and session.rotation_count:
+        orientation = orientation_summary(session.rotation)
+    return session_stats_from_parts(
+        session.meta, session.imu_count, first_t, last_t, heart_rate_stats(session.heart_rate["bpm"]), session.dropped, orientation
+    )
+
+
+def session_stats_from_parts(meta: Dict[str, Any], imu_count: int, imu_first_t: Optional[float], imu_last_t: Optional[float], hr_stats: Dict[str, Any], dropped: Optional[Dict[str, int]] = None, orientation: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """The sessions-row stats from payload metadata, the IMU span, heart_rate_stats output, drop counts and the orientation summary."""
+    dropped = dropped or {}
+    orientation = orientation or {}
+    duration = optional_float(meta.get("duration"))
+    if duration is None and imu_count > 1:
+        if imu_first_t == imu_first_t and imu_last_t == imu_last_t:
+            duration = (imu_last_t - imu_first_t) / 1000.0
+
+    hr_count = hr_stats["count"]
 
-    ok, info = _write_text(target, raw_text)
-    if not ok:
-        return False, info
+    imu_hz_measured = None
+    heart_rate_hz_measured = None
+    if duration and duration > 0:
+        imu_hz_measured = float(imu_count) / float(duration)
+        heart_rate_hz_measured = float(hr_count) / float(duration) if hr_count > 0 else None
+
+    return {
+        "duration": duration,
+        "imu_hz_measured": imu_hz_measured,
+        "imu_hz_sampling_rate_defined": optional_float(meta.get("imu_hz")),
+        "heart_rate_hz_measured": heart_rate_hz_measured,
+        "heart_rate_hz_sampling_rate": optional_float(meta.get("heart_rate_hz")),
+        "heart_mean": hr_stats["mean"],
+        "heart_max": int(hr_stats["max"]) if hr_stats["max"] is not None else None,
+        "imu_dropped": dropped.get("imu", 0),
+        "heart_rate_dropped": dropped.get("heart_rate", 0),
+        "rotation_dropped": dropped.get("rotation", 0),
+        "rotation_samples": orientation.get("samples", 0),
+        "max_angular_velocity": orientation.get("max_angular_velocity"),
+    }
 
-    ok, info2 = _process_and_save(directory, fname, raw_text)
-    if not ok:
-        return False, info2
 
-    # --- NEW: Run detailed analysis and print to console ---
-    try:
-        from .analysis import analyze_session
-        payload_for_analysis = info2.get("payload") if isinstance(info2, dict) else {}
-        analyze_session(payload_for_analysis)
-    except Exception as e:
-        LOG.error(f"Failed to run session analysis: {e}")
-    # -------------------------------------------------------
+def raw_filename_for(directory: Path, device_id: Optional[str], ext: str = ".json") -> str:
+    """A new raw filename, in the device's directory of raw_data (created here) when ``device_id`` is set."""
+    name = make_unique_filename(ext=ext)
+    if device_id is None:
+        return name
+    (directory / "raw_data" / device_id).mkdir(exist_ok=True)
+    return f"{device_id}/{name}"
 
-    payload = info2.get("payload") if isinstance(info2, dict) else {}
 
-    duration = None
-    try:
-        if payload.get("duration") is not None:
-            duration = float(payload.get("duration"))
-    except Exception:
-        duration = None
+def write_raw_payload(directory: Path, raw_text: Union[str, bytes], device_id: Optional[str] = None) -> Tuple[bool, str]:
+    """Durably write the request body to raw_data, compressed as configured in rawstore.
 
-    imu_rows_count = 0
-    hr_values = []
-    try:
-        imu_list = payload.get("imu") or []
-        for item in imu_list:
-            imu_rows_count += 1
-    except Exception:
-        imu_rows_count = 0
+    Returns ``(True, filename)`` or ``(False, error)``; the filename is relative to raw_data.
+    """
+    return rawstore.write_raw_text(directory / "raw_data", raw_filename_for(directory, device_id), raw_text, fsync=True)
 
-    try:
-        hr_list = payload.get("heart_rates") or []
-        for item in hr_list:
-            if isinstance(item, dict):
-                v = item.get("bpm")
-                if v is None:
-                    v = item.get("value")
-                try:
-                    if v is not None:
-                        hr_values.append(float(v))
-                except Exception:
-                    pass
-            else:
-                try:
-                    hr_values.append(float(item))
-                except Exception:
-                    LOG.debug("Failed to parse heart rate value %r in %s", item, fname)
-    except Exception:
-        hr_values = []
 
-    if duration is None:
-        try:
-            imu_list = payload.get("imu") or []
-            if len(imu_list) > 1 and isinstance(imu_list[0], dict):
-                first_t = float(imu_list[0].get("t"))
-                last_t = float(imu_list[-1].get("t"))
-                duration = (last_t - first_t) / 1000.0
-        except Exception:
-            duration = None
+def load_raw_session(directory: Path, raw_filename: str) -> Tuple[bool, Any]:
+    try:
+        raw_text = rawstore.read_raw_text(directory / "raw_data" / raw_filename)
+    except Exception as exc:
+        return False, f"Failed to read raw file: {exc}"
+    return parse_raw_text(raw_filename, raw_text)
 
-    imu_hz_measured = None
-    if duration and duration > 0:
-        try:
-            imu_hz_measured = float(imu_rows_count) / float(duration)
-        except Exception:
-            imu_hz_measured = None
 
-    heart_rate_hz_measured = None
-    if duration and duration > 0:
-        try:
-            heart_rate_hz_measured = float(len(hr_values)) / float(duration) if len(hr_values) > 0 else None
-        except Exception:
-            heart_rate_hz_measured = None
+def parse_raw_text(raw_filename: str, raw_text: str) -> Tuple[bool, Any]:
+    if rawstore.is_ndjson(raw_filename):
+        # Raw log of a chunked upload
+        return parse_ndjson(raw_text)
+    return parse_payload(raw_text)
 
-    imu_hz_defined = None
-    try:
-        imu_hz_defined = payload.get("imu_hz")
-        if imu_hz_defined is not None:
-            imu_hz_defined = float(imu_hz_defined)
-    except Exception:
-        imu_hz_defined = None
 
-    heart_hz_defined = None
-    try:
-        heart_hz_defined = payload.get("heart_rate_hz")
-        if heart_hz_defined is not None:
-            heart_hz_defined = float(heart_hz_defined)
-    except Exception:
-        heart_hz_defined = None
+def process_raw_payload(directory: Path, raw_filename: str, session: SessionColumns, processed_format: str = DEFAULT_PROCESSED_FORMAT) -> Tuple[bool, Dict[str, Any]]:
+    """Write processed files, print the analysis report and compute the sessions-row stats."""
+    ok, info = _process_and_save(directory, raw_filename, "", session, processed_format)
+    if not ok:
+        return False, info
 
-    heart_mean = None
-    heart_max = None
+    with timed("analysis", info["timings"]):
+        # A failed analysis leaves the session stored without results; they are computed on request.
+        try:
+            from .analysis import analyze_columns
+            info["analysis"] = analyze_columns(session)
+        except Exception as e:
+            LOG.error(f"Failed to run session analysis: {e}")
+
+        info["stats"] = _session_stats(session, (info.get("analysis") or {}).get("orientation"))
+    return True, info
+
+
+def _save_analysis(conn, session_id: int, info: Optional[Dict[str, Any]]) -> None:
+    results = (info or {}).get("analysis")
+    if results:
+        save_results(conn, session_id, dump_results(results), results["version"])
+
+
+def _save_rollups(conn, session_id: int, status: str, info: Optional[Dict[str, Any]]) -> None:
+    # Only finished (or failed) sessions change the trends; skip the queue's intermediate states.
+    if status in ("done", "failed"):
+        info = info or {}
+        rollups.record_session(conn, session_id, info.get("analysis") or info.get("summary"))
+
+
+def content_hash(raw: Union[str, bytes]) -> str:
+    """SHA-256 of an uploaded session body, stored as ``sessions.content_sha256`` (see server/batch.py)."""
+    return hashlib.sha256(raw.encode("utf-8") if isinstance(raw, str) else raw).hexdigest()
+
+
+def insert_row(conn, raw_filename: str, info: Optional[Dict[str, Any]] = None, status: str = "done", skip_duplicate: bool = False) -> Optional[int]:
+    """Insert a sessions row on ``conn`` (inside the caller's transaction) and return its id.
+
+    ``info["content_sha256"]`` is stored unless another row already has it.
+    With ``skip_duplicate`` such a row is not inserted at all and None is returned.
+    """
+    info = info or {}
+    processed = info.get("processed", {})
+    stats = info.get("stats", {})
+    columns = ("created_at", "raw_filename", "device_id", "imu_csv", "heart_csv", "rotation_file", "processed_format") + SESSION_STAT_COLUMNS + ("status", "processing_version", "timings")
+    values = (
+        int(datetime.datetime.now().timestamp()),
+        raw_filename,
+        rawstore.device_of(raw_filename),
+        processed.get("imu"),
+        processed.get("heart_rate"),
+        processed.get("rotation"),
+        processed.get("format"),
+    ) + tuple(stats.get(c) for c in SESSION_STAT_COLUMNS) + (
+        status, PROCESSING_VERSION if processed else None, dump_results(info["timings"]) if info.get("timings") else None,
+    )
+    placeholders = ",".join("?" * len(columns))
+    digest = info.get("content_sha256")
+    if digest is None:
+        sql = f"INSERT INTO sessions ({', '.join(columns)}) VALUES ({placeholders})"
+    elif skip_duplicate:
+        sql = (f"INSERT INTO sessions ({', '.join(columns)}, content_sha256) VALUES ({placeholders}, ?) "
+               "ON CONFLICT (content_sha256) WHERE content_sha256 IS NOT NULL DO NOTHING")
+        values += (digest,)
+    else:
+        # The hash identifies the first copy only; a repeated /end still gets its own row.
+        sql = (f"INSERT INTO sessions ({', '.join(columns)}, content_sha256) VALUES ({placeholders}, "
+               "(SELECT ? WHERE NOT EXISTS (SELECT 1 FROM sessions WHERE content_sha256 = ?)))")
+        values += (digest, digest)
+    cur = conn.execute(sql, values)
+    if not cur.rowcount:
+        return None
+    _save_analysis(conn, cur.lastrowid, info)
+    _save_rollups(conn, cur.lastrowid, status, info)
+    return cur.lastrowid
+
+
+def insert_session(directory: Path, raw_filename: str, info: Optional[Dict[str, Any]] = None, status: str = "done") -> Optional[int]:
+    """Insert a sessions row and return its id (None if the insert failed)."""
+    db_path = directory / "sessions.db"
     try:
-        if len(hr_values) > 0:
-            heart_mean = sum(hr_values) / float(len(hr_values))
-            heart_max = int(max(hr_values))
+        with timed("db"), transaction(db_path) as conn:
+            return insert_row(conn, raw_filename, info, status)
     except Exception:
-        heart_mean = None
-        heart_max = None
+        LOG.exception("Failed to insert session metadata into %s", db_path)
+        return None
+
+
+def update_session(directory: Path, session_id: int, status: str, info: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+    assignments = {"status": status, "error": error}
+    if info:
+        processed = info.get("processed", {})
+        if info.get("raw"):
+            assignments["raw_filename"] = info["raw"]
+        assignments["imu_csv"] = processed.get("imu")
+        assignments["heart_csv"] = processed.get("heart_rate")
+        assignments["rotation_file"] = processed.get("rotation")
+        assignments["processed_format"] = processed.get("format")
+        assignments.update({c: info.get("stats", {}).get(c) for c in SESSION_STAT_COLUMNS})
+        assignments["processing_version"] = PROCESSING_VERSION
+
+    sets = [k + " = ?" for k in assignments]
+    params = list(assignments.values())
+    if info and info.get("timings"):
+        # Merged into the stages already recorded, e.g. by the request that queued the session.
+        sets.append("timings = json_patch(COALESCE(timings, '{}'), ?)")
+        params.append(dump_results(info["timings"]))
 
     db_path = directory / "sessions.db"
     try:
-        conn = sqlite3.connect(str(db_path))
-        cur = conn.cursor()
-        created_at = int(datetime.datetime.now().timestamp())
-        imu_csv = info2.get("processed", {}).get("imu")
-        heart_csv = info2.get("processed", {}).get("heart_rate")
-        cur.execute(
-            "INSERT INTO sessions (created_at, raw_filename, imu_csv, heart_csv, duration, imu_hz_measured, imu_hz_sampling_rate_defined, heart_rate_hz_measured, heart_rate_hz_sampling_rate, heart_mean, heart_max) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
-            (created_at, fname, imu_csv, heart_csv, duration, imu_hz_measured, imu_hz_defined, heart_rate_hz_measured, heart_hz_defined, heart_mean, heart_max),
-        )
-        conn.commit()
-        conn.close()
+        with timed("db"), transaction(db_path) as conn:
+            conn.execute(f"UPDATE sessions SET {', '.join(sets)} WHERE id = ?", tuple(params) + (session_id,))
+            _save_analysis(conn, session_id, info)
+            _save_rollups(conn, session_id, status, info)
     except Exception:
-        LOG.exception("Failed to insert session metadata into %s", db_path)
+        LOG.exception("Failed to update session %s in %s", session_id, db_path)
+
+
+def process_queued_session(directory: Path, session_id: int, raw_filename: str, session: Optional[SessionColumns] = None, processed_format: str = DEFAULT_PROCESSED_FORMAT) -> bool:
+    """Background-worker entry point: process a raw file already recorded as ``queued``.
+
+    ``session`` may carry the columns parsed by the request; otherwise the raw file is re-read.
+    """
+    directory = Path(directory)
+    update_session(directory, session_id, "processing")
+    timings: Dict[str, float] = {}
+    if session is None:
+        with timed("parse", timings):
+            ok, session = load_raw_session(directory, raw_filename)
+        if not ok:
+            update_session(directory, session_id, "failed", error=session)
+            return False
+    ok, info = process_raw_payload(directory, raw_filename, session, processed_format)
+    if not ok:
+        update_session(directory, session_id, "failed", error=info.get("error"))
+        return False
+    info["timings"] = {**timings, **info["timings"]}
+    update_session(directory, session_id, "done", info)
+    return True
+
+
+def save_raw_json_payload(directory: Path, raw_text: Union[str, bytes], session: Optional[SessionColumns] = None, processed_format: str = DEFAULT_PROCESSED_FORMAT, timings: Optional[Dict[str, float]] = None) -> Tuple[bool, Any]:
+    """Store the raw body, write processed files and record the session in the DB.
+
+    ``session`` is the already-ingested body; when omitted ``raw_text`` is parsed here.
+    ``timings`` holds stages the caller already timed (e.g. ``parse``); the
+    session's own stages are added and the whole dict stored with the row.
+    """
+    timings = {} if timings is None else timings
+    if session is None:
+        with timed("parse", timings):
+            ok, session = parse_payload(raw_text)
+        if not ok:
+            return False, session
+
+    with timed("raw_write", timings):
+        ok, fname = write_raw_payload(directory, raw_text, session.device_id)
+    if not ok:
+        return False, fname
+
+    ok, info2 = process_raw_payload(directory, fname, session, processed_format)
+    if not ok:
+        return False, info2
+    info2["timings"] = {**timings, **info2["timings"]}
+    info2["content_sha256"] = content_hash(raw_text)
 
+    info2["session_id"] = insert_session(directory, fname, info2)
     return True, info2
@@ -0,0 +1,204 @@
+"""
+Running aggregates for sessions that arrive in batches (chunked uploads and
+live feedback).
+
+Each aggregator is fed column batches in arrival order, split anywhere, and
+ends up with the numbers the batch functions in analysis.py compute over the
+whole session: counts, maxima and strike peaks are identical, and means match
+up to float rounding of the running sum. ``state()`` / ``from_state()``
+round-trip through JSON-safe dicts so an upload in progress can keep its
+aggregates on disk between requests.
+"""
+from typing import Any, Dict, List, Optional
+
+from .analysis import STRIKE_MIN_DIST_MS, STRIKE_THRESHOLD, calculate_hr_zones, finite_magnitudes, scan_strikes, strike_summary
+from .ingest import finite_values, rate_from_span
+
+
+class ColumnSpan:
+    """Sample count plus first/last timestamp of a column, for measured rates and duration."""
+
+    def __init__(self, count: int = 0, first_t: Optional[float] = None, last_t: Optional[float] = None):
+        self.count = count
+        self.first_t = first_t
+        self.last_t = last_t
+
+    def update(self, t_col) -> None:
+        if not len(t_col):
+            return
+        if self.count == 0:
+            self.first_t = t_col[0]
+        self.last_t = t_col[-1]
+        self.count += len(t_col)
+
+    def rate_hz(self, fallback=None) -> Optional[float]:
+        return rate_from_span(self.count, self.first_t, self.last_t, fallback)
+
+    def state(self) -> Dict[str, Any]:
+        return {"count": self.count, "first_t": self.first_t, "last_t": self.last_t}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "ColumnSpan":
+        return cls(**state)
+
+
+class HeartRateAggregator:
+    """Running mean/max/count and zone counts of a bpm column.
+
+    With ``skip_zero`` 0 bpm readings (no sensor lock) are left out, matching
+    the printed analysis report; without it the numbers match
+    ``heart_rate_stats`` as stored in the sessions table.
+    """
+
+    def __init__(self, skip_zero: bool = False):
+        self.skip_zero = skip_zero
+        self.count = 0
+        self.total = 0.0
+        self.max: Optional[float] = None
+        self.last: Optional[float] = None
+        self.zones: Dict[str, int] = {}
+
+    def update(self, bpm_col) -> None:
+        values = finite_values(bpm_col)
+        if self.skip_zero:
+            values = [v for v in values if v]
+        if not values:
+            return
+        peak = max(values)
+        if self.max is None or peak > self.max:
+            self.max = peak
+        self.last = values[-1]
+        self.count += len(values)
+        self.total = sum(values, self.total)
+        for zone, n in calculate_hr_zones(values).items():
+            self.zones[zone] = self.zones.get(zone, 0) + n
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.count:
+            return {"mean": None, "max": None, "count": 0}
+        return {"mean": self.total / float(self.count), "max": self.max, "count": self.count}
+
+    def zone_counts(self) -> Dict[str, int]:
+        names = calculate_hr_zones([]).keys()
+        return {zone: self.zones.get(zone, 0) for zone in names}
+
+    def state(self) -> Dict[str, Any]:
+        return {"skip_zero": self.skip_zero, "count": self.count, "total": self.total,
+                "max": self.max, "last": self.last, "zones": dict(self.zones)}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "HeartRateAggregator":
+        agg = cls(state["skip_zero"])
+        agg.count, agg.total, agg.max = state["count"], state["total"], state["max"]
+        agg.last = state.get("last")
+        agg.zones = dict(state["zones"])
+        return agg
+
+
+class IntensityAggregator:
+    """Running average/max of the accelerometer magnitude."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def update(self, ax, ay, az) -> None:
+        mags = finite_magnitudes(ax, ay, az)
+        if not mags:
+            return
+        peak = max(mags)
+        if not self.count or peak > self.max:
+            self.max = peak
+        self.count += len(mags)
+        self.total = sum(mags, self.total)
+
+    def stats(self) -> Dict[str, float]:
+        if not self.count:
+            return {"avg_intensity": 0.0, "max_intensity": 0.0}
+        return {"avg_intensity": self.total / self.count, "max_intensity": self.max}
+
+    def state(self) -> Dict[str, Any]:
+        return {"count": self.count, "total": self.total, "max": self.max}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "IntensityAggregator":
+        agg = cls()
+        agg.count, agg.total, agg.max = state["count"], state["total"], state["max"]
+        return agg
+
+
+class StrikeDetector:
+    """detect_kendo_strikes over a stream: keeps the debounce state between batches.
+
+    Only the most recent strike is kept as a peak (``open_peak``), since later
+    samples inside its debounce window may still raise it; earlier strikes are
+    folded into a running count, sum and max, so the state stays the same size
+    however long the session runs.
+    """
+
+    def __init__(self, threshold: float = STRIKE_THRESHOLD, min_dist_ms: float = STRIKE_MIN_DIST_MS):
+        self.threshold = threshold
+        self.min_dist_ms = min_dist_ms
+        self.last_strike_time = -min_dist_ms
+        self.closed_count = 0
+        self.closed_total = 0.0
+        self.closed_max = 0.0
+        self.open_peak: Optional[float] = None
+
+    @property
+    def strike_count(self) -> int:
+        return self.closed_count + (self.open_peak is not None)
+
+    def update(self, t_col, ax, ay, az) -> List[Dict[str, Any]]:
+        """Feed one batch and return its events.
+
+        A ``strike`` event (with its start ``t``) is emitted for each strike
+        that starts in the batch, and a ``strike_update`` event when the batch
+        raised the peak of the strike that was open before it. ``index`` counts
+        strikes from 0 over the whole stream.
+        """
+        had_open = self.open_peak is not None
+        peaks = [self.open_peak] if had_open else []
+        times = []
+        self.last_strike_time = scan_strikes(
+            t_col, ax, ay, az, self.threshold, self.min_dist_ms, peaks, self.last_strike_time, times
+        )
+        events = []
+        first_new = self.closed_count + had_open
+        if had_open and peaks[0] != self.open_peak:
+            events.append({"type": "strike_update", "index": self.closed_count, "force": peaks[0]})
+        for k, (t, force) in enumerate(zip(times, peaks[had_open:])):
+            events.append({"type": "strike", "index": first_new + k, "t": t, "force": force})
+
+        for force in peaks[:-1]:
+            self.closed_count += 1
+            self.closed_total += force
+            if force > self.closed_max:
+                self.closed_max = force
+        if peaks:
+            self.open_peak = peaks[-1]
+        return events
+
+    def stats(self) -> Dict[str, Any]:
+        count = self.strike_count
+        if not count:
+            return strike_summary([])
+        return {
+            "strike_count": count,
+            "max_strike_force": max(self.closed_max, self.open_peak) if self.closed_count else self.open_peak,
+            "avg_strike_force": (self.closed_total + self.open_peak) / count,
+        }
+
+    def state(self) -> Dict[str, Any]:
+        return {"threshold": self.threshold, "min_dist_ms": self.min_dist_ms,
+                "last_strike_time": self.last_strike_time, "closed_count": self.closed_count,
+                "closed_total": self.closed_total, "closed_max": self.closed_max, "open_peak": self.open_peak}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "StrikeDetector":
+        det = cls(state["threshold"], state["min_dist_ms"])
+        det.last_strike_time = state["last_strike_time"]
+        det.closed_count, det.closed_total = state["closed_count"], state["closed_total"]
+        det.closed_max, det.open_peak = state["closed_max"], state["open_peak"]
+        return det
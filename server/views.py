@@ -1,21 +1,80 @@
-from flask import request, jsonify, render_template, send_from_directory, abort
-from .storage import make_data_dir, save_raw_json_payload
-import json
+from flask import request, jsonify, render_template, send_from_directory, abort, current_app, url_for, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from . import jsoncodec
+from .batch import BatchError, json_items, ndjson_items, save_batch
+from .chunked import RECEIVING, UploadError, append_chunk, finish_upload, start_upload, stream_lines
+from .db import connection
+from .export import ExportError, export_filename, export_zip, parse_export_args
+from .ingest import parse_payload
+from . import metrics
+from .metrics import timed
+from .queries import QueryError, list_sessions, parse_listing_args
+from .results import ResultsError, session_results_json
+from .rollups import TrendsError, trends
+from .series import DEFAULT_POINTS, METRIC_STREAMS, SeriesError, query as query_series
+from .storage import content_hash, make_data_dir, save_raw_json_payload, write_raw_payload, insert_session, iter_processed_csv
 import logging
 from pathlib import Path
-import sqlite3
 import datetime
 
 LOG = logging.getLogger("sensor_server.views")
 
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+SSE_RETRY_MS = 1000
+SSE_KEEPALIVE_S = 15.0
+LONG_POLL_MAX_S = 60.0
+
 def _repo_data_paths():
-    repo_root = Path(__file__).resolve().parent.parent
-    data_dir = repo_root / "data"
+    data_dir = Path(current_app.config["DATA_DIR"])
     db_path = data_dir / "sessions.db"
     processed_dir = data_dir / "processed_data"
     raw_dir = data_dir / "raw_data"
     return db_path, processed_dir, raw_dir
 
+class CodecJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider (jsonify, request.get_json) on top of server.jsoncodec."""
+
+    def dumps(self, obj, **kwargs):
+        return jsoncodec.dumps(obj, kwargs.get("sort_keys", self.sort_keys), kwargs.get("default", self.default))
+
+    def loads(self, s, **kwargs):
+        return jsoncodec.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(jsoncodec.dumps_bytes(obj, self.sort_keys, self.default), mimetype=self.mimetype)
+
+
+SUMMARY_FIELDS = ("session_id", "raw", "processed", "stats")
+SUMMARY_RESULTS = ("heart_rate", "zones", "intensity", "strikes")
+
+
+def _wants_echo() -> bool:
+    """``?echo=1`` asks /end to return everything it has: the decoded payload and the full analysis."""
+    return request.args.get("echo", "").lower() in ("1", "true", "yes")
+
+
+def _session_summary(info):
+    """Fixed-size answer of a stored session; the per-strike and per-window lists are left to /api/session/<id>/analysis."""
+    if _wants_echo():
+        return info
+    summary = {k: info[k] for k in SUMMARY_FIELDS if k in info}
+    results = info.get("analysis") or info.get("summary")
+    if results:
+        summary["summary"] = {k: results[k] for k in SUMMARY_RESULTS if k in results}
+    return summary
+
+
+def _session_state(session_id: int):
+    """Status of a session's row, ``done`` for rows from before the queue, None for an unknown id."""
+    db_path, _, _ = _repo_data_paths()
+    with connection(db_path) as conn:
+        row = conn.execute("SELECT status FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    if row is None:
+        return None
+    return row["status"] or "done"
+
+
 def _format_ts(ts):
     try:
         return datetime.datetime.fromtimestamp(int(ts)).isoformat(sep=" ")
@@ -26,48 +85,300 @@ def _format_ts(ts):
 def register_routes(app):
     @app.route("/end", methods=["POST"])
     def receive_end():
-        raw = request.get_data(as_text=True)
+        raw = request.get_data()
         if not raw:
             return jsonify({"status": "error", "message": "Empty request body"}), 400
+        # Decode once, straight from the body bytes; storage and analysis read the resulting columns.
+        queue = current_app.extensions["ingest_queue"]
+        timings = {}
+        with timed("parse", timings):
+            ok, session = parse_payload(raw, keep_payload=not queue.is_async and _wants_echo())
+        if not ok:
+            LOG.warning("Invalid JSON received: %s", session)
+            return jsonify({"status": "error", "message": "Invalid JSON payload", "error": session}), 400
+        data_dir = make_data_dir(str(current_app.config["DATA_DIR"]))
+        if not queue.is_async:
+            ok, info = save_raw_json_payload(data_dir, raw, session, queue.processed_format, timings)
+            if not ok:
+                return jsonify({"status": "error", "message": "Failed to save data", "error": info}), 500
+            # info is a session_meta dict with processed filenames, stats and analysis
+            with timed("response"):
+                resp = jsonify({"status": "success", "message": "Data saved", "session": _session_summary(info)})
+            return resp, 200
+
+        # Only the raw write and a "queued" row happen in the request; CSVs,
+        # analysis and stats are filled in by the ingest queue.
+        with timed("raw_write", timings):
+            ok, fname = write_raw_payload(data_dir, raw, session.device_id)
+        if not ok:
+            return jsonify({"status": "error", "message": "Failed to save data", "error": fname}), 500
+        # The worker's stages are merged into these timings by update_session.
+        session_id = insert_session(data_dir, fname, {"timings": timings, "content_sha256": content_hash(raw)}, status="queued")
+        if session_id is None:
+            # The raw file is on disk; recover_pending picks it up on the next start.
+            return jsonify({"status": "error", "message": "Failed to record session", "raw": fname}), 500
+        queue.submit(session_id, fname, session)
+        return jsonify({
+            "status": "accepted",
+            "message": "Data saved, processing queued",
+            "session_id": session_id,
+            "raw": fname,
+            "status_url": url_for("session_status", session_id=session_id),
+        }), 202
+
+    @app.route("/sessions/batch", methods=["POST"])
+    def upload_batch():
+        # See server/batch.py. NDJSON is read line by line; a JSON array is decoded whole.
+        data_dir = make_data_dir(str(current_app.config["DATA_DIR"]))
+        queue = current_app.extensions["ingest_queue"]
+        limit = current_app.config["BATCH_MAX_SESSIONS"]
+        try:
+            if request.mimetype in NDJSON_MIMETYPES:
+                items = ndjson_items(stream_lines(request.stream))
+            else:
+                raw = request.get_data()
+                if not raw:
+                    return jsonify({"status": "error", "message": "Empty request body"}), 400
+                items = json_items(raw, limit)
+            results = save_batch(data_dir, items, queue, limit)
+        except BatchError as exc:
+            return jsonify({"status": "error", "message": str(exc)}), exc.status
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        with timed("response"):
+            resp = jsonify({"status": "success", "counts": counts, "sessions": results})
+        return resp, 200
+
+    def _chunk_body():
+        # NDJSON is consumed line by line from the socket; a JSON object chunk is
+        # read whole, so clients bound memory by choosing the chunk size.
+        if request.mimetype in NDJSON_MIMETYPES:
+            return stream_lines(request.stream)
+        raw = request.get_data(as_text=True)
+        return raw if raw.strip() else None
+
+    @app.route("/session/start", methods=["POST"])
+    def upload_start():
+        meta = request.get_json(silent=True)
+        data_dir = make_data_dir(str(current_app.config["DATA_DIR"]))
+        try:
+            session_id = start_upload(data_dir, meta if isinstance(meta, dict) else {})
+        except UploadError as exc:
+            return jsonify({"status": "error", "message": str(exc)}), exc.status
+        current_app.extensions["live_hub"].open(session_id)
+        return jsonify({
+            "status": "success",
+            "session_id": session_id,
+            "chunk_url": url_for("upload_chunk", session_id=session_id),
+            "end_url": url_for("upload_end", session_id=session_id),
+        }), 201
+
+    @app.route("/session/<int:session_id>/chunk", methods=["POST"])
+    def upload_chunk(session_id: int):
+        body = _chunk_body()
+        if body is None:
+            return jsonify({"status": "error", "message": "Empty request body"}), 400
+        data_dir = make_data_dir(str(current_app.config["DATA_DIR"]))
         try:
-            json.loads(raw)
+            with timed("chunk"):
+                progress = append_chunk(data_dir, session_id, body, request.args.get("seq", type=int))
+        except UploadError as exc:
+            return jsonify({"status": "error", "message": str(exc)}), exc.status
+        current_app.extensions["live_hub"].publish(session_id, progress["events"])
+        return jsonify({"status": "success", **progress}), 200
+
+    @app.route("/session/<int:session_id>/end", methods=["POST"])
+    def upload_end(session_id: int):
+        data_dir = make_data_dir(str(current_app.config["DATA_DIR"]))
+        queue = current_app.extensions["ingest_queue"]
+        try:
+            info = finish_upload(data_dir, session_id, _chunk_body(), queue.processed_format)
+        except UploadError as exc:
+            return jsonify({"status": "error", "message": str(exc)}), exc.status
+        current_app.extensions["live_hub"].publish(session_id, [{"type": "end", "stats": info["stats"]}], close=True)
+        with timed("response"):
+            resp = jsonify({"status": "success", "message": "Data saved", "session_id": session_id, "session": _session_summary(info)})
+        return resp, 200
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype="text/plain", content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    @app.route("/session/<int:session_id>/live", methods=["GET"])
+    def session_live(session_id: int):
+        """Server-Sent Events stream of a chunked upload's live events."""
+        state = _session_state(session_id)
+        if state is None:
+            return jsonify({"status": "error", "message": "Session not found"}), 404
+        hub = current_app.extensions["live_hub"]
+        after = request.headers.get("Last-Event-ID", type=int) or request.args.get("after", 0, type=int)
+
+        def generate(after, receiving):
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            while True:
+                # Only an upload still receiving chunks is waited on; otherwise the backlog is sent and the stream ends.
+                events, closed = hub.wait(session_id, after, SSE_KEEPALIVE_S if receiving else 0)
+                if hub.shutting_down and not events:
+                    # The server is stopping: end the stream; the client reconnects with Last-Event-ID.
+                    return
+                for event in events:
+                    yield f"id: {event['id']}\nevent: {event['type']}\ndata: {jsoncodec.dumps(event)}\n\n"
+                    after = event["id"]
+                if closed or not receiving:
+                    return
+                if not events:
+                    # Comment line keeps proxies from closing an idle stream.
+                    yield ": keepalive\n\n"
+                    receiving = _session_state(session_id) == RECEIVING
+
+        return Response(
+            stream_with_context(generate(after, state == RECEIVING)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.route("/session/<int:session_id>/events", methods=["GET"])
+    def session_events(session_id: int):
+        """Long-poll variant of /live: events after ``after``, waiting up to ``timeout`` s."""
+        state = _session_state(session_id)
+        if state is None:
+            return jsonify({"status": "error", "message": "Session not found"}), 404
+        receiving = state == RECEIVING
+        timeout = min(max(request.args.get("timeout", 25.0, type=float), 0.0), LONG_POLL_MAX_S) if receiving else 0.0
+        events, closed = current_app.extensions["live_hub"].wait(
+            session_id, request.args.get("after", 0, type=int), timeout
+        )
+        return jsonify({"status": "success", "events": events, "closed": closed or not receiving}), 200
+
+    @app.route("/session/<int:session_id>/status", methods=["GET"])
+    def session_status(session_id: int):
+        db_path, _, _ = _repo_data_paths()
+        try:
+            with connection(db_path) as conn:
+                row = conn.execute(
+                    "SELECT id, status, error, raw_filename FROM sessions WHERE id = ?", (session_id,)
+                ).fetchone()
         except Exception as exc:
-            LOG.warning("Invalid JSON received: %s", exc)
-            return jsonify({"status": "error", "message": "Invalid JSON payload", "error": str(exc)}), 400
-        data_dir = make_data_dir()
-        ok, info = save_raw_json_payload(data_dir, raw)
-        if not ok:
-            return jsonify({"status": "error", "message": "Failed to save data", "error": info}), 500
-        # info is a session_meta dict with processed filenames and stats
-        return jsonify({"status": "success", "message": "Data saved", "session": info}), 200
+            LOG.exception("Failed to read status of session %s: %s", session_id, exc)
+            return jsonify({"status": "error", "message": "Failed to read sessions DB"}), 500
+        if not row:
+            return jsonify({"status": "error", "message": "Session not found"}), 404
+        return jsonify({
+            "status": "success",
+            "session_id": row["id"],
+            # Rows written before the queue existed have no status and are complete.
+            "state": row["status"] or "done",
+            "error": row["error"],
+            "raw": row["raw_filename"],
+        }), 200
     
     @app.route("/", methods=["GET"])
     def index():
         db_path, _, _ = _repo_data_paths()
         sessions = []
+        next_cursor = None
+        try:
+            listing = parse_listing_args(request.args)
+        except QueryError as exc:
+            return render_template("index.html", sessions=[], error=str(exc)), 400
         if db_path.exists():
             try:
-                conn = sqlite3.connect(str(db_path))
-                conn.row_factory = sqlite3.Row
-                cur = conn.cursor()
-                cur.execute(
-                    "SELECT id, created_at, duration, heart_mean, heart_max, imu_csv, heart_csv, raw_filename FROM sessions ORDER BY id DESC"
-                )
-                
-                # Fetch data and format the timestamp
-                sessions = [
-                    {
-                        **dict(r),
-                        "created_at": _format_ts(r["created_at"])
-                    }
-                    for r in cur.fetchall()
-                ]
-                conn.close()
+                rows, next_cursor = list_sessions(db_path, **listing)
+                # Only the rows on this page get their timestamp formatted
+                sessions = [{**r, "created_at": _format_ts(r["created_at"])} for r in rows]
+            except QueryError as exc:
+                return render_template("index.html", sessions=[], error=str(exc)), 400
             except Exception as exc:
                 LOG.exception("Failed to read sessions DB: %s", exc)
 
-        # Pass the list of sessions directly to the template
-        return render_template("index.html", sessions=sessions)
+        next_args = {k: v for k, v in request.args.items() if k != "after"}
+        next_url = url_for("index", after=next_cursor, **next_args) if next_cursor else None
+        return render_template("index.html", sessions=sessions, next_url=next_url, paged=bool(request.args.get("after")))
+
+    @app.route("/api/sessions", methods=["GET"])
+    def api_sessions():
+        db_path, _, _ = _repo_data_paths()
+        try:
+            rows, next_cursor = list_sessions(db_path, **parse_listing_args(request.args))
+        except QueryError as exc:
+            return jsonify({"status": "error", "message": str(exc)}), 400
+        except Exception as exc:
+            LOG.exception("Failed to list sessions: %s", exc)
+            return jsonify({"status": "error", "message": "Failed to read sessions DB"}), 500
+        return jsonify({"status": "success", "sessions": rows, "next": next_cursor}), 200
+
+    @app.route("/api/trends", methods=["GET"])
+    def api_trends():
+        """Per-day/week/month totals of finished sessions, answered from the rollup tables."""
+        db_path, _, _ = _repo_data_paths()
+        bucket = request.args.get("bucket", "day")
+        try:
+            rows = trends(db_path, bucket, request.args.get("from"), request.args.get("to"), request.args.get("device") or None)
+        except TrendsError as exc:
+            return jsonify({"status": "error", "message": str(exc)}), 400
+        except Exception as exc:
+            LOG.exception("Failed to read trends: %s", exc)
+            return jsonify({"status": "error", "message": "Failed to read sessions DB"}), 500
+        return jsonify({"status": "success", "bucket": bucket, "trends": rows}), 200
+
+    @app.route("/api/export", methods=["GET"])
+    def api_export():
+        """Zip of the finished sessions between two days, streamed while it is built (server/export.py)."""
+        db_path, _, _ = _repo_data_paths()
+        try:
+            params = parse_export_args(request.args)
+        except ExportError as exc:
+            return jsonify({"status": "error", "message": str(exc)}), exc.status
+        return Response(
+            stream_with_context(export_zip(db_path.parent, **params)),
+            mimetype="application/zip",
+            headers={"Content-Disposition": f"attachment; filename={export_filename(params)}"},
+        )
+
+    @app.route("/api/session/<int:session_id>/analysis", methods=["GET"])
+    def api_session_analysis(session_id: int):
+        """Stored analysis results (HR zones, intensity, strike list) of a finished session."""
+        db_path, _, _ = _repo_data_paths()
+        try:
+            text = session_results_json(db_path.parent, session_id, current_app.extensions["analysis_cache"])
+        except ResultsError as exc:
+            return jsonify({"status": "error", "message": str(exc)}), exc.status
+        except Exception as exc:
+            LOG.exception("Failed to load analysis of session %s: %s", session_id, exc)
+            return jsonify({"status": "error", "message": "Failed to load session analysis"}), 500
+        # The stored JSON is spliced in as is; re-encoding it would cost more than the lookup.
+        body = f'{{"status":"success","session_id":{session_id},"analysis":{text}}}'
+        return Response(body, mimetype="application/json")
+
+    @app.route("/api/session/<int:session_id>/series", methods=["GET"])
+    def api_session_series(session_id: int):
+        """Chart data: at most ``points`` min/max/mean buckets of ``metric`` between ``from`` and ``to`` (ms)."""
+        metric = request.args.get("metric", "accel")
+        try:
+            t_from = request.args.get("from", type=float)
+            t_to = request.args.get("to", type=float)
+            points = request.args.get("points", DEFAULT_POINTS, type=int)
+            if metric not in METRIC_STREAMS:
+                raise SeriesError(f"Unknown metric: {metric}")
+        except (SeriesError, ValueError) as exc:
+            return jsonify({"status": "error", "message": str(exc)}), 400
+        column = "imu_csv" if METRIC_STREAMS[metric] == "imu" else "heart_csv"
+        db_path, processed_dir, _ = _repo_data_paths()
+        with connection(db_path) as conn:
+            row = conn.execute(f"SELECT status, {column} AS filename FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if not row:
+            return jsonify({"status": "error", "message": "Session not found"}), 404
+        if not row["filename"] or not (processed_dir / row["filename"]).exists():
+            return jsonify({"status": "error", "message": f"Session is {row['status'] or 'missing its processed data'}"}), 409
+        try:
+            data = query_series(processed_dir.parent, row["filename"], metric, t_from, t_to, points)
+        except SeriesError as exc:
+            return jsonify({"status": "error", "message": str(exc)}), 400
+        except Exception as exc:
+            LOG.exception("Failed to read series of session %s: %s", session_id, exc)
+            return jsonify({"status": "error", "message": "Failed to read session data"}), 500
+        return jsonify({"status": "success", "session_id": session_id, "metric": metric, **data}), 200
 
     @app.route("/session/<int:session_id>", methods=["GET"])
     def session_detail(session_id: int):
@@ -75,22 +386,43 @@ def register_routes(app):
         if not db_path.exists():
             abort(404)
         try:
-            conn = sqlite3.connect(str(db_path))
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT * FROM sessions WHERE id = ?", (session_id,)
-            )
-            row = cur.fetchone()
-            conn.close()
+            with connection(db_path) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT * FROM sessions WHERE id = ?", (session_id,)
+                )
+                row = cur.fetchone()
             if not row:
                 abort(404)
             session = dict(row)
             session["created_at_human"] = _format_ts(session.get("created_at"))
-            return render_template("session.html", session=session)
+            analysis = None
+            if (session["status"] or "done") == "done":
+                try:
+                    analysis = jsoncodec.loads(session_results_json(db_path.parent, session_id, current_app.extensions["analysis_cache"]))
+                except Exception as exc:
+                    LOG.warning("No analysis for session %s: %s", session_id, exc)
+            return render_template("session.html", session=session, analysis=analysis)
         except Exception as exc:
             LOG.exception("Failed to load session %s: %s", session_id, exc)
             abort(500)
 
-
-
+    @app.route("/session/<int:session_id>/<stream>.csv", methods=["GET"])
+    def session_csv(session_id: int, stream: str):
+        """CSV export of a processed stream, converted on the fly from whatever format is stored."""
+        columns = {"imu": "imu_csv", "heart_rate": "heart_csv", "rotation": "rotation_file"}
+        if stream not in columns:
+            abort(404)
+        db_path, processed_dir, _ = _repo_data_paths()
+        with connection(db_path) as conn:
+            row = conn.execute(
+                f"SELECT {columns[stream]} AS filename FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if not row or not row["filename"] or not (processed_dir / row["filename"]).exists():
+            abort(404)
+        filename = row["filename"]
+        return Response(
+            stream_with_context(iter_processed_csv(processed_dir.parent, filename)),
+            mimetype="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={Path(filename).stem}.csv"},
+        )
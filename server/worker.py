@@ -0,0 +1,145 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Deque, Dict, Optional
+import logging
+import threading
+
+from .db import connection
+from .ingest import SessionColumns
+from .rawstore import device_of, is_ndjson, iter_raw_files, raw_stem, relative_name
+from .storage import DEFAULT_PROCESSED_FORMAT, insert_session, process_queued_session
+
+LOG = logging.getLogger("sensor_server.worker")
+
+PENDING_STATES = ("queued", "processing")
+
+
+def _log_failure(future: Future) -> None:
+    exc = future.exception()
+    if exc is not None:
+        LOG.error("Background session processing crashed: %s", exc)
+
+
+class IngestQueue:
+    """Background pool that processes raw files after POST /end has returned.
+
+    ``workers`` <= 0 disables the pool: submitted sessions are processed inline.
+    ``kind`` is "thread" or "process"; process workers re-read the raw file
+    instead of receiving the parsed columns. ``processed_format`` is passed on
+    to the storage writers.
+
+    Sessions of one device (the directory of their raw file) are processed one
+    at a time, in the order they were submitted; different devices, and
+    sessions without a device, run in parallel.
+    """
+
+    def __init__(self, data_dir: Path, workers: int = 2, kind: str = "thread", processed_format: str = DEFAULT_PROCESSED_FORMAT):
+        self.data_dir = Path(data_dir)
+        self.workers = workers
+        self.kind = kind
+        self.processed_format = processed_format
+        # device id -> sessions waiting behind the one being processed
+        self._waiting: Dict[str, Deque[tuple]] = {}
+        self._lock = threading.Condition()
+        if workers <= 0:
+            self._executor = None
+        elif kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        elif kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError(f"Unknown ingest executor kind: {kind!r}")
+
+    @property
+    def is_async(self) -> bool:
+        return self._executor is not None
+
+    def submit(self, session_id: int, raw_filename: str, session: Optional[SessionColumns] = None) -> None:
+        if self._executor is None:
+            process_queued_session(self.data_dir, session_id, raw_filename, session, self.processed_format)
+            return
+        if self.kind == "process":
+            session = None
+        task = (session_id, raw_filename, session)
+        device = device_of(raw_filename)
+        if device is not None:
+            with self._lock:
+                if device in self._waiting:
+                    self._waiting[device].append(task)
+                    return
+                self._waiting[device] = deque()
+        self._start(device, task)
+
+    def _start(self, device: Optional[str], task: tuple) -> None:
+        try:
+            future = self._executor.submit(process_queued_session, self.data_dir, *task, self.processed_format)
+        except RuntimeError:
+            if device is not None:
+                # The pool is shut down; the device's other sessions stay queued in sessions.db for recover_pending.
+                with self._lock:
+                    del self._waiting[device]
+                    self._lock.notify_all()
+            raise
+        future.add_done_callback(_log_failure)
+        if device is not None:
+            future.add_done_callback(lambda _: self._next(device))
+
+    def _next(self, device: str) -> None:
+        with self._lock:
+            waiting = self._waiting[device]
+            if not waiting:
+                del self._waiting[device]
+                self._lock.notify_all()
+                return
+            task = waiting.popleft()
+        try:
+            self._start(device, task)
+        except RuntimeError as exc:
+            LOG.warning("Session %s left queued: %s", task[0], exc)
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            if wait:
+                # Sessions waiting behind another of their device are only handed to the pool later.
+                with self._lock:
+                    while self._waiting:
+                        self._lock.wait()
+            self._executor.shutdown(wait=wait)
+
+
+def recover_pending(data_dir: Path, queue: IngestQueue) -> int:
+    """Re-queue unfinished work left by a previous run.
+
+    That is rows still ``queued``/``processing`` and raw files that never got a
+    sessions row. Returns the number of sessions queued.
+    """
+    db_path = data_dir / "sessions.db"
+    pending = []
+    known = set()
+    try:
+        with connection(db_path) as conn:
+            for session_id, raw_filename, status in conn.execute("SELECT id, raw_filename, status FROM sessions"):
+                known.add(raw_filename)
+                if status in PENDING_STATES:
+                    pending.append((session_id, raw_filename))
+    except Exception:
+        LOG.exception("Failed to scan %s for pending sessions", db_path)
+        return 0
+
+    known_stems = {raw_stem(name) for name in known if name}
+    raw_dir = data_dir / "raw_data"
+    for raw_path in iter_raw_files(raw_dir):
+        name = relative_name(raw_dir, raw_path)
+        # A stem with a row is covered even if a copy under another codec
+        # suffix was left behind by an interrupted compression.
+        if raw_stem(name) in known_stems or is_ndjson(name):
+            continue
+        session_id = insert_session(data_dir, name, status="queued")
+        if session_id is not None:
+            pending.append((session_id, name))
+
+    for session_id, raw_filename in pending:
+        LOG.info("Re-queueing session %s (%s)", session_id, raw_filename)
+        queue.submit(session_id, raw_filename)
+    return len(pending)
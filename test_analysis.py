@@ -1,7 +1,12 @@
+import math
 import urllib.request
 import json
 import random
 
+import pytest
+
+from server import analysis, rhythm, streaming
+
 def generate_dummy_data():
     # Generate some dummy heart rate data
     heart_rates = []
@@ -57,5 +62,214 @@ def test_server():
     except Exception as e:
         print(f"Error sending request: {e}")
 
+def _imu_rows(payload):
+    return [[s["t"], s["ax"], s["ay"], s["az"], s["gx"], s["gy"], s["gz"]] for s in payload["imu"]]
+
+def _run_both_backends(fn, *args, **kwargs):
+    pytest.importorskip("numpy")
+    previous = analysis.get_backend()
+    try:
+        analysis.set_backend("python")
+        expected = fn(*args, **kwargs)
+        analysis.set_backend("numpy")
+        actual = fn(*args, **kwargs)
+    finally:
+        analysis.set_backend(previous)
+    return expected, actual
+
+def test_numpy_backend_matches_python_on_dummy_data():
+    payload = generate_dummy_data()
+    rows = _imu_rows(payload)
+    bpm = [float(hr["bpm"]) for hr in payload["heart_rates"]]
+
+    expected, actual = _run_both_backends(analysis.detect_kendo_strikes, rows)
+    assert actual == expected
+    assert expected["strike_count"] == 5
+    expected, actual = _run_both_backends(analysis.calculate_movement_intensity, rows)
+    assert actual == expected
+    expected, actual = _run_both_backends(analysis.calculate_hr_zones, bpm)
+    assert actual == expected
+
+def test_numpy_backend_matches_python_on_random_inputs():
+    rng = random.Random(118)
+    for _ in range(200):
+        t = 0.0
+        rows = []
+        for _ in range(rng.randint(0, 400)):
+            # Mix integer ms, float and repeated timestamps.
+            t += rng.choice([0, 1, 10, 50, 100, 199.5, 200, 250.25])
+            rows.append([t] + [rng.uniform(-4.0, 4.0) for _ in range(6)])
+        threshold = rng.choice([0.5, 2.0, 4.0])
+        min_dist_ms = rng.choice([0, 100, 200, 1000])
+        bpm = [rng.uniform(50, 200) for _ in range(rng.randint(0, 50))] + [100.0, 130.0, 150.0]
+
+        expected, actual = _run_both_backends(analysis.detect_kendo_strikes, rows, threshold, min_dist_ms)
+        assert actual == expected
+        expected, actual = _run_both_backends(analysis.calculate_movement_intensity, rows)
+        assert actual == expected
+        expected, actual = _run_both_backends(analysis.calculate_hr_zones, bpm)
+        assert actual == expected
+
+def test_numpy_backend_falls_back_on_unsorted_timestamps():
+    rows = [[500, 3, 0, 0, 0, 0, 0], [0, 4, 0, 0, 0, 0, 0], [900, 5, 0, 0, 0, 0, 0]]
+    expected, actual = _run_both_backends(analysis.detect_kendo_strikes, rows)
+    assert actual == expected
+
+def _random_splits(rng, n):
+    cuts = sorted(rng.sample(range(1, n), min(n - 1, rng.randint(0, 8)))) if n > 1 else []
+    return list(zip([0] + cuts, cuts + [n]))
+
+def _streamed(rows, bpm, splits, threshold, min_dist_ms):
+    detector = streaming.StrikeDetector(threshold, min_dist_ms)
+    hr = streaming.HeartRateAggregator()
+    intensity = streaming.IntensityAggregator()
+    events = []
+    for start, stop in splits:
+        t, ax, ay, az = analysis._columns_from_rows(rows[start:stop])
+        events += detector.update(t, ax, ay, az)
+        intensity.update(ax, ay, az)
+    for start, stop in _random_splits(random.Random(len(bpm)), len(bpm)):
+        hr.update(bpm[start:stop])
+    return detector, hr, intensity, events
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_streaming_aggregators_match_batch_functions(backend):
+    if backend == "numpy":
+        pytest.importorskip("numpy")
+    previous = analysis.get_backend()
+    analysis.set_backend(backend)
+    try:
+        rng = random.Random(8)
+        for _ in range(200):
+            t = 0.0
+            rows = []
+            for _ in range(rng.randint(0, 300)):
+                t += rng.choice([0, 1, 10, 50, 199.5, 200, 250.25])
+                rows.append([t] + [rng.uniform(-4.0, 4.0) for _ in range(6)])
+            threshold = rng.choice([0.5, 2.0, 4.0])
+            min_dist_ms = rng.choice([0, 100, 200, 1000])
+            bpm = [rng.uniform(50, 200) for _ in range(rng.randint(0, 50))]
+
+            detector, hr, intensity, events = _streamed(rows, bpm, _random_splits(rng, len(rows)), threshold, min_dist_ms)
+            peaks, times = [], []
+            analysis.scan_strikes(*analysis._columns_from_rows(rows), threshold, min_dist_ms, peaks, -min_dist_ms, times)
+            # Replaying the events rebuilds the batch peaks and start times.
+            replayed = {}
+            for e in events:
+                replayed[e["index"]] = e["force"]
+            assert [replayed[i] for i in range(len(replayed))] == peaks
+            assert [e["t"] for e in events if e["type"] == "strike"] == times
+            expected = analysis.detect_kendo_strikes(rows, threshold, min_dist_ms)
+            assert detector.stats() == pytest.approx(expected, rel=1e-12)
+            assert detector.stats()["max_strike_force"] == expected["max_strike_force"]
+
+            assert hr.zone_counts() == analysis.calculate_hr_zones(bpm)
+            expected_hr = analysis.heart_rate_stats(bpm)
+            assert (hr.count, hr.max) == (expected_hr["count"], expected_hr["max"])
+            assert hr.stats()["mean"] == pytest.approx(expected_hr["mean"], rel=1e-12)
+            expected_intensity = analysis.calculate_movement_intensity(rows)
+            assert intensity.stats() == pytest.approx(expected_intensity, rel=1e-12)
+
+            restored = streaming.StrikeDetector.from_state(json.loads(json.dumps(detector.state())))
+            assert restored.state() == detector.state()
+    finally:
+        analysis.set_backend(previous)
+
+
+def rotation_swings(n, swing_starts, rate_dps=250.0, swing_ms=300, interval_ms=10.0, scale=2.0):
+    """Rotation columns turning about y at ``rate_dps`` for ``swing_ms`` from each start, at rest otherwise.
+
+    Quaternions are scaled by ``scale`` so they need normalizing.
+    """
+    rotation = {k: [] for k in ("t", "x", "y", "z", "w")}
+    angle = 0.0
+    for i in range(n):
+        t = i * interval_ms
+        if any(start < t <= start + swing_ms for start in swing_starts):
+            angle += math.radians(rate_dps) * interval_ms / 1000.0
+        for k, v in zip(("t", "x", "y", "z", "w"), (t, 0.0, scale * math.sin(angle / 2), 0.0, scale * math.cos(angle / 2))):
+            rotation[k].append(v)
+    return rotation
+
+def test_orientation_swings_match_strikes_on_both_backends():
+    rotation = rotation_swings(2000, [1000, 5000, 9000, 12000])
+    rotation["w"][1500] = rotation["y"][1500] = 0.0  # a zero-length sample
+    strikes = [1250.0, 5400.0, 5420.0, 15000.0]
+
+    expected, actual = _run_both_backends(analysis.orientation_summary, rotation, strikes)
+    assert expected["swing_count"] == 4
+    assert [s["strike"] for s in expected["swings"]] == [0, 1, None, None]
+    assert (expected["swings_with_strike"], expected["strikes_with_swing"]) == (2, 2)
+    assert expected["max_angular_velocity"] == pytest.approx(250.0)
+    assert expected["avg_swing_arc"] == pytest.approx(75.0, abs=3.0)
+    assert expected["swings"][0]["pitch_delta"] == pytest.approx(75.0, abs=3.0)
+    for key, value in expected.items():
+        if key != "swings":
+            assert actual[key] == pytest.approx(value, rel=1e-9)
+    for e, a in zip(expected["swings"], actual["swings"]):
+        assert a == pytest.approx(e, rel=1e-9, abs=1e-9)
+
+    # q and -q are the same orientation: flipping signs mid-stream is not a rotation.
+    flipped = {k: [(-v if k != "t" and i % 2 else v) for i, v in enumerate(col)] for k, col in rotation.items()}
+    assert analysis.orientation_summary(flipped, strikes)["swing_count"] == 4
+
+def test_alignment_weights_zones_by_elapsed_time_and_skips_gaps():
+    # 1 Hz heart rate with a 21 s dropout, sent out of order with a no-lock and a NaN reading inside the gap.
+    hr = [(s * 1000.0, 80.0 + 0.5 * s) for s in range(40)] + [(s * 1000.0, 140.0) for s in range(60, 100)]
+    hr += [(50000.0, 0.0), (55000.0, math.nan)]
+    random.Random(3).shuffle(hr)
+    hr_t, bpm = [t for t, _ in hr], [b for _, b in hr]
+    imu_t = [i * 10.0 for i in range(10000)]
+    ax = [1.0 if t < 40000 else 3.0 for t in imu_t]
+    zeros = [0.0] * len(imu_t)
+    strikes = [10000.0, 35000.0, 50000.0, 95000.0]
+
+    expected, actual = _run_both_backends(analysis.alignment_summary, hr_t, bpm, imu_t, ax, zeros, zeros, strikes)
+    assert actual == expected
+    resting, fat_burn, cardio, peak = analysis.hr_zone_labels()
+    assert expected["zone_seconds"] == {resting: 39.0, fat_burn: 0.0, cardio: 39.0, peak: 0.0}
+    assert expected["hr_gaps"] == [{"start": 39000.0, "end": 60000.0}]
+    assert (expected["hr_covered_s"], expected["hr_gap_s"]) == (78.0, 21.0)
+    assert expected["intensity_by_zone"] == {resting: 1.0, fat_burn: None, cardio: 3.0, peak: None}
+    # The second strike's window ends in the gap, the last one's after the last reading.
+    assert expected["strike_bpm"] == [85.0, 97.5, None, 140.0]
+    assert expected["strike_hr_delta"] == [5.0, None, None, None]
+    assert expected["avg_strike_hr_delta"] == 5.0
+
+    rng = random.Random(23)
+    for _ in range(50):
+        n = rng.randint(0, 200)
+        hr_t = [rng.choice([rng.uniform(0, 60000), rng.randrange(0, 60000, 500)]) for _ in range(n)]
+        bpm = [rng.choice([0.0, math.nan, rng.uniform(60, 190)]) for _ in range(n)]
+        imu_t = sorted(rng.uniform(-1000, 61000) for _ in range(rng.randint(0, 300)))
+        axes = [[rng.uniform(-3, 3) for _ in imu_t] for _ in range(3)]
+        expected, actual = _run_both_backends(analysis.alignment_summary, hr_t, bpm, imu_t, *axes, imu_t[::37])
+        assert actual == expected
+
+def test_rhythm_finds_swing_cadence_and_hrv():
+    # 60 s at rest, then 120 s swinging at 0.75 Hz (45 per minute).
+    imu_t = [i * 10.0 for i in range(18000)]
+    az = [1.0 if t < 60000 else 1.0 + 0.5 * math.sin(2 * math.pi * 0.75 * t / 1000.0) for t in imu_t]
+    zeros = [0.0] * len(imu_t)
+    strikes = [60000.0 + i * 1333.0 for i in range(40)] + [120000.0 + i * 1333.0 for i in range(40)]
+
+    expected, actual = _run_both_backends(rhythm.rhythm_summary, imu_t, zeros, zeros, az, strikes)
+    for key, value in expected.items():
+        assert actual[key] == pytest.approx(value, rel=1e-9, abs=1e-9)
+    assert expected["cadence_spm"] == pytest.approx(45.0, abs=0.5)
+    assert expected["window_cadence_spm"][0] is None  # at rest
+    assert expected["window_cadence_spm"][-1] == pytest.approx(45.0, abs=0.5)
+    assert expected["cadence_cv"] < 0.01
+    # The pause between the two runs of strikes is not part of the rhythm.
+    assert expected["strike_interval_ms"] == pytest.approx(1333.0)
+    assert expected["strike_interval_cv"] == pytest.approx(0.0, abs=1e-9)
+
+    # 60 and 75 bpm alternating (1000 and 800 ms intervals), with a gap that breaks the successive differences.
+    hr_t = [i * 1000.0 for i in range(10)] + [30000.0 + i * 1000.0 for i in range(10)]
+    bpm = [60.0 if i % 2 else 75.0 for i in range(20)]
+    hrv = rhythm.hrv_summary(hr_t, bpm)
+    assert hrv == pytest.approx({"readings": 20, "mean_rr_ms": 900.0, "sdnn_ms": 100.0, "rmssd_ms": 200.0})
+
+
 if __name__ == "__main__":
     test_server()
@@ -0,0 +1,289 @@
+from array import array
+import csv
+import io
+import json
+import math
+import random
+import sqlite3
+import threading
+
+import pytest
+
+from server import columnar, durable, ingest, rawstore
+from server.db import close_all, connection, init_db, transaction
+from server.reprocess import reprocess
+from server.storage import PROCESSING_VERSION, insert_session, load_raw_session, read_processed, write_processed
+
+
+def test_columnar_round_trip(tmp_path):
+    cols = {"t": array("d", [0.0, 10.5, 1e12]), "x": array("d", [1.25, -2.5, float("nan")]), "n": [1, 2, 3]}
+    ok, name = columnar.write_columns(tmp_path / "a.kcol", cols, {"t": "f8", "x": "f4", "n": "i4"}, meta={"k": 1})
+    assert ok and name == "a.kcol"
+
+    with columnar.ColumnFile(tmp_path / "a.kcol") as cf:
+        assert cf.rows == 3 and cf.names == ("t", "x", "n") and cf.meta == {"k": 1}
+        view = cf.view("t")
+        assert list(view) == [0.0, 10.5, 1e12]
+        view.release()
+        assert list(cf.read("n", 1, 3)) == [2, 3]
+    loaded = columnar.read_columns(tmp_path / "a.kcol")
+    assert loaded["x"][:2].tolist() == [1.25, -2.5] and math.isnan(loaded["x"][2])
+
+
+def test_columnar_rejects_bad_files(tmp_path):
+    (tmp_path / "empty.kcol").write_bytes(b"")
+    (tmp_path / "junk.kcol").write_bytes(b"not a column file")
+    columnar.write_columns(tmp_path / "ok.kcol", {"t": [1.0, 2.0]}, {"t": "f8"})
+    (tmp_path / "cut.kcol").write_bytes((tmp_path / "ok.kcol").read_bytes()[:-8])
+    for name in ("empty.kcol", "junk.kcol", "cut.kcol"):
+        with pytest.raises(columnar.ColumnFileError):
+            columnar.ColumnFile(tmp_path / name)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "columnar"])
+def test_processed_formats_read_back(tmp_path, fmt):
+    (tmp_path / "processed_data").mkdir()
+    cols = {"t": array("d", [0.0, 500.0]), "bpm": array("d", [80.0, float("nan")])}
+    ok, name = write_processed(tmp_path / "processed_data", "s", "heart_rate", cols, fmt)
+    assert ok
+    loaded = read_processed(tmp_path, name)
+    assert list(loaded) == ["t", "bpm"]
+    assert loaded["t"].tolist() == [0.0, 500.0]
+    assert loaded["bpm"][0] == 80.0 and math.isnan(loaded["bpm"][1])
+
+
+def _baseline_csv(headers, samples, aliases=()):
+    """What the original per-sample writer produced: one csv row of raw values per object sample."""
+    out = io.StringIO(newline="")
+    writer = csv.writer(out)
+    writer.writerow(headers)
+    for item in samples:
+        row = [item.get(k) for k in headers]
+        for k, alias in aliases:
+            if row[headers.index(k)] is None:
+                row[headers.index(k)] = item.get(alias)
+        writer.writerow(row)
+    return out.getvalue()
+
+
+def test_parse_payload_builds_columns_in_one_pass(tmp_path):
+    imu = [{"t": t * 10.0, "ax": 0.5 + t, "ay": -0.25, "az": 9.81, "gx": 0.125, "gy": 1e-3, "gz": 2.5} for t in range(5)]
+    hr = [{"t": 0.0, "bpm": 80.0}, {"t": 1000.0, "value": 81.5}, {"bpm": 82.0}, {"t": 3000.0, "bpm": None}]
+    payload = {"duration": 5, "imu_hz": "100", "imu": imu + [{**imu[0], "ax": "1.5"}, {"t": 60.0}, 3], "heart_rates": hr + [72]}
+    ok, session = ingest.parse_payload(json.dumps(payload).encode())
+    assert ok and session.payload is None
+
+    # Bad IMU samples are dropped; a missing optional field becomes NaN in its own column only.
+    assert (session.imu_count, session.heart_rate_count, session.rotation_count) == (5, 4, 0)
+    assert session.dropped == {"imu": 3, "heart_rate": 1, "rotation": 0}
+    assert list(session.imu["ax"]) == [0.5, 1.5, 2.5, 3.5, 4.5]
+    assert list(session.heart_rate["bpm"]) == [80.0, 81.5, 82.0, 72.0]
+    assert [math.isnan(t) for t in session.heart_rate["t"]] == [False, False, True, True]
+    assert session.meta == {"duration": 5.0, "imu_hz": None, "heart_rate_hz": None}
+
+    # The processed CSV of well-formed samples matches the original writer byte for byte.
+    clean = ingest.parse_payload(json.dumps({"imu": imu, "heart_rates": hr[:3]}))[1]
+    for stream, samples, aliases in (("imu", imu, ()), ("heart_rate", hr[:3], (("bpm", "value"),))):
+        ok, name = write_processed(tmp_path, "s", stream, clean.stream(stream), "csv")
+        assert ok
+        expected = _baseline_csv(list(ingest.STREAM_FIELDS[stream]), samples, aliases)
+        assert (tmp_path / name).read_bytes() == expected.encode("utf-8")
+
+
+@pytest.mark.parametrize("codec", ["zstd", "gzip", "lzma", "none"])
+def test_raw_store_round_trip(tmp_path, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    previous = rawstore.get_compression()
+    rawstore.set_compression(codec, 1)
+    try:
+        text = '{"imu": [], "note": "' + "\u00e9" * (rawstore.ENCODE_CHUNK_CHARS + 10) + '"}'
+        ok, name = rawstore.write_raw_text(tmp_path, "session_x.json", text, fsync=True)
+    finally:
+        rawstore.set_compression(*previous)
+    assert ok and name == "session_x.json" + rawstore.SUFFIXES[codec]
+    assert rawstore.read_raw_text(tmp_path / name) == text
+    assert rawstore.raw_stem(name) == "session_x"
+    assert [p.name for p in rawstore.iter_raw_files(tmp_path)] == [name]
+
+
+def test_raw_migration_compresses_in_place(tmp_path):
+    init_db(tmp_path)
+    raw_dir = tmp_path / "raw_data"
+    raw_dir.mkdir()
+    (raw_dir / "session_a.json").write_text('{"duration": 5, "imu": [], "heart_rates": [{"t": 0, "bpm": 90}]}')
+    (raw_dir / "session_b.ndjson").write_text('{"t": 0, "bpm": 90}\n')
+    session_id = insert_session(tmp_path, "session_a.json")
+    insert_session(tmp_path, "session_b.ndjson", status="receiving")
+    (raw_dir / "session_c.json").write_text("{}")
+    insert_session(tmp_path, "session_c.json", status="queued")
+    (raw_dir / "session_d.json").write_text("{}")  # written by /end, row not inserted yet
+
+    stats = rawstore.migrate(tmp_path, "gzip")
+    assert (stats["files"], stats["skipped"]) == (1, 3)
+    assert sorted(p.name for p in raw_dir.iterdir()) == ["session_a.json.gz", "session_b.ndjson", "session_c.json", "session_d.json"]
+    with connection(tmp_path / "sessions.db") as conn:
+        row = conn.execute("SELECT raw_filename FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    assert row["raw_filename"] == "session_a.json.gz"
+    ok, session = load_raw_session(tmp_path, row["raw_filename"])
+    assert ok and session.meta["duration"] == 5 and list(session.heart_rate["bpm"]) == [90.0]
+
+
+def _borrow_and_hold(db_path):
+    with connection(db_path) as conn:
+        return conn
+
+
+def test_connection_pool_reuses_tuned_connections(tmp_path):
+    db_path = tmp_path / "pool.db"
+    with connection(db_path) as conn:
+        first = conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        conn.execute("CREATE TABLE t (x INTEGER)")
+    with connection(db_path) as conn:
+        assert conn is first
+        # A borrow overlapping this one, from another thread, gets its own connection.
+        other = []
+        thread = threading.Thread(target=lambda: other.append(_borrow_and_hold(db_path)))
+        thread.start()
+        thread.join()
+        assert other[0] is not conn
+
+    with pytest.raises(RuntimeError):
+        with transaction(db_path) as conn:
+            conn.execute("INSERT INTO t VALUES (1)")
+            raise RuntimeError("abort")
+    with transaction(db_path) as conn:
+        conn.execute("INSERT INTO t VALUES (2)")
+    with connection(db_path) as conn:
+        assert [r[0] for r in conn.execute("SELECT x FROM t")] == [2]
+
+    close_all()
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.execute("SELECT 1")
+    with connection(db_path) as conn:
+        assert conn is not first and conn.execute("SELECT count(*) FROM t").fetchone()[0] == 1
+
+
+def test_reprocess_rebuilds_and_skips_unchanged(tmp_path):
+    init_db(tmp_path)
+    raw_dir = tmp_path / "raw_data"
+    raw_dir.mkdir()
+    (tmp_path / "processed_data").mkdir()
+    body = '{"duration": 2, "imu": [{"t": 0, "ax": 1, "ay": 0, "az": 0}], "heart_rates": [{"t": 0, "bpm": 90}]}'
+    (raw_dir / "session_a.json").write_text(body)
+    (raw_dir / "session_b.json").write_text(body)
+    (raw_dir / "session_c.json").write_text("{not json")
+    old_id = insert_session(tmp_path, "session_a.json")  # row from before the current PROCESSING_VERSION
+
+    stats = reprocess(tmp_path, jobs=1)
+    assert (stats["processed"], stats["unchanged"], stats["failed"]) == (2, 0, 1)
+    with connection(tmp_path / "sessions.db") as conn:
+        rows = {r["raw_filename"]: dict(r) for r in conn.execute("SELECT * FROM sessions")}
+    assert rows["session_a.json"]["id"] == old_id and rows["session_a.json"]["heart_max"] == 90
+    assert rows["session_b.json"]["processing_version"] == PROCESSING_VERSION
+    assert rows["session_c.json"]["status"] == "failed"
+    assert read_processed(tmp_path, rows["session_b.json"]["heart_csv"])["bpm"].tolist() == [90.0]
+
+    # Unchanged content is skipped, even once recompressed under a new name and mtime.
+    rawstore.migrate(tmp_path, "gzip")
+    stats = reprocess(tmp_path, jobs=2)
+    assert (stats["processed"], stats["unchanged"], stats["failed"]) == (0, 2, 1)
+    assert reprocess(tmp_path, jobs=1)["checked"] == 1  # only the failed one is read again
+    stats = reprocess(tmp_path, jobs=1, processed_format="csv")
+    assert stats["processed"] == 2
+    assert sorted(p.name for p in (tmp_path / "processed_data").iterdir()) == [
+        f"session_{s}_{stream}{ext}" for s in "ab" for stream in ("heart_rate", "imu") for ext in (".csv", "_lod.kcol")]
+
+
+def _reference_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    try:
+        value = float(value)
+    except OverflowError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+def _reference_columns(schema, items):
+    """Field-by-field statement of the sample rules the generated validators implement."""
+    cols, dropped = {k: [] for k in schema.fields}, 0
+    for item in items:
+        if not isinstance(item, dict):
+            item = {schema.bare: item} if schema.bare else None
+        if item is None:
+            dropped += 1
+            continue
+        values = {}
+        for name in schema.fields:
+            value = item.get(name)
+            if value is None and name in dict(schema.aliases):
+                value = item.get(dict(schema.aliases)[name])
+            values[name] = _reference_number(value)
+        if any(values[name] is None for name in schema.required):
+            dropped += 1
+            continue
+        for name in schema.fields:
+            cols[name].append(math.nan if values[name] is None else values[name])
+    return cols, dropped
+
+
+def test_validators_match_reference_on_fuzzed_samples():
+    rng = random.Random(118)
+    junk = [None, True, "1.5", "", [], {}, math.nan, math.inf, -math.inf, 10 ** 400, 1e308, -0.0, 7]
+    for key, (stream, schema) in ingest.PAYLOAD_STREAMS.items():
+        keys = list(schema.fields) + [alias for _, alias in schema.aliases]
+        items = []
+        for _ in range(3000):
+            roll = rng.random()
+            if roll < 0.05:
+                items.append(rng.choice(junk))
+                continue
+            sample = {k: rng.uniform(-1e3, 1e3) if rng.random() < 0.5 else rng.randint(-1000, 1000) for k in schema.fields}
+            if roll < 0.5:
+                for k in rng.sample(keys, rng.randint(1, 2)):
+                    if rng.random() < 0.3:
+                        sample.pop(k, None)
+                    else:
+                        sample[k] = rng.choice(junk)
+            items.append(sample)
+
+        session = ingest.SessionColumns()
+        ingest.validate_samples(session, stream, items)
+        expected, dropped = _reference_columns(schema, items)
+        assert session.dropped[stream] == dropped > 0
+        for name in schema.fields:
+            got = session.stream(stream)[name]
+            assert len(got) == len(expected[name]) == len(items) - dropped
+            assert all(a == b or (math.isnan(a) and math.isnan(b)) for a, b in zip(got, expected[name]))
+
+    # The same samples sent as NDJSON lines are validated the same way.
+    lines = [json.dumps(s) for s in items if isinstance(s, dict) and "w" in s]
+    ok, session = ingest.parse_ndjson("\n".join(lines))
+    assert ok and session.rotation_count == len(lines) - session.dropped["rotation"]
+    assert ingest.parse_payload(b'{"imu": {"t": 1}}') == (False, "Invalid payload: imu must be a list")
+
+
+@pytest.mark.parametrize("level", ["atomic", "fsync", "group"])
+def test_atomic_writes_keep_old_file_on_failure(tmp_path, level):
+    previous = durable.get_level()
+    durable.set_level(level)
+    try:
+        target = tmp_path / "a.kcol"
+        assert columnar.write_columns(target, {"t": [1.0, 2.0]}, {"t": "f8"})[0]
+        ok, err = columnar.write_columns(target, {"t": [1.0], "x": [1.0, 2.0]}, {"t": "f8", "x": "f8"})
+        assert not ok and columnar.read_columns(target)["t"].tolist() == [1.0, 2.0]
+
+        # Concurrent writers share group commits; every file ends up complete.
+        threads = [threading.Thread(target=columnar.write_columns, args=(tmp_path / f"{i}.kcol", {"t": [float(i)] * 100}, {"t": "f8"}))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        durable.set_level(previous)
+    assert [columnar.read_columns(tmp_path / f"{i}.kcol")["t"][0] for i in range(8)] == [float(i) for i in range(8)]
+    assert not list(tmp_path.glob("*" + durable.TMP_SUFFIX))
@@ -0,0 +1,546 @@
+import json
+import math
+import threading
+import time
+
+import pytest
+
+from server import analysis, create_app, fsck, jsoncodec, lifecycle, rollups, series, worker
+from server.db import connection
+from server.storage import load_raw_session
+from test_analysis import generate_dummy_data, rotation_swings
+
+
+def _make_client(tmp_path, **config):
+    app = create_app({"DATA_DIR": tmp_path, **config})
+    return app, app.test_client()
+
+
+def _wait_for_state(client, session_id, timeout=10.0):
+    deadline = time.time() + timeout
+    while True:
+        state = client.get(f"/session/{session_id}/status").get_json()["state"]
+        if state in ("done", "failed") or time.time() > deadline:
+            return state
+        time.sleep(0.02)
+
+
+def test_end_returns_202_and_processes_in_background(tmp_path):
+    app, client = _make_client(tmp_path, INGEST_WORKERS=2)
+    resp = client.post("/end", data=json.dumps(generate_dummy_data()), content_type="application/json")
+    assert resp.status_code == 202
+    body = resp.get_json()
+    assert body["status"] == "accepted"
+    assert (tmp_path / "raw_data" / body["raw"]).exists()
+
+    assert _wait_for_state(client, body["session_id"]) == "done"
+    detail = client.get(f"/session/{body['session_id']}")
+    assert detail.status_code == 200
+    assert b"112.33" in detail.data
+    app.extensions["ingest_queue"].shutdown()
+
+
+def test_end_synchronous_mode_keeps_200_response(tmp_path):
+    _, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    resp = client.post("/end", data=json.dumps(generate_dummy_data()), content_type="application/json")
+    assert resp.status_code == 200
+    assert resp.get_json()["session"]["processed"]["imu"].endswith("_imu.kcol")
+
+
+def test_csv_processed_format_and_export(tmp_path):
+    _, client = _make_client(tmp_path, INGEST_WORKERS=0, PROCESSED_FORMAT="csv")
+    payload = generate_dummy_data()
+    resp = client.post("/end", data=json.dumps(payload), content_type="application/json")
+    imu_name = resp.get_json()["session"]["processed"]["imu"]
+    assert imu_name.endswith("_imu.csv")
+    export = client.get("/session/1/imu.csv")
+    assert export.status_code == 200
+    assert export.data == (tmp_path / "processed_data" / imu_name).read_bytes()
+
+
+def test_columnar_session_exports_csv(tmp_path):
+    _, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    payload = generate_dummy_data()
+    client.post("/end", data=json.dumps(payload), content_type="application/json")
+    lines = client.get("/session/1/imu.csv").data.decode().splitlines()
+    assert lines[0] == "t,ax,ay,az,gx,gy,gz"
+    assert len(lines) == len(payload["imu"]) + 1
+    first = [float(v) for v in lines[1].split(",")]
+    expected = payload["imu"][0]
+    assert first[0] == expected["t"]
+    assert abs(first[1] - expected["ax"]) < 1e-6
+    assert client.get("/session/1/heart_rate.csv").data.decode().splitlines()[1] == "0,80"
+    assert client.get("/session/1/other.csv").status_code == 404
+
+
+def test_invalid_json_is_rejected(tmp_path):
+    _, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    resp = client.post("/end", data="{not json", content_type="application/json")
+    assert resp.status_code == 400
+    assert client.get("/session/1/status").status_code == 404
+
+
+def test_startup_requeues_raw_files_without_rows(tmp_path):
+    (tmp_path / "raw_data").mkdir()
+    (tmp_path / "raw_data" / "session_orphan.json").write_text(json.dumps(generate_dummy_data()))
+    _, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    status = client.get("/session/1/status").get_json()
+    assert status["state"] == "done"
+    assert status["raw"] == "session_orphan.json"
+    assert (tmp_path / "processed_data" / "session_orphan_imu.kcol").exists()
+
+
+def test_api_sessions_keyset_pagination(tmp_path):
+    app, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    from server.db import execute_batched
+    execute_batched(
+        tmp_path / "sessions.db",
+        "INSERT INTO sessions (created_at, raw_filename, duration, heart_mean, status) VALUES (?,?,?,?,?)",
+        [(1000 + i, f"s{i}.json", float(i % 7), 90.0 + (i % 13), "done") for i in range(25)],
+    )
+
+    seen, cursor = [], None
+    while True:
+        url = "/api/sessions?limit=10" + (f"&after={cursor}" if cursor else "")
+        body = client.get(url).get_json()
+        seen.extend(r["id"] for r in body["sessions"])
+        cursor = body["next"]
+        if cursor is None:
+            break
+    assert seen == list(range(25, 0, -1))
+
+    seen, cursor = [], None
+    while True:
+        url = "/api/sessions?limit=4&sort=heart_mean&order=asc&duration_min=3" + (f"&after={cursor}" if cursor else "")
+        body = client.get(url).get_json()
+        seen.extend((r["heart_mean"], r["id"]) for r in body["sessions"])
+        cursor = body["next"]
+        if cursor is None:
+            break
+    rows = [(90.0 + (i % 13), i + 1) for i in range(25) if i % 7 >= 3]
+    assert seen == sorted(rows)
+
+    assert client.get("/api/sessions?sort=bogus").status_code == 400
+    assert client.get("/api/sessions?sort=heart_mean&after=nope").status_code == 400
+    page = client.get("/?limit=10")
+    assert page.status_code == 200 and b"Older sessions" in page.data
+
+
+def test_chunked_upload_matches_single_request(tmp_path):
+    payload = generate_dummy_data()
+    _, single = _make_client(tmp_path / "single", INGEST_WORKERS=0)
+    expected = single.post("/end", data=json.dumps(payload), content_type="application/json").get_json()["session"]
+
+    _, client = _make_client(tmp_path / "chunked", INGEST_WORKERS=0)
+    start = client.post("/session/start", json={"imu_hz": payload["imu_hz"], "heart_rate_hz": payload["heart_rate_hz"]})
+    assert start.status_code == 201
+    chunk_url = start.get_json()["chunk_url"]
+
+    imu, hr = payload["imu"], payload["heart_rates"]
+    first = {"imu": imu[:40], "heart_rates": hr[:1]}
+    assert client.post(chunk_url + "?seq=0", json=first).get_json()["imu_samples"] == 40
+    # A retried chunk is acknowledged but not appended twice; a gap is refused.
+    assert client.post(chunk_url + "?seq=0", json=first).get_json()["duplicate"] is True
+    assert client.post(chunk_url + "?seq=5", json=first).status_code == 409
+    ndjson = "\n".join(json.dumps(s) for s in imu[40:] + hr[1:])
+    resp = client.post(chunk_url + "?seq=1", data=ndjson, content_type="application/x-ndjson")
+    assert resp.get_json()["imu_samples"] == len(imu)
+    assert client.post(chunk_url, data="{broken", content_type="application/x-ndjson").status_code == 400
+
+    end = client.post(start.get_json()["end_url"], json={"duration": payload["duration"]})
+    assert end.status_code == 200
+    info = end.get_json()["session"]
+    assert info["stats"] == expected["stats"]
+    assert info["summary"]["strikes"] == expected["summary"]["strikes"]
+    for stream in ("imu", "heart_rate"):
+        chunked_file = tmp_path / "chunked" / "processed_data" / info["processed"][stream]
+        assert chunked_file.read_bytes() == (tmp_path / "single" / "processed_data" / expected["processed"][stream]).read_bytes()
+    assert _wait_for_state(client, end.get_json()["session_id"]) == "done"
+    assert not (tmp_path / "chunked" / "spool" / "1").exists()
+    # The finished raw log is archived compressed and still loads for reprocessing.
+    assert not info["raw"].endswith(".ndjson")
+    ok, session = load_raw_session(tmp_path / "chunked", info["raw"])
+    assert ok and session.imu_count == len(imu) and session.meta["duration"] == payload["duration"]
+    assert client.post(chunk_url, json=first).status_code == 404
+
+
+def test_live_events_follow_chunks(tmp_path):
+    app, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    urls = client.post("/session/start").get_json()
+    assert client.get("/session/1/events?timeout=0").get_json() == {"status": "success", "events": [], "closed": False}
+
+    samples = [{"t": t, "ax": a, "ay": 0, "az": 0, "gx": 0, "gy": 0, "gz": 0}
+               for t, a in ((0, 1.0), (10, 3.0), (20, 1.0), (300, 4.0))]
+    resp = client.post(urls["chunk_url"], json={"imu": samples[:2], "heart_rates": [{"t": 0, "bpm": 120}]}).get_json()
+    assert [e["type"] for e in resp["events"]] == ["strike", "stats"]
+    client.post(urls["chunk_url"], json={"imu": samples[2:]})
+
+    polled = client.get("/session/1/events?after=0&timeout=1").get_json()
+    strikes = [e for e in polled["events"] if e["type"] == "strike"]
+    assert [(e["t"], e["force"]) for e in strikes] == [(10, 3.0), (300, 4.0)]
+    assert polled["events"][1]["heart_rate"]["last"] == 120
+    last_id = polled["events"][-1]["id"]
+
+    client.post(urls["end_url"])
+    stream = client.get("/session/1/live", headers={"Last-Event-ID": str(last_id)})
+    assert stream.mimetype == "text/event-stream"
+    body = stream.get_data(as_text=True)
+    assert "event: end" in body and "event: strike\n" not in body
+
+    # Unknown ids are refused and do not get a channel; a session that is not receiving ends at once.
+    hub = app.extensions["live_hub"]
+    assert client.get("/session/99/live").status_code == 404
+    assert client.get("/session/99/events").status_code == 404
+    assert 99 not in hub._channels
+    done = client.post("/end", data=json.dumps(generate_dummy_data()), content_type="application/json").get_json()["session"]["session_id"]
+    assert client.get(f"/session/{done}/events?timeout=30").get_json() == {"status": "success", "events": [], "closed": True}
+    assert "event:" not in client.get(f"/session/{done}/live").get_data(as_text=True)
+    assert done not in hub._channels
+
+
+def test_session_analysis_is_stored_and_follows_parameters(tmp_path, monkeypatch):
+    app, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    resp = client.post("/end?echo=1", data=json.dumps(generate_dummy_data()), content_type="application/json")
+    stored = resp.get_json()["session"]["analysis"]
+    assert client.get("/api/session/99/analysis").status_code == 404
+
+    body = client.get("/api/session/1/analysis").get_json()
+    assert body["analysis"] == stored
+    assert len(stored["strike_times"]) == stored["strikes"]["strike_count"] > 0
+    assert (1, analysis.analysis_version()) in app.extensions["analysis_cache"]._entries
+
+    # New parameters give a new version; the results are recomputed from the processed files.
+    monkeypatch.setattr(analysis, "STRIKE_THRESHOLD", 1e9)
+    fresh = client.get("/api/session/1/analysis").get_json()["analysis"]
+    assert fresh["version"] != stored["version"] and fresh["strikes"]["strike_count"] == 0
+    assert fresh["zones"] == stored["zones"]
+    with connection(tmp_path / "sessions.db") as conn:
+        assert conn.execute("SELECT version FROM session_analysis WHERE session_id = 1").fetchone()[0] == fresh["version"]
+    assert b"Strikes:</strong> 0" in client.get("/session/1").data
+
+
+def test_series_levels_are_bounded_and_rebuilt(tmp_path):
+    _, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    imu = [{"t": i * 10, "ax": (i % 50) / 10.0, "ay": 0.0, "az": 1.0, "gx": 0.1, "gy": 0.2, "gz": 0.3} for i in range(5003)]
+    payload = {"imu": imu, "heart_rates": [{"t": 0, "bpm": 80}], "imu_hz": 100, "heart_rate_hz": 1}
+    info = client.post("/end", data=json.dumps(payload), content_type="application/json").get_json()["session"]
+
+    body = client.get("/api/session/1/series?metric=accel&points=100").get_json()
+    assert body["bucket"] > 1 and 0 < len(body["t"]) <= 100
+    assert all(lo <= mean <= hi for lo, mean, hi in zip(body["min"], body["mean"], body["max"]))
+    # Bucket values are stored as float32.
+    assert max(body["max"]) == pytest.approx(math.sqrt(4.9 ** 2 + 1), rel=1e-6)
+
+    # A narrow window is answered with the raw samples.
+    raw = client.get("/api/session/1/series?metric=accel&from=1000&to=1090").get_json()
+    assert raw["bucket"] == 1 and raw["t"] == [float(t) for t in range(1000, 1100, 10)]
+
+    # Pyramids built from blocks match the one written at ingest; a missing one is rebuilt.
+    lod = tmp_path / "processed_data" / series.lod_filename(info["processed"]["imu"])
+    builder = series.LodBuilder("imu")
+    cols = {k: [s[k] for s in imu] for k in ("t", "ax", "ay", "az", "gx", "gy", "gz")}
+    for i in range(0, len(imu), 997):
+        builder.add({k: v[i:i + 997] for k, v in cols.items()})
+    ok, _ = builder.write(tmp_path / "blocks_lod.kcol")
+    assert ok and (tmp_path / "blocks_lod.kcol").read_bytes() == lod.read_bytes()
+    lod.unlink()
+    assert client.get("/api/session/1/series?metric=accel&points=100").get_json()["t"] == body["t"]
+    assert client.get("/api/session/1/series?metric=nope").status_code == 400
+
+
+def test_trends_follow_sessions_incrementally(tmp_path, monkeypatch):
+    _, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    results = [
+        client.post("/end?echo=1", data=json.dumps(generate_dummy_data()), content_type="application/json").get_json()["session"]["analysis"]
+        for _ in range(3)
+    ]
+    day = rollups.day_of(time.time())
+    body = client.get(f"/api/trends?bucket=day&from={day}&to={day}").get_json()
+    assert [row["start"] for row in body["trends"]] == [day]
+    today = body["trends"][0]
+    assert today["sessions"] == 3
+    assert today["strikes"] == sum(r["strikes"]["strike_count"] for r in results)
+    assert today["avg_intensity"] == pytest.approx(sum(r["intensity"]["avg_intensity"] for r in results) / 3)
+    # Zone time is the elapsed time covered by heart-rate readings.
+    assert sum(today["hr_zone_seconds"].values()) == pytest.approx(sum(r["alignment"]["hr_covered_s"] for r in results))
+
+    # Move one session back a week and rebuild: the bulk pass matches the incremental tables.
+    with connection(tmp_path / "sessions.db") as conn:
+        with conn:
+            conn.execute("UPDATE sessions SET created_at = created_at - 7 * 86400 WHERE id = 1")
+        incremental = [tuple(r) for r in conn.execute("SELECT * FROM rollup_days ORDER BY day")]
+    stats = rollups.rebuild(tmp_path)
+    assert stats["sessions"] == 3 and stats["days"] == 2 and stats["computed"] == 0
+    with connection(tmp_path / "sessions.db") as conn:
+        rebuilt = [tuple(r) for r in conn.execute("SELECT * FROM rollup_days ORDER BY day")]
+    assert rebuilt[1][2:] == pytest.approx(tuple(a - b for a, b in zip(incremental[0][2:], rebuilt[0][2:])))
+    weeks = client.get("/api/trends?bucket=week").get_json()["trends"]
+    assert [row["sessions"] for row in weeks] == [1, 2]
+    assert client.get(f"/api/trends?from={int(time.time())}").get_json()["trends"][0]["sessions"] == 2
+
+    # Results recomputed under new parameters update the rollups of their day.
+    monkeypatch.setattr(analysis, "STRIKE_THRESHOLD", 1e9)
+    client.get("/api/session/2/analysis")
+    today = client.get(f"/api/trends?from={day}").get_json()["trends"][0]
+    assert today["strikes"] == results[2]["strikes"]["strike_count"]
+    assert client.get("/api/trends?bucket=year").status_code == 400
+    assert client.get("/api/trends?from=yesterday").status_code == 400
+
+
+@pytest.mark.parametrize("backend", jsoncodec.available_backends())
+def test_end_response_is_slim_unless_echo_requested(tmp_path, backend):
+    previous = jsoncodec.get_backend()
+    jsoncodec.set_backend(backend)
+    try:
+        _, client = _make_client(tmp_path, INGEST_WORKERS=0)
+        payload = generate_dummy_data()
+        slim = client.post("/end", data=json.dumps(payload), content_type="application/json")
+        assert slim.status_code == 200
+        info = slim.get_json()["session"]
+        assert "payload" not in info and info["session_id"] == 1 and info["stats"]["duration"] == payload["duration"]
+        # Scalars only: the lists stay behind /api/session/<id>/analysis.
+        assert set(info) == {"session_id", "raw", "processed", "stats", "summary"}
+        assert set(info["summary"]) == {"heart_rate", "zones", "intensity", "strikes"}
+
+        full = client.post("/end?echo=1", data=json.dumps(payload), content_type="application/json").get_json()
+        assert full["session"]["payload"] == payload
+        assert full["session"]["analysis"]["strikes"] == info["summary"]["strikes"]
+        assert len(full["session"]["analysis"]["strike_times"]) == info["summary"]["strikes"]["strike_count"]
+
+        # Literals only the standard library accepts still load; the sample is dropped and counted.
+        body = '{"imu": [{"t": 0, "ax": NaN, "ay": 0, "az": 1, "gx": 0, "gy": 0, "gz": 0}], "heart_rates": [80, "x"]}'
+        resp = client.post("/end", data=body, content_type="application/json")
+        assert resp.status_code == 200
+        with connection(tmp_path / "sessions.db") as conn:
+            row = conn.execute("SELECT imu_dropped, heart_rate_dropped, rotation_dropped FROM sessions WHERE id = ?",
+                               (resp.get_json()["session"]["session_id"],)).fetchone()
+        assert tuple(row) == (1, 1, 0)
+        assert client.post("/end", data=b'{"imu": [', content_type="application/json").status_code == 400
+    finally:
+        jsoncodec.set_backend(previous)
+
+
+def test_rotation_vectors_are_stored_and_summarized(tmp_path):
+    payload = generate_dummy_data()
+    rotation = rotation_swings(300, [10000, 40000], swing_ms=1000, interval_ms=59900 / 299)
+    # Sent without times (spread over the IMU span), with one zero-length sample.
+    payload["rotation_vectors"] = [dict(zip("xyzw", q)) for q in zip(*(rotation[k] for k in "xyzw"))]
+    payload["rotation_vectors"][7] = {"x": 0, "y": 0, "z": 0, "w": 0}
+    _, single = _make_client(tmp_path / "single", INGEST_WORKERS=0)
+    info = single.post("/end?echo=1", data=json.dumps(payload), content_type="application/json").get_json()["session"]
+    stats = info["stats"]
+    assert (stats["rotation_samples"], stats["rotation_dropped"]) == (299, 1)
+    assert stats["max_angular_velocity"] == info["analysis"]["orientation"]["max_angular_velocity"] > 0
+    assert info["analysis"]["orientation"]["swing_count"] == 2
+
+    export = single.get("/session/1/rotation.csv").data.decode().splitlines()
+    assert export[0] == "t,x,y,z,w" and len(export) == 300
+    first_t = float(export[1].split(",")[0])
+    assert first_t == payload["imu"][0]["t"] and float(export[-1].split(",")[0]) == payload["imu"][-1]["t"]
+    t, x, y, z, w = map(float, export[1].split(","))
+    assert x * x + y * y + z * z + w * w == pytest.approx(1.0, abs=1e-6)
+    # Results recomputed from the processed files keep the orientation section.
+    with connection(tmp_path / "single" / "sessions.db") as conn:
+        conn.execute("DELETE FROM session_analysis")
+        assert conn.execute("SELECT rotation_samples FROM sessions").fetchone()[0] == 299
+    stored = single.get("/api/session/1/analysis").get_json()["analysis"]["orientation"]
+    assert stored["swing_count"] == 2 and stored["samples"] == 299
+
+    # A chunked upload spools the stream and writes the same file.
+    _, client = _make_client(tmp_path / "chunked", INGEST_WORKERS=0)
+    urls = client.post("/session/start", json={k: payload[k] for k in ("imu_hz", "heart_rate_hz")}).get_json()
+    body = {k: payload[k] for k in ("imu", "heart_rates", "rotation_vectors")}
+    assert client.post(urls["chunk_url"], json=body).get_json()["rotation_samples"] == 300
+    end = client.post(urls["end_url"], json={"duration": payload["duration"]}).get_json()["session"]
+    assert end["stats"] == stats
+    chunked_file = tmp_path / "chunked" / "processed_data" / end["processed"]["rotation"]
+    assert chunked_file.read_bytes() == (tmp_path / "single" / "processed_data" / info["processed"]["rotation"]).read_bytes()
+
+
+def test_shutdown_drains_requests_and_queued_sessions(tmp_path):
+    app, client = _make_client(tmp_path, INGEST_WORKERS=2)
+    # The test client leaves responses open until closed, as a WSGI server would close them.
+    with client.post("/end", data=json.dumps(generate_dummy_data()), content_type="application/json") as resp:
+        queued = resp.get_json()
+    with client.post("/session/start") as resp:
+        live_id = resp.get_json()["session_id"]
+    stream = client.get(f"/session/{live_id}/live", buffered=False)
+    assert app.extensions["inflight"].active == 1
+
+    drained = []
+    stopper = threading.Thread(target=lambda: drained.append(lifecycle.shutdown_app(app, 5.0)))
+    stopper.start()
+    # The open live stream ends once shutdown starts; the client can then close it.
+    assert b"retry:" in b"".join(stream.response)
+    stream.close()
+    stopper.join(5.0)
+    assert drained == [True]
+    with connection(tmp_path / "sessions.db") as conn:
+        status = conn.execute("SELECT status FROM sessions WHERE id = ?", (queued["session_id"],)).fetchone()[0]
+    assert status == "done"
+
+    refused = client.get("/")
+    assert refused.status_code == 503 and refused.headers["Retry-After"] == str(lifecycle.RETRY_AFTER_S)
+
+
+def test_stage_timings_are_recorded_and_exported(tmp_path):
+    app, client = _make_client(tmp_path, INGEST_WORKERS=2, PROFILE="header")
+    resp = client.post("/end", data=json.dumps(generate_dummy_data()), content_type="application/json")
+    session_id = resp.get_json()["session_id"]
+    assert _wait_for_state(client, session_id) == "done"
+    app.extensions["ingest_queue"].shutdown()
+    with connection(tmp_path / "sessions.db") as conn:
+        timings = json.loads(conn.execute("SELECT timings FROM sessions WHERE id = ?", (session_id,)).fetchone()[0])
+    # The request's stages and the worker's are merged into one row.
+    assert {"parse", "raw_write", "processed_write", "analysis"} <= set(timings)
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'sensor_ingest_stage_seconds_bucket{stage="processed_write",le="+Inf"}' in text
+    # Metrics are per process, so earlier tests' requests are counted too.
+    assert 'sensor_http_requests_total{endpoint="receive_end",status="202"} ' in text
+    assert "X-Profile-File" not in client.get("/").headers
+
+    profiled = client.get("/", headers={"X-Profile": "1"})
+    assert (tmp_path / "profiles" / profiled.headers["X-Profile-File"]).stat().st_size > 0
+
+
+def test_startup_check_repairs_damaged_and_leftover_files(tmp_path):
+    app, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    session_id = client.post("/end", data=json.dumps(generate_dummy_data()), content_type="application/json").get_json()["session"]["session_id"]
+    processed = tmp_path / "processed_data"
+    with connection(tmp_path / "sessions.db") as conn:
+        imu_name = conn.execute("SELECT imu_csv FROM sessions WHERE id = ?", (session_id,)).fetchone()[0]
+    # What a power cut during writes could leave behind.
+    (processed / imu_name).write_bytes((processed / imu_name).read_bytes()[:100])
+    (processed / ".session_x_imu.kcol.1.2.tmp").write_bytes(b"partial")
+    (processed / "session_gone_imu.kcol").write_bytes(b"orphan")
+
+    app, client = _make_client(tmp_path, INGEST_WORKERS=0)
+    assert _wait_for_state(client, session_id) == "done"
+    assert fsck.processed_file_error(processed / imu_name) is None
+    assert series.lod_filename(imu_name) in {p.name for p in processed.iterdir()}
+    assert not list(processed.glob("*.tmp"))
+    assert client.get(f"/api/session/{session_id}/series?metric=accel").status_code == 200
+    # Unreferenced processed files are only deleted on request.
+    assert (processed / "session_gone_imu.kcol").exists()
+    app.extensions["ingest_queue"].shutdown()
+    assert fsck.check(tmp_path, prune_orphans=True)["orphans"] == 1
+    assert not (processed / "session_gone_imu.kcol").exists()
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_batch_upload_dedupes_by_content(tmp_path, workers):
+    app, client = _make_client(tmp_path, INGEST_WORKERS=workers)
+    bodies = [json.dumps(generate_dummy_data()).encode() for _ in range(3)]
+    client.post("/end", data=bodies[0], content_type="application/json")
+
+    ndjson = b"\n".join(bodies + [bodies[1], b'{"imu": 5}'])
+    resp = client.post("/sessions/batch", data=ndjson, content_type="application/x-ndjson")
+    assert resp.status_code == 200
+    results = resp.get_json()["sessions"]
+    created = "queued" if workers else "created"
+    assert [r["status"] for r in results] == ["duplicate", created, created, "duplicate", "invalid"]
+    assert results[0]["session_id"] == 1 and results[3]["session_id"] == results[1]["session_id"]
+
+    # A retry of the same batch stores nothing new.
+    retry = client.post("/sessions/batch", data=ndjson, content_type="application/x-ndjson").get_json()
+    assert retry["counts"] == {"duplicate": 4, "invalid": 1}
+    for result in results[1:3]:
+        assert _wait_for_state(client, result["session_id"]) == "done"
+    assert len(list((tmp_path / "raw_data").iterdir())) == 3
+
+    array = client.post("/sessions/batch", json=[generate_dummy_data(), "x"]).get_json()
+    assert [r["status"] for r in array["sessions"]] == [created, "invalid"]
+    assert client.post("/sessions/batch", json={"imu": []}).status_code == 400
+    app.extensions["ingest_queue"].shutdown()
+
+
+def test_sessions_are_partitioned_per_device(tmp_path):
+    app, client = _make_client(tmp_path, INGEST_WORKERS=2)
+    uploads = ["athlete-1", "athlete-2", "athlete-1", None, "athlete-1"]
+    ids = []
+    for device in uploads:
+        payload = generate_dummy_data()
+        if device:
+            payload["device_id"] = device
+        ids.append(client.post("/end", data=json.dumps(payload), content_type="application/json").get_json()["session_id"])
+    bad = client.post("/end", data=json.dumps({**generate_dummy_data(), "device_id": "../x"}), content_type="application/json")
+    assert bad.status_code == 400
+    assert all(_wait_for_state(client, i) == "done" for i in ids)
+
+    with connection(tmp_path / "sessions.db") as conn:
+        rows = {r["id"]: dict(r) for r in conn.execute("SELECT id, device_id, raw_filename, imu_csv FROM sessions")}
+    for session_id, device in zip(ids, uploads):
+        row = rows[session_id]
+        assert row["device_id"] == device
+        for name, root in ((row["raw_filename"], "raw_data"), (row["imu_csv"], "processed_data")):
+            assert name.startswith(f"{device}/" if device else "session_")
+            assert (tmp_path / root / name).is_file()
+
+    listing = client.get("/api/sessions?device=athlete-1&sort=duration").get_json()["sessions"]
+    assert sorted(r["id"] for r in listing) == [ids[0], ids[2], ids[4]]
+    assert client.get("/api/trends?device=athlete-2").get_json()["trends"][0]["sessions"] == 1
+    assert client.get("/api/trends").get_json()["trends"][0]["sessions"] == 5
+    assert client.get(f"/api/session/{ids[1]}/series?metric=accel").status_code == 200
+    app.extensions["ingest_queue"].shutdown()
+
+    # The startup check keeps files in device directories.
+    assert fsck.check(tmp_path) == {"temp_files": 0, "requeued": 0, "failed": 0, "bad_pyramids": 0, "orphans": 0}
+
+
+def test_ingest_queue_orders_sessions_per_device(tmp_path, monkeypatch):
+    events, lock = [], threading.Lock()
+
+    def process(data_dir, session_id, raw_filename, session, processed_format):
+        with lock:
+            events.append(("start", raw_filename))
+        time.sleep(0.01)
+        with lock:
+            events.append(("end", raw_filename))
+
+    monkeypatch.setattr(worker, "process_queued_session", process)
+    queue = worker.IngestQueue(tmp_path, workers=4)
+    names = [f"{device}/s{i}.json" for i in range(5) for device in ("a", "b", "c")]
+    for i, name in enumerate(names):
+        queue.submit(i, name)
+    queue.shutdown(wait=True)
+
+    for device in ("a", "b", "c"):
+        mine = [(kind, name) for kind, name in events if name.startswith(device + "/")]
+        assert mine == [(kind, f"{device}/s{i}.json") for i in range(5) for kind in ("start", "end")]
+    # Different devices overlapped.
+    first_end = next(i for i, (kind, _) in enumerate(events) if kind == "end")
+    assert sum(kind == "start" for kind, _ in events[:first_end]) == 3
+
+
+@pytest.mark.parametrize("processed_format", ["columnar", "csv"])
+def test_export_streams_sessions_as_zip(tmp_path, processed_format):
+    import io
+    import zipfile
+
+    _, client = _make_client(tmp_path, INGEST_WORKERS=0, PROCESSED_FORMAT=processed_format)
+    for device in ("watch-a", "watch-b", "watch-a"):
+        client.post("/end", data=json.dumps({**generate_dummy_data(), "device_id": device}), content_type="application/json")
+
+    resp = client.get("/api/export?format=csv&device=watch-a")
+    assert resp.status_code == 200 and resp.mimetype == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(resp.data))
+    assert archive.testzip() is None
+    assert archive.namelist() == ["sessions.csv"] + [f"{i}/{name}" for i in (1, 3) for name in ("analysis.json", "imu.csv", "heart_rate.csv")]
+    rows = archive.read("sessions.csv").decode().splitlines()
+    assert rows[0].startswith("id,") and [r.split(",")[0] for r in rows[1:]] == ["1", "3"]
+    assert archive.read("1/imu.csv") == client.get("/session/1/imu.csv").data
+    assert json.loads(archive.read("3/analysis.json"))["strikes"]["strike_count"] == 5
+
+    np = pytest.importorskip("numpy")
+    archive = zipfile.ZipFile(io.BytesIO(client.get("/api/export?format=npz").data))
+    assert len([n for n in archive.namelist() if n.endswith("imu.npz")]) == 3
+    with np.load(io.BytesIO(archive.read("2/imu.npz"))) as npz:
+        imu = client.get("/session/2/imu.csv").data.decode().splitlines()
+        assert npz.files == imu[0].split(",")
+        # Columnar files keep float32 axes, which the CSV prints with 9 digits.
+        assert npz["ax"].tolist() == pytest.approx([float(r.split(",")[1]) for r in imu[1:]], rel=1e-7)
+
+    assert client.get("/api/export?format=xlsx").status_code == 400
+    assert client.get("/api/export?from=yesterday").status_code == 400
+    assert zipfile.ZipFile(io.BytesIO(client.get("/api/export?to=2000-01-01").data)).namelist() == ["sessions.csv"]